@@ -14,7 +14,8 @@ use axum::{
     Json, Router,
 };
 use mongodb::{
-    bson::{doc, Bson, DateTime as BsonDateTime, Document},
+    bson::{doc, oid::ObjectId, Bson, DateTime as BsonDateTime, Document},
+    options::ReturnDocument,
     Client as MongoClient, Database,
 };
 use redis::Client as RedisClient;
@@ -22,6 +23,23 @@ use serde::{Deserialize, Serialize};
 use serde_json::{json, Value};
 use tracing::{error, info, warn};
 
+/// Storage format of the analyses this function writes (per-answer subdocuments)
+const LEGACY_ANALYSIS_FORMAT: i32 = 1;
+/// Fields of the compact analysis format (format_version 2) of intelligence-ms
+const COMPACT_ANALYSIS_FIELDS: [&str; 6] = [
+    "answer_count",
+    "answer_hashes",
+    "sentiment_scores",
+    "sentiment_labels",
+    "label_names",
+    "label_counts",
+];
+/// Rollups of the monthly buckets the intelligence-ms retention job has closed
+const ROLLUPS_COLLECTION: &str = "analysis_rollups";
+const IDEA_ROLLUPS_COLLECTION: &str = "idea_rollups";
+/// Canonical ideas of intelligence-ms, with the frequency the analyses add to them
+const IDEAS_COLLECTION: &str = "ideas";
+
 #[derive(Clone)]
 struct AppState {
     redis_client: RedisClient,
@@ -631,64 +649,287 @@ async fn save_analysis(
         "aggregate_sentiment_score": output.aggregate_sentiment_score,
         "aggregate_sentiment_label": &output.aggregate_sentiment_label,
         "cluster_summaries": cluster_docs,
+        "format_version": LEGACY_ANALYSIS_FORMAT,
         "timestamp": BsonDateTime::now(),
     };
 
-    analyses
-        .update_one(
+    // Drop the fields of a compact document intelligence-ms may have stored,
+    // the marker of an archived one and the bucket: the intelligence-ms
+    // retention job assigns the bucket of the new timestamp.
+    let mut stale_fields = Document::new();
+    for field in COMPACT_ANALYSIS_FIELDS {
+        stale_fields.insert(field, "");
+    }
+    stale_fields.insert("archived", "");
+    stale_fields.insert("bucket", "");
+
+    let previous = analyses
+        .find_one_and_update(
             doc! { "question_id": &request.question_id },
-            doc! { "$set": analysis_doc },
+            doc! { "$set": analysis_doc, "$unset": stale_fields },
         )
         .upsert(true)
+        .return_document(ReturnDocument::Before)
+        .projection(doc! {
+            "_id": 0,
+            "bucket": 1,
+            "label_counts": 1,
+            "answers.sentiment_label": 1,
+            "cluster_summaries.summary": 1,
+            "cluster_summaries.count": 1,
+            "cluster_summaries.idea_id": 1,
+        })
         .await
         .context("failed to save analysis")?;
 
+    if let Some(previous) = previous {
+        // The new clusters carry no idea_id, so the old ones stop counting
+        if let Err(error) = withdraw_idea_frequencies(db, &previous).await {
+            error!(
+                question_id = %request.question_id,
+                "failed to withdraw idea frequencies: {error:#}"
+            );
+        }
+        if let Ok(bucket) = previous.get_str("bucket") {
+            // The analysis is saved; a failed release only leaves its old
+            // answers counted in the closed bucket as well.
+            if let Err(error) =
+                release_contribution(db, bucket, &request.question_id, &previous).await
+            {
+                error!(
+                    question_id = %request.question_id,
+                    "failed to release analysis from bucket {bucket}: {error:#}"
+                );
+            }
+        }
+    }
+
     Ok(())
 }
 
-async fn get_sentiment_stats(State(state): State<AppState>) -> Response {
-    let analyses = state.mongo_db.collection::<Document>("analyses");
+/// Label and idea counts a stored analysis adds to its bucket's rollups, as
+/// `contribution()` in intelligence-ms computes them
+fn contribution(analysis: &Document) -> (HashMap<String, i64>, HashMap<String, i64>) {
+    let mut label_counts = HashMap::new();
+    if let Ok(counts) = analysis.get_document("label_counts") {
+        for (label, count) in counts {
+            label_counts.insert(label.clone(), count_value(count));
+        }
+    } else if let Ok(answers) = analysis.get_array("answers") {
+        for answer in answers.iter().filter_map(Bson::as_document) {
+            let label = answer.get_str("sentiment_label").unwrap_or_default();
+            *label_counts.entry(label.to_string()).or_insert(0) += 1;
+        }
+    }
 
-    let pipeline = vec![
-        doc! { "$unwind": "$answers" },
-        doc! {
-            "$group": {
-                "_id": "$answers.sentiment_label",
-                "count": { "$sum": 1 }
+    let mut idea_counts = HashMap::new();
+    if let Ok(clusters) = analysis.get_array("cluster_summaries") {
+        for cluster in clusters.iter().filter_map(Bson::as_document) {
+            let summary = cluster.get_str("summary").unwrap_or_default();
+            if summary.is_empty() {
+                continue;
             }
-        },
-    ];
-
-    let mut cursor = match analyses.aggregate(pipeline).await {
-        Ok(cursor) => cursor,
-        Err(error) => {
-            return (
-                StatusCode::INTERNAL_SERVER_ERROR,
-                Json(json!({ "error": format!("failed to query sentiment stats: {error}") })),
-            )
-                .into_response();
+            let count = match cluster.get("count") {
+                None | Some(Bson::Null) => 1,
+                Some(count) => count_value(count),
+            };
+            *idea_counts.entry(summary.to_string()).or_insert(0) += count;
         }
+    }
+    (label_counts, idea_counts)
+}
+
+/// Subtract a re-saved analysis from the rollups of its old bucket, as
+/// `release_moves()` in intelligence-ms does. Buckets that are still open have
+/// no rollups, so nothing matches them; a bucket whose rollup is being
+/// computed gets the release queued for the retention job to apply.
+async fn release_contribution(
+    db: &Database,
+    bucket: &str,
+    question_id: &str,
+    previous: &Document,
+) -> Result<()> {
+    let (label_counts, idea_counts) = contribution(previous);
+    let mut decrement = doc! {
+        "analyses": -1_i64,
+        "answers": -label_counts.values().sum::<i64>(),
+    };
+    for (label, count) in &label_counts {
+        decrement.insert(format!("label_counts.{label}"), -count);
+    }
+    // Pairs, since labels and summaries are not valid field names
+    let release = doc! {
+        "question_id": question_id,
+        "labels": count_pairs(&label_counts),
+        "ideas": count_pairs(&idea_counts),
     };
 
-    let mut rows: Vec<Document> = Vec::new();
-    while cursor.advance().await.unwrap_or(false) {
-        if let Ok(current) = cursor.deserialize_current() {
-            rows.push(current);
+    let rollups = db.collection::<Document>(ROLLUPS_COLLECTION);
+    // The rollup may start or finish closing between the two conditional
+    // updates; retry until one applies or the bucket turns out to be open
+    loop {
+        let released = rollups
+            .update_one(
+                doc! { "_id": bucket, "closing": { "$ne": true } },
+                doc! { "$inc": decrement.clone() },
+            )
+            .await
+            .context("failed to release analysis rollup")?;
+        if released.matched_count > 0 {
+            break;
+        }
+        let queued = rollups
+            .update_one(
+                doc! { "_id": bucket, "closing": true },
+                doc! { "$push": { "releases": release.clone() } },
+            )
+            .await
+            .context("failed to queue analysis release")?;
+        if queued.matched_count > 0 {
+            return Ok(());
         }
+        let exists = rollups
+            .count_documents(doc! { "_id": bucket })
+            .await
+            .context("failed to read analysis rollup")?;
+        if exists == 0 {
+            return Ok(());
+        }
+    }
+
+    let idea_rollups = db.collection::<Document>(IDEA_ROLLUPS_COLLECTION);
+    for (summary, count) in &idea_counts {
+        idea_rollups
+            .update_one(
+                doc! { "bucket": bucket, "summary": summary },
+                doc! { "$inc": { "count": -count } },
+            )
+            .await
+            .context("failed to release idea rollup")?;
     }
+    Ok(())
+}
 
-    let total: i64 = rows
+fn count_pairs(counts: &HashMap<String, i64>) -> Vec<Bson> {
+    counts
         .iter()
-        .map(|row| row.get_i64("count").unwrap_or(0))
-        .sum();
+        .map(|(key, count)| Bson::Array(vec![Bson::String(key.clone()), Bson::Int64(*count)]))
+        .collect()
+}
+
+/// Idea frequency deltas of replacing a stored analysis with one without
+/// canonical ideas, as `frequency_deltas()` in intelligence-ms computes them
+fn idea_frequency_deltas(previous: &Document) -> HashMap<ObjectId, i64> {
+    let mut deltas = HashMap::new();
+    if let Ok(clusters) = previous.get_array("cluster_summaries") {
+        for cluster in clusters.iter().filter_map(Bson::as_document) {
+            if let Ok(idea_id) = cluster.get_object_id("idea_id") {
+                let count = cluster.get("count").map_or(0, count_value);
+                *deltas.entry(idea_id).or_insert(0) -= count;
+            }
+        }
+    }
+    deltas
+}
+
+/// Subtract a re-saved analysis' old clusters from the frequencies of their
+/// canonical ideas, as `apply_frequency_deltas()` in intelligence-ms does
+async fn withdraw_idea_frequencies(db: &Database, previous: &Document) -> Result<()> {
+    let ideas = db.collection::<Document>(IDEAS_COLLECTION);
+    for (idea_id, delta) in idea_frequency_deltas(previous) {
+        if delta == 0 {
+            continue;
+        }
+        ideas
+            .update_one(
+                doc! { "_id": idea_id },
+                doc! {
+                    "$inc": { "frequency": delta },
+                    "$set": { "updated_at": BsonDateTime::now() },
+                },
+            )
+            .await
+            .context("failed to update idea frequency")?;
+    }
+    Ok(())
+}
+
+fn count_value(value: &Bson) -> i64 {
+    match value {
+        Bson::Int32(value) => i64::from(*value),
+        Bson::Int64(value) => *value,
+        Bson::Double(value) => *value as i64,
+        _ => 0,
+    }
+}
+
+fn count_field(row: &Document) -> i64 {
+    row.get("count").map_or(0, count_value)
+}
+
+async fn get_sentiment_stats(State(state): State<AppState>) -> Response {
+    let analyses = state.mongo_db.collection::<Document>("analyses");
+
+    // Legacy documents hold one subdocument per answer; compact documents
+    // written by intelligence-ms carry a per-document label histogram.
+    let pipelines = [
+        vec![
+            doc! { "$match": { "answers": { "$exists": true } } },
+            doc! { "$unwind": "$answers" },
+            doc! {
+                "$group": {
+                    "_id": "$answers.sentiment_label",
+                    "count": { "$sum": 1 }
+                }
+            },
+        ],
+        vec![
+            doc! { "$match": { "label_counts": { "$exists": true } } },
+            doc! { "$project": { "labels": { "$objectToArray": "$label_counts" } } },
+            doc! { "$unwind": "$labels" },
+            doc! {
+                "$group": {
+                    "_id": "$labels.k",
+                    "count": { "$sum": "$labels.v" }
+                }
+            },
+        ],
+    ];
+
+    let mut counts: Vec<(String, i64)> = Vec::new();
+    for pipeline in pipelines {
+        let mut cursor = match analyses.aggregate(pipeline).await {
+            Ok(cursor) => cursor,
+            Err(error) => {
+                return (
+                    StatusCode::INTERNAL_SERVER_ERROR,
+                    Json(json!({ "error": format!("failed to query sentiment stats: {error}") })),
+                )
+                    .into_response();
+            }
+        };
+
+        while cursor.advance().await.unwrap_or(false) {
+            if let Ok(current) = cursor.deserialize_current() {
+                let sentiment = current.get_str("_id").unwrap_or("").to_string();
+                let count = count_field(&current);
+                match counts.iter_mut().find(|(label, _)| *label == sentiment) {
+                    Some((_, total)) => *total += count,
+                    None => counts.push((sentiment, count)),
+                }
+            }
+        }
+    }
+
+    let total: i64 = counts.iter().map(|(_, count)| count).sum();
 
     let stats: Vec<Value> = if total == 0 {
         Vec::new()
     } else {
-        rows.iter()
-            .map(|row| {
-                let sentiment = row.get_str("_id").unwrap_or("").to_string();
-                let count = row.get_i64("count").unwrap_or(0);
+        counts
+            .iter()
+            .map(|(sentiment, count)| {
+                let count = *count;
                 json!({
                     "sentiment": sentiment,
                     "count": count,
@@ -960,4 +1201,22 @@ mod tests {
         let ideas = cluster_and_summarize(&answers, &model());
         assert!(!ideas.is_empty());
     }
+    #[test]
+    fn idea_frequency_deltas_withdraw_the_previous_clusters() {
+        let first = ObjectId::new();
+        let second = ObjectId::new();
+        let previous = doc! {
+            "cluster_summaries": [
+                { "summary": "Faster checkout", "count": 3, "idea_id": first },
+                { "summary": "Quicker payment", "count": 2_i64, "idea_id": first },
+                { "summary": "Better support", "count": 4, "idea_id": second },
+                { "summary": "Without an idea", "count": 5 },
+            ],
+        };
+
+        let deltas = idea_frequency_deltas(&previous);
+        assert_eq!(deltas.len(), 2);
+        assert_eq!(deltas[&first], -5);
+        assert_eq!(deltas[&second], -4);
+    }
 }
@@ -0,0 +1,93 @@
+"""
+Bounded read-through cache of stored analyses for the read RPCs.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from . import config
+from . import metrics
+
+
+class AnalysisCache:
+    """
+    LRU cache of analysis documents keyed by question and view
+
+    Entries expire after a TTL, which bounds staleness when another replica
+    saved the analysis. Local saves call invalidate(). A read that was in
+    flight during an invalidation is not cached, so it cannot bring back the
+    document the save replaced.
+    """
+
+    def __init__(self, max_entries: int | None = None, ttl_seconds: float | None = None):
+        """
+        Args:
+            max_entries: Cached documents kept at most; 0 disables the cache
+            ttl_seconds: Seconds an entry is served before it is read again
+        """
+        self._max_entries = config.ANALYSIS_CACHE_SIZE if max_entries is None else max_entries
+        self._ttl = config.ANALYSIS_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Tuple[str, Hashable], Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        # question_id -> [reads in flight, invalidations seen]
+        self._reads: Dict[str, List[int]] = {}
+        metrics.ANALYSIS_CACHE_ENTRIES.set_function(lambda: len(self._entries))
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_entries > 0
+
+    def get(self, question_id: str, view: Hashable) -> Optional[Dict[str, Any]]:
+        """Cached document, or None on a miss; callers must not modify it"""
+        if not self.enabled:
+            return None
+        key = (question_id, view)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                metrics.ANALYSIS_CACHE_REQUESTS.labels(result='miss').inc()
+                return None
+            self._entries.move_to_end(key)
+        metrics.ANALYSIS_CACHE_REQUESTS.labels(result='hit').inc()
+        return entry[1]
+
+    def begin_read(self, question_id: str) -> int:
+        """Register a database read; pass the result to end_read()"""
+        with self._lock:
+            read = self._reads.setdefault(question_id, [0, 0])
+            read[0] += 1
+            return read[1]
+
+    def end_read(
+        self,
+        question_id: str,
+        token: int,
+        view: Hashable = None,
+        document: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Finish a read, caching document unless the question was invalidated meanwhile"""
+        with self._lock:
+            read = self._reads[question_id]
+            read[0] -= 1
+            if document is not None and self.enabled and read[1] == token:
+                key = (question_id, view)
+                self._entries[key] = (time.monotonic() + self._ttl, document)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+            if read[0] == 0:
+                del self._reads[question_id]
+
+    def invalidate(self, question_ids) -> None:
+        """Drop every cached view of the given questions"""
+        question_ids = set(question_ids)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in question_ids]:
+                del self._entries[key]
+            for question_id in question_ids:
+                if question_id in self._reads:
+                    self._reads[question_id][1] += 1
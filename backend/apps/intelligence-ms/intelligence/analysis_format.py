@@ -0,0 +1,173 @@
+"""
+Versioned storage formats of analysis documents.
+
+Format 1 (legacy) stores one subdocument per answer with its index, full text,
+score and label. Format 2 (compact) stores the per-answer results as parallel
+binary arrays plus a label histogram, and each answer text only once, keyed by
+a hash, in the shared `answer_texts` collection:
+
+    answer_count      number of answers
+    answer_hashes     answer_count * ANSWER_HASH_SIZE bytes, keys into answer_texts
+    sentiment_scores  answer_count float32 values
+    sentiment_labels  answer_count uint8 codes into label_names
+    label_names       labels in code order
+    label_counts      {label: number of answers}
+
+Readers expand either format to the legacy shape with expand_analysis().
+"""
+import hashlib
+from typing import Any, Dict, Iterable, List, Mapping, Tuple
+
+import numpy as np
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+LEGACY_FORMAT = 1
+COMPACT_FORMAT = 2
+
+ANSWER_TEXTS_COLLECTION = 'answer_texts'
+ANSWER_HASH_SIZE = 16
+
+LEGACY_FIELDS = ('answers',)
+COMPACT_FIELDS = (
+    'answer_count',
+    'answer_hashes',
+    'sentiment_scores',
+    'sentiment_labels',
+    'label_names',
+    'label_counts',
+)
+
+
+def answer_hash(text: str) -> bytes:
+    """Key of an answer text in the answer_texts collection"""
+    return hashlib.blake2b((text or '').encode('utf-8'), digest_size=ANSWER_HASH_SIZE).digest()
+
+
+def format_version(doc: Mapping[str, Any]) -> int:
+    """Storage format of an analysis document; documents without one are legacy"""
+    return int(doc.get('format_version') or LEGACY_FORMAT)
+
+
+def encode_analysis(
+    analysis_data: Dict[str, Any],
+    version: int = COMPACT_FORMAT,
+) -> Tuple[Dict[str, Any], Dict[bytes, str]]:
+    """
+    Convert an analysis to the given storage format
+
+    Args:
+        analysis_data: Analysis in the legacy shape (per-answer 'answers' list)
+        version: LEGACY_FORMAT or COMPACT_FORMAT
+
+    Returns:
+        (document, answer texts by hash to store alongside it)
+    """
+    if version == LEGACY_FORMAT:
+        doc = {key: value for key, value in analysis_data.items() if key not in COMPACT_FIELDS}
+        doc['format_version'] = LEGACY_FORMAT
+        return doc, {}
+
+    answers = sorted(analysis_data.get('answers') or [], key=lambda answer: answer['index'])
+    texts: Dict[bytes, str] = {}
+    hashes = []
+    scores = np.empty(len(answers), dtype=np.float32)
+    codes = np.empty(len(answers), dtype=np.uint8)
+    label_codes: Dict[str, int] = {}
+    label_counts: Dict[str, int] = {}
+    for position, answer in enumerate(answers):
+        text = answer.get('answer_text') or ''
+        key = answer_hash(text)
+        texts[key] = text
+        hashes.append(key)
+        scores[position] = float(answer.get('sentiment_score') or 0.0)
+        label = answer.get('sentiment_label') or ''
+        codes[position] = label_codes.setdefault(label, len(label_codes))
+        label_counts[label] = label_counts.get(label, 0) + 1
+
+    doc = {key: value for key, value in analysis_data.items() if key not in LEGACY_FIELDS}
+    doc.update({
+        'format_version': COMPACT_FORMAT,
+        'answer_count': len(answers),
+        'answer_hashes': b''.join(hashes),
+        'sentiment_scores': scores.tobytes(),
+        'sentiment_labels': codes.tobytes(),
+        'label_names': list(label_codes),
+        'label_counts': label_counts,
+    })
+    return doc, texts
+
+
+def analysis_update(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Upsert update that also drops the other format's fields and any archive marker"""
+    stale = LEGACY_FIELDS if format_version(doc) == COMPACT_FORMAT else COMPACT_FIELDS
+    return {'$set': doc, '$unset': {field: '' for field in stale + ('archived',)}}
+
+
+def answer_hashes(doc: Mapping[str, Any]) -> List[bytes]:
+    """Answer text keys of a compact document, in answer order"""
+    blob = bytes(doc.get('answer_hashes') or b'')
+    return [blob[start:start + ANSWER_HASH_SIZE] for start in range(0, len(blob), ANSWER_HASH_SIZE)]
+
+
+def expand_analysis(doc: Dict[str, Any], texts: Mapping[bytes, str]) -> Dict[str, Any]:
+    """
+    Convert a stored analysis of either format to the legacy shape
+
+    Args:
+        doc: Stored document
+        texts: Answer texts by hash, see fetch_answer_texts()
+    """
+    if format_version(doc) != COMPACT_FORMAT or 'answer_hashes' not in doc:
+        # Legacy, or an archived stub without per-answer data
+        return doc
+    scores = np.frombuffer(bytes(doc.get('sentiment_scores') or b''), dtype=np.float32)
+    codes = np.frombuffer(bytes(doc.get('sentiment_labels') or b''), dtype=np.uint8)
+    label_names = doc.get('label_names') or []
+    expanded = {key: value for key, value in doc.items() if key not in COMPACT_FIELDS}
+    expanded['answers'] = [
+        {
+            'index': index,
+            'answer_text': texts.get(key, ''),
+            'sentiment_score': float(scores[index]),
+            'sentiment_label': label_names[codes[index]],
+        }
+        for index, key in enumerate(answer_hashes(doc))
+    ]
+    return expanded
+
+
+def fetch_answer_texts(collection, keys: Iterable[bytes]) -> Dict[bytes, str]:
+    """Look up answer texts by hash"""
+    keys = list(set(keys))
+    if not keys:
+        return {}
+    return {
+        bytes(doc['_id']): doc.get('text') or ''
+        for doc in collection.find({'_id': {'$in': keys}})
+    }
+
+
+def expand_analyses(docs: List[Dict[str, Any]], collection) -> List[Dict[str, Any]]:
+    """Expand many stored analyses with one answer_texts query"""
+    keys = [key for doc in docs for key in answer_hashes(doc)]
+    texts = fetch_answer_texts(collection, keys)
+    return [expand_analysis(doc, texts) for doc in docs]
+
+
+def save_answer_texts(collection, texts: Mapping[bytes, str]) -> None:
+    """Insert answer texts that are not stored yet; stored texts never change"""
+    if not texts:
+        return
+    try:
+        collection.bulk_write(
+            [
+                UpdateOne({'_id': key}, {'$setOnInsert': {'text': text}}, upsert=True)
+                for key, text in texts.items()
+            ],
+            ordered=False,
+        )
+    except BulkWriteError as e:
+        # Concurrent upserts of the same text race on _id; either one stored it
+        if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+            raise
@@ -1,4 +1,6 @@
 """Configuration defaults for intelligence-ms."""
+import hashlib
+import json
 import os
 
 BASE_DIR = os.getenv(
@@ -43,12 +45,34 @@ TRANSLATION_DETECT_LANGUAGE = (
     os.getenv('TRANSLATION_DETECT_LANGUAGE', 'true').lower() == 'true'
 )
 
+# Models whose results an analysis stores. The default MODEL_VERSION is
+# derived from them, so changing a model stops the reuse of stored results and
+# makes scripts/backfill.py select the analyses it produced.
+ANALYSIS_MODELS = {
+    'sentiment': SENTIMENT_MODEL_ID,
+    'embedding': EMBEDDING_MODEL,
+    'paraphrase': PARAPHRASE_MODEL,
+    'translation': (
+        f'{TRANSLATION_MODEL}:{TRANSLATION_TASK}' if TRANSLATE_BEFORE_SENTIMENT else ''
+    ),
+}
+MODEL_VERSION = os.getenv('INTELLIGENCE_MODEL_VERSION') or 'intelligence-ms-' + hashlib.blake2b(
+    json.dumps(ANALYSIS_MODELS, sort_keys=True).encode(), digest_size=6).hexdigest()
+
 CLUSTER_DISTANCE_THRESHOLD = float(
     os.getenv('CLUSTER_DISTANCE_THRESHOLD', '0.5')
 )
 CLUSTER_MIN_SIZE = int(os.getenv('CLUSTER_MIN_SIZE', '3'))
 CLUSTER_MAX_COUNT = int(os.getenv('CLUSTER_MAX_COUNT', '6'))
 MAX_CLUSTER_EXAMPLES = int(os.getenv('MAX_CLUSTER_EXAMPLES', '8'))
+# Assign answers to the previous analysis' clusters, reclustering only when
+# more than CLUSTER_DRIFT_LIMIT of them are beyond CLUSTER_DISTANCE_THRESHOLD.
+# Independent of INCREMENTAL_ANALYSIS_ENABLED: the stored analysis is loaded
+# when either is set.
+INCREMENTAL_CLUSTERING_ENABLED = (
+    os.getenv('INCREMENTAL_CLUSTERING_ENABLED', 'false').lower() == 'true'
+)
+CLUSTER_DRIFT_LIMIT = float(os.getenv('CLUSTER_DRIFT_LIMIT', '0.2'))
 
 PARAPHRASE_MIN_WORDS = int(os.getenv('PARAPHRASE_MIN_WORDS', '4'))
 PARAPHRASE_MAX_WORDS = int(os.getenv('PARAPHRASE_MAX_WORDS', '12'))
@@ -57,3 +81,171 @@ PARAPHRASE_MIN_NEW_TOKENS = int(os.getenv('PARAPHRASE_MIN_NEW_TOKENS', '4'))
 PARAPHRASE_REPORT_ENABLED = (
     os.getenv('PARAPHRASE_REPORT_ENABLED', 'false').lower() == 'true'
 )
+
+# 'sync' saves each analysis before replying; 'write_behind' queues it for the
+# bulk flusher (see write_behind.py)
+ANALYSIS_WRITE_MODES = ('sync', 'write_behind')
+ANALYSIS_WRITE_MODE = os.getenv('ANALYSIS_WRITE_MODE', 'sync').strip().lower()
+if ANALYSIS_WRITE_MODE not in ANALYSIS_WRITE_MODES:
+    raise ValueError(
+        f"ANALYSIS_WRITE_MODE must be one of {', '.join(ANALYSIS_WRITE_MODES)}, "
+        f"not {ANALYSIS_WRITE_MODE!r}"
+    )
+ANALYSIS_WRITE_QUEUE_SIZE = int(os.getenv('ANALYSIS_WRITE_QUEUE_SIZE', '1000'))
+# Longest wait for room in a full queue before an analysis is written synchronously
+ANALYSIS_WRITE_QUEUE_TIMEOUT_MS = int(os.getenv('ANALYSIS_WRITE_QUEUE_TIMEOUT_MS', '1000'))
+ANALYSIS_WRITE_BATCH_SIZE = int(os.getenv('ANALYSIS_WRITE_BATCH_SIZE', '100'))
+ANALYSIS_WRITE_FLUSH_INTERVAL_MS = int(
+    os.getenv('ANALYSIS_WRITE_FLUSH_INTERVAL_MS', '500')
+)
+ANALYSIS_WRITE_MAX_RETRIES = int(os.getenv('ANALYSIS_WRITE_MAX_RETRIES', '3'))
+ANALYSIS_WRITE_RETRY_BACKOFF_MS = int(
+    os.getenv('ANALYSIS_WRITE_RETRY_BACKOFF_MS', '200')
+)
+
+# Storage format of new analysis documents: 1 = legacy per-answer subdocuments, 2 = compact
+ANALYSIS_DOC_FORMAT = int(os.getenv('ANALYSIS_DOC_FORMAT', '1'))
+
+# Read-through cache of GetAnalysis / GetAnalyses documents; size 0 disables it
+ANALYSIS_CACHE_SIZE = int(os.getenv('ANALYSIS_CACHE_SIZE', '1024'))
+ANALYSIS_CACHE_TTL_SECONDS = float(os.getenv('ANALYSIS_CACHE_TTL_SECONDS', '30'))
+
+# Closed monthly buckets older than this are archived by scripts/retention.py
+ANALYSIS_RETENTION_MONTHS = int(os.getenv('ANALYSIS_RETENTION_MONTHS', '12'))
+
+# ExportAnalyses / scripts/export_parquet.py: documents per Mongo cursor batch
+# and rows per Arrow record batch
+EXPORT_CURSOR_BATCH_SIZE = int(os.getenv('EXPORT_CURSOR_BATCH_SIZE', '1000'))
+EXPORT_BATCH_ROWS = int(os.getenv('EXPORT_BATCH_ROWS', '16384'))
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
+
+SIMILARITY_INDEX_ENABLED = (
+    os.getenv('SIMILARITY_INDEX_ENABLED', 'false').lower() == 'true'
+)
+SIMILARITY_INDEX_PATH = os.getenv(
+    'SIMILARITY_INDEX_PATH',
+    os.path.join(BASE_DIR, '.cache', 'similarity-index'),
+)
+SIMILARITY_INDEX_NLIST = int(os.getenv('SIMILARITY_INDEX_NLIST', '0'))
+SIMILARITY_INDEX_NPROBE = int(os.getenv('SIMILARITY_INDEX_NPROBE', '8'))
+SIMILARITY_INDEX_MIN_TRAIN = int(
+    os.getenv('SIMILARITY_INDEX_MIN_TRAIN', '4096')
+)
+SIMILARITY_INDEX_SNAPSHOT_INTERVAL_S = int(
+    os.getenv('SIMILARITY_INDEX_SNAPSHOT_INTERVAL_S', '300')
+)
+
+IDEA_CANONICALIZATION_ENABLED = (
+    os.getenv('IDEA_CANONICALIZATION_ENABLED', 'false').lower() == 'true'
+)
+IDEA_MERGE_DISTANCE = float(os.getenv('IDEA_MERGE_DISTANCE', '0.25'))
+
+PREPARED_MODELS_DIR = os.getenv(
+    'PREPARED_MODELS_DIR',
+    os.path.join(BASE_DIR, '.cache', 'prepared-models'),
+)
+MODEL_MMAP_WEIGHTS = (
+    os.getenv('MODEL_MMAP_WEIGHTS', 'true').lower() == 'true'
+)
+
+ADMIN_PORT = int(os.getenv('ADMIN_PORT', '0'))
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+PROFILE_SIGNALS_ENABLED = (
+    os.getenv('PROFILE_SIGNALS_ENABLED', 'false').lower() == 'true'
+)
+PROFILE_OUTPUT_DIR = os.getenv(
+    'PROFILE_OUTPUT_DIR',
+    os.path.join(BASE_DIR, '.cache', 'profiles'),
+)
+PROFILE_DEFAULT_SECONDS = int(os.getenv('PROFILE_DEFAULT_SECONDS', '30'))
+PROFILE_MAX_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', '600'))
+PROFILE_SAMPLE_INTERVAL_MS = int(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '10'))
+TRACEMALLOC_FRAMES = int(os.getenv('TRACEMALLOC_FRAMES', '10'))
+
+# 'grpc' serves AnalyzeQuestion, 'stream' consumes the analytics-ms request
+# stream, 'both' runs the two side by side.
+SERVICE_MODE = os.getenv('INTELLIGENCE_SERVICE_MODE', 'grpc').lower()
+
+# Texts per sentiment / embedding model call
+SENTIMENT_BATCH_SIZE = int(os.getenv('SENTIMENT_BATCH_SIZE', '32'))
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '32'))
+# Torch intra-op threads; 0 keeps torch's default of one per core
+TORCH_THREADS = int(os.getenv('TORCH_THREADS', '0'))
+
+# Measured TORCH_THREADS, batch sizes and ANALYSIS_CONCURRENCY (see tuning.py).
+# CALIBRATE_ON_STARTUP: 'never' only loads an existing profile, 'missing'
+# calibrates when there is no profile for this node and models, 'always'
+# recalibrates on every start. Explicitly set env vars win over the profile.
+TUNING_PROFILE_PATH = os.getenv(
+    'TUNING_PROFILE_PATH',
+    os.path.join(BASE_DIR, '.cache', 'tuning-profile.json'),
+)
+CALIBRATE_ON_STARTUP = os.getenv('CALIBRATE_ON_STARTUP', 'never').strip().lower()
+CALIBRATION_TEXTS = int(os.getenv('CALIBRATION_TEXTS', '256'))
+CALIBRATION_REPEAT = int(os.getenv('CALIBRATION_REPEAT', '2'))
+CALIBRATION_BATCH_SIZES = os.getenv('CALIBRATION_BATCH_SIZES', '8,16,32,64,128')
+# Empty: powers of two up to the available cores
+CALIBRATION_THREADS = os.getenv('CALIBRATION_THREADS', '')
+
+# Answers per sentiment chunk; AnalyzeQuestionStream sends one message per chunk
+ANALYSIS_STREAM_CHUNK_SIZE = int(os.getenv('ANALYSIS_STREAM_CHUNK_SIZE', '256'))
+# AnswerChunk messages buffered ahead of processing by AnalyzeQuestionUpload
+UPLOAD_PREFETCH_CHUNKS = int(os.getenv('UPLOAD_PREFETCH_CHUNKS', '4'))
+
+# Reuse per-answer results of the stored analysis for unchanged answers
+INCREMENTAL_ANALYSIS_ENABLED = (
+    os.getenv('INCREMENTAL_ANALYSIS_ENABLED', 'false').lower() == 'true'
+)
+
+REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
+REDIS_PORT = int(os.getenv('REDIS_PORT', '6379'))
+REDIS_PASSWORD = os.getenv('REDIS_PASSWORD') or None
+REQUEST_STREAM = os.getenv(
+    'ANALYTICS_INTELLIGENCE_REQUEST_STREAM', 'analytics:intelligence:request:v1')
+RESULT_STREAM = os.getenv(
+    'ANALYTICS_INTELLIGENCE_RESULT_STREAM', 'analytics:intelligence:result:v1')
+DLQ_STREAM = os.getenv(
+    'ANALYTICS_INTELLIGENCE_DLQ_STREAM', 'analytics:intelligence:dlq:v1')
+STREAM_GROUP = os.getenv('INTELLIGENCE_STREAM_GROUP', 'intelligence-ms')
+STREAM_CONSUMER = os.getenv(
+    'INTELLIGENCE_STREAM_CONSUMER', os.getenv('HOSTNAME', 'intelligence-ms'))
+STREAM_BATCH_SIZE = int(os.getenv('INTELLIGENCE_STREAM_BATCH_SIZE', '16'))
+STREAM_BLOCK_MS = int(os.getenv('INTELLIGENCE_STREAM_BLOCK_MS', '5000'))
+STREAM_CLAIM_IDLE_MS = int(os.getenv('INTELLIGENCE_STREAM_CLAIM_IDLE_MS', '300000'))
+STREAM_CLAIM_INTERVAL_S = int(os.getenv('INTELLIGENCE_STREAM_CLAIM_INTERVAL_S', '30'))
+STREAM_MAX_DELIVERIES = int(os.getenv('INTELLIGENCE_STREAM_MAX_DELIVERIES', '5'))
+
+# gRPC server threads, as many as before the scheduler and lanes existed
+GRPC_MAX_WORKERS = int(os.getenv('GRPC_MAX_WORKERS', '10'))
+# Each RPC class runs in its own lane of (concurrency, queue size), see lanes.py.
+# The analyze lane admits more calls than ANALYSIS_CONCURRENCY so jobs from
+# every form reach the scheduler queue.
+RPC_LANES_ENABLED = os.getenv('RPC_LANES_ENABLED', 'false').lower() == 'true'
+RPC_LANES = {
+    'analyze': (
+        int(os.getenv('RPC_LANE_ANALYZE_CONCURRENCY', '24')),
+        int(os.getenv('RPC_LANE_ANALYZE_QUEUE', '8')),
+    ),
+    'read': (
+        int(os.getenv('RPC_LANE_READ_CONCURRENCY', '8')),
+        int(os.getenv('RPC_LANE_READ_QUEUE', '32')),
+    ),
+    'export': (
+        int(os.getenv('RPC_LANE_EXPORT_CONCURRENCY', '2')),
+        int(os.getenv('RPC_LANE_EXPORT_QUEUE', '2')),
+    ),
+}
+# Analyses run in ANALYSIS_CONCURRENCY slots; waiting jobs are scheduled
+# fairly across forms (see scheduler.py). The gRPC server keeps at least
+# SCHEDULER_THREADS_PER_SLOT threads per slot so waiting jobs reach the
+# scheduler queue instead of the gRPC one.
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'false').lower() == 'true'
+ANALYSIS_CONCURRENCY = int(os.getenv('ANALYSIS_CONCURRENCY', '10'))
+SCHEDULER_THREADS_PER_SLOT = int(os.getenv('SCHEDULER_THREADS_PER_SLOT', '3'))
+SCHEDULER_QUANTUM = float(os.getenv('SCHEDULER_QUANTUM', '100'))
+SCHEDULER_CHARS_PER_UNIT = int(os.getenv('SCHEDULER_CHARS_PER_UNIT', '200'))
+# Autoscaling signals (see load.py): per-answer cost averaged over this many
+# recent answers, and assumed until the first analysis finished
+LOAD_COST_WINDOW_ANSWERS = int(os.getenv('LOAD_COST_WINDOW_ANSWERS', '5000'))
+LOAD_INITIAL_ANSWER_SECONDS = float(os.getenv('LOAD_INITIAL_ANSWER_SECONDS', '0.02'))
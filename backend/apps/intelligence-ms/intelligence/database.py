@@ -1,10 +1,60 @@
 """
 MongoDB Database Module for Analytics
 """
-from typing import Dict, Any
-from pymongo import MongoClient
+from typing import Any, Dict, Iterator, List, Tuple
+from pymongo import IndexModel, MongoClient
 import os
 from datetime import datetime
+import logging
+
+from . import config
+from .analysis_cache import AnalysisCache
+from .analysis_format import (
+    ANSWER_TEXTS_COLLECTION,
+    COMPACT_FORMAT,
+    analysis_update,
+    answer_hashes,
+    encode_analysis,
+    expand_analyses,
+    fetch_answer_texts,
+    format_version,
+    save_answer_texts,
+)
+from .idea_catalog import FREQUENCY_PROJECTION, apply_frequency_deltas, frequency_deltas
+from .partitions import (
+    FINISHED,
+    IDEA_ROLLUPS_COLLECTION,
+    ROLLUPS_COLLECTION,
+    bucket_of,
+    closed_buckets,
+    find_moves,
+    idea_count_pipeline,
+    label_count_pipelines,
+    open_match,
+    release_moves,
+)
+from .write_behind import AnalysisWriteBehind
+
+# Fields of the summary view served by get_analyses(); legacy documents also
+# read their answers' labels to build the label histogram.
+SUMMARY_PROJECTION = {
+    '_id': 0,
+    'question_id': 1,
+    'question_text': 1,
+    'aggregate_sentiment_score': 1,
+    'aggregate_sentiment_label': 1,
+    'cluster_summaries.summary': 1,
+    'cluster_summaries.count': 1,
+    'model_version': 1,
+    'timestamp': 1,
+    'format_version': 1,
+    'answer_count': 1,
+    'label_counts': 1,
+    'answers.sentiment_label': 1,
+}
+FULL_PROJECTION = {'_id': 0, 'answer_embeddings': 0, 'cluster_summaries.centroid': 0}
+
+logger = logging.getLogger(__name__)
 
 
 class MongoDBManager:
@@ -61,25 +111,54 @@ class MongoDBManager:
             except Exception as e2:
                 raise Exception(f"Failed to connect to MongoDB: {str(e2)}")
 
+        self._analysis_cache = AnalysisCache()
+        self._write_behind = None
+        if config.ANALYSIS_WRITE_MODE == 'write_behind':
+            # Invalidate again once written, in case a read cached the old
+            # document while the new one was queued
+            self._write_behind = AnalysisWriteBehind(
+                self._write_analyses,
+                on_flush=self._analysis_cache.invalidate,
+            )
+
     def _ensure_collections(self):
         """Ensure required collections exist with indexes"""
         collections = [
             'analyses',
             'sentiment_stats',
+            'ideas',
+            ANSWER_TEXTS_COLLECTION,
+            ROLLUPS_COLLECTION,
+            IDEA_ROLLUPS_COLLECTION,
         ]
 
+        existing = set(self.db.list_collection_names())
         for collection in collections:
-            if collection not in self.db.list_collection_names():
+            if collection not in existing:
                 self.db.create_collection(collection)
 
-        # Create indexes
-        self.db['analyses'].create_index('question_id', unique=True)
-        self.db['analyses'].create_index('timestamp')
+        # Create indexes (one round trip per collection; no-op when they exist)
+        self.db['analyses'].create_indexes([
+            IndexModel('question_id', unique=True),
+            IndexModel('timestamp'),
+            IndexModel('bucket'),
+        ])
+        self.db[IDEA_ROLLUPS_COLLECTION].create_indexes([
+            IndexModel([('bucket', 1), ('summary', 1)], unique=True),
+        ])
+        self.db['ideas'].create_indexes([
+            IndexModel([('frequency', -1)]),
+            IndexModel([('model', 1), ('created_at', 1)]),
+        ])
 
     def save_analysis(self, analysis_data: Dict[str, Any]) -> str:
         """
         Save analysis result to database
 
+        The document is stored in the ANALYSIS_DOC_FORMAT format, in the
+        bucket of the current month. In write-behind mode the analysis is queued and persisted by the next
+        bulk flush, and the question ID is returned immediately.
+
         Args:
             analysis_data: Dictionary containing analysis results
 
@@ -87,17 +166,80 @@ class MongoDBManager:
             MongoDB insert_id
         """
         analysis_data['timestamp'] = datetime.utcnow()
+        analysis_data['bucket'] = bucket_of(analysis_data['timestamp'])
+        doc, texts = encode_analysis(analysis_data, config.ANALYSIS_DOC_FORMAT)
 
+        if self._write_behind is not None:
+            self._analysis_cache.invalidate([doc['question_id']])
+            self._write_behind.submit(doc, texts)
+            return str(analysis_data['question_id'])
         try:
-            result = self.db['analyses'].update_one(
-                {'question_id': analysis_data['question_id']},
-                {'$set': analysis_data},
-                upsert=True
+            return self._write_analysis(doc, texts)
+        finally:
+            self._analysis_cache.invalidate([doc['question_id']])
+
+    def save_analyses(self, documents: List[Dict[str, Any]]) -> None:
+        """
+        Upsert many analyses with one bulk write, bypassing write-behind
+
+        Args:
+            documents: Analyses in the legacy shape, stored in ANALYSIS_DOC_FORMAT
+                in the bucket of their timestamp (default: now)
+        """
+        texts = {}
+        docs = []
+        now = datetime.utcnow()
+        for document in documents:
+            timestamp = document.get('timestamp') or now
+            doc, doc_texts = encode_analysis(
+                {**document, 'timestamp': timestamp, 'bucket': bucket_of(timestamp)},
+                config.ANALYSIS_DOC_FORMAT,
             )
-            return str(result.upserted_id or analysis_data['question_id'])
+            texts.update(doc_texts)
+            docs.append(doc)
+        if not docs:
+            return
+        try:
+            self._write_analyses(docs, texts)
+        except Exception as e:
+            raise Exception(f"Failed to save analyses: {str(e)}")
+        finally:
+            self._analysis_cache.invalidate([doc['question_id'] for doc in docs])
+
+    def _write_analysis(self, doc: Dict[str, Any], texts=None) -> str:
+        try:
+            self._write_analyses([doc], texts or {})
+            return str(doc['question_id'])
         except Exception as e:
             raise Exception(f"Failed to save analysis: {str(e)}")
 
+    def _write_analyses(self, docs: List[Dict[str, Any]], texts) -> None:
+        """Upsert encoded analyses, keeping answer texts, bucket rollups and idea frequencies consistent"""
+        from pymongo import UpdateOne
+
+        question_ids = [doc['question_id'] for doc in docs]
+        moves = find_moves(self.db, question_ids, min(doc['bucket'] for doc in docs))
+        stored_ideas = list(self.db['analyses'].find(
+            {'question_id': {'$in': question_ids}, 'cluster_summaries.idea_id': {'$exists': True}},
+            FREQUENCY_PROJECTION,
+        ))
+        # Texts first, so a stored analysis never refers to a missing text
+        save_answer_texts(self.db[ANSWER_TEXTS_COLLECTION], texts)
+        self.db['analyses'].bulk_write(
+            [
+                UpdateOne({'question_id': doc['question_id']}, analysis_update(doc), upsert=True)
+                for doc in docs
+            ],
+            ordered=False,
+        )
+        release_moves(self.db, moves)
+        # Only once the analyses are stored, and never raised: a retry of this
+        # write would count the new clusters twice
+        try:
+            apply_frequency_deltas(self.db['ideas'], frequency_deltas(stored_ideas, docs))
+        except Exception as e:
+            logger.error(f"Failed to update idea frequencies of {question_ids}: {e}")
+
     def update_sentiment_stats(self, sentiment_label: str):
         """
         Update sentiment statistics
@@ -121,20 +263,26 @@ class MongoDBManager:
         """
         Get sentiment statistics
 
+        Only analyses of open buckets are aggregated, and the rollups of
+        closed buckets are added. Compact documents carry a label histogram;
+        legacy documents are counted per answer.
+
         Returns:
             Dictionary with sentiment stats
         """
         try:
-            pipeline = [
-                {'$unwind': '$answers'},
-                {
-                    '$group': {
-                        '_id': '$answers.sentiment_label',
-                        'count': {'$sum': 1},
-                    }
-                },
-            ]
-            stats = list(self.db['analyses'].aggregate(pipeline))
+            counts: Dict[str, int] = {}
+            closed = []
+            for rollup in self.db[ROLLUPS_COLLECTION].find(FINISHED, {'label_counts': 1}).sort('_id', 1):
+                closed.append(rollup['_id'])
+                for label, count in (rollup.get('label_counts') or {}).items():
+                    counts[label] = counts.get(label, 0) + int(count)
+            for pipeline in label_count_pipelines(open_match(closed)):
+                for stat in self.db['analyses'].aggregate(pipeline):
+                    label = stat.get('_id') or ''
+                    counts[label] = counts.get(label, 0) + int(stat.get('count', 0))
+            counts = {label: count for label, count in counts.items() if count > 0}
+            stats = [{'_id': label, 'count': count} for label, count in counts.items()]
 
             if not stats:
                 fallback = [
@@ -174,6 +322,10 @@ class MongoDBManager:
         """
         Get most frequent ideas
 
+        Reads the canonical idea table, where paraphrased summaries are already
+        merged. Falls back to grouping stored summaries by exact text when the
+        table has not been populated yet.
+
         Args:
             limit: Number of top ideas to return
 
@@ -181,78 +333,98 @@ class MongoDBManager:
             Dictionary with frequent ideas
         """
         try:
-            pipeline = [
-                {'$unwind': '$cluster_summaries'},
-                {
-                    '$match': {
-                        'cluster_summaries.summary': {
-                            '$exists': True,
-                            '$ne': '',
-                        }
-                    }
-                },
-                {
-                    '$group': {
-                        '_id': '$cluster_summaries.summary',
-                        'frequency': {
-                            '$sum': {'$ifNull': ['$cluster_summaries.count', 1]},
-                        },
-                    }
-                },
-                {'$sort': {'frequency': -1}},
-                {'$limit': limit},
-            ]
-            ideas = list(self.db['analyses'].aggregate(pipeline))
-
-            total_frequency = 0
-            total_frequency_result = list(
-                self.db['analyses'].aggregate(
+            if self.db['ideas'].find_one({'frequency': {'$gt': 0}}, {'_id': 1}) is None:
+                return self._aggregate_frequent_ideas(limit)
+
+            ideas = list(
+                self.db['ideas']
+                .find({'frequency': {'$gt': 0}}, {'summary': 1, 'frequency': 1})
+                .sort('frequency', -1)
+                .limit(limit)
+            )
+            totals = list(
+                self.db['ideas'].aggregate(
                     [
-                        {'$unwind': '$cluster_summaries'},
-                        {
-                            '$match': {
-                                'cluster_summaries.summary': {
-                                    '$exists': True,
-                                    '$ne': '',
-                                }
-                            }
-                        },
+                        {'$match': {'frequency': {'$gt': 0}}},
                         {
                             '$group': {
                                 '_id': None,
-                                'total': {
-                                    '$sum': {
-                                        '$ifNull': ['$cluster_summaries.count', 1]
-                                    }
-                                },
+                                'total_frequency': {'$sum': '$frequency'},
+                                'total_ideas': {'$sum': 1},
                             }
                         },
                     ]
                 )
             )
-            if total_frequency_result:
-                total_frequency = int(total_frequency_result[0].get('total', 0))
+            total_frequency = int(totals[0].get('total_frequency', 0)) if totals else 0
+            total_ideas = int(totals[0].get('total_ideas', 0)) if totals else 0
 
-            total_ideas_result = list(
+            formatted = []
+            for idea in ideas:
+                frequency = int(idea.get('frequency', 0))
+                formatted.append(
+                    {
+                        'idea': idea.get('summary') or '',
+                        'frequency': frequency,
+                        'percentage': (
+                            (frequency / total_frequency) * 100
+                            if total_frequency
+                            else 0
+                        ),
+                    }
+                )
+
+            return {
+                'ideas': formatted,
+                'total_ideas': total_ideas,
+            }
+        except Exception as e:
+            raise Exception(f"Failed to get frequent ideas: {str(e)}")
+
+    def _aggregate_frequent_ideas(self, limit: int) -> Dict[str, Any]:
+        try:
+            # Idea counts of the open buckets plus the rollups of the closed ones
+            closed = closed_buckets(self.db)
+            counts = idea_count_pipeline(open_match(closed))
+            if closed:
+                counts += [
+                    {
+                        '$unionWith': {
+                            'coll': IDEA_ROLLUPS_COLLECTION,
+                            'pipeline': [
+                                {'$match': {'bucket': {'$in': closed}}},
+                                {'$project': {'_id': '$summary', 'count': 1}},
+                            ],
+                        }
+                    },
+                    {'$group': {'_id': '$_id', 'count': {'$sum': '$count'}}},
+                    {'$match': {'count': {'$gt': 0}}},
+                ]
+            pipeline = counts + [
+                {'$project': {'frequency': '$count'}},
+                {'$sort': {'frequency': -1}},
+                {'$limit': limit},
+            ]
+            ideas = list(self.db['analyses'].aggregate(pipeline))
+
+            total_frequency = 0
+            total_ideas = 0
+            totals_result = list(
                 self.db['analyses'].aggregate(
-                    [
-                        {'$unwind': '$cluster_summaries'},
+                    counts + [
                         {
-                            '$match': {
-                                'cluster_summaries.summary': {
-                                    '$exists': True,
-                                    '$ne': '',
-                                }
+                            '$group': {
+                                '_id': None,
+                                'total': {'$sum': '$count'},
+                                'ideas': {'$sum': 1},
                             }
                         },
-                        {'$group': {'_id': '$cluster_summaries.summary'}},
-                        {'$count': 'total'},
                     ]
                 )
             )
-            total_ideas = 0
-            if total_ideas_result:
-                total_ideas = int(total_ideas_result[0].get('total', 0))
+            if totals_result:
+                total_frequency = int(totals_result[0].get('total', 0))
+                total_ideas = int(totals_result[0].get('ideas', 0))
 
             formatted = []
             for idea in ideas:
@@ -286,16 +458,227 @@ class MongoDBManager:
             question_id: The question ID to retrieve
 
         Returns:
-            Analysis data or None if not found
+            Analysis data in the legacy shape, whatever its storage format,
+            or None if not found
         """
         try:
-            return self.db['analyses'].find_one(
+            doc = self.db['analyses'].find_one(
                 {'question_id': question_id},
                 {'_id': 0}
             )
+            if doc is None:
+                return None
+            return expand_analyses([doc], self.db[ANSWER_TEXTS_COLLECTION])[0]
         except Exception as e:
             raise Exception(f"Failed to get analysis: {str(e)}")
 
+    def iter_analyses(
+        self,
+        match: Dict[str, Any],
+        projection: Dict[str, Any],
+        batch_size: int | None = None,
+        expand: bool = False,
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Page through stored analyses with a single cursor
+
+        Only one page is held in memory at a time, and the cursor fetches pages
+        of the same size from the server.
+
+        Args:
+            match: Filter on analyses
+            projection: Fields to read
+            batch_size: Documents per page (default: EXPORT_CURSOR_BATCH_SIZE)
+            expand: Convert compact documents to the legacy shape, with answer texts
+
+        Yields:
+            Lists of at most batch_size documents
+        """
+        batch_size = max(1, batch_size or config.EXPORT_CURSOR_BATCH_SIZE)
+        cursor = self.db['analyses'].find(match, projection, batch_size=batch_size)
+        try:
+            page = []
+            for doc in cursor:
+                page.append(doc)
+                if len(page) >= batch_size:
+                    yield expand_analyses(page, self.db[ANSWER_TEXTS_COLLECTION]) if expand else page
+                    page = []
+            if page:
+                yield expand_analyses(page, self.db[ANSWER_TEXTS_COLLECTION]) if expand else page
+        finally:
+            cursor.close()
+
+    def get_analyses(
+        self,
+        question_ids: List[str],
+        include_answers: bool = False,
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Get stored analyses for the read RPCs, through the analysis cache
+
+        Every document carries answer_count and label_counts whatever its
+        storage format. Embeddings and cluster centroids are never returned.
+
+        Args:
+            question_ids: Questions to look up
+            include_answers: Also return the per-answer results with their texts
+
+        Returns:
+            Analyses by question ID; questions never analyzed are missing.
+            The documents may be shared with the cache and must not be modified.
+        """
+        found = {}
+        missing = []
+        for question_id in dict.fromkeys(question_ids):
+            cached = self._analysis_cache.get(question_id, include_answers)
+            if cached is not None:
+                found[question_id] = cached
+            else:
+                missing.append(question_id)
+        if not missing:
+            return found
+
+        tokens = {question_id: self._analysis_cache.begin_read(question_id) for question_id in missing}
+        loaded = {}
+        try:
+            docs = list(self.db['analyses'].find(
+                {'question_id': {'$in': missing}},
+                FULL_PROJECTION if include_answers else SUMMARY_PROJECTION,
+            ))
+            if include_answers:
+                docs = expand_analyses(docs, self.db[ANSWER_TEXTS_COLLECTION])
+            for doc in docs:
+                loaded[doc['question_id']] = _read_view(doc, include_answers)
+        except Exception as e:
+            raise Exception(f"Failed to get analyses: {str(e)}")
+        finally:
+            for question_id, token in tokens.items():
+                self._analysis_cache.end_read(
+                    question_id, token, include_answers, loaded.get(question_id))
+        found.update(loaded)
+        return found
+
+    def get_cluster_summaries(self, question_id: str) -> List[Dict[str, Any]]:
+        """
+        Get the stored cluster summaries of a question
+
+        Args:
+            question_id: The question ID
+
+        Returns:
+            Cluster summaries, empty if the question was never analyzed
+        """
+        try:
+            doc = self.db['analyses'].find_one(
+                {'question_id': question_id},
+                {'_id': 0, 'cluster_summaries': 1},
+            )
+            return (doc or {}).get('cluster_summaries') or []
+        except Exception as e:
+            raise Exception(f"Failed to get cluster summaries: {str(e)}")
+
+    def iter_answer_embeddings(
+        self,
+        since: datetime | None = None,
+        batch_size: int = 500,
+    ) -> Iterator[Tuple[str, Dict[str, Any], datetime | None]]:
+        """
+        Stream stored answer embeddings, oldest analyses first
+
+        Args:
+            since: Only analyses saved at or after this time
+            batch_size: MongoDB cursor batch size
+
+        Yields:
+            (question_id, packed embeddings, timestamp) tuples
+        """
+        query: Dict[str, Any] = {'answer_embeddings': {'$exists': True}}
+        if since is not None:
+            query['timestamp'] = {'$gte': since}
+        try:
+            cursor = (
+                self.db['analyses']
+                .find(
+                    query,
+                    {'_id': 0, 'question_id': 1, 'answer_embeddings': 1, 'timestamp': 1},
+                )
+                .sort('timestamp', 1)
+                .batch_size(batch_size)
+            )
+            for doc in cursor:
+                yield doc['question_id'], doc['answer_embeddings'], doc.get('timestamp')
+        except Exception as e:
+            raise Exception(f"Failed to read answer embeddings: {str(e)}")
+
+    def get_answer_texts(
+        self,
+        keys: List[Tuple[str, int]],
+    ) -> Dict[Tuple[str, int], str]:
+        """
+        Look up answer texts by question ID and answer index
+
+        Args:
+            keys: (question_id, answer_index) pairs
+
+        Returns:
+            Mapping of the pairs that were found to their answer text
+        """
+        wanted = set(keys)
+        question_ids = list({question_id for question_id, _ in wanted})
+        if not question_ids:
+            return {}
+        try:
+            cursor = self.db['analyses'].find(
+                {'question_id': {'$in': question_ids}},
+                {
+                    '_id': 0,
+                    'question_id': 1,
+                    'format_version': 1,
+                    'answers.index': 1,
+                    'answers.answer_text': 1,
+                    'answer_hashes': 1,
+                },
+            )
+            texts = {}
+            hashed = {}
+            for doc in cursor:
+                if format_version(doc) == COMPACT_FORMAT:
+                    for index, text_key in enumerate(answer_hashes(doc)):
+                        key = (doc['question_id'], index)
+                        if key in wanted:
+                            hashed[key] = text_key
+                    continue
+                for answer in doc.get('answers') or []:
+                    key = (doc['question_id'], answer.get('index'))
+                    if key in wanted:
+                        texts[key] = answer.get('answer_text') or ''
+            if hashed:
+                stored = fetch_answer_texts(self.db[ANSWER_TEXTS_COLLECTION], hashed.values())
+                for key, text_key in hashed.items():
+                    texts[key] = stored.get(text_key, '')
+            return texts
+        except Exception as e:
+            raise Exception(f"Failed to get answer texts: {str(e)}")
+
     def close(self):
-        """Close the MongoDB connection"""
+        """Flush pending writes and close the MongoDB connection"""
+        if self._write_behind is not None:
+            self._write_behind.close()
         self.client.close()
+
+
+def _read_view(doc: Dict[str, Any], include_answers: bool) -> Dict[str, Any]:
+    """Give a stored analysis of either format its answer count and label histogram"""
+    answers = doc.get('answers')
+    if answers is not None and 'label_counts' not in doc:
+        label_counts: Dict[str, int] = {}
+        for answer in answers:
+            label = answer.get('sentiment_label') or ''
+            label_counts[label] = label_counts.get(label, 0) + 1
+        doc['label_counts'] = label_counts
+        doc['answer_count'] = len(answers)
+    if not include_answers:
+        doc.pop('answers', None)
+    doc.setdefault('answer_count', 0)
+    doc.setdefault('label_counts', {})
+    return doc
@@ -0,0 +1,45 @@
+"""
+Compact binary encoding of embeddings stored in MongoDB.
+"""
+from typing import Any, Dict
+
+import numpy as np
+
+from . import config
+
+EMBEDDING_DTYPE = 'float16'
+
+
+def pack_embeddings(embeddings: np.ndarray) -> Dict[str, Any]:
+    """Encode an (n, dim) embedding matrix as a compact float16 blob."""
+    matrix = np.ascontiguousarray(embeddings, dtype=np.float16)
+    return {
+        'model': config.EMBEDDING_MODEL,
+        'dtype': EMBEDDING_DTYPE,
+        'dim': int(matrix.shape[1]),
+        'data': matrix.tobytes(),
+    }
+
+
+def unpack_embeddings(packed: Dict[str, Any] | None) -> np.ndarray | None:
+    """Decode a blob written by `pack_embeddings`, or None if unusable."""
+    if not packed or packed.get('dtype') != EMBEDDING_DTYPE:
+        return None
+    if packed.get('model') != config.EMBEDDING_MODEL:
+        return None
+    dim = int(packed.get('dim') or 0)
+    if dim <= 0:
+        return None
+    return np.frombuffer(bytes(packed['data']), dtype=np.float16).reshape(-1, dim)
+
+
+def pack_vector(vector: np.ndarray) -> bytes:
+    """Encode a single embedding as float16 bytes (model and dim are implied)."""
+    return np.ascontiguousarray(vector, dtype=np.float16).tobytes()
+
+
+def unpack_vector(data: bytes | None) -> np.ndarray | None:
+    """Decode bytes written by `pack_vector` as a float32 vector."""
+    if not data:
+        return None
+    return np.frombuffer(bytes(data), dtype=np.float16).astype(np.float32)
@@ -0,0 +1,284 @@
+"""
+Columnar export of stored analyses as Arrow record batches.
+
+Three flat tables can be exported:
+
+    answers    one row per answer: index, score and label (and text if requested)
+    clusters   one row per cluster summary
+    questions  one row per analysis: aggregate sentiment and label counts
+
+Rows are built from pages of a Mongo cursor (see MongoDBManager.iter_analyses)
+and emitted in batches of at most batch_rows, so memory use is bounded by the
+batch size rather than the number of analyses.
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pyarrow as pa
+
+from .analysis_format import COMPACT_FORMAT, format_version
+from .partitions import contribution
+
+ANSWERS_TABLE = 'answers'
+CLUSTERS_TABLE = 'clusters'
+QUESTIONS_TABLE = 'questions'
+TABLES = (ANSWERS_TABLE, CLUSTERS_TABLE, QUESTIONS_TABLE)
+
+_TIMESTAMP = pa.timestamp('ms', tz='UTC')
+_LABEL = pa.dictionary(pa.int8(), pa.string())
+
+
+def schema(table: str, include_texts: bool = False) -> pa.Schema:
+    """Arrow schema of an export table"""
+    if table == ANSWERS_TABLE:
+        fields = [
+            pa.field('question_id', pa.string()),
+            pa.field('analyzed_at', _TIMESTAMP),
+            pa.field('model_version', pa.string()),
+            pa.field('answer_index', pa.int32()),
+            pa.field('sentiment_score', pa.float32()),
+            pa.field('sentiment_label', _LABEL),
+        ]
+        if include_texts:
+            fields.insert(4, pa.field('answer_text', pa.string()))
+        return pa.schema(fields)
+    if table == CLUSTERS_TABLE:
+        return pa.schema([
+            pa.field('question_id', pa.string()),
+            pa.field('analyzed_at', _TIMESTAMP),
+            pa.field('cluster_index', pa.int32()),
+            pa.field('summary', pa.string()),
+            pa.field('count', pa.int32()),
+            pa.field('representative', pa.string()),
+            pa.field('idea_id', pa.string()),
+        ])
+    if table == QUESTIONS_TABLE:
+        return pa.schema([
+            pa.field('question_id', pa.string()),
+            pa.field('question_text', pa.string()),
+            pa.field('analyzed_at', _TIMESTAMP),
+            pa.field('model_version', pa.string()),
+            pa.field('aggregate_sentiment_score', pa.float32()),
+            pa.field('aggregate_sentiment_label', _LABEL),
+            pa.field('answer_count', pa.int32()),
+            pa.field('label_counts', pa.map_(pa.string(), pa.int32())),
+            pa.field('bucket', pa.string()),
+            pa.field('archived', pa.bool_()),
+        ])
+    raise ValueError(f'Unknown export table: {table}')
+
+
+def projection(table: str, include_texts: bool = False) -> Dict[str, int]:
+    """Fields of the stored analyses a table is built from"""
+    fields = ['question_id', 'timestamp']
+    if table == ANSWERS_TABLE:
+        fields += [
+            'model_version',
+            'format_version',
+            'answers.index',
+            'answers.sentiment_score',
+            'answers.sentiment_label',
+            'sentiment_scores',
+            'sentiment_labels',
+            'label_names',
+        ]
+        if include_texts:
+            fields += ['answers.answer_text', 'answer_hashes']
+    elif table == CLUSTERS_TABLE:
+        fields += [
+            'cluster_summaries.summary',
+            'cluster_summaries.count',
+            'cluster_summaries.representative',
+            'cluster_summaries.idea_id',
+        ]
+    elif table == QUESTIONS_TABLE:
+        fields += [
+            'question_text',
+            'model_version',
+            'aggregate_sentiment_score',
+            'aggregate_sentiment_label',
+            'answer_count',
+            'label_counts',
+            'answers.sentiment_label',
+            'bucket',
+            'archived',
+        ]
+    else:
+        raise ValueError(f'Unknown export table: {table}')
+    return {'_id': 0, **{field: 1 for field in fields}}
+
+
+def export_match(
+    question_ids: Iterable[str] = (),
+    model_version: str = '',
+    analyzed_after: Optional[datetime] = None,
+    analyzed_before: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """Mongo filter on the analyses to export; empty arguments don't filter"""
+    match: Dict[str, Any] = {}
+    question_ids = list(question_ids)
+    if question_ids:
+        match['question_id'] = {'$in': question_ids}
+    if model_version:
+        match['model_version'] = model_version
+    timestamp = {}
+    if analyzed_after is not None:
+        timestamp['$gte'] = _naive_utc(analyzed_after)
+    if analyzed_before is not None:
+        timestamp['$lt'] = _naive_utc(analyzed_before)
+    if timestamp:
+        match['timestamp'] = timestamp
+    return match
+
+
+def record_batches(
+    pages: Iterable[List[Dict[str, Any]]],
+    table: str,
+    include_texts: bool = False,
+    batch_rows: int = 65536,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Convert pages of stored analyses to record batches of an export table
+
+    Args:
+        pages: Lists of documents read with projection(table, include_texts);
+            compact documents must be expanded when include_texts is set
+        table: ANSWERS_TABLE, CLUSTERS_TABLE or QUESTIONS_TABLE
+        include_texts: Add the answer_text column to the answers table
+        batch_rows: Rows per batch; an analysis' rows may span two batches
+
+    Yields one empty batch if nothing matched, so readers still get the schema.
+    """
+    target = schema(table, include_texts)
+    rows = _ROW_BUILDERS[table]
+    batch_rows = max(1, batch_rows)
+    columns: Dict[str, list] = {name: [] for name in target.names}
+    pending = 0
+    emitted = False
+    for page in pages:
+        for doc in page:
+            for name, values in rows(doc, include_texts).items():
+                columns[name].append(values)
+            pending += len(columns['question_id'][-1])
+            while pending >= batch_rows:
+                yield _to_batch(columns, target, batch_rows)
+                pending -= batch_rows
+                emitted = True
+    if pending or not emitted:
+        yield _to_batch(columns, target, pending)
+
+
+def ipc_stream(batch: pa.RecordBatch) -> bytes:
+    """Serialize a record batch as a self-contained Arrow IPC stream (schema + batch)"""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def _answer_rows(doc: Dict[str, Any], include_texts: bool) -> Dict[str, Any]:
+    if format_version(doc) == COMPACT_FORMAT and 'sentiment_scores' in doc:
+        scores = np.frombuffer(bytes(doc.get('sentiment_scores') or b''), dtype=np.float32)
+        codes = np.frombuffer(bytes(doc.get('sentiment_labels') or b''), dtype=np.uint8)
+        label_names = np.array(doc.get('label_names') or [''], dtype=object)
+        indices = np.arange(len(scores), dtype=np.int32)
+        labels = label_names[codes].tolist()
+        texts = None
+    else:
+        # Legacy documents, and compact ones expanded for their texts
+        answers = sorted(doc.get('answers') or [], key=lambda answer: answer['index'])
+        indices = np.array([answer['index'] for answer in answers], dtype=np.int32)
+        scores = np.array(
+            [answer.get('sentiment_score') or 0.0 for answer in answers], dtype=np.float32)
+        labels = [answer.get('sentiment_label') or '' for answer in answers]
+        texts = [answer.get('answer_text') or '' for answer in answers]
+    count = len(indices)
+    rows = {
+        'question_id': [doc['question_id']] * count,
+        'analyzed_at': [_analyzed_at(doc)] * count,
+        'model_version': [doc.get('model_version') or ''] * count,
+        'answer_index': indices,
+        'sentiment_score': scores,
+        'sentiment_label': labels,
+    }
+    if include_texts:
+        rows['answer_text'] = texts if texts is not None else [''] * count
+    return rows
+
+
+def _cluster_rows(doc: Dict[str, Any], include_texts: bool) -> Dict[str, Any]:
+    clusters = doc.get('cluster_summaries') or []
+    return {
+        'question_id': [doc['question_id']] * len(clusters),
+        'analyzed_at': [_analyzed_at(doc)] * len(clusters),
+        'cluster_index': np.arange(len(clusters), dtype=np.int32),
+        'summary': [cluster.get('summary') or '' for cluster in clusters],
+        'count': np.array([int(cluster.get('count') or 0) for cluster in clusters], dtype=np.int32),
+        'representative': [cluster.get('representative') for cluster in clusters],
+        'idea_id': [
+            str(cluster['idea_id']) if cluster.get('idea_id') is not None else None
+            for cluster in clusters
+        ],
+    }
+
+
+def _question_rows(doc: Dict[str, Any], include_texts: bool) -> Dict[str, Any]:
+    label_counts, _ = contribution(doc)
+    return {
+        'question_id': [doc['question_id']],
+        'question_text': [doc.get('question_text') or ''],
+        'analyzed_at': [_analyzed_at(doc)],
+        'model_version': [doc.get('model_version') or ''],
+        'aggregate_sentiment_score': np.array(
+            [doc.get('aggregate_sentiment_score') or 0.0], dtype=np.float32),
+        'aggregate_sentiment_label': [doc.get('aggregate_sentiment_label') or ''],
+        'answer_count': np.array(
+            [doc.get('answer_count', sum(label_counts.values()))], dtype=np.int32),
+        'label_counts': [list(label_counts.items())],
+        'bucket': [doc.get('bucket')],
+        'archived': [bool(doc.get('archived'))],
+    }
+
+
+_ROW_BUILDERS = {
+    ANSWERS_TABLE: _answer_rows,
+    CLUSTERS_TABLE: _cluster_rows,
+    QUESTIONS_TABLE: _question_rows,
+}
+
+
+def _to_batch(columns: Dict[str, list], target: pa.Schema, rows: int) -> pa.RecordBatch:
+    """Take the first `rows` rows of the buffered column chunks as a record batch"""
+    arrays = []
+    for field in target:
+        chunks = columns[field.name]
+        values = _concat(chunks)
+        columns[field.name] = [values[rows:]] if len(values) > rows else []
+        values = values[:rows]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=pa.string()).dictionary_encode().cast(field.type))
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=target)
+
+
+def _concat(chunks: list):
+    if chunks and all(isinstance(chunk, np.ndarray) for chunk in chunks):
+        return np.concatenate(chunks)
+    values: list = []
+    for chunk in chunks:
+        values.extend(chunk.tolist() if isinstance(chunk, np.ndarray) else chunk)
+    return values
+
+
+def _analyzed_at(doc: Dict[str, Any]) -> Optional[datetime]:
+    timestamp = doc.get('timestamp')
+    return timestamp.replace(tzinfo=timezone.utc) if timestamp is not None else None
+
+
+def _naive_utc(value: datetime) -> datetime:
+    """Stored timestamps are naive UTC"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
@@ -0,0 +1,200 @@
+"""
+Global table of canonical ideas shared across questions.
+"""
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+from pymongo import UpdateOne
+
+from . import config
+from .embeddings import pack_vector, unpack_vector
+
+logger = logging.getLogger(__name__)
+
+
+class IdeaCatalog:
+    """Merges cluster summaries into canonical ideas by centroid similarity"""
+
+    def __init__(self, collection, merge_distance: float | None = None):
+        """
+        Initialize the catalog from the ideas collection
+
+        Args:
+            collection: The ideas collection
+            merge_distance: Maximum cosine distance between a cluster centroid
+                and an idea centroid for the cluster to count towards it
+        """
+        self._collection = collection
+        self._merge_distance = (
+            config.IDEA_MERGE_DISTANCE if merge_distance is None else merge_distance
+        )
+        self._lock = threading.Lock()
+        self._ids: List[Any] = []
+        self._centroids = np.zeros((0, 0), dtype=np.float32)
+        self._loaded_until = None
+        self._load_new()
+
+    def canonicalize(self, clusters: List[Dict[str, Any]]) -> None:
+        """
+        Attach the `idea_id` of its canonical idea to each cluster
+
+        Unmatched clusters become new ideas with frequency 0. Frequencies are
+        not changed here: the analysis write applies them once the document
+        is stored (see frequency_deltas()), so a failed or dropped write
+        never counts.
+
+        Args:
+            clusters: Cluster summaries with `summary`, `count` and `centroid`
+        """
+        pending = []
+        for cluster in clusters:
+            centroid = cluster.get('centroid')
+            if centroid is None or not cluster.get('summary'):
+                continue
+            centroid = np.asarray(centroid, dtype=np.float32)
+            norm = np.linalg.norm(centroid)
+            pending.append((cluster, centroid / norm if norm > 0 else centroid))
+        if not pending:
+            return
+
+        pending = self._match(pending)
+        if pending:
+            # Another replica may have created matching ideas meanwhile
+            self._load_new()
+            pending = self._match(pending)
+        if not pending:
+            return
+
+        # Clusters of this analysis that are close to each other share one new idea
+        new_ideas: List[Dict[str, Any]] = []
+        new_centroids: List[np.ndarray] = []
+        members: List[List[Dict[str, Any]]] = []
+        now = datetime.utcnow()
+        for cluster, centroid in pending:
+            for position, other in enumerate(new_centroids):
+                if 1.0 - float(other @ centroid) <= self._merge_distance:
+                    members[position].append(cluster)
+                    break
+            else:
+                new_ideas.append({
+                    'summary': cluster['summary'],
+                    'centroid': pack_vector(centroid),
+                    'model': config.EMBEDDING_MODEL,
+                    'frequency': 0,
+                    'created_at': now,
+                    'updated_at': now,
+                })
+                new_centroids.append(centroid)
+                members.append([cluster])
+        result = self._collection.insert_many(new_ideas)
+        with self._lock:
+            for idea_id, centroid, cluster_group in zip(result.inserted_ids, new_centroids, members):
+                self._append(idea_id, centroid)
+                for cluster in cluster_group:
+                    cluster['idea_id'] = idea_id
+
+    def _match(self, pending):
+        """Attach known ideas; returns the clusters left without one"""
+        unmatched = []
+        with self._lock:
+            for cluster, centroid in pending:
+                idea_id = self._nearest(centroid)
+                if idea_id is None:
+                    unmatched.append((cluster, centroid))
+                else:
+                    cluster['idea_id'] = idea_id
+        return unmatched
+
+    def _nearest(self, centroid: np.ndarray):
+        if not self._ids or self._centroids.shape[1] != centroid.shape[0]:
+            return None
+        similarities = self._centroids @ centroid
+        best = int(np.argmax(similarities))
+        if 1.0 - float(similarities[best]) <= self._merge_distance:
+            return self._ids[best]
+        return None
+
+    def _append(self, idea_id, centroid: np.ndarray) -> None:
+        if self._centroids.size == 0:
+            self._centroids = centroid[np.newaxis, :].astype(np.float32)
+        else:
+            self._centroids = np.vstack([self._centroids, centroid])
+        self._ids.append(idea_id)
+
+    def _load_new(self) -> None:
+        """Add ideas created since the last load; the query runs outside the lock"""
+        query: Dict[str, Any] = {'model': config.EMBEDDING_MODEL}
+        with self._lock:
+            if self._loaded_until is not None:
+                query['created_at'] = {'$gte': self._loaded_until}
+        docs = list(self._collection.find(
+            query, {'_id': 1, 'centroid': 1, 'created_at': 1}
+        ).sort('created_at', 1))
+        with self._lock:
+            known = set(self._ids)
+            for doc in docs:
+                created_at = doc.get('created_at')
+                if created_at and (
+                    self._loaded_until is None or created_at > self._loaded_until
+                ):
+                    self._loaded_until = created_at
+                if doc['_id'] in known:
+                    continue
+                centroid = unpack_vector(doc.get('centroid'))
+                if centroid is None:
+                    continue
+                if self._centroids.size and centroid.shape[0] != self._centroids.shape[1]:
+                    continue
+                self._append(doc['_id'], centroid)
+                known.add(doc['_id'])
+
+
+FREQUENCY_PROJECTION = {
+    '_id': 0,
+    'question_id': 1,
+    'cluster_summaries.idea_id': 1,
+    'cluster_summaries.count': 1,
+}
+
+
+def frequency_deltas(
+    stored_docs: Iterable[Dict[str, Any]],
+    docs: Iterable[Dict[str, Any]],
+) -> Counter:
+    """
+    Change of each idea's frequency when `docs` replace `stored_docs`
+
+    A question's previous clusters are withdrawn and its new ones counted,
+    so re-analysis does not inflate idea frequencies.
+
+    Args:
+        stored_docs: Stored analyses of the questions, read with FREQUENCY_PROJECTION
+            before the write
+        docs: The analyses being written
+    """
+    deltas: Counter = Counter()
+    for sign, documents in ((-1, stored_docs), (1, docs)):
+        for doc in documents:
+            for cluster in doc.get('cluster_summaries') or []:
+                if cluster.get('idea_id') is not None:
+                    deltas[cluster['idea_id']] += sign * int(cluster.get('count', 0))
+    return deltas
+
+
+def apply_frequency_deltas(collection, deltas: Counter) -> None:
+    """Increment idea frequencies by the deltas of frequency_deltas()"""
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {'_id': idea_id},
+            {'$inc': {'frequency': delta}, '$set': {'updated_at': now}},
+        )
+        for idea_id, delta in deltas.items()
+        if delta
+    ]
+    if operations:
+        collection.bulk_write(operations, ordered=False)
@@ -8,16 +8,15 @@ import os
 import re
 import threading
 from collections import Counter
-from typing import Dict, Iterable, List
+from typing import Callable, Dict, Iterable, List
 
 import numpy as np
 from langdetect import DetectorFactory, LangDetectException, detect
-from sentence_transformers import SentenceTransformer
-from sklearn.cluster import AgglomerativeClustering
-from sklearn.metrics.pairwise import cosine_distances
-from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, pipeline
 
 from . import config
+from . import metrics
+from .model_artifacts import load_pretrained, map_weights, prepared_path
+from .telemetry import record_inference, stage
 
 
 DetectorFactory.seed = 0
@@ -26,7 +25,12 @@ DetectorFactory.seed = 0
 class IdeaSummarizer:
     """Clusters answers and generates one paraphrased sentence per cluster."""
 
-    def __init__(self):
+    def __init__(self, eager: bool = True):
+        """
+        Args:
+            eager: Load the models now; pass False and run `loaders()` to load
+                them concurrently with other startup work.
+        """
         self._logger = logging.getLogger(__name__)
         self._embedding_model = None
         self._paraphraser = None
@@ -34,26 +38,70 @@ class IdeaSummarizer:
         self._translator = None
         self._translator_lock = threading.Lock()
         os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+        if eager:
+            for load in self.loaders().values():
+                load()
+
+    def loaders(self) -> Dict[str, Callable[[], object]]:
+        """Independent model loading steps, keyed by startup phase name."""
+        loaders = {
+            'embedding_model': self._get_embedding_model,
+            'paraphrase_model': self._get_paraphraser,
+        }
         if config.TRANSLATE_BEFORE_SENTIMENT:
-            self._init_translator()
+            loaders['summary_translator'] = self._init_translator
+        return loaders
+
+    def loaded_models(self) -> Dict[str, object]:
+        """Loaded torch modules keyed by name, for memory reports."""
+        models = {}
+        if self._embedding_model is not None:
+            models['embedding'] = self._embedding_model
+        if self._paraphraser is not None:
+            models['paraphrase'] = self._paraphraser.model
+        if self._translator is not None:
+            models['summary_translator'] = self._translator.model
+        return models
 
     def summarize_clusters(
         self,
         answers: List[str],
         question_text: str,
     ) -> List[Dict[str, int | str]]:
-        """Return cluster summaries with counts."""
+        """Return cluster summaries with counts and centroid embeddings."""
+        summaries, _ = self.summarize_and_embed(answers, question_text)
+        return summaries
+
+    def summarize_and_embed(
+        self,
+        answers: List[str],
+        question_text: str,
+        known_embeddings: Dict[str, np.ndarray] | None = None,
+        previous_clusters: List[Dict] | None = None,
+    ) -> tuple[List[Dict[str, int | str]], Dict[str, np.ndarray]]:
+        """
+        Return cluster summaries and the embedding of each normalized answer.
+
+        `known_embeddings` (normalized text -> embedding) skips encoding texts
+        that were already embedded, e.g. once for a whole batch of questions.
+
+        `previous_clusters` (`centroid`, `representative`, `summary`) from the
+        question's last analysis seed incremental clustering: answers are
+        assigned to the nearest previous centroid unless too many fall outside
+        CLUSTER_DISTANCE_THRESHOLD. Clusters whose representative answer is
+        unchanged keep their previous summary instead of being paraphrased.
+        """
         cleaned = self._normalize_answers(answers)
         if not cleaned:
-            return []
+            return [], {}
 
         counts = Counter(cleaned)
         texts = list(counts.keys())
         weights = np.array([counts[text] for text in texts], dtype=float)
 
-        embeddings = self._embed_texts(texts)
+        embeddings = self._embed_with_known(texts, known_embeddings or {})
         if embeddings is None:
-            return []
+            return [], {}
 
         if self._logger.isEnabledFor(logging.DEBUG):
             duplicate_count = int(weights.sum() - len(texts))
@@ -70,40 +118,96 @@ class IdeaSummarizer:
                 config.CLUSTER_MAX_COUNT,
             )
 
-        labels = self._cluster_embeddings(embeddings, weights)
+        with stage('clustering', texts=len(texts)):
+            labels = None
+            if config.INCREMENTAL_CLUSTERING_ENABLED and previous_clusters:
+                labels = self._assign_to_clusters(embeddings, weights, previous_clusters)
+            mode = 'incremental' if labels is not None else 'full'
+            if labels is None:
+                labels = self._cluster_embeddings(embeddings, weights)
+        metrics.CLUSTERING_RUNS.labels(mode=mode).inc()
         if self._logger.isEnabledFor(logging.DEBUG):
             label_counts = Counter(labels)
             self._logger.debug("Cluster labels: %s", dict(label_counts))
 
+        centroids = self._cluster_centroids(embeddings, weights, labels)
+        previous_summaries = {
+            cluster['representative']: cluster['summary']
+            for cluster in previous_clusters or []
+            if cluster.get('representative') and cluster.get('summary')
+        }
         summaries = []
         for label in sorted(set(labels)):
             indices = np.where(labels == label)[0]
             cluster_count = int(weights[indices].sum())
             representative = self._representative_sentence(
                 texts, embeddings, weights, indices, label)
-            summary = self._paraphrase_or_fallback(representative)
-            summaries.append({'summary': summary, 'count': cluster_count})
+            summary = previous_summaries.get(representative)
+            if summary is None:
+                summary = self._paraphrase_or_fallback(representative)
+            else:
+                metrics.PARAPHRASES_REUSED.inc()
+            summaries.append({
+                'summary': summary,
+                'count': cluster_count,
+                'centroid': centroids[label],
+                'representative': representative,
+            })
 
         summaries.sort(key=lambda item: item['count'], reverse=True)
-        return summaries
+        return summaries, dict(zip(texts, embeddings))
+
+    def embed(self, texts: List[str]) -> np.ndarray | None:
+        """Return L2-normalized embeddings for the given texts."""
+        return self._embed_texts(self._normalize_answers(texts))
+
+    def embed_unique(self, texts: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Embed each distinct normalized text once, keyed by normalized text."""
+        unique = list(dict.fromkeys(self._normalize_answers(texts)))
+        embeddings = self._embed_texts(unique)
+        if embeddings is None:
+            return {}
+        return dict(zip(unique, embeddings))
+
+    @staticmethod
+    def normalize_answer(answer: str) -> str:
+        """Collapse whitespace the same way answers are keyed for clustering."""
+        return re.sub(r"\s+", " ", answer or '').strip()
 
     def _normalize_answers(self, answers: Iterable[str]) -> List[str]:
         return [
-            re.sub(r"\s+", " ", answer).strip()
+            self.normalize_answer(answer)
             for answer in (answers or [])
-            if answer and re.sub(r"\s+", " ", answer).strip()
+            if answer and self.normalize_answer(answer)
         ]
 
+    def _embed_with_known(
+        self,
+        texts: List[str],
+        known: Dict[str, np.ndarray],
+    ) -> np.ndarray | None:
+        missing = [text for text in texts if text not in known]
+        if not missing:
+            return np.array([known[text] for text in texts]) if texts else None
+        computed = self._embed_texts(missing)
+        if computed is None:
+            return None
+        lookup = {**known, **dict(zip(missing, computed))}
+        return np.array([lookup[text] for text in texts])
+
     def _embed_texts(self, texts: List[str]):
         if not texts:
             return None
         try:
             model = self._get_embedding_model()
-            embeddings = model.encode(
-                texts,
-                show_progress_bar=False,
-                normalize_embeddings=True,
-            )
+            with stage('embedding', texts=len(texts)):
+                embeddings = model.encode(
+                    texts,
+                    batch_size=max(1, config.EMBEDDING_BATCH_SIZE),
+                    show_progress_bar=False,
+                    normalize_embeddings=True,
+                )
+            record_inference('embedding', len(texts))
             return np.array(embeddings)
         except Exception as exc:
             raise RuntimeError(
@@ -111,6 +215,8 @@ class IdeaSummarizer:
             ) from exc
 
     def _cluster_embeddings(self, embeddings: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        from sklearn.cluster import AgglomerativeClustering
+
         if embeddings.shape[0] <= 1:
             return np.zeros((embeddings.shape[0],), dtype=int)
 
@@ -132,6 +238,49 @@ class IdeaSummarizer:
             labels = self._merge_small_clusters(embeddings, weights, labels)
         return labels
 
+    def _assign_to_clusters(
+        self,
+        embeddings: np.ndarray,
+        weights: np.ndarray,
+        previous_clusters: List[Dict],
+    ) -> np.ndarray | None:
+        """
+        Label each text with its nearest previous centroid
+
+        Returns None, asking for a full recluster, when the previous centroids
+        are unusable or the weight share of texts farther than
+        CLUSTER_DISTANCE_THRESHOLD from every centroid exceeds
+        CLUSTER_DRIFT_LIMIT.
+        """
+        centroids = [
+            np.asarray(cluster['centroid'], dtype=np.float32)
+            for cluster in previous_clusters
+            if cluster.get('centroid') is not None
+        ]
+        if not centroids or any(c.shape != (embeddings.shape[1],) for c in centroids):
+            return None
+        matrix = np.stack(centroids)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms > 0, norms, 1)
+
+        # Embeddings are L2-normalized, so cosine distance is 1 - dot product
+        distances = 1.0 - embeddings @ matrix.T
+        nearest = distances.argmin(axis=1)
+        outside = distances[np.arange(len(nearest)), nearest] > config.CLUSTER_DISTANCE_THRESHOLD
+        drift = float(weights[outside].sum() / weights.sum())
+        if drift > config.CLUSTER_DRIFT_LIMIT:
+            self._logger.debug(
+                "Cluster drift %.2f exceeds %.2f; reclustering",
+                drift,
+                config.CLUSTER_DRIFT_LIMIT,
+            )
+            return None
+
+        _, labels = np.unique(nearest, return_inverse=True)
+        if config.CLUSTER_MIN_SIZE > 1:
+            labels = self._merge_small_clusters(embeddings, weights, labels)
+        return labels
+
     def _merge_small_clusters(
         self,
         embeddings: np.ndarray,
@@ -180,6 +329,8 @@ class IdeaSummarizer:
         centroids: Dict[int, np.ndarray],
         source_label: int,
     ) -> int:
+        from sklearn.metrics.pairwise import cosine_distances
+
         source = centroids[source_label]
         other_labels = [label for label in centroids.keys()
                         if label != source_label]
@@ -197,6 +348,8 @@ class IdeaSummarizer:
         indices: np.ndarray,
         label: int,
     ) -> str:
+        from sklearn.metrics.pairwise import cosine_distances
+
         if indices.size == 0:
             return ''
         subset_embeddings = embeddings[indices]
@@ -238,7 +391,7 @@ class IdeaSummarizer:
     def _paraphrase_sentence(self, sentence: str) -> str:
         paraphraser = self._get_paraphraser()
         prompt = f"Paraphrase: {sentence}"
-        with self._paraphraser_lock:
+        with self._paraphraser_lock, stage('paraphrase'):
             result = paraphraser(
                 prompt,
                 do_sample=False,
@@ -249,6 +402,7 @@ class IdeaSummarizer:
                 length_penalty=0.9,
                 clean_up_tokenization_spaces=True,
             )
+        record_inference('paraphrase', 1)
         if not result:
             return ''
         return (result[0].get('generated_text') or '').strip()
@@ -300,9 +454,12 @@ class IdeaSummarizer:
 
     def _get_embedding_model(self):
         if self._embedding_model is None:
+            from sentence_transformers import SentenceTransformer
+
+            prepared = prepared_path(config.EMBEDDING_MODEL)
             try:
                 self._embedding_model = SentenceTransformer(
-                    config.EMBEDDING_MODEL,
+                    prepared or config.EMBEDDING_MODEL,
                     cache_folder=config.HF_HOME,
                     local_files_only=True,
                 )
@@ -310,25 +467,29 @@ class IdeaSummarizer:
                 raise RuntimeError(
                     'Missing embedding model cache. Run scripts/cache_models.py.'
                 ) from exc
+            if prepared:
+                map_weights(
+                    self._embedding_model[0].auto_model, config.EMBEDDING_MODEL)
         return self._embedding_model
 
     def _get_paraphraser(self):
         if self._paraphraser is None:
+            from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, pipeline
+
             try:
-                tokenizer = AutoTokenizer.from_pretrained(
+                tokenizer = load_pretrained(
+                    AutoTokenizer,
                     config.PARAPHRASE_MODEL,
-                    cache_dir=config.HF_HOME,
-                    local_files_only=True,
                 )
-                model = AutoModelForSeq2SeqLM.from_pretrained(
+                model = load_pretrained(
+                    AutoModelForSeq2SeqLM,
                     config.PARAPHRASE_MODEL,
-                    cache_dir=config.HF_HOME,
-                    local_files_only=True,
                 )
             except Exception as exc:
                 raise RuntimeError(
                     'Missing paraphrase model cache. Run scripts/cache_models.py.'
                 ) from exc
+            map_weights(model, config.PARAPHRASE_MODEL)
             model_config = getattr(model, 'config', None)
             if model_config is not None:
                 model_config.max_length = None
@@ -355,27 +516,28 @@ class IdeaSummarizer:
         return self._paraphraser
 
     def _init_translator(self) -> None:
+        from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, pipeline
+
         model_id = (config.TRANSLATION_MODEL or '').strip()
         if not model_id or model_id.lower() == 'none':
             raise RuntimeError(
                 'Translation is enabled but TRANSLATION_MODEL is not set.'
             )
         try:
-            tokenizer = AutoTokenizer.from_pretrained(
+            tokenizer = load_pretrained(
+                AutoTokenizer,
                 model_id,
-                cache_dir=config.HF_HOME,
-                local_files_only=True,
                 use_fast=False,
             )
-            model = AutoModelForSeq2SeqLM.from_pretrained(
+            model = load_pretrained(
+                AutoModelForSeq2SeqLM,
                 model_id,
-                cache_dir=config.HF_HOME,
-                local_files_only=True,
             )
         except Exception as exc:
             raise RuntimeError(
                 'Translation model unavailable. Run scripts/cache_models.py.'
             ) from exc
+        map_weights(model, model_id)
 
         translation_task = (config.TRANSLATION_TASK or '').strip()
         if translation_task == 'translation':
@@ -397,14 +559,16 @@ class IdeaSummarizer:
         if not config.TRANSLATION_DETECT_LANGUAGE:
             return True
         try:
-            language = detect(text)
+            with stage('language_detection', trace_span=False):
+                language = detect(text)
         except LangDetectException:
             return True
         return language != 'en'
 
     def _translate(self, text: str) -> str:
-        with self._translator_lock:
+        with self._translator_lock, stage('translation', trace_span=False):
             result = self._translator(text, truncation=True)
+        record_inference('translation', 1)
         if not result:
             raise RuntimeError('Translation returned empty result.')
         translated = (result[0].get('translation_text') or '').strip()
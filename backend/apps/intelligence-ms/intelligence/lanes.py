@@ -0,0 +1,174 @@
+"""
+Per-class concurrency lanes for gRPC calls.
+
+Every RPC belongs to a lane (analyze, read or export) with its own limit of
+running handlers and of calls waiting for one. A call beyond both is rejected
+with RESOURCE_EXHAUSTED instead of taking a server thread. The gRPC thread pool
+is sized to the sum of the lanes, so a flood of analyses can hold at most the
+analyze lane's threads and reads always find one of their own.
+"""
+import threading
+import time
+from typing import Dict, Optional
+
+import grpc
+
+from . import config
+from . import metrics
+
+ANALYZE_LANE = 'analyze'
+READ_LANE = 'read'
+EXPORT_LANE = 'export'
+
+# Methods without a lane run unlimited
+METHOD_LANES = {
+    'AnalyzeQuestion': ANALYZE_LANE,
+    'AnalyzeQuestionStream': ANALYZE_LANE,
+    'AnalyzeQuestionUpload': ANALYZE_LANE,
+    'GetSentimentStats': READ_LANE,
+    'GetFrequentIdeas': READ_LANE,
+    'FindSimilarAnswers': READ_LANE,
+    'GetAnalysis': READ_LANE,
+    'GetAnalyses': READ_LANE,
+    'ExportAnalyses': EXPORT_LANE,
+}
+
+
+class LaneFull(Exception):
+    """The lane's handlers and queue are all taken"""
+
+
+class Lane:
+    """Limits the calls of one lane running at once and waiting to run"""
+
+    def __init__(self, name: str, concurrency: int, queue_size: int):
+        """
+        Args:
+            name: Lane name, used as the metrics label
+            concurrency: Handlers allowed to run at once
+            queue_size: Calls allowed to wait for a running handler to finish
+        """
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(0, queue_size)
+        self._condition = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+        metrics.RPC_LANE_IN_FLIGHT.labels(lane=name).set_function(lambda: self._running)
+        metrics.RPC_LANE_QUEUE_DEPTH.labels(lane=name).set_function(lambda: self._waiting)
+
+    @property
+    def capacity(self) -> int:
+        """Threads the lane can occupy: running plus waiting calls"""
+        return self.concurrency + self.queue_size
+
+    def acquire(self, timeout: Optional[float] = None) -> None:
+        """
+        Wait for a free handler; pair with release()
+
+        Args:
+            timeout: Seconds to wait, None waits indefinitely
+
+        Raises:
+            LaneFull: The queue is full
+            TimeoutError: No handler became free within timeout
+        """
+        if timeout is not None and timeout >= threading.TIMEOUT_MAX:
+            # gRPC reports calls without a deadline as ~2**63 seconds remaining
+            timeout = None
+        started = time.monotonic()
+        with self._condition:
+            if self._running >= self.concurrency:
+                if self._waiting >= self.queue_size:
+                    metrics.RPC_LANE_REJECTED.labels(lane=self.name, reason='full').inc()
+                    raise LaneFull(f'{self.name} lane is full')
+                self._waiting += 1
+                try:
+                    admitted = self._condition.wait_for(
+                        lambda: self._running < self.concurrency, timeout)
+                finally:
+                    self._waiting -= 1
+                if not admitted:
+                    metrics.RPC_LANE_REJECTED.labels(lane=self.name, reason='deadline').inc()
+                    raise TimeoutError(f'No {self.name} lane handler within {timeout:.1f}s')
+            self._running += 1
+        metrics.RPC_LANE_WAIT_SECONDS.labels(lane=self.name).observe(time.monotonic() - started)
+
+    def release(self) -> None:
+        with self._condition:
+            self._running -= 1
+            self._condition.notify()
+
+
+class RpcLanes:
+    """The lanes of the gRPC server"""
+
+    def __init__(self, lanes: Dict[str, Lane]):
+        self.lanes = lanes
+
+    @classmethod
+    def from_config(cls) -> 'RpcLanes':
+        return cls({
+            name: Lane(name, concurrency, queue_size)
+            for name, (concurrency, queue_size) in config.RPC_LANES.items()
+        })
+
+    def for_method(self, method: str) -> Optional[Lane]:
+        return self.lanes.get(METHOD_LANES.get(method, ''))
+
+    def thread_budget(self) -> int:
+        """Server threads needed for every lane to fill up at once"""
+        return sum(lane.capacity for lane in self.lanes.values())
+
+
+class LaneInterceptor(grpc.ServerInterceptor):
+    """Admits every RPC through its lane for the duration of the handler"""
+
+    def __init__(self, lanes: RpcLanes):
+        self._lanes = lanes
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        lane = self._lanes.for_method(handler_call_details.method.rsplit('/', 1)[-1])
+        if lane is None:
+            return handler
+
+        def unary(behavior):
+            def limited(request_or_iterator, context):
+                _acquire(lane, context)
+                try:
+                    return behavior(request_or_iterator, context)
+                finally:
+                    lane.release()
+            return limited
+
+        def streaming(behavior):
+            def limited(request_or_iterator, context):
+                _acquire(lane, context)
+                try:
+                    yield from behavior(request_or_iterator, context)
+                finally:
+                    lane.release()
+            return limited
+
+        if handler.unary_unary:
+            return handler._replace(unary_unary=unary(handler.unary_unary))
+        if handler.stream_unary:
+            return handler._replace(stream_unary=unary(handler.stream_unary))
+        if handler.unary_stream:
+            return handler._replace(unary_stream=streaming(handler.unary_stream))
+        if handler.stream_stream:
+            return handler._replace(stream_stream=streaming(handler.stream_stream))
+        return handler
+
+
+def _acquire(lane: Lane, context) -> None:
+    """Take a lane handler within the call deadline, aborting the call otherwise"""
+    try:
+        lane.acquire(context.time_remaining())
+    except LaneFull as e:
+        context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+    except TimeoutError as e:
+        context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, str(e))
@@ -0,0 +1,128 @@
+"""
+Queued analysis work, exported as autoscaling signals.
+
+CPU and request counts lag behind load: a pod is busy at 100% CPU long after
+the queue has grown, and one request may carry two answers or twenty thousand.
+LoadTracker counts the answers waiting for and holding analysis slots, and
+keeps a rolling per-answer cost, measured per stage, over the last
+LOAD_COST_WINDOW_ANSWERS analyzed answers. Their product estimates the seconds
+of inference queued on the pod, which an autoscaler can act on before latency
+degrades (see k8s/intelligence-ms-autoscaling.example.yaml).
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import ContextManager, Deque, Dict, Iterator, Optional, Tuple
+
+from . import config
+from . import metrics
+
+TOTAL_STAGE = 'total'
+
+_local = threading.local()
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """Add a stage's duration to the analysis running on this thread, if any"""
+    stages = getattr(_local, 'stages', None)
+    if stages is not None:
+        stages[name] = stages.get(name, 0.0) + seconds
+
+
+class LoadTracker:
+    """Answers queued and running in analysis slots, and their rolling cost"""
+
+    def __init__(self, window_answers: int | None = None, initial_answer_seconds: float | None = None):
+        """
+        Args:
+            window_answers: Answers the rolling cost is averaged over
+            initial_answer_seconds: Per-answer cost assumed before any analysis finished
+        """
+        self._window = max(1, window_answers or config.LOAD_COST_WINDOW_ANSWERS)
+        self._initial = (
+            config.LOAD_INITIAL_ANSWER_SECONDS
+            if initial_answer_seconds is None
+            else initial_answer_seconds
+        )
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queued_answers = 0
+        self._running_answers = 0
+        # (answers, seconds per stage) of recent analyses, oldest first
+        self._samples: Deque[Tuple[int, Dict[str, float]]] = deque()
+        self._sample_answers = 0
+        self._sample_seconds: Dict[str, float] = {}
+
+        metrics.INFLIGHT_ANALYSES.set_function(lambda: self._in_flight)
+        metrics.QUEUED_ANSWERS.set_function(lambda: self._queued_answers)
+        metrics.RUNNING_ANSWERS.set_function(lambda: self._running_answers)
+        metrics.QUEUED_INFERENCE_SECONDS.set_function(self.queued_seconds)
+        metrics.ANSWER_COST_SECONDS.labels(stage=TOTAL_STAGE).set(self._initial)
+
+    def answer_cost(self, stage: str = TOTAL_STAGE) -> float:
+        """Rolling seconds per answer of a stage, or of the whole analysis"""
+        with self._lock:
+            if not self._sample_answers:
+                return self._initial if stage == TOTAL_STAGE else 0.0
+            return self._sample_seconds.get(stage, 0.0) / self._sample_answers
+
+    def queued_seconds(self) -> float:
+        """Estimated inference seconds of the answers waiting for or holding a slot"""
+        cost = self.answer_cost()
+        with self._lock:
+            return (self._queued_answers + self._running_answers) * cost
+
+    @contextmanager
+    def job(self, answers: int, slot: Optional[ContextManager] = None) -> Iterator[None]:
+        """
+        Track an analysis of `answers` answers while it waits for and holds a slot
+
+        Args:
+            answers: Answers in the analysis
+            slot: Scheduler slot to wait for, see FairScheduler.slot()
+        """
+        with self._lock:
+            self._in_flight += 1
+            self._queued_answers += answers
+        admitted = False
+        try:
+            with slot if slot is not None else nullcontext():
+                with self._lock:
+                    self._queued_answers -= answers
+                    self._running_answers += answers
+                admitted = True
+                outer, _local.stages = getattr(_local, 'stages', None), {}
+                started = time.perf_counter()
+                try:
+                    yield
+                finally:
+                    stages, _local.stages = _local.stages, outer
+                    stages[TOTAL_STAGE] = time.perf_counter() - started
+                    with self._lock:
+                        self._running_answers -= answers
+                    if answers:
+                        self._add_sample(answers, stages)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                if not admitted:
+                    self._queued_answers -= answers
+
+    def _add_sample(self, answers: int, stages: Dict[str, float]) -> None:
+        with self._lock:
+            self._samples.append((answers, stages))
+            self._sample_answers += answers
+            for stage, seconds in stages.items():
+                self._sample_seconds[stage] = self._sample_seconds.get(stage, 0.0) + seconds
+            while len(self._samples) > 1 and self._sample_answers - self._samples[0][0] >= self._window:
+                old_answers, old_stages = self._samples.popleft()
+                self._sample_answers -= old_answers
+                for stage, seconds in old_stages.items():
+                    self._sample_seconds[stage] -= seconds
+            costs = {
+                stage: seconds / self._sample_answers
+                for stage, seconds in self._sample_seconds.items()
+            }
+        for stage, cost in costs.items():
+            metrics.ANSWER_COST_SECONDS.labels(stage=stage).set(cost)
@@ -0,0 +1,159 @@
+"""
+Prometheus metrics for intelligence-ms.
+"""
+import logging
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_WRITE_QUEUE_DEPTH = Gauge(
+    'intelligence_analysis_write_queue_depth',
+    'Analyses waiting in the write-behind queue',
+)
+ANALYSIS_WRITE_FLUSH_SECONDS = Histogram(
+    'intelligence_analysis_write_flush_seconds',
+    'Duration of write-behind bulk flushes, including retries',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+ANALYSIS_WRITE_BATCH_SIZE = Histogram(
+    'intelligence_analysis_write_batch_size',
+    'Number of analyses per write-behind bulk flush',
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+ANALYSIS_WRITE_FAILURES = Counter(
+    'intelligence_analysis_write_failures_total',
+    'Write-behind failures by reason',
+    ['reason'],
+)
+
+STAGE_DURATION_SECONDS = Histogram(
+    'intelligence_stage_duration_seconds',
+    'Duration of one invocation of an analysis stage',
+    ['stage'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+MODEL_INFERENCES = Counter(
+    'intelligence_model_inferences_total',
+    'Model invocations (one per batch)',
+    ['model'],
+)
+MODEL_BATCH_SIZE = Histogram(
+    'intelligence_model_batch_size',
+    'Inputs per model invocation',
+    ['model'],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024),
+)
+ANSWERS_REUSED = Counter(
+    'intelligence_answers_reused_total',
+    'Answers whose stored sentiment and embedding were reused',
+)
+CLUSTERING_RUNS = Counter(
+    'intelligence_clustering_runs_total',
+    'Clusterings by mode (incremental assignment or full recluster)',
+    ['mode'],
+)
+PARAPHRASES_REUSED = Counter(
+    'intelligence_paraphrases_reused_total',
+    'Cluster summaries kept because the representative answer was unchanged',
+)
+ANALYSIS_CACHE_REQUESTS = Counter(
+    'intelligence_analysis_cache_requests_total',
+    'Stored analysis reads by cache result (hit or miss)',
+    ['result'],
+)
+ANALYSIS_CACHE_ENTRIES = Gauge(
+    'intelligence_analysis_cache_entries',
+    'Documents held by the stored analysis cache',
+)
+
+STREAM_JOBS = Counter(
+    'intelligence_stream_jobs_total',
+    'Stream jobs handled by outcome',
+    ['outcome'],
+)
+STREAM_BATCH_SIZE = Histogram(
+    'intelligence_stream_batch_size',
+    'Jobs per stream read',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+STREAM_RECLAIMED = Counter(
+    'intelligence_stream_reclaimed_total',
+    'Pending stream entries claimed from idle consumers',
+)
+
+ANALYSIS_QUEUE_WAIT_SECONDS = Histogram(
+    'intelligence_analysis_queue_wait_seconds',
+    'Time an analysis waited for a scheduler slot',
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+ANALYSIS_QUEUE_DEPTH = Gauge(
+    'intelligence_analysis_queue_depth',
+    'Analyses waiting for a scheduler slot',
+)
+
+# Autoscaling signals, see load.py
+INFLIGHT_ANALYSES = Gauge(
+    'intelligence_inflight_analyses',
+    'Analyses waiting for or holding a scheduler slot',
+)
+QUEUED_ANSWERS = Gauge(
+    'intelligence_queued_answers',
+    'Answers of analyses waiting for a scheduler slot',
+)
+RUNNING_ANSWERS = Gauge(
+    'intelligence_running_answers',
+    'Answers of analyses holding a scheduler slot',
+)
+QUEUED_INFERENCE_SECONDS = Gauge(
+    'intelligence_queued_inference_seconds',
+    'Estimated inference seconds of queued and running answers',
+)
+ANSWER_COST_SECONDS = Gauge(
+    'intelligence_answer_cost_seconds',
+    'Rolling seconds per analyzed answer, by stage (total: whole analysis)',
+    ['stage'],
+)
+
+RPC_LANE_QUEUE_DEPTH = Gauge(
+    'intelligence_rpc_lane_queue_depth',
+    'Calls waiting for a handler of their lane',
+    ['lane'],
+)
+RPC_LANE_IN_FLIGHT = Gauge(
+    'intelligence_rpc_lane_in_flight',
+    'Calls running in their lane',
+    ['lane'],
+)
+RPC_LANE_WAIT_SECONDS = Histogram(
+    'intelligence_rpc_lane_wait_seconds',
+    'Time a call waited for a handler of its lane',
+    ['lane'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+RPC_LANE_REJECTED = Counter(
+    'intelligence_rpc_lane_rejected_total',
+    'Calls rejected by their lane, by reason (full queue or deadline)',
+    ['lane', 'reason'],
+)
+
+
+def start_metrics_server(port: int | None = None) -> bool:
+    """
+    Serve the default Prometheus registry over HTTP
+
+    Args:
+        port: Port to listen on; defaults to METRICS_PORT, 0 disables
+
+    Returns:
+        True when the server was started
+    """
+    port = config.METRICS_PORT if port is None else port
+    if port <= 0:
+        logger.info("Metrics server disabled")
+        return False
+    start_http_server(port)
+    logger.info(f"Metrics server started on port {port}")
+    return True
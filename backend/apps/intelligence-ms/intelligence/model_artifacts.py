@@ -0,0 +1,102 @@
+"""
+Loading of prepared (safetensors) model artifacts.
+
+`scripts/cache_models.py --prepare` writes every configured model to
+PREPARED_MODELS_DIR as safetensors weights plus tokenizer files (including
+the fast-tokenizer `tokenizer.json` where the model has one). When such an
+artifact exists it is loaded instead of the HuggingFace cache checkpoint, and
+with MODEL_MMAP_WEIGHTS the parameters are re-pointed at memory-mapped
+safetensors tensors. The weights are then backed by the page cache, so worker
+processes and restarted pods on the same node share one copy.
+"""
+import glob
+import logging
+import os
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+PREPARED_MARKER = 'prepared.json'
+
+
+def prepared_dir_name(model_id: str) -> str:
+    """Directory name of a prepared model (same scheme as the HF cache)."""
+    return model_id.strip().replace('/', '--')
+
+
+def prepared_path(model_id: str) -> str | None:
+    """Return the prepared artifact directory of a model, if it was built."""
+    path = os.path.join(config.PREPARED_MODELS_DIR, prepared_dir_name(model_id))
+    if os.path.exists(os.path.join(path, PREPARED_MARKER)):
+        return path
+    return None
+
+
+def load_pretrained(factory, model_id: str, **kwargs):
+    """
+    Load a tokenizer or model from its prepared artifact, else the HF cache
+
+    Args:
+        factory: A transformers Auto* class
+        model_id: HuggingFace model ID
+        **kwargs: Extra `from_pretrained` arguments
+    """
+    path = prepared_path(model_id)
+    if path:
+        return factory.from_pretrained(path, local_files_only=True, **kwargs)
+    return factory.from_pretrained(
+        model_id,
+        cache_dir=config.HF_HOME,
+        local_files_only=True,
+        **kwargs,
+    )
+
+
+def map_weights(model, model_id: str) -> int:
+    """
+    Back a loaded model's parameters with memory-mapped safetensors tensors
+
+    The private copies made by `from_pretrained` are released once every
+    parameter points at the mapped file. Parameters missing from the file
+    (e.g. tied weights saved once) are left untouched.
+
+    Args:
+        model: A torch module loaded from the prepared artifact
+        model_id: HuggingFace model ID
+
+    Returns:
+        Number of parameters that were mapped
+    """
+    path = prepared_path(model_id)
+    if not path or not config.MODEL_MMAP_WEIGHTS:
+        return 0
+    files = sorted(glob.glob(os.path.join(path, '*.safetensors')))
+    if not files:
+        return 0
+
+    import torch
+    from safetensors.torch import load_file
+
+    state = {}
+    for weights_file in files:
+        # CPU tensors returned by safetensors are views of a private,
+        # read-only-in-practice file mapping
+        state.update(load_file(weights_file, device='cpu'))
+
+    mapped = 0
+    with torch.no_grad():
+        for name, param in model.named_parameters():
+            tensor = state.get(name)
+            if tensor is None or tensor.shape != param.shape or tensor.dtype != param.dtype:
+                continue
+            param.data = tensor
+            mapped += 1
+    logger.info(
+        "Mapped %d/%d parameters of %s from %s",
+        mapped,
+        sum(1 for _ in model.parameters()),
+        model_id,
+        path,
+    )
+    return mapped
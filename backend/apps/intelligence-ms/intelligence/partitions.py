@@ -0,0 +1,375 @@
+"""
+Monthly partitioning of stored analyses.
+
+Every analysis records the month it was saved in as `bucket` ('YYYY-MM', UTC).
+The retention job (scripts/retention.py) closes past buckets by storing their
+rollups: sentiment label counts in `analysis_rollups` and idea counts in
+`idea_rollups`. Stats add the rollups to an aggregation over the open buckets
+only. Once a closed bucket is older than the retention period its raw documents
+move to a monthly `analyses_archive_YYYY_MM` collection. A summary stub stays in
+`analyses` (aggregate sentiment, label counts, cluster summaries).
+
+Re-saving an analysis of a closed bucket moves it to the current bucket. Its
+old contribution is then subtracted from the closed bucket's rollup, so no
+answer is counted twice. intelligence-fn-rs does the same when it re-saves an
+analysis, but leaves the new bucket to assign_buckets().
+
+A bucket whose rollup is being computed has a rollup document marked
+`closing`. Its analyses still count as open, and releases of analyses moved
+out of it are queued on the rollup document for close_bucket() to apply.
+"""
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Mapping, Tuple
+
+from pymongo import DeleteMany, InsertOne, ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+ROLLUPS_COLLECTION = 'analysis_rollups'
+IDEA_ROLLUPS_COLLECTION = 'idea_rollups'
+ARCHIVE_COLLECTION_PREFIX = 'analyses_archive_'
+
+# Enough of an analysis to know what it adds to its bucket's rollup
+CONTRIBUTION_PROJECTION = {
+    '_id': 0,
+    'question_id': 1,
+    'bucket': 1,
+    'label_counts': 1,
+    'answers.sentiment_label': 1,
+    'cluster_summaries.summary': 1,
+    'cluster_summaries.count': 1,
+}
+# Per-answer data removed from an archived analysis' stub
+RAW_FIELDS = (
+    'answers',
+    'answer_hashes',
+    'sentiment_scores',
+    'sentiment_labels',
+    'label_names',
+    'answer_embeddings',
+)
+
+
+def bucket_of(timestamp: datetime) -> str:
+    """Bucket of an analysis saved at a (UTC) timestamp"""
+    return f'{timestamp.year:04d}-{timestamp.month:02d}'
+
+
+def months_before(bucket: str, months: int) -> str:
+    """The bucket `months` months before `bucket`"""
+    year, month = (int(part) for part in bucket.split('-'))
+    index = year * 12 + (month - 1) - months
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+
+def archive_collection(bucket: str) -> str:
+    return ARCHIVE_COLLECTION_PREFIX + bucket.replace('-', '_')
+
+
+# Rollup documents of buckets whose rollup is finished
+FINISHED = {'closing': {'$ne': True}}
+
+
+def closed_buckets(db) -> List[str]:
+    """Buckets that have a finished rollup, oldest first"""
+    return sorted(doc['_id'] for doc in db[ROLLUPS_COLLECTION].find(FINISHED, {'_id': 1}))
+
+
+def open_match(closed: List[str]) -> Dict[str, Any]:
+    """
+    Filter on analyses not covered by a rollup
+
+    Documents without a bucket (written by intelligence-fn-rs, or before
+    partitioning) are open until the retention job assigns one, and so are
+    the analyses of a bucket that is still closing.
+    """
+    if not closed:
+        return {}
+    return {'bucket': {'$nin': list(closed)}}
+
+
+def label_count_pipelines(match: Mapping[str, Any]) -> List[List[Dict[str, Any]]]:
+    """Aggregations yielding {_id: label, count} for legacy and compact documents"""
+    return [
+        [
+            {'$match': {**match, 'answers': {'$exists': True}}},
+            {'$unwind': '$answers'},
+            {
+                '$group': {
+                    '_id': '$answers.sentiment_label',
+                    'count': {'$sum': 1},
+                }
+            },
+        ],
+        [
+            {'$match': {**match, 'label_counts': {'$exists': True}}},
+            {'$project': {'labels': {'$objectToArray': '$label_counts'}}},
+            {'$unwind': '$labels'},
+            {
+                '$group': {
+                    '_id': '$labels.k',
+                    'count': {'$sum': '$labels.v'},
+                }
+            },
+        ],
+    ]
+
+
+def idea_count_pipeline(match: Mapping[str, Any]) -> List[Dict[str, Any]]:
+    """Aggregation yielding {_id: summary, count} over the matching analyses"""
+    return [
+        {'$match': dict(match)},
+        {'$unwind': '$cluster_summaries'},
+        {
+            '$match': {
+                'cluster_summaries.summary': {
+                    '$exists': True,
+                    '$ne': '',
+                }
+            }
+        },
+        {
+            '$group': {
+                '_id': '$cluster_summaries.summary',
+                'count': {
+                    '$sum': {'$ifNull': ['$cluster_summaries.count', 1]},
+                },
+            }
+        },
+    ]
+
+
+def contribution(doc: Mapping[str, Any]) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """(label counts, idea counts) an analysis adds to its bucket"""
+    label_counts = doc.get('label_counts')
+    if label_counts is None:
+        label_counts = {}
+        for answer in doc.get('answers') or []:
+            label = answer.get('sentiment_label') or ''
+            label_counts[label] = label_counts.get(label, 0) + 1
+    idea_counts: Dict[str, int] = {}
+    for cluster in doc.get('cluster_summaries') or []:
+        summary = cluster.get('summary')
+        if summary:
+            count = cluster.get('count')
+            idea_counts[summary] = idea_counts.get(summary, 0) + int(1 if count is None else count)
+    return dict(label_counts), idea_counts
+
+
+def find_moves(db, question_ids: Iterable[str], current_bucket: str) -> List[Dict[str, Any]]:
+    """
+    Stored analyses of these questions in an earlier bucket than current_bucket
+
+    Read before re-saving them; pass the result to release_moves() once the
+    new documents are written.
+    """
+    question_ids = list(question_ids)
+    if not question_ids:
+        return []
+    return list(db['analyses'].find(
+        {'question_id': {'$in': question_ids}, 'bucket': {'$lt': current_bucket}},
+        CONTRIBUTION_PROJECTION,
+    ))
+
+
+def release_moves(db, moves: List[Dict[str, Any]]) -> None:
+    """
+    Subtract moved analyses from the rollups of their closed buckets
+
+    Releases from a bucket that is closing are queued on its rollup document;
+    close_bucket() subtracts them if it counted the analysis.
+    """
+    rollups = db[ROLLUPS_COLLECTION]
+    for doc in moves:
+        label_counts, idea_counts = contribution(doc)
+        bucket = doc['bucket']
+        decrement = {f'label_counts.{label}': -count for label, count in label_counts.items()}
+        decrement['analyses'] = -1
+        decrement['answers'] = -sum(label_counts.values())
+        # Pairs, since labels and summaries are not valid field names
+        release = {
+            'question_id': doc['question_id'],
+            'labels': [[label, count] for label, count in label_counts.items()],
+            'ideas': [[summary, count] for summary, count in idea_counts.items()],
+        }
+        # The rollup document may start or finish closing between the two
+        # conditional updates; retry until one applies or the bucket is open
+        while True:
+            if rollups.update_one({'_id': bucket, **FINISHED}, {'$inc': decrement}).matched_count:
+                if idea_counts:
+                    db[IDEA_ROLLUPS_COLLECTION].bulk_write(
+                        [
+                            UpdateOne({'bucket': bucket, 'summary': summary}, {'$inc': {'count': -count}})
+                            for summary, count in idea_counts.items()
+                        ],
+                        ordered=False,
+                    )
+                break
+            if rollups.update_one(
+                {'_id': bucket, 'closing': True}, {'$push': {'releases': release}},
+            ).matched_count:
+                break
+            # Without upsert, buckets that are still open are left alone
+            if rollups.count_documents({'_id': bucket}, limit=1) == 0:
+                break
+
+
+def assign_buckets(db, batch_size: int = 1000) -> int:
+    """Give analyses without a bucket the bucket of their timestamp"""
+    assigned = 0
+    while True:
+        page = list(
+            db['analyses']
+            .find({'bucket': {'$exists': False}}, {'_id': 1, 'timestamp': 1})
+            .limit(batch_size)
+        )
+        if not page:
+            return assigned
+        db['analyses'].bulk_write(
+            [
+                UpdateOne(
+                    {'_id': doc['_id']},
+                    {'$set': {'bucket': bucket_of(doc.get('timestamp') or datetime(1970, 1, 1))}},
+                )
+                for doc in page
+            ],
+            ordered=False,
+        )
+        assigned += len(page)
+
+
+def close_bucket(db, bucket: str) -> Dict[str, Any]:
+    """
+    Store (or recompute) the rollup of a bucket
+
+    The rollup document is marked `closing` before the analyses are counted, so
+    an analysis moved out of the bucket meanwhile queues its release instead of
+    missing the rollup (see release_moves()). A queued release is subtracted
+    only if its analysis was counted. Idea counts are written first; the
+    rollup is finished last, and only if no release was queued since it was
+    computed.
+
+    Returns:
+        The rollup document
+    """
+    rollups = db[ROLLUPS_COLLECTION]
+    try:
+        rollups.update_one(
+            {'_id': bucket, **FINISHED},
+            {'$set': {'closing': True, 'releases': []}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # Already closing, e.g. after an interrupted run: keep its queued releases
+        pass
+
+    counted = set()
+    scanned_labels: Counter = Counter()
+    scanned_ideas: Counter = Counter()
+    for doc in db['analyses'].find({'bucket': bucket}, CONTRIBUTION_PROJECTION):
+        label_counts, idea_counts = contribution(doc)
+        counted.add(doc['question_id'])
+        scanned_labels.update(label_counts)
+        scanned_ideas.update(idea_counts)
+
+    while True:
+        marker = rollups.find_one({'_id': bucket})
+        if marker is None:
+            raise RuntimeError(f"Rollup of {bucket} was removed while closing")
+        if not marker.get('closing'):
+            # Finished by a concurrent close_bucket()
+            return marker
+        releases = marker.get('releases') or []
+        label_counts = Counter(scanned_labels)
+        idea_counts = Counter(scanned_ideas)
+        analyses = len(counted)
+        for release in releases:
+            if release['question_id'] in counted:
+                label_counts.subtract(dict(release['labels']))
+                idea_counts.subtract(dict(release['ideas']))
+                analyses -= 1
+
+        db[IDEA_ROLLUPS_COLLECTION].bulk_write(
+            [DeleteMany({'bucket': bucket})] + [
+                InsertOne({'bucket': bucket, 'summary': summary, 'count': count})
+                for summary, count in idea_counts.items()
+                if count
+            ],
+            ordered=True,
+        )
+        label_counts = {label: count for label, count in label_counts.items() if count}
+        rollup = {
+            '_id': bucket,
+            'label_counts': label_counts,
+            'answers': sum(label_counts.values()),
+            'analyses': analyses,
+            'closed_at': datetime.utcnow(),
+        }
+        finished = rollups.update_one(
+            {'_id': bucket, 'closing': True, 'releases': {'$size': len(releases)}},
+            {
+                '$set': {key: value for key, value in rollup.items() if key != '_id'},
+                '$unset': {'closing': '', 'releases': ''},
+            },
+        )
+        if finished.matched_count:
+            return rollup
+
+
+def archive_bucket(db, bucket: str, batch_size: int = 200) -> int:
+    """
+    Move the raw documents of a closed bucket to its archive collection
+
+    Each archived analysis is replaced by a stub keeping its summary and its
+    rollup contribution. The stub is only written if the analysis was not
+    re-saved since it was read.
+
+    Returns:
+        Number of analyses archived
+    """
+    archive = db[archive_collection(bucket)]
+    archive.create_index('question_id', unique=True)
+    archived = 0
+    while True:
+        page = list(
+            db['analyses']
+            .find({'bucket': bucket, 'archived': {'$ne': True}})
+            .limit(batch_size)
+        )
+        if not page:
+            return archived
+        archive.bulk_write(
+            [ReplaceOne({'question_id': doc['question_id']}, doc, upsert=True) for doc in page],
+            ordered=False,
+        )
+        stubs = []
+        for doc in page:
+            label_counts, _ = contribution(doc)
+            stubs.append(UpdateOne(
+                {'_id': doc['_id'], 'timestamp': doc.get('timestamp')},
+                {
+                    '$set': {
+                        'archived': True,
+                        'label_counts': label_counts,
+                        'answer_count': sum(label_counts.values()),
+                        'cluster_summaries': [
+                            {key: value for key, value in cluster.items() if key != 'centroid'}
+                            for cluster in doc.get('cluster_summaries') or []
+                        ],
+                    },
+                    '$unset': {field: '' for field in RAW_FIELDS},
+                },
+            ))
+        result = db['analyses'].bulk_write(stubs, ordered=False)
+        archived += result.modified_count
+        if result.matched_count < len(stubs):
+            # Re-saved meanwhile, so now in the current bucket; drop the stale copies
+            current = {
+                doc['question_id']
+                for doc in db['analyses'].find(
+                    {'_id': {'$in': [doc['_id'] for doc in page]}, 'bucket': {'$ne': bucket}},
+                    {'question_id': 1},
+                )
+            }
+            if current:
+                archive.delete_many({'question_id': {'$in': list(current)}})
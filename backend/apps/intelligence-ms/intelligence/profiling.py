@@ -0,0 +1,423 @@
+"""
+On-demand profiling and memory inspection for intelligence-ms.
+
+Exposed through a token-protected admin HTTP server (ADMIN_PORT/ADMIN_TOKEN)
+and, when PROFILE_SIGNALS_ENABLED is set, through signals:
+
+    SIGUSR1  start a CPU profile for PROFILE_DEFAULT_SECONDS (stop it if running)
+    SIGUSR2  take a tracemalloc snapshot and write a runtime report
+"""
+import hmac
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+
+
+def _output_path(kind: str, extension: str) -> str:
+    os.makedirs(config.PROFILE_OUTPUT_DIR, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S.%fZ')
+    return os.path.join(
+        config.PROFILE_OUTPUT_DIR, f'{kind}-{os.getpid()}-{stamp}.{extension}')
+
+
+class SamplingProfiler:
+    """Samples the Python stack of every thread and writes speedscope files"""
+
+    def __init__(self, interval_ms: int | None = None):
+        self._interval = max(
+            1, interval_ms or config.PROFILE_SAMPLE_INTERVAL_MS) / 1000
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._result: Optional[str] = None
+        self._done = threading.Event()
+        self._done.set()
+
+    @property
+    def running(self) -> bool:
+        return not self._done.is_set()
+
+    def start(self, seconds: float | None = None) -> bool:
+        """
+        Start sampling in the background
+
+        Args:
+            seconds: Stop automatically after this long (capped by PROFILE_MAX_SECONDS)
+
+        Returns:
+            False if a profile is already running
+        """
+        seconds = min(
+            seconds or config.PROFILE_DEFAULT_SECONDS, config.PROFILE_MAX_SECONDS)
+        with self._lock:
+            if self.running:
+                return False
+            self._stop.clear()
+            self._done.clear()
+            self._result = None
+            self._thread = threading.Thread(
+                target=self._run, args=(seconds,), name='cpu-profiler', daemon=True)
+            self._thread.start()
+        logger.info(f"CPU profile started for {seconds:.0f}s")
+        return True
+
+    def stop(self, timeout: float = 30.0) -> Optional[str]:
+        """Stop a running profile early and return the written file"""
+        self._stop.set()
+        return self.wait(timeout)
+
+    def wait(self, timeout: float | None = None) -> Optional[str]:
+        """Wait for the current profile and return the written file"""
+        self._done.wait(timeout)
+        return self._result
+
+    def _run(self, seconds: float) -> None:
+        try:
+            self._result = self._sample(seconds)
+        except Exception:
+            logger.exception("CPU profile failed")
+        finally:
+            self._done.set()
+
+    def _sample(self, seconds: float) -> str:
+        frames: List[Dict[str, Any]] = []
+        frame_ids: Dict[tuple, int] = {}
+        samples: Dict[int, List[List[int]]] = {}
+        weights: Dict[int, List[float]] = {}
+        names: Dict[int, str] = {}
+        own_ident = threading.get_ident()
+
+        start = last = time.perf_counter()
+        deadline = start + seconds
+        while not self._stop.is_set() and time.perf_counter() < deadline:
+            # Weight each sample by the real time since the previous one; the
+            # sampler can fall behind its interval while it waits for the GIL.
+            now = time.perf_counter()
+            weight, last = max(now - last, self._interval), now
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    key = (code.co_name, code.co_filename, code.co_firstlineno)
+                    index = frame_ids.get(key)
+                    if index is None:
+                        index = frame_ids[key] = len(frames)
+                        frames.append({'name': key[0], 'file': key[1], 'line': key[2]})
+                    stack.append(index)
+                    frame = frame.f_back
+                stack.reverse()
+                samples.setdefault(ident, []).append(stack)
+                weights.setdefault(ident, []).append(weight)
+                names.setdefault(ident, thread_names.get(ident, str(ident)))
+            self._stop.wait(self._interval)
+        elapsed = time.perf_counter() - start
+
+        profiles = []
+        for ident, stacks in samples.items():
+            profiles.append({
+                'type': 'sampled',
+                'name': names[ident],
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': elapsed,
+                'samples': stacks,
+                'weights': weights[ident],
+            })
+        path = _output_path('cpu', 'speedscope.json')
+        with open(path, 'w') as handle:
+            json.dump({
+                '$schema': SPEEDSCOPE_SCHEMA,
+                'name': f'intelligence-ms pid {os.getpid()}',
+                'exporter': 'intelligence-ms',
+                'activeProfileIndex': 0,
+                'shared': {'frames': frames},
+                'profiles': profiles,
+            }, handle)
+        logger.info(
+            f"CPU profile written to {path} "
+            f"({sum(len(s) for s in samples.values())} samples over {elapsed:.1f}s)")
+        return path
+
+
+class MemorySnapshots:
+    """tracemalloc snapshots, each diffed against the previous one"""
+
+    def __init__(self, frames: int | None = None):
+        self._frames = frames or config.TRACEMALLOC_FRAMES
+        self._lock = threading.Lock()
+        self._previous: Optional[tracemalloc.Snapshot] = None
+
+    def snapshot(self, top: int = 25) -> Dict[str, Any]:
+        """
+        Take a snapshot, write it and its diff to PROFILE_OUTPUT_DIR
+
+        The first call starts tracemalloc, so only allocations made after it
+        are traced.
+
+        Returns:
+            Paths written and the top allocation sites (and growth since the
+            previous snapshot)
+        """
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self._frames)
+                logger.info(f"tracemalloc started ({self._frames} frames)")
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            previous, self._previous = self._previous, snapshot
+
+        path = _output_path('heap', 'tracemalloc')
+        snapshot.dump(path)
+        current, peak = tracemalloc.get_traced_memory()
+        report: Dict[str, Any] = {
+            'snapshot': path,
+            'traced_mb': round(current / 2**20, 2),
+            'traced_peak_mb': round(peak / 2**20, 2),
+            'top': [
+                {'site': str(stat.traceback[0]), 'size_kb': round(stat.size / 1024, 1),
+                 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:top]
+            ],
+        }
+        if previous is not None:
+            diff = snapshot.compare_to(previous, 'lineno')
+            diff_path = _output_path('heap-diff', 'txt')
+            with open(diff_path, 'w') as handle:
+                for stat in diff:
+                    handle.write(f'{stat}\n')
+            report['diff'] = diff_path
+            report['growth'] = [
+                {'site': str(stat.traceback[0]),
+                 'size_diff_kb': round(stat.size_diff / 1024, 1),
+                 'count_diff': stat.count_diff}
+                for stat in diff[:top]
+            ]
+        logger.info(f"tracemalloc snapshot written to {path}")
+        return report
+
+    def stop(self) -> None:
+        """Stop tracing and drop the previous snapshot"""
+        with self._lock:
+            self._previous = None
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+
+def _process_memory() -> Dict[str, float]:
+    memory = {}
+    try:
+        with open('/proc/self/status') as handle:
+            for line in handle:
+                key, _, value = line.partition(':')
+                if key in ('VmRSS', 'VmHWM', 'RssAnon', 'RssFile', 'RssShmem'):
+                    memory[f'{key}_mb'] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        pass
+    return memory
+
+
+def _model_memory(model) -> Dict[str, Any]:
+    parameters = list(model.parameters())
+    buffers = list(model.buffers())
+    dtypes = Counter(str(param.dtype) for param in parameters)
+    return {
+        'class': type(model).__name__,
+        'parameters': sum(param.numel() for param in parameters),
+        'parameter_mb': round(
+            sum(param.numel() * param.element_size() for param in parameters) / 2**20, 1),
+        'buffer_mb': round(
+            sum(buf.numel() * buf.element_size() for buf in buffers) / 2**20, 1),
+        'dtypes': dict(dtypes),
+        'device': str(parameters[0].device) if parameters else None,
+    }
+
+
+def runtime_report(models: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """Torch thread settings, process memory and memory held by each model"""
+    report: Dict[str, Any] = {
+        'pid': os.getpid(),
+        'threads': threading.active_count(),
+        'process_memory': _process_memory(),
+        'env': {
+            key: os.environ[key]
+            for key in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'TOKENIZERS_PARALLELISM')
+            if key in os.environ
+        },
+    }
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        report['torch'] = {
+            'version': torch.__version__,
+            'num_threads': torch.get_num_threads(),
+            'num_interop_threads': torch.get_num_interop_threads(),
+            'parallel_info': torch.__config__.parallel_info(),
+        }
+    report['models'] = {}
+    for name, model in (models or {}).items():
+        try:
+            report['models'][name] = _model_memory(model)
+        except Exception as e:
+            report['models'][name] = {'error': str(e)}
+    return report
+
+
+def write_runtime_report(models: Dict[str, Any] | None = None) -> str:
+    path = _output_path('runtime', 'json')
+    with open(path, 'w') as handle:
+        json.dump(runtime_report(models), handle, indent=2)
+    logger.info(f"Runtime report written to {path}")
+    return path
+
+
+class Profiling:
+    """Profilers shared by the admin server and signal handlers"""
+
+    def __init__(self, models: Callable[[], Dict[str, Any]] | None = None):
+        """
+        Args:
+            models: Returns the loaded torch modules keyed by name
+        """
+        self.cpu = SamplingProfiler()
+        self.memory = MemorySnapshots()
+        self._models = models or dict
+
+    def models(self) -> Dict[str, Any]:
+        return self._models()
+
+
+def _handler(profiling: Profiling, token: str):
+    class AdminHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logger.debug("admin: " + format, *args)
+
+        def _reply(self, status: int, body: Dict[str, Any]) -> None:
+            data = json.dumps(body, indent=2).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _authorized(self) -> bool:
+            supplied = self.headers.get('Authorization', '')
+            if hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+                return True
+            self._reply(401, {'error': 'unauthorized'})
+            return False
+
+        def do_GET(self):
+            if not self._authorized():
+                return
+            route = urlsplit(self.path).path
+            if route == '/debug/runtime':
+                self._reply(200, runtime_report(profiling.models()))
+            elif route == '/debug/profile/cpu':
+                self._reply(200, {'running': profiling.cpu.running})
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if not self._authorized():
+                return
+            url = urlsplit(self.path)
+            query = parse_qs(url.query)
+            if url.path == '/debug/profile/cpu/start':
+                seconds = float(query.get('seconds', [0])[0]) or None
+                started = profiling.cpu.start(seconds)
+                if started and query.get('wait', ['false'])[0] == 'true':
+                    self._reply(200, {'profile': profiling.cpu.wait()})
+                else:
+                    self._reply(202 if started else 409, {'started': started})
+            elif url.path == '/debug/profile/cpu/stop':
+                self._reply(200, {'profile': profiling.cpu.stop()})
+            elif url.path == '/debug/memory/snapshot':
+                top = int(query.get('top', [25])[0])
+                self._reply(200, profiling.memory.snapshot(top))
+            elif url.path == '/debug/memory/stop':
+                profiling.memory.stop()
+                self._reply(200, {'tracing': False})
+            elif url.path == '/debug/runtime':
+                self._reply(200, {'report': write_runtime_report(profiling.models())})
+            else:
+                self._reply(404, {'error': 'not found'})
+
+    return AdminHandler
+
+
+def start_admin_server(
+    profiling: Profiling,
+    port: int | None = None,
+    token: str | None = None,
+) -> Optional[ThreadingHTTPServer]:
+    """
+    Serve the profiling endpoints on a background thread
+
+    Args:
+        profiling: Shared profilers
+        port: Port to listen on; defaults to ADMIN_PORT, 0 disables
+        token: Bearer token required on every request; defaults to ADMIN_TOKEN
+
+    Returns:
+        The running server, or None when disabled
+    """
+    port = config.ADMIN_PORT if port is None else port
+    token = config.ADMIN_TOKEN if token is None else token
+    if port <= 0:
+        logger.info("Admin server disabled")
+        return None
+    if not token:
+        logger.warning("ADMIN_PORT is set but ADMIN_TOKEN is empty; admin server disabled")
+        return None
+    server = ThreadingHTTPServer(('0.0.0.0', port), _handler(profiling, token))
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name='admin-server', daemon=True).start()
+    logger.info(f"Admin server started on port {port}")
+    return server
+
+
+def install_signal_handlers(profiling: Profiling) -> bool:
+    """Bind SIGUSR1/SIGUSR2 when PROFILE_SIGNALS_ENABLED is set"""
+    if not config.PROFILE_SIGNALS_ENABLED or not hasattr(signal, 'SIGUSR1'):
+        return False
+
+    def toggle_cpu_profile(signum, frame):
+        if profiling.cpu.running:
+            threading.Thread(target=profiling.cpu.stop, daemon=True).start()
+        else:
+            profiling.cpu.start()
+
+    def dump_memory(signum, frame):
+        def run():
+            try:
+                profiling.memory.snapshot()
+                write_runtime_report(profiling.models())
+            except Exception:
+                logger.exception("Memory snapshot failed")
+        threading.Thread(target=run, name='memory-snapshot', daemon=True).start()
+
+    signal.signal(signal.SIGUSR1, toggle_cpu_profile)
+    signal.signal(signal.SIGUSR2, dump_memory)
+    logger.info("Profiling signals enabled (SIGUSR1: CPU profile, SIGUSR2: memory snapshot)")
+    return True
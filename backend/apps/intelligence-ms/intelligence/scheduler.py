@@ -0,0 +1,192 @@
+"""
+Weighted fair scheduling of analysis jobs across forms.
+
+Analyses run in a fixed number of slots. When every slot is busy, waiting jobs
+are queued per form and the next free slot goes to the highest priority level
+with waiters, then by deficit round-robin across that level's forms. A form's
+credit grows by SCHEDULER_QUANTUM cost units per round and a job starts once the
+credit covers its estimated cost. A form submitting thousands of large jobs
+therefore gets the same share of slots as a form submitting one small job.
+"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterable, Iterator, Optional
+
+from . import config
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Fairness key of jobs whose caller did not name a form
+UNKNOWN_FORM = 'unknown'
+
+
+def estimate_cost(answers: Iterable[str]) -> float:
+    """
+    Estimate the cost of analyzing a question's answers
+
+    One unit per answer (sentiment, embedding and clustering scale with the
+    count) plus one unit per SCHEDULER_CHARS_PER_UNIT characters (tokenization
+    and translation scale with the length).
+    """
+    count = 0
+    chars = 0
+    for answer in answers:
+        count += 1
+        chars += len(answer or '')
+    return max(1.0, count + chars / max(1, config.SCHEDULER_CHARS_PER_UNIT))
+
+
+class _Waiter:
+    __slots__ = ('form_id', 'cost', 'granted', 'event')
+
+    def __init__(self, form_id: str, cost: float):
+        self.form_id = form_id
+        self.cost = cost
+        self.granted = False
+        self.event = threading.Event()
+
+
+class FairScheduler:
+    """Admits analysis jobs into a fixed number of slots, fairly across forms"""
+
+    def __init__(self, concurrency: int | None = None, quantum: float | None = None):
+        """
+        Args:
+            concurrency: Analyses allowed to run at once
+            quantum: Cost units credited to a waiting form per round
+        """
+        self._concurrency = max(1, concurrency or config.ANALYSIS_CONCURRENCY)
+        self._quantum = max(1.0, float(quantum or config.SCHEDULER_QUANTUM))
+        self._lock = threading.Lock()
+        self._available = self._concurrency
+        # priority -> form_id -> waiters, in round-robin order
+        self._levels: Dict[int, 'OrderedDict[str, Deque[_Waiter]]'] = {}
+        self._deficits: Dict[tuple, float] = {}
+        self._waiting = 0
+        metrics.ANALYSIS_QUEUE_DEPTH.set_function(lambda: self._waiting)
+
+    @property
+    def concurrency(self) -> int:
+        return self._concurrency
+
+    @contextmanager
+    def slot(
+        self,
+        form_id: str,
+        cost: float,
+        priority: int = 0,
+        timeout: Optional[float] = None,
+    ) -> Iterator[None]:
+        """
+        Hold an analysis slot for the duration of the block
+
+        Args:
+            form_id: Fairness key; jobs of the same form share one queue
+            cost: Estimated job cost, see estimate_cost()
+            priority: Higher levels are always served first
+            timeout: Seconds to wait for a slot, None waits indefinitely
+
+        Raises:
+            TimeoutError: No slot was granted within timeout
+        """
+        self._acquire(form_id or '', max(1.0, cost), priority, timeout)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _acquire(self, form_id: str, cost: float, priority: int, timeout: Optional[float]) -> None:
+        started = time.monotonic()
+        with self._lock:
+            if self._available > 0 and not self._waiting:
+                self._available -= 1
+                metrics.ANALYSIS_QUEUE_WAIT_SECONDS.observe(0.0)
+                return
+            waiter = _Waiter(form_id, cost)
+            forms = self._levels.setdefault(priority, OrderedDict())
+            if form_id not in forms:
+                # A newly active form joins the end of the round with one quantum
+                forms[form_id] = deque()
+                self._deficits[(priority, form_id)] = self._quantum
+            forms[form_id].append(waiter)
+            self._waiting += 1
+            # A slot may be free while others wait, e.g. after a timeout
+            if self._available > 0:
+                self._available -= 1
+                self._grant(self._next())
+
+        # gRPC reports calls without a deadline as ~2**63 seconds remaining
+        waiter.event.wait(timeout if timeout is None or timeout < threading.TIMEOUT_MAX else None)
+        with self._lock:
+            if not waiter.granted:
+                self._remove(priority, waiter)
+                raise TimeoutError(
+                    f"Timed out after {time.monotonic() - started:.1f}s waiting for an analysis slot")
+        metrics.ANALYSIS_QUEUE_WAIT_SECONDS.observe(time.monotonic() - started)
+
+    def _release(self) -> None:
+        with self._lock:
+            waiter = self._next()
+            if waiter is None:
+                self._available += 1
+            else:
+                # Hand the slot straight to the next job
+                self._grant(waiter)
+
+    def _grant(self, waiter: Optional[_Waiter]) -> None:
+        if waiter is None:
+            self._available += 1
+            return
+        waiter.granted = True
+        waiter.event.set()
+
+    def _next(self) -> Optional[_Waiter]:
+        """Pop the next waiter by priority, then deficit round-robin (lock held)"""
+        levels = [level for level, forms in self._levels.items() if forms]
+        if not levels:
+            return None
+        priority = max(levels)
+        forms = self._levels[priority]
+        while True:
+            for _ in range(len(forms)):
+                form_id, waiters = next(iter(forms.items()))
+                key = (priority, form_id)
+                head = waiters[0]
+                if self._deficits[key] >= head.cost:
+                    # The form keeps its turn while its credit lasts
+                    self._deficits[key] -= head.cost
+                    waiters.popleft()
+                    self._waiting -= 1
+                    if not waiters:
+                        del forms[form_id]
+                        del self._deficits[key]
+                    return head
+                forms.move_to_end(form_id)
+                self._deficits[key] += self._quantum
+            # Nobody could afford their next job: skip the empty rounds at once
+            rounds = min(
+                math.ceil((waiters[0].cost - self._deficits[(priority, form_id)]) / self._quantum)
+                for form_id, waiters in forms.items()
+            )
+            if rounds > 0:
+                for form_id in forms:
+                    self._deficits[(priority, form_id)] += rounds * self._quantum
+
+    def _remove(self, priority: int, waiter: _Waiter) -> None:
+        forms = self._levels.get(priority, {})
+        waiters = forms.get(waiter.form_id)
+        if not waiters:
+            return
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            return
+        self._waiting -= 1
+        if not waiters:
+            del forms[waiter.form_id]
+            del self._deficits[(priority, waiter.form_id)]
@@ -1,19 +1,15 @@
 """
 Sentiment Analysis Module using a transformer classifier with optional translation.
 """
-from typing import Tuple
+from typing import Callable, Dict, List, Tuple
 import logging
 import threading
 
 from langdetect import DetectorFactory, LangDetectException, detect
-from transformers import (
-    AutoModelForSeq2SeqLM,
-    AutoModelForSequenceClassification,
-    AutoTokenizer,
-    pipeline,
-)
 
 from . import config
+from .model_artifacts import load_pretrained, map_weights
+from .telemetry import record_inference, stage
 
 
 DetectorFactory.seed = 0
@@ -22,17 +18,37 @@ DetectorFactory.seed = 0
 class SentimentAnalyzer:
     """Analyzes sentiment using a transformer model; can translate to English first."""
 
-    def __init__(self):
+    def __init__(self, eager: bool = True):
+        """
+        Args:
+            eager: Load the models now; pass False and run `loaders()` to load
+                them concurrently with other startup work.
+        """
         self._logger = logging.getLogger(__name__)
         self._translator = None
         self._translator_lock = threading.Lock()
         self._sentiment = None
         self._sentiment_lock = threading.Lock()
 
-        self._init_sentiment_model()
+        if eager:
+            for load in self.loaders().values():
+                load()
 
+    def loaders(self) -> Dict[str, Callable[[], None]]:
+        """Independent model loading steps, keyed by startup phase name."""
+        loaders = {'sentiment_model': self._init_sentiment_model}
         if config.TRANSLATE_BEFORE_SENTIMENT:
-            self._init_translator()
+            loaders['sentiment_translator'] = self._init_translator
+        return loaders
+
+    def loaded_models(self) -> Dict[str, object]:
+        """Loaded torch modules keyed by name, for memory reports."""
+        models = {}
+        if self._sentiment is not None:
+            models['sentiment'] = self._sentiment.model
+        if self._translator is not None:
+            models['sentiment_translator'] = self._translator.model
+        return models
 
     def analyze(self, text: str) -> Tuple[float, str]:
         """
@@ -48,53 +64,76 @@ class SentimentAnalyzer:
             text = self._translate(text)
 
         sentiment_score, label, report = self._score_sentiment(text)
-        if config.SENTIMENT_REPORT_ENABLED:
-            self._logger.info(
-                "Sentiment report | pos=%.4f neu=%.4f neg=%.4f "
-                "positive_score=%.4f label=%s",
-                report["pos_prob"],
-                report["neu_prob"],
-                report["neg_prob"],
-                report["positive_score"],
-                label,
-            )
-        elif self._logger.isEnabledFor(logging.DEBUG):
-            self._logger.debug(
-                "Sentiment report | pos=%.4f neu=%.4f neg=%.4f "
-                "positive_score=%.4f label=%s",
-                report["pos_prob"],
-                report["neu_prob"],
-                report["neg_prob"],
-                report["positive_score"],
-                label,
-            )
-
+        self._log_report(label, report)
         return sentiment_score, label
 
+    def analyze_batch(self, texts: List[str]) -> List[Tuple[float, str]]:
+        """
+        Analyze many texts with batched model calls.
+
+        Returns:
+            One (sentiment_score, sentiment_label) per text, in order
+        """
+        results: List[Tuple[float, str]] = [(0.5, "NEUTRAL")] * len(texts)
+        indices = [index for index, text in enumerate(texts) if text]
+        if not indices:
+            return results
+
+        inputs = []
+        for index in indices:
+            text = texts[index]
+            if self._translator and self._should_translate(text):
+                text = self._translate(text)
+            inputs.append(text)
+
+        batch_size = max(1, config.SENTIMENT_BATCH_SIZE)
+        for start in range(0, len(inputs), batch_size):
+            chunk = inputs[start:start + batch_size]
+            with self._sentiment_lock, stage('sentiment', trace_span=False):
+                outputs = self._sentiment(
+                    chunk,
+                    truncation=True,
+                    return_all_scores=True,
+                    batch_size=batch_size,
+                )
+            record_inference('sentiment', len(chunk))
+            if len(outputs) != len(chunk):
+                raise RuntimeError('Sentiment model returned a partial batch.')
+            for offset, scores in enumerate(outputs):
+                sentiment_score, label, report = self._scores_to_result(scores)
+                self._log_report(label, report)
+                results[indices[start + offset]] = (sentiment_score, label)
+        return results
+
     def save_model(self, model_path: str):
         """No-op for the sentiment analyzer."""
         return None
 
     def _init_sentiment_model(self) -> None:
+        from transformers import (
+            AutoModelForSequenceClassification,
+            AutoTokenizer,
+            pipeline,
+        )
+
         model_id = (config.SENTIMENT_MODEL_ID or '').strip()
         if not model_id:
             raise RuntimeError('SENTIMENT_MODEL_ID is not set.')
         try:
-            tokenizer = AutoTokenizer.from_pretrained(
+            tokenizer = load_pretrained(
+                AutoTokenizer,
                 model_id,
-                cache_dir=config.HF_HOME,
-                local_files_only=True,
                 use_fast=True,
             )
-            model = AutoModelForSequenceClassification.from_pretrained(
+            model = load_pretrained(
+                AutoModelForSequenceClassification,
                 model_id,
-                cache_dir=config.HF_HOME,
-                local_files_only=True,
             )
         except Exception as exc:
             raise RuntimeError(
                 'Sentiment model unavailable. Run scripts/cache_models.py.'
             ) from exc
+        map_weights(model, model_id)
 
         self._sentiment = pipeline(
             'sentiment-analysis',
@@ -105,11 +144,15 @@ class SentimentAnalyzer:
         self._logger.info('Sentiment model loaded: %s', model_id)
 
     def _score_sentiment(self, text: str) -> Tuple[float, str, dict]:
-        with self._sentiment_lock:
+        with self._sentiment_lock, stage('sentiment', trace_span=False):
             result = self._sentiment(
                 text, truncation=True, return_all_scores=True)
+        record_inference('sentiment', 1)
         if not result:
             raise RuntimeError('Sentiment model returned empty result.')
+        return self._scores_to_result(result)
+
+    def _scores_to_result(self, result) -> Tuple[float, str, dict]:
         scores = result[0] if isinstance(result[0], list) else result
         label_scores = {}
         for item in scores:
@@ -158,27 +201,46 @@ class SentimentAnalyzer:
         }
         return positive_score, label, report
 
+    def _log_report(self, label: str, report: dict) -> None:
+        if config.SENTIMENT_REPORT_ENABLED:
+            level = logging.INFO
+        elif self._logger.isEnabledFor(logging.DEBUG):
+            level = logging.DEBUG
+        else:
+            return
+        self._logger.log(
+            level,
+            "Sentiment report | pos=%.4f neu=%.4f neg=%.4f "
+            "positive_score=%.4f label=%s",
+            report["pos_prob"],
+            report["neu_prob"],
+            report["neg_prob"],
+            report["positive_score"],
+            label,
+        )
+
     def _init_translator(self) -> None:
+        from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, pipeline
+
         model_id = (config.TRANSLATION_MODEL or '').strip()
         if not model_id or model_id.lower() == 'none':
             raise RuntimeError(
                 'Translation is enabled but TRANSLATION_MODEL is not set.'
             )
         try:
-            tokenizer = AutoTokenizer.from_pretrained(
+            tokenizer = load_pretrained(
+                AutoTokenizer,
                 model_id,
-                cache_dir=config.HF_HOME,
-                local_files_only=True,
             )
-            model = AutoModelForSeq2SeqLM.from_pretrained(
+            model = load_pretrained(
+                AutoModelForSeq2SeqLM,
                 model_id,
-                cache_dir=config.HF_HOME,
-                local_files_only=True,
             )
         except Exception as exc:
             raise RuntimeError(
                 'Translation model unavailable. Run scripts/cache_models.py.'
             ) from exc
+        map_weights(model, model_id)
 
         translation_task = (config.TRANSLATION_TASK or '').strip()
         if translation_task == 'translation':
@@ -200,14 +262,16 @@ class SentimentAnalyzer:
         if not config.TRANSLATION_DETECT_LANGUAGE:
             return True
         try:
-            language = detect(text)
+            with stage('language_detection', trace_span=False):
+                language = detect(text)
         except LangDetectException:
             return True
         return language != 'en'
 
     def _translate(self, text: str) -> str:
-        with self._translator_lock:
+        with self._translator_lock, stage('translation', trace_span=False):
             result = self._translator(text, truncation=True)
+        record_inference('translation', 1)
         if not result:
             raise RuntimeError('Translation returned empty result.')
         translated = (result[0].get('translation_text') or '').strip()
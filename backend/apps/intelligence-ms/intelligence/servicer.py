@@ -2,25 +2,63 @@
 gRPC Service Implementation for Analytics
 """
 import logging
+import queue
+import threading
+from datetime import datetime, timezone
+
 import grpc
+import numpy as np
+from opentelemetry import trace
+
+from . import config
+from . import metrics
+from .embeddings import pack_embeddings, pack_vector, unpack_embeddings, unpack_vector
+from .load import LoadTracker
+from .scheduler import UNKNOWN_FORM, estimate_cost
+from .telemetry import span, stage
 
 logger = logging.getLogger(__name__)
 
+MAX_SIMILAR_ANSWERS = 100
+MAX_ANALYSES_PER_REQUEST = 1000
+MAX_EXPORT_BATCH_ROWS = 65536
+
+# SentimentLabel enum values of the analyzer's labels
+_SENTIMENT_LABELS = {'POSITIVE': 1, 'NEGATIVE': 2, 'NEUTRAL': 3}
+# ExportTable enum values, unspecified meaning answers
+_EXPORT_TABLES = {0: 'answers', 1: 'answers', 2: 'clusters', 3: 'questions'}
+
 
 class AnalyticsServicer:
     """Implementation of the Analytics gRPC service"""
     
-    def __init__(self, db_manager, sentiment_analyzer, idea_summarizer):
+    def __init__(
+        self,
+        db_manager,
+        sentiment_analyzer,
+        idea_summarizer,
+        similarity_index=None,
+        idea_catalog=None,
+        scheduler=None,
+    ):
         """
         Initialize the servicer
         
         Args:
             db_manager: MongoDB manager instance
             sentiment_analyzer: Sentiment analyzer instance
+            idea_summarizer: Idea summarizer instance
+            similarity_index: Optional answer similarity index
+            idea_catalog: Optional canonical idea table
+            scheduler: Optional FairScheduler admitting analyses
         """
         self.db_manager = db_manager
         self.sentiment_analyzer = sentiment_analyzer
         self.idea_summarizer = idea_summarizer
+        self.similarity_index = similarity_index
+        self.idea_catalog = idea_catalog
+        self.scheduler = scheduler
+        self.load = LoadTracker()
     
     def AnalyzeQuestion(self, request, context):
         """
@@ -33,100 +71,630 @@ class AnalyticsServicer:
         Returns:
             AnalysisResponse with sentiment score, label, and extracted ideas
         """
+        try:
+            answers = self._request_answers(request)
+            form_id, priority = self._scheduling(request, context, answers)
+
+            with self.analysis_slot(form_id, answers, priority, context.time_remaining()):
+                analysis_data, cluster_summaries = self.run_analysis(
+                    request.question_id,
+                    request.question_text,
+                    answers,
+                )
+            return self._analysis_response(analysis_data, cluster_summaries, request.compact)
+
+        except Exception as e:
+            logger.error(f"Error analyzing question: {str(e)}")
+            current_span = trace.get_current_span()
+            current_span.record_exception(e)
+            current_span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
+            from . import analytics_pb2 as analytics_pb2
+            return analytics_pb2.AnalysisResponse(
+                question_id=getattr(request, 'question_id', ''),
+                success=False,
+                error_message=str(e)
+            )
+    
+    def AnalyzeQuestionUpload(self, request_iterator, context):
+        """
+        Analyze a question whose answers arrive as a stream of AnswerChunk
+
+        Each chunk is scored and embedded while the next ones are still
+        uploading; clustering runs once the stream closes.
+
+        Returns:
+            AnalysisResponse, as for AnalyzeQuestion
+        """
         from . import analytics_pb2 as analytics_pb2
-        
+
+        question_id = ''
         try:
-            # Support multiple answers: request.answer_text is now a repeated field
+            question_text = ''
             answers = []
-            if hasattr(request, 'answer_text'):
-                if isinstance(request.answer_text, str):
-                    answers = [request.answer_text]
-                else:
-                    answers = list(request.answer_text)
-
-            per_answer_results = []
-            sentiment_scores = []
+            sentiments = []
+            reused = 0
+            known_embeddings = {}
+            stored_embeddings = {}
+            previous = None
+            form_id = priority = None
+            compact = False
+            waiting = []
+            for chunk in self._prefetch(request_iterator):
+                question_id = question_id or chunk.question_id
+                question_text = question_text or chunk.question_text
+                compact = compact or chunk.compact
+                texts = list(chunk.answer_text)
+                if not question_id:
+                    # The stored analysis to reuse is only known with the question
+                    waiting.extend(texts)
+                    continue
+                if previous is None:
+                    previous = self.load_previous(question_id)
+                    stored_embeddings = self._stored_embeddings(previous)
+                    form_id, priority = self._scheduling(chunk, context, ())
+                    texts = waiting + texts
+                if not texts:
+                    continue
 
-            for idx, ans in enumerate(answers):
-                score, label = self.sentiment_analyzer.analyze(ans)
+                with self.analysis_slot(form_id, texts, priority, context.time_remaining()):
+                    for _, scored, chunk_reused in self.iter_sentiments(
+                            texts, previous=previous, chunk_size=len(texts)):
+                        sentiments.extend(scored)
+                        reused += chunk_reused
+                    normalized = map(self.idea_summarizer.normalize_answer, texts)
+                    known_embeddings.update(self.idea_summarizer.embed_unique(
+                        text for text in normalized
+                        if text not in stored_embeddings and text not in known_embeddings
+                    ))
+                answers.extend(texts)
 
-                sentiment_scores.append(float(score))
+            if not question_id:
+                raise ValueError('No answer chunk set question_id')
+            trace.get_current_span().set_attribute('intelligence.answers', len(answers))
 
-                per_answer_results.append({
-                    'index': idx,
-                    'answer_text': ans,
-                    'sentiment_score': float(score),
-                    'sentiment_label': label,
-                })
+            with self.analysis_slot(form_id, answers, priority, context.time_remaining()):
+                analysis_data, cluster_summaries, answer_embeddings = self.summarize(
+                    question_id,
+                    question_text,
+                    answers,
+                    sentiments,
+                    reused,
+                    known_embeddings=known_embeddings,
+                    previous=previous,
+                )
+                self.persist(analysis_data, answer_embeddings)
+            return self._analysis_response(analysis_data, cluster_summaries, compact)
 
-            cluster_summaries = self.idea_summarizer.summarize_clusters(
-                answers,
-                request.question_text,
+        except Exception as e:
+            logger.error(f"Error analyzing uploaded question: {str(e)}")
+            current_span = trace.get_current_span()
+            current_span.record_exception(e)
+            current_span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
+            return analytics_pb2.AnalysisResponse(
+                question_id=question_id,
+                success=False,
+                error_message=str(e)
             )
 
-            # Aggregate sentiment across answers (mean)
-            if sentiment_scores:
-                aggregate_score = float(sum(sentiment_scores) / len(sentiment_scores))
-                if aggregate_score >= 0.6:
-                    aggregate_label = "POSITIVE"
-                elif aggregate_score <= 0.4:
-                    aggregate_label = "NEGATIVE"
-                else:
-                    aggregate_label = "NEUTRAL"
-            else:
-                aggregate_score = 0.5
-                aggregate_label = "NEUTRAL"
+    def _prefetch(self, request_iterator):
+        """Read a client stream on a helper thread so the upload overlaps processing"""
+        buffer = queue.Queue(maxsize=max(1, config.UPLOAD_PREFETCH_CHUNKS))
+        stopped = threading.Event()
+        done = object()
 
-            # Prepare data for DB upsert
-            analysis_data = {
-                'question_id': request.question_id,
-                'question_text': request.question_text,
-                'answers': per_answer_results,
-                'aggregate_sentiment_score': aggregate_score,
-                'aggregate_sentiment_label': aggregate_label,
-                'cluster_summaries': cluster_summaries,
-            }
+        def put(item):
+            # Give up once the handler has stopped reading, e.g. after an error
+            while not stopped.is_set():
+                try:
+                    buffer.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
 
-            self.db_manager.save_analysis(analysis_data)
+        def read():
+            try:
+                for item in request_iterator:
+                    if not put(item):
+                        return
+                put(done)
+            except Exception as e:
+                put(e)
 
-            # Build proto response
-            answers_proto = [
-                analytics_pb2.AnswerAnalysis(
-                    index=a['index'],
-                    answer_text=a['answer_text'],
-                    sentiment_score=a['sentiment_score'],
-                    sentiment_label=a['sentiment_label'],
-                )
-                for a in per_answer_results
-            ]
+        threading.Thread(target=read, name='upload-prefetch', daemon=True).start()
+        try:
+            while True:
+                item = buffer.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stopped.set()
+
+    def AnalyzeQuestionStream(self, request, context):
+        """
+        Analyze a question, streaming results as each stage finishes
+
+        Yields one SentimentChunk per ANALYSIS_STREAM_CHUNK_SIZE answers, then
+        the cluster summaries, then an AnalysisStatus once the analysis is
+        saved (or failed).
+        """
+        from . import analytics_pb2 as analytics_pb2
+
+        try:
+            answers = self._request_answers(request)
+            form_id, priority = self._scheduling(request, context, answers)
+
+            with self.analysis_slot(form_id, answers, priority, context.time_remaining()):
+                previous = self.load_previous(request.question_id)
+                sentiments = []
+                reused = 0
+                for start, chunk, chunk_reused in self.iter_sentiments(answers, previous=previous):
+                    sentiments.extend(chunk)
+                    reused += chunk_reused
+                    yield analytics_pb2.AnalysisEvent(sentiments=analytics_pb2.SentimentChunk(
+                        **self._answers_proto(
+                            (
+                                (start + offset, answers[start + offset], score, label)
+                                for offset, (score, label) in enumerate(chunk)
+                            ),
+                            request.compact,
+                        )
+                    ))
 
-            cluster_summaries_proto = [
-                analytics_pb2.ClusterSummary(
-                    summary=item['summary'],
-                    count=int(item.get('count', 0)),
+                analysis_data, cluster_summaries, answer_embeddings = self.summarize(
+                    request.question_id,
+                    request.question_text,
+                    answers,
+                    sentiments,
+                    reused,
+                    previous=previous,
                 )
-                for item in cluster_summaries
-                if item.get('summary')
-            ]
+                yield analytics_pb2.AnalysisEvent(clusters=analytics_pb2.ClusterSummaries(
+                    cluster_summaries=self._cluster_summaries_proto(cluster_summaries),
+                ))
+                self.persist(analysis_data, answer_embeddings)
 
-            return analytics_pb2.AnalysisResponse(
+            yield analytics_pb2.AnalysisEvent(status=analytics_pb2.AnalysisStatus(
                 question_id=request.question_id,
-                answers=answers_proto,
-                aggregate_sentiment_score=aggregate_score,
-                aggregate_sentiment_label=aggregate_label,
-                cluster_summaries=cluster_summaries_proto,
-                success=True
-            )
+                aggregate_sentiment_score=analysis_data['aggregate_sentiment_score'],
+                aggregate_sentiment_label=analysis_data['aggregate_sentiment_label'],
+                success=True,
+                reused_answers=reused,
+            ))
 
         except Exception as e:
-            logger.error(f"Error analyzing question: {str(e)}")
-            from . import analytics_pb2 as analytics_pb2
-            return analytics_pb2.AnalysisResponse(
-                question_id=getattr(request, 'question_id', ''),
+            logger.error(f"Error streaming analysis: {str(e)}")
+            current_span = trace.get_current_span()
+            current_span.record_exception(e)
+            current_span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
+            yield analytics_pb2.AnalysisEvent(status=analytics_pb2.AnalysisStatus(
+                question_id=request.question_id,
                 success=False,
-                error_message=str(e)
+                error_message=str(e),
+            ))
+
+    def _analysis_response(self, analysis_data, cluster_summaries, compact=False):
+        from . import analytics_pb2 as analytics_pb2
+
+        return analytics_pb2.AnalysisResponse(
+            question_id=analysis_data['question_id'],
+            **self._answers_proto(
+                (
+                    (a['index'], a['answer_text'], a['sentiment_score'], a['sentiment_label'])
+                    for a in analysis_data['answers']
+                ),
+                compact,
+            ),
+            aggregate_sentiment_score=analysis_data['aggregate_sentiment_score'],
+            aggregate_sentiment_label=analysis_data['aggregate_sentiment_label'],
+            cluster_summaries=self._cluster_summaries_proto(cluster_summaries),
+            success=True,
+            reused_answers=analysis_data['reused_answers'],
+        )
+
+    def _answers_proto(self, results, compact=False):
+        """
+        Per-answer fields of a response from (index, text, score, label) tuples
+
+        Returns:
+            {'answers': [AnswerAnalysis]}, or {'compact_answers': CompactAnswers}
+            without the answer texts when compact is set
+        """
+        from . import analytics_pb2 as analytics_pb2
+
+        if not compact:
+            return {'answers': [
+                analytics_pb2.AnswerAnalysis(
+                    index=index,
+                    answer_text=text,
+                    sentiment_score=float(score),
+                    sentiment_label=label,
+                )
+                for index, text, score, label in results
+            ]}
+
+        indices, scores, labels = [], [], []
+        for index, _, score, label in results:
+            indices.append(index)
+            scores.append(float(score))
+            labels.append(_SENTIMENT_LABELS.get(label, analytics_pb2.SENTIMENT_LABEL_UNSPECIFIED))
+        return {'compact_answers': analytics_pb2.CompactAnswers(
+            indices=indices,
+            sentiment_scores=scores,
+            sentiment_labels=labels,
+        )}
+
+    def _request_answers(self, request):
+        # Support multiple answers: request.answer_text is now a repeated field
+        if isinstance(request.answer_text, str):
+            return [request.answer_text]
+        return list(request.answer_text)
+
+    def _scheduling(self, request, context, answers):
+        """Form and priority of a request, also recorded on the current span"""
+        # Callers identify the form (the fairness key) and an optional
+        # priority in metadata. Calls without a form share one flow: one
+        # flow per question would let a busy form take a share per question.
+        metadata = dict(context.invocation_metadata() or ())
+        form_id = metadata.get('x-form-id') or UNKNOWN_FORM
+        priority = _int_or_zero(metadata.get('x-priority'))
+        trace.get_current_span().set_attributes({
+            'intelligence.question_id': request.question_id,
+            'intelligence.form_id': form_id,
+            'intelligence.answers': len(answers),
+        })
+        return form_id, priority
+
+    def _cluster_summaries_proto(self, cluster_summaries):
+        from . import analytics_pb2 as analytics_pb2
+
+        return [
+            analytics_pb2.ClusterSummary(
+                summary=item['summary'],
+                count=int(item.get('count', 0)),
             )
-    
+            for item in cluster_summaries
+            if item.get('summary')
+        ]
+
+    def analysis_slot(self, form_id, answers, priority=0, timeout=None):
+        """
+        Wait for the scheduler to admit an analysis of answers for form_id
+
+        The answers count towards the load signals while they wait and run.
+
+        Returns:
+            Context manager holding the slot; without a scheduler the analysis
+            is admitted at once
+        """
+        slot = None
+        if self.scheduler is not None:
+            slot = self.scheduler.slot(form_id, estimate_cost(answers), priority, timeout)
+        return self.load.job(len(answers), slot)
+
+    def run_analysis(
+        self,
+        question_id,
+        question_text,
+        answers,
+        sentiments=None,
+        known_embeddings=None,
+        previous=None,
+    ):
+        """
+        Analyze a question's answers, then persist and index the result
+
+        Shared by AnalyzeQuestion and the Redis stream worker; see analyze()
+        for the arguments.
+
+        Returns:
+            Tuple of (saved analysis document, cluster summaries)
+        """
+        analysis_data, cluster_summaries, answer_embeddings = self.analyze(
+            question_id,
+            question_text,
+            answers,
+            sentiments=sentiments,
+            known_embeddings=known_embeddings,
+            previous=previous,
+        )
+        self.persist(analysis_data, answer_embeddings)
+        return analysis_data, cluster_summaries
+
+    def persist(self, analysis_data, answer_embeddings):
+        """Save an analysis document and add its embeddings to the similarity index"""
+        with stage('mongo_save'):
+            self.db_manager.save_analysis(analysis_data)
+
+        if self.similarity_index is not None and answer_embeddings is not None:
+            self.similarity_index.add(
+                analysis_data['question_id'],
+                answer_embeddings,
+                analysis_data.get('timestamp'),
+            )
+
+    def analyze(
+        self,
+        question_id,
+        question_text,
+        answers,
+        sentiments=None,
+        known_embeddings=None,
+        previous=None,
+    ):
+        """
+        Analyze a question's answers into an analysis document without saving it
+
+        Answers whose text was already analyzed in the stored analysis reuse
+        its sentiment and embedding; only new or changed answers go through
+        the models.
+
+        Args:
+            question_id: Question identifier
+            question_text: Question text
+            answers: Answer texts
+            sentiments: Precomputed (score, label) per answer, e.g. from a
+                batched model call; None entries (or None for all) are
+                reused from the stored analysis or computed here
+            known_embeddings: Precomputed embeddings by normalized answer text
+            previous: Stored analysis from load_previous(); loaded when omitted,
+                pass {} to analyze from scratch
+
+        Returns:
+            Tuple of (analysis document, cluster summaries, answer embedding
+            matrix or None)
+        """
+        if previous is None:
+            previous = self.load_previous(question_id)
+        scored = []
+        reused = 0
+        for _, chunk, chunk_reused in self.iter_sentiments(answers, sentiments, previous):
+            scored.extend(chunk)
+            reused += chunk_reused
+        return self.summarize(
+            question_id, question_text, answers, scored, reused, known_embeddings, previous)
+
+    def iter_sentiments(self, answers, sentiments=None, previous=None, chunk_size=None):
+        """
+        Score answers in order, one batched model call per chunk
+
+        Args:
+            answers: Answer texts
+            sentiments: Precomputed (score, label) per answer, None where unknown
+            previous: Stored analysis whose results are reused for unchanged answers
+            chunk_size: Answers per chunk; defaults to ANALYSIS_STREAM_CHUNK_SIZE
+
+        Yields:
+            (index of the chunk's first answer, [(score, label)], reused count)
+        """
+        stored_sentiments = self._stored_sentiments(previous or {})
+        chunk_size = max(1, chunk_size or config.ANALYSIS_STREAM_CHUNK_SIZE)
+        for start in range(0, len(answers), chunk_size):
+            texts = answers[start:start + chunk_size]
+            chunk = (
+                list(sentiments[start:start + chunk_size])
+                if sentiments is not None else [None] * len(texts)
+            )
+            reused = 0
+            for offset, text in enumerate(texts):
+                if chunk[offset] is None:
+                    stored = stored_sentiments.get(self.idea_summarizer.normalize_answer(text))
+                    if stored is not None:
+                        chunk[offset] = stored
+                        reused += 1
+            missing = [offset for offset, sentiment in enumerate(chunk) if sentiment is None]
+            if missing:
+                with span('sentiment_analysis', answers=len(missing)):
+                    scores = self.sentiment_analyzer.analyze_batch(
+                        [texts[offset] for offset in missing])
+                for offset, sentiment in zip(missing, scores):
+                    chunk[offset] = sentiment
+            if reused:
+                metrics.ANSWERS_REUSED.inc(reused)
+            yield start, chunk, reused
+
+    def summarize(
+        self,
+        question_id,
+        question_text,
+        answers,
+        sentiments,
+        reused,
+        known_embeddings=None,
+        previous=None,
+    ):
+        """
+        Cluster scored answers and build the analysis document
+
+        Args:
+            sentiments: (score, label) per answer, from iter_sentiments()
+            reused: Answers whose results came from the stored analysis
+
+        Returns:
+            Same as analyze()
+        """
+        previous = previous or {}
+        stored_embeddings = self._stored_embeddings(previous)
+        trace.get_current_span().set_attribute('intelligence.reused_answers', reused)
+
+        per_answer_results = []
+        sentiment_scores = []
+        for idx, (ans, (score, label)) in enumerate(zip(answers, sentiments)):
+            sentiment_scores.append(float(score))
+
+            per_answer_results.append({
+                'index': idx,
+                'answer_text': ans,
+                'sentiment_score': float(score),
+                'sentiment_label': label,
+            })
+
+        with span('idea_summarization', answers=len(answers)):
+            cluster_summaries, text_embeddings = self.idea_summarizer.summarize_and_embed(
+                answers,
+                question_text,
+                known_embeddings={**stored_embeddings, **(known_embeddings or {})},
+                previous_clusters=self._previous_clusters(previous),
+            )
+
+        # Aggregate sentiment across answers (mean)
+        if sentiment_scores:
+            aggregate_score = float(sum(sentiment_scores) / len(sentiment_scores))
+            if aggregate_score >= 0.6:
+                aggregate_label = "POSITIVE"
+            elif aggregate_score <= 0.4:
+                aggregate_label = "NEGATIVE"
+            else:
+                aggregate_label = "NEUTRAL"
+        else:
+            aggregate_score = 0.5
+            aggregate_label = "NEUTRAL"
+
+        if self.idea_catalog is not None:
+            # Frequencies follow when the analysis is saved; an analysis
+            # without canonical ideas is still a valid analysis
+            try:
+                self.idea_catalog.canonicalize(cluster_summaries)
+            except Exception as e:
+                logger.warning(f"Could not canonicalize ideas of {question_id}: {e}")
+
+        # Prepare data for DB upsert
+        analysis_data = {
+            'question_id': question_id,
+            'question_text': question_text,
+            'answers': per_answer_results,
+            'aggregate_sentiment_score': aggregate_score,
+            'aggregate_sentiment_label': aggregate_label,
+            'model_version': config.MODEL_VERSION,
+            'models': dict(config.ANALYSIS_MODELS),
+            'reused_answers': reused,
+            'cluster_summaries': [
+                {
+                    **item,
+                    'centroid': pack_vector(item['centroid']),
+                } if item.get('centroid') is not None else item
+                for item in cluster_summaries
+            ],
+        }
+
+        answer_embeddings = self._answer_embeddings(answers, text_embeddings)
+        if answer_embeddings is not None:
+            analysis_data['answer_embeddings'] = pack_embeddings(answer_embeddings)
+
+        return analysis_data, cluster_summaries, answer_embeddings
+
+    def prepare_batch(self, answer_lists, previous_docs):
+        """
+        Score and embed the new answers of several questions in one pass each
+
+        Answers covered by a question's stored analysis are skipped; analyze()
+        reuses their stored results.
+
+        Args:
+            answer_lists: Answer texts per question
+            previous_docs: Stored analysis per question, from load_previous()
+
+        Returns:
+            Tuple of (sentiments per question, with None for reused answers,
+            embeddings by normalized text)
+        """
+        normalize = self.idea_summarizer.normalize_answer
+        stored = [self.reusable_results(doc) for doc in previous_docs]
+        new_answers = [
+            (position, index, answer)
+            for position, answers in enumerate(answer_lists)
+            for index, answer in enumerate(answers)
+            if normalize(answer) not in stored[position][0]
+        ]
+        new_texts = [answer for _, _, answer in new_answers]
+        unembedded = [
+            answer
+            for position, _, answer in new_answers
+            if normalize(answer) not in stored[position][1]
+        ]
+        sentiments = self.sentiment_analyzer.analyze_batch(new_texts)
+        known_embeddings = self.idea_summarizer.embed_unique(unembedded)
+
+        per_question = [[None] * len(answers) for answers in answer_lists]
+        for (position, index, _), sentiment in zip(new_answers, sentiments):
+            per_question[position][index] = sentiment
+        return per_question, known_embeddings
+
+    def load_previous(self, question_id):
+        """
+        Load the stored analysis of a question for incremental re-analysis
+
+        Returns:
+            The stored document, or {} when there is none, it was produced by
+            another model version or other models, or neither incremental
+            analysis nor incremental clustering is enabled
+        """
+        if not (config.INCREMENTAL_ANALYSIS_ENABLED or config.INCREMENTAL_CLUSTERING_ENABLED):
+            return {}
+        try:
+            with stage('mongo_load'):
+                previous = self.db_manager.get_analysis(question_id)
+        except Exception as e:
+            logger.warning(f"Could not load previous analysis of {question_id}: {e}")
+            return {}
+        # The models are compared too, in case INTELLIGENCE_MODEL_VERSION is
+        # pinned and was not bumped with a model change
+        if (
+            not previous
+            or previous.get('model_version') != config.MODEL_VERSION
+            or previous.get('models') != config.ANALYSIS_MODELS
+        ):
+            return {}
+        return previous
+
+    def reusable_results(self, previous):
+        """
+        Per-answer results of a stored analysis, keyed by normalized answer text
+
+        Returns:
+            Tuple of ({text: (score, label)}, {text: embedding})
+        """
+        return self._stored_sentiments(previous), self._stored_embeddings(previous)
+
+    def _stored_sentiments(self, previous):
+        # The stored analysis may only be loaded for its clusters
+        if not config.INCREMENTAL_ANALYSIS_ENABLED:
+            return {}
+        sentiments = {}
+        for answer in previous.get('answers') or []:
+            text = self.idea_summarizer.normalize_answer(answer.get('answer_text'))
+            if text and answer.get('sentiment_label') is not None:
+                sentiments[text] = (float(answer.get('sentiment_score', 0.5)), answer['sentiment_label'])
+        return sentiments
+
+    def _stored_embeddings(self, previous):
+        if not config.INCREMENTAL_ANALYSIS_ENABLED:
+            return {}
+        stored_answers = previous.get('answers') or []
+        matrix = unpack_embeddings(previous.get('answer_embeddings'))
+        if matrix is None or len(matrix) != len(stored_answers):
+            return {}
+        embeddings = {}
+        for position, answer in enumerate(stored_answers):
+            text = self.idea_summarizer.normalize_answer(answer.get('answer_text'))
+            if text and matrix[position].any():
+                embeddings[text] = matrix[position].astype(np.float32)
+        return embeddings
+
+    def _previous_clusters(self, previous):
+        """Stored clusters with decoded centroids, if embedded by the current model"""
+        packed = previous.get('answer_embeddings') or {}
+        if packed.get('model') != config.EMBEDDING_MODEL:
+            return []
+        return [
+            {**cluster, 'centroid': unpack_vector(cluster.get('centroid'))}
+            for cluster in previous.get('cluster_summaries') or []
+            if cluster.get('centroid') is not None
+        ]
+
     def GetSentimentStats(self, request, context):
         """
         Get sentiment statistics across all analyzed questions
@@ -194,3 +762,227 @@ class AnalyticsServicer:
         except Exception as e:
             logger.error(f"Error getting frequent ideas: {str(e)}")
             context.abort(grpc.StatusCode.INTERNAL, str(e))
+
+    def FindSimilarAnswers(self, request, context):
+        """
+        Find stored answers semantically close to a text or to another answer
+        
+        Args:
+            request: SimilarAnswersRequest with a text or a question_id/answer_index
+            context: gRPC context
+            
+        Returns:
+            SimilarAnswersResponse with the closest answers, best first
+        """
+        from . import analytics_pb2 as analytics_pb2
+
+        if self.similarity_index is None:
+            context.abort(grpc.StatusCode.UNAVAILABLE, 'Similarity index is disabled')
+        if not request.text and not request.question_id:
+            context.abort(
+                grpc.StatusCode.INVALID_ARGUMENT,
+                'Either text or question_id must be set',
+            )
+
+        if request.text:
+            query = self.idea_summarizer.embed([request.text])
+            query = query[0] if query is not None else None
+        else:
+            query = self.similarity_index.get_vector(
+                request.question_id, request.answer_index)
+        if query is None:
+            context.abort(grpc.StatusCode.NOT_FOUND, 'No embedding found for query')
+
+        try:
+            top_k = min(request.top_k or 10, MAX_SIMILAR_ANSWERS)
+            exclude = request.question_id if request.exclude_same_question else None
+            # Fetch one extra match so the query answer itself can be dropped
+            matches = self.similarity_index.search(query, top_k + 1, exclude)
+            if not request.text:
+                matches = [
+                    match for match in matches
+                    if (match[0], match[1]) != (request.question_id, request.answer_index)
+                ]
+            matches = [
+                match for match in matches[:top_k]
+                if match[2] >= request.min_similarity
+            ]
+            texts = self.db_manager.get_answer_texts(
+                [(question_id, index) for question_id, index, _ in matches])
+
+            return analytics_pb2.SimilarAnswersResponse(
+                answers=[
+                    analytics_pb2.SimilarAnswer(
+                        question_id=question_id,
+                        answer_index=index,
+                        answer_text=texts.get((question_id, index), ''),
+                        similarity=similarity,
+                    )
+                    for question_id, index, similarity in matches
+                ]
+            )
+
+        except Exception as e:
+            logger.error(f"Error finding similar answers: {str(e)}")
+            context.abort(grpc.StatusCode.INTERNAL, str(e))
+
+    def GetAnalysis(self, request, context):
+        """
+        Get the stored analysis of one question
+
+        Args:
+            request: GetAnalysisRequest with a question_id and a view
+            context: gRPC context
+
+        Returns:
+            StoredAnalysis with the fields of the requested view
+        """
+        if not request.question_id:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'question_id must be set')
+        try:
+            analyses = self.db_manager.get_analyses(
+                [request.question_id], _includes_answers(request.view))
+        except Exception as e:
+            logger.error(f"Error getting analysis: {str(e)}")
+            context.abort(grpc.StatusCode.INTERNAL, str(e))
+        if request.question_id not in analyses:
+            context.abort(grpc.StatusCode.NOT_FOUND, f'No analysis for question {request.question_id}')
+        return self._stored_analysis_proto(analyses[request.question_id], request.view)
+
+    def GetAnalyses(self, request, context):
+        """
+        Get the stored analyses of many questions with one database read
+
+        Args:
+            request: GetAnalysesRequest with question_ids and a view
+            context: gRPC context
+
+        Returns:
+            GetAnalysesResponse with the analyses found, in request order
+        """
+        from . import analytics_pb2 as analytics_pb2
+
+        question_ids = list(dict.fromkeys(request.question_ids))
+        if len(question_ids) > MAX_ANALYSES_PER_REQUEST:
+            context.abort(
+                grpc.StatusCode.INVALID_ARGUMENT,
+                f'At most {MAX_ANALYSES_PER_REQUEST} question_ids per request',
+            )
+        try:
+            analyses = self.db_manager.get_analyses(question_ids, _includes_answers(request.view))
+            return analytics_pb2.GetAnalysesResponse(
+                analyses=[
+                    self._stored_analysis_proto(analyses[question_id], request.view)
+                    for question_id in question_ids
+                    if question_id in analyses
+                ],
+                missing_question_ids=[
+                    question_id for question_id in question_ids if question_id not in analyses
+                ],
+            )
+        except Exception as e:
+            logger.error(f"Error getting analyses: {str(e)}")
+            context.abort(grpc.StatusCode.INTERNAL, str(e))
+
+    def ExportAnalyses(self, request, context):
+        """
+        Stream stored analyses as Arrow IPC record batches
+
+        Analyses are read with one cursor and a table-specific projection, so
+        only a cursor page and a record batch are held in memory.
+
+        Args:
+            request: ExportAnalysesRequest with the table and filters
+            context: gRPC context
+
+        Yields:
+            ArrowRecordBatch messages, each a complete IPC stream
+        """
+        from . import analytics_pb2 as analytics_pb2
+        from . import export
+
+        table = _EXPORT_TABLES.get(request.table)
+        if table is None:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, f'Unknown export table {request.table}')
+        batch_rows = request.batch_rows or config.EXPORT_BATCH_ROWS
+        if not 0 < batch_rows <= MAX_EXPORT_BATCH_ROWS:
+            context.abort(
+                grpc.StatusCode.INVALID_ARGUMENT,
+                f'batch_rows must be between 1 and {MAX_EXPORT_BATCH_ROWS}',
+            )
+        include_texts = table == export.ANSWERS_TABLE and request.include_answer_texts
+        match = export.export_match(
+            request.question_ids,
+            request.model_version,
+            _from_millis(request.analyzed_after),
+            _from_millis(request.analyzed_before),
+        )
+        try:
+            pages = self.db_manager.iter_analyses(
+                match, export.projection(table, include_texts), expand=include_texts)
+            for batch in export.record_batches(pages, table, include_texts, batch_rows):
+                yield analytics_pb2.ArrowRecordBatch(
+                    ipc_stream=export.ipc_stream(batch),
+                    rows=batch.num_rows,
+                )
+        except Exception as e:
+            logger.error(f"Error exporting analyses: {str(e)}")
+            context.abort(grpc.StatusCode.INTERNAL, str(e))
+
+    def _stored_analysis_proto(self, doc, view):
+        from . import analytics_pb2 as analytics_pb2
+
+        timestamp = doc.get('timestamp')
+        answers = {}
+        if _includes_answers(view):
+            answers = self._answers_proto(
+                (
+                    (a['index'], a.get('answer_text') or '', a['sentiment_score'], a['sentiment_label'])
+                    for a in doc.get('answers') or []
+                ),
+                compact=view == analytics_pb2.ANALYSIS_VIEW_COMPACT,
+            )
+        return analytics_pb2.StoredAnalysis(
+            question_id=doc['question_id'],
+            question_text=doc.get('question_text') or '',
+            aggregate_sentiment_score=float(doc.get('aggregate_sentiment_score') or 0.0),
+            aggregate_sentiment_label=doc.get('aggregate_sentiment_label') or '',
+            cluster_summaries=self._cluster_summaries_proto(doc.get('cluster_summaries') or []),
+            answer_count=int(doc.get('answer_count') or 0),
+            label_counts={label: int(count) for label, count in doc['label_counts'].items()},
+            model_version=doc.get('model_version') or '',
+            analyzed_at=(
+                int(timestamp.replace(tzinfo=timezone.utc).timestamp() * 1000)
+                if timestamp is not None else 0
+            ),
+            **answers,
+        )
+
+    def _answer_embeddings(self, answers, text_embeddings):
+        """Build an (n_answers, dim) matrix aligned with answer indices; blank answers get zero rows"""
+        if not text_embeddings:
+            return None
+        dim = len(next(iter(text_embeddings.values())))
+        matrix = np.zeros((len(answers), dim), dtype=np.float32)
+        for idx, ans in enumerate(answers):
+            embedding = text_embeddings.get(self.idea_summarizer.normalize_answer(ans))
+            if embedding is not None:
+                matrix[idx] = embedding
+        return matrix
+
+
+def _includes_answers(view):
+    from . import analytics_pb2 as analytics_pb2
+
+    return view in (analytics_pb2.ANALYSIS_VIEW_FULL, analytics_pb2.ANALYSIS_VIEW_COMPACT)
+
+
+def _from_millis(value):
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc) if value else None
+
+
+def _int_or_zero(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
@@ -0,0 +1,556 @@
+"""
+Approximate nearest-neighbour index over stored answer embeddings.
+
+Vectors are kept in an IVF (inverted file) layout: a k-means coarse quantizer
+assigns each vector to a list, and a query only scans the `nprobe` lists whose
+centroids are closest to it. Below `SIMILARITY_INDEX_MIN_TRAIN` vectors the
+index is a single list and search is exact.
+
+Snapshots store the vectors sorted by list as `.npy` files that are
+memory-mapped on load, so restarts do not re-read every analysis from MongoDB.
+Vectors added after a snapshot live in small per-list in-memory blocks until
+the next snapshot or rebuild folds them in.
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from . import config
+from .embeddings import unpack_embeddings
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT_VERSION = 1
+MAX_TRAIN_SAMPLES = 50000
+MAX_LISTS = 4096
+
+
+class SimilarityIndex:
+    """Incremental IVF index of answer embeddings with memory-mapped snapshots"""
+
+    def __init__(
+        self,
+        path: str | None = None,
+        nlist: int | None = None,
+        nprobe: int | None = None,
+        min_train: int | None = None,
+    ):
+        """
+        Initialize an empty index
+
+        Args:
+            path: Snapshot directory
+            nlist: Number of IVF lists; 0 picks sqrt(n) at each rebuild
+            nprobe: Lists scanned per query
+            min_train: Minimum live vectors before a coarse quantizer is trained
+        """
+        self._path = path or config.SIMILARITY_INDEX_PATH
+        self._nlist = config.SIMILARITY_INDEX_NLIST if nlist is None else nlist
+        self._nprobe = max(1, nprobe or config.SIMILARITY_INDEX_NPROBE)
+        self._min_train = (
+            config.SIMILARITY_INDEX_MIN_TRAIN if min_train is None else min_train
+        )
+        self._lock = threading.RLock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+        self._dim = None
+        self._questions: List[str] = []
+        self._question_codes: Dict[str, int] = {}
+        # Current generation per question code; rows from older generations
+        # are stale and skipped until the next snapshot drops them.
+        self._generations = np.full(16, -1, dtype=np.int32)
+        self._live_counts: Dict[int, int] = {}
+        self._centroids = None
+        # Base rows are sorted by list: list `l` is rows offsets[l]:offsets[l + 1].
+        # Meta columns are (question code, answer index, generation).
+        self._base_vectors = np.zeros((0, 0), dtype=np.float16)
+        self._base_meta = np.zeros((0, 3), dtype=np.int32)
+        self._base_offsets = np.zeros(2, dtype=np.int64)
+        self._tail: Dict[int, List[Tuple[np.ndarray, np.ndarray]]] = {}
+        self._total_rows = 0
+        self._trained_size = 0
+        self._version = 0
+        self._snapshot_version = 0
+        self.built_until = None
+
+    @property
+    def size(self) -> int:
+        """Number of live (non-stale) vectors"""
+        with self._lock:
+            return sum(self._live_counts.values())
+
+    def add(
+        self,
+        question_id: str,
+        embeddings: np.ndarray,
+        timestamp: datetime | None = None,
+    ) -> None:
+        """
+        Replace the vectors of a question
+
+        Args:
+            question_id: Question the answers belong to
+            embeddings: (n_answers, dim) matrix; all-zero rows are skipped
+            timestamp: Analysis timestamp, used to resume backfills
+        """
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2:
+            return
+        with self._lock:
+            if self._dim is None and vectors.shape[0]:
+                self._dim = int(vectors.shape[1])
+            if vectors.shape[0] and vectors.shape[1] != self._dim:
+                logger.warning(
+                    "Skipping embeddings for %s: dim %d != index dim %d",
+                    question_id,
+                    vectors.shape[1],
+                    self._dim,
+                )
+                return
+
+            code = self._next_generation(question_id)
+            rows = np.flatnonzero(np.linalg.norm(vectors, axis=1) > 0)
+            self._live_counts[code] = int(rows.size)
+            if rows.size:
+                meta = np.column_stack([
+                    np.full(rows.size, code),
+                    rows,
+                    np.full(rows.size, self._generations[code]),
+                ]).astype(np.int32)
+                live_vectors = vectors[rows]
+                lists = self._assign(live_vectors, self._centroids)
+                stored = live_vectors.astype(np.float16)
+                for list_id in np.unique(lists):
+                    mask = lists == list_id
+                    self._tail.setdefault(int(list_id), []).append(
+                        (stored[mask], meta[mask]))
+                self._total_rows += int(rows.size)
+
+            if timestamp and (self.built_until is None or timestamp > self.built_until):
+                self.built_until = timestamp
+            self._version += 1
+
+    def search(
+        self,
+        query: np.ndarray,
+        top_k: int = 10,
+        exclude_question_id: str | None = None,
+    ) -> List[Tuple[str, int, float]]:
+        """
+        Find the answers closest to a query embedding
+
+        Args:
+            query: Query embedding
+            top_k: Maximum number of matches
+            exclude_question_id: Skip answers of this question
+
+        Returns:
+            List of (question_id, answer_index, cosine similarity), best first
+        """
+        q = np.asarray(query, dtype=np.float32).ravel()
+        norm = np.linalg.norm(q)
+        if norm == 0 or top_k <= 0:
+            return []
+        q = q / norm
+
+        with self._lock:
+            if self._dim is None or q.shape[0] != self._dim:
+                return []
+            if self._centroids is None:
+                probes = [0]
+            else:
+                probes = np.argsort(-(self._centroids @ q))[: self._nprobe]
+            parts = self._list_blocks(probes)
+            generations = self._generations.copy()
+            questions = self._questions
+            excluded = self._question_codes.get(exclude_question_id, -1)
+
+        if not parts:
+            return []
+        vectors = np.concatenate([vecs for vecs, _ in parts])
+        meta = np.concatenate([rows for _, rows in parts])
+        valid = meta[:, 2] == generations[meta[:, 0]]
+        if excluded >= 0:
+            valid &= meta[:, 0] != excluded
+        vectors = vectors[valid]
+        meta = meta[valid]
+        if not len(meta):
+            return []
+
+        scores = vectors.astype(np.float32) @ q
+        k = min(top_k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [
+            (questions[meta[i, 0]], int(meta[i, 1]), float(scores[i]))
+            for i in best
+        ]
+
+    def get_vector(self, question_id: str, answer_index: int) -> np.ndarray | None:
+        """Return the stored embedding of one answer, if indexed"""
+        with self._lock:
+            code = self._question_codes.get(question_id)
+            if code is None:
+                return None
+            generation = self._generations[code]
+            blocks = self._all_blocks()
+        for vecs, meta in blocks:
+            hits = np.flatnonzero(
+                (meta[:, 0] == code)
+                & (meta[:, 1] == answer_index)
+                & (meta[:, 2] == generation)
+            )
+            if hits.size:
+                return np.asarray(vecs[hits[0]], dtype=np.float32)
+        return None
+
+    def needs_rebuild(self) -> bool:
+        """True when the quantizer should be (re)trained or stale rows compacted"""
+        with self._lock:
+            live = sum(self._live_counts.values())
+            if self._total_rows > 2 * max(live, 1):
+                return True
+            if live < self._min_train:
+                return False
+            return self._centroids is None or live >= 2 * self._trained_size
+
+    def rebuild(self) -> None:
+        """Retrain the coarse quantizer on all live vectors and re-bucket them"""
+        with self._lock:
+            blocks = self._all_blocks()
+            generations = self._generations.copy()
+            seen = {id(vecs) for vecs, _ in blocks}
+
+        vectors, meta = self._live_rows(blocks, generations)
+        centroids = None
+        if len(vectors) >= max(1, self._min_train):
+            centroids = self._train(vectors)
+        lists = self._assign(vectors.astype(np.float32), centroids)
+        order = np.argsort(lists, kind='stable')
+        num_lists = 1 if centroids is None else len(centroids)
+        counts = np.bincount(lists, minlength=num_lists)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        with self._lock:
+            self._install(
+                centroids, vectors[order], meta[order], offsets, seen,
+                reassign=True)
+            self._trained_size = len(vectors)
+        logger.info(
+            "Similarity index rebuilt: %d vectors, %d lists",
+            len(vectors),
+            num_lists,
+        )
+
+    def snapshot(self) -> bool:
+        """
+        Write the index to disk and memory-map it back
+
+        Returns:
+            True when a snapshot was written
+        """
+        with self._lock:
+            if self._dim is None or self._version == self._snapshot_version:
+                return False
+            version = self._version
+            num_lists = len(self._base_offsets) - 1
+            per_list = [self._list_blocks([list_id]) for list_id in range(num_lists)]
+            seen = {id(vecs) for blocks in per_list for vecs, _ in blocks}
+            generations = self._generations.copy()
+            manifest = {
+                'format_version': SNAPSHOT_FORMAT_VERSION,
+                'model': config.EMBEDDING_MODEL,
+                'dim': self._dim,
+                'questions': list(self._questions),
+                'generations': generations[: len(self._questions)].tolist(),
+                'built_until': (
+                    self.built_until.isoformat() if self.built_until else None
+                ),
+                'trained_size': self._trained_size,
+            }
+            centroids = self._centroids
+
+        masks = [
+            [meta[:, 2] == generations[meta[:, 0]] for _, meta in blocks]
+            for blocks in per_list
+        ]
+        counts = [int(sum(mask.sum() for mask in list_masks)) for list_masks in masks]
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        total = int(offsets[-1])
+        if total == 0:
+            return False
+
+        tmp_path = f'{self._path}.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        out_vectors = np.lib.format.open_memmap(
+            os.path.join(tmp_path, 'vectors.npy'),
+            mode='w+', dtype=np.float16, shape=(total, self._dim))
+        out_meta = np.lib.format.open_memmap(
+            os.path.join(tmp_path, 'meta.npy'),
+            mode='w+', dtype=np.int32, shape=(total, 3))
+        position = 0
+        for blocks, list_masks in zip(per_list, masks):
+            for (vecs, meta), mask in zip(blocks, list_masks):
+                count = int(mask.sum())
+                out_vectors[position:position + count] = vecs[mask]
+                out_meta[position:position + count] = meta[mask]
+                position += count
+        out_vectors.flush()
+        out_meta.flush()
+        del out_vectors, out_meta
+        np.save(os.path.join(tmp_path, 'offsets.npy'), offsets)
+        if centroids is not None:
+            np.save(os.path.join(tmp_path, 'centroids.npy'), centroids)
+        with open(os.path.join(tmp_path, 'manifest.json'), 'w') as handle:
+            json.dump(manifest, handle)
+
+        old_path = f'{self._path}.old'
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(self._path):
+            os.replace(self._path, old_path)
+        os.replace(tmp_path, self._path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+        vectors = np.load(os.path.join(self._path, 'vectors.npy'), mmap_mode='r')
+        meta = np.load(os.path.join(self._path, 'meta.npy'), mmap_mode='r')
+        with self._lock:
+            unchanged = self._version == version
+            self._install(centroids, vectors, meta, offsets, seen, reassign=False)
+            if unchanged:
+                self._snapshot_version = self._version
+        logger.info("Similarity index snapshot written: %d vectors", total)
+        return True
+
+    def load(self) -> bool:
+        """
+        Memory-map the last snapshot, if it matches the embedding model
+
+        Returns:
+            True when a snapshot was loaded
+        """
+        manifest_path = os.path.join(self._path, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            return False
+        try:
+            with open(manifest_path) as handle:
+                manifest = json.load(handle)
+            if manifest.get('format_version') != SNAPSHOT_FORMAT_VERSION:
+                logger.info("Ignoring similarity index snapshot: format changed")
+                return False
+            if manifest.get('model') != config.EMBEDDING_MODEL:
+                logger.info("Ignoring similarity index snapshot: model changed")
+                return False
+            vectors = np.load(os.path.join(self._path, 'vectors.npy'), mmap_mode='r')
+            meta = np.load(os.path.join(self._path, 'meta.npy'), mmap_mode='r')
+            offsets = np.load(os.path.join(self._path, 'offsets.npy'))
+            centroids_path = os.path.join(self._path, 'centroids.npy')
+            centroids = (
+                np.load(centroids_path) if os.path.exists(centroids_path) else None
+            )
+        except Exception as e:
+            logger.warning(f"Failed to load similarity index snapshot: {str(e)}")
+            return False
+
+        with self._lock:
+            self._dim = int(manifest['dim'])
+            self._questions = list(manifest['questions'])
+            self._question_codes = {
+                question_id: code for code, question_id in enumerate(self._questions)
+            }
+            self._generations = np.full(
+                max(16, len(self._questions)), -1, dtype=np.int32)
+            self._generations[: len(self._questions)] = manifest['generations']
+            counts = np.bincount(meta[:, 0], minlength=len(self._questions))
+            self._live_counts = {
+                code: int(count) for code, count in enumerate(counts) if count
+            }
+            self._centroids = centroids
+            self._base_vectors = vectors
+            self._base_meta = meta
+            self._base_offsets = offsets
+            self._tail = {}
+            self._total_rows = len(vectors)
+            self._trained_size = int(manifest.get('trained_size') or 0)
+            built_until = manifest.get('built_until')
+            self.built_until = (
+                datetime.fromisoformat(built_until) if built_until else None
+            )
+            self._version = 0
+            self._snapshot_version = 0
+        logger.info(
+            "Similarity index snapshot loaded: %d vectors, %d questions",
+            len(vectors),
+            len(self._questions),
+        )
+        return True
+
+    def backfill(self, records: Iterable[Tuple[str, Dict[str, Any], datetime | None]]) -> int:
+        """
+        Add stored embeddings, e.g. analyses saved since the last snapshot
+
+        Args:
+            records: (question_id, packed embeddings, timestamp) tuples
+
+        Returns:
+            Number of questions added
+        """
+        added = 0
+        for question_id, packed, timestamp in records:
+            if self._stopping.is_set():
+                break
+            embeddings = unpack_embeddings(packed)
+            if embeddings is None:
+                continue
+            self.add(question_id, embeddings, timestamp)
+            added += 1
+        return added
+
+    def start(self, db_manager, interval_s: int | None = None) -> None:
+        """
+        Backfill from MongoDB and snapshot periodically in a background thread
+
+        Args:
+            db_manager: MongoDB manager providing `iter_answer_embeddings`
+            interval_s: Seconds between maintenance runs
+        """
+        interval = max(
+            1,
+            interval_s or config.SIMILARITY_INDEX_SNAPSHOT_INTERVAL_S,
+        )
+
+        def run():
+            try:
+                added = self.backfill(
+                    db_manager.iter_answer_embeddings(since=self.built_until))
+                logger.info(
+                    "Similarity index backfill added %d questions", added)
+            except Exception as e:
+                logger.error(f"Similarity index backfill failed: {str(e)}")
+            while not self._stopping.wait(interval):
+                self._maintain()
+
+        self._thread = threading.Thread(
+            target=run, name='similarity-index', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the maintenance thread and write a final snapshot"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+        self._maintain()
+
+    def _maintain(self) -> None:
+        try:
+            if self.needs_rebuild():
+                self.rebuild()
+            self.snapshot()
+        except Exception as e:
+            logger.error(f"Similarity index maintenance failed: {str(e)}")
+
+    def _next_generation(self, question_id: str) -> int:
+        code = self._question_codes.get(question_id)
+        if code is None:
+            code = len(self._questions)
+            self._questions.append(question_id)
+            self._question_codes[question_id] = code
+        if code >= len(self._generations):
+            grown = np.full(2 * len(self._generations), -1, dtype=np.int32)
+            grown[: len(self._generations)] = self._generations
+            self._generations = grown
+        self._generations[code] += 1
+        return code
+
+    def _list_blocks(self, list_ids) -> List[Tuple[np.ndarray, np.ndarray]]:
+        num_lists = len(self._base_offsets) - 1
+        blocks = []
+        for list_id in list_ids:
+            list_id = int(list_id)
+            if list_id < num_lists:
+                start = int(self._base_offsets[list_id])
+                end = int(self._base_offsets[list_id + 1])
+                if end > start:
+                    blocks.append((
+                        self._base_vectors[start:end],
+                        self._base_meta[start:end],
+                    ))
+            blocks.extend(self._tail.get(list_id, []))
+        return blocks
+
+    def _all_blocks(self) -> List[Tuple[np.ndarray, np.ndarray]]:
+        blocks = []
+        if len(self._base_vectors):
+            blocks.append((self._base_vectors, self._base_meta))
+        for list_blocks in self._tail.values():
+            blocks.extend(list_blocks)
+        return blocks
+
+    def _live_rows(self, blocks, generations) -> Tuple[np.ndarray, np.ndarray]:
+        if not blocks:
+            return (
+                np.zeros((0, self._dim or 0), dtype=np.float16),
+                np.zeros((0, 3), dtype=np.int32),
+            )
+        vectors = np.concatenate([vecs for vecs, _ in blocks])
+        meta = np.concatenate([rows for _, rows in blocks])
+        valid = meta[:, 2] == generations[meta[:, 0]]
+        return vectors[valid], meta[valid]
+
+    def _train(self, vectors: np.ndarray) -> np.ndarray:
+        from sklearn.cluster import MiniBatchKMeans
+
+        nlist = self._nlist or int(round(np.sqrt(len(vectors))))
+        nlist = max(1, min(nlist, MAX_LISTS, len(vectors)))
+        sample = vectors
+        if len(vectors) > MAX_TRAIN_SAMPLES:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(len(vectors), MAX_TRAIN_SAMPLES, replace=False)]
+        kmeans = MiniBatchKMeans(
+            n_clusters=nlist,
+            batch_size=2048,
+            n_init=3,
+            random_state=0,
+        ).fit(sample.astype(np.float32))
+        centroids = kmeans.cluster_centers_.astype(np.float32)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return centroids / norms
+
+    def _assign(self, vectors: np.ndarray, centroids: np.ndarray | None) -> np.ndarray:
+        if centroids is None or not len(vectors):
+            return np.zeros(len(vectors), dtype=np.int64)
+        return np.argmax(vectors @ centroids.T, axis=1)
+
+    def _install(self, centroids, vectors, meta, offsets, seen, reassign: bool) -> None:
+        # Keep blocks added while the new base was being built; they are not
+        # part of it. Their list ids are only valid if the centroids are kept.
+        tail: Dict[int, List[Tuple[np.ndarray, np.ndarray]]] = {}
+        pending_rows = 0
+        for list_id, blocks in self._tail.items():
+            for vecs, rows in blocks:
+                if id(vecs) in seen:
+                    continue
+                pending_rows += len(rows)
+                if not reassign:
+                    tail.setdefault(list_id, []).append((vecs, rows))
+                    continue
+                lists = self._assign(vecs.astype(np.float32), centroids)
+                for new_list in np.unique(lists):
+                    mask = lists == new_list
+                    tail.setdefault(int(new_list), []).append(
+                        (vecs[mask], rows[mask]))
+        self._centroids = centroids
+        self._base_vectors = vectors
+        self._base_meta = meta
+        self._base_offsets = offsets
+        self._tail = tail
+        self._total_rows = len(vectors) + pending_rows
+        self._version += 1
@@ -0,0 +1,71 @@
+"""
+Startup orchestration and phase timings.
+"""
+import logging
+import time
+from concurrent import futures
+from contextlib import contextmanager
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Runs startup phases, in parallel where possible, and logs their timings"""
+
+    def __init__(self):
+        self._started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a sequential startup phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, time.perf_counter() - start)
+
+    def run_parallel(self, tasks: Dict[str, Callable[[], Any]]) -> Dict[str, Any]:
+        """
+        Run independent startup tasks in threads and wait for all of them
+
+        Args:
+            tasks: Callables keyed by phase name
+
+        Returns:
+            Each task's return value, keyed by phase name
+
+        Raises:
+            The first task failure, after every task has finished
+        """
+        if not tasks:
+            return {}
+        with futures.ThreadPoolExecutor(
+            max_workers=len(tasks), thread_name_prefix='startup'
+        ) as pool:
+            pending = {
+                name: pool.submit(self._timed, name, task)
+                for name, task in tasks.items()
+            }
+            futures.wait(pending.values())
+        return {name: future.result() for name, future in pending.items()}
+
+    def log_summary(self) -> None:
+        """Log the total startup time and the duration of every phase"""
+        total = time.perf_counter() - self._started
+        breakdown = ', '.join(
+            f'{name}={seconds:.2f}s' for name, seconds in self.phases.items()
+        )
+        logger.info(f"Startup completed in {total:.2f}s ({breakdown})")
+
+    def _timed(self, name: str, task: Callable[[], Any]) -> Any:
+        start = time.perf_counter()
+        try:
+            return task()
+        finally:
+            self._record(name, time.perf_counter() - start)
+
+    def _record(self, name: str, seconds: float) -> None:
+        self.phases[name] = seconds
+        logger.info(f"Startup phase {name} took {seconds:.2f}s")
@@ -0,0 +1,429 @@
+"""
+Redis Streams worker speaking the analytics-ms intelligence protocol.
+
+Reads IntelligenceRequestEvent entries from the request stream with a consumer
+group, analyzes each read batch with batched model calls, publishes
+IntelligenceResultEvent entries and acknowledges the requests in one pipeline.
+Entries left pending by a crashed consumer are reclaimed after
+STREAM_CLAIM_IDLE_MS; entries that are malformed or keep failing go to the DLQ.
+Delivery is at least once: a crash between publishing and acknowledging
+republishes the same result.
+"""
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import config
+from . import metrics
+from .telemetry import consumer_span, inject_context, linked_span
+
+logger = logging.getLogger(__name__)
+
+PRODUCER_SERVICE = 'intelligence-ms'
+MAX_TOP_IDEAS = 10
+REQUIRED_FIELDS = (
+    'jobId', 'formId', 'snapshotId', 'windowKey',
+    'questionId', 'questionText', 'answers', 'analysisHash',
+)
+TRACE_FIELDS = ('traceparent', 'tracestate', 'baggage')
+# Scheduler form for the batched model pass shared by a read's jobs
+BATCH_FORM = 'stream-batch'
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+@dataclass
+class StreamJob:
+    message_id: str
+    request: Dict[str, Any]
+    metadata: Dict[str, str]
+
+
+def parse_request(fields: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Decode and validate the IntelligenceRequestEvent of a stream entry
+
+    Raises:
+        ValueError: The entry has no payload or the payload is malformed
+    """
+    raw = fields.get('payload')
+    if raw is None:
+        raise ValueError('Stream entry has no payload field')
+    try:
+        request = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise ValueError(f'Payload is not valid JSON: {e}') from e
+    if not isinstance(request, dict):
+        raise ValueError('Payload is not a JSON object')
+    missing = [field for field in REQUIRED_FIELDS if field not in request]
+    if missing:
+        raise ValueError(f"Payload is missing {', '.join(missing)}")
+    wrong_type = [
+        field for field in REQUIRED_FIELDS
+        if field != 'answers' and not isinstance(request[field], str)
+    ]
+    if wrong_type:
+        raise ValueError(f"{', '.join(wrong_type)} must be strings")
+    answers = request['answers']
+    if not isinstance(answers, list) or not all(isinstance(a, str) for a in answers):
+        raise ValueError('answers must be an array of strings')
+    return request
+
+
+def sentiment_percentages(answers: List[Dict[str, Any]]) -> Dict[str, float]:
+    """Share of non-blank answers per sentiment label, in percent"""
+    labels = [
+        answer['sentiment_label']
+        for answer in answers
+        if (answer.get('answer_text') or '').strip()
+    ]
+    total = len(labels)
+    if not total:
+        return {'positivePct': 0.0, 'neutralPct': 0.0, 'negativePct': 0.0}
+    return {
+        'positivePct': labels.count('POSITIVE') / total * 100,
+        'neutralPct': labels.count('NEUTRAL') / total * 100,
+        'negativePct': labels.count('NEGATIVE') / total * 100,
+    }
+
+
+def _priority(request: Dict[str, Any]) -> int:
+    """Optional scheduling priority carried in the request payload"""
+    try:
+        return int(request.get('priority') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class StreamWorker:
+    """Consumes the analytics-ms request stream in batches"""
+
+    def __init__(
+        self,
+        redis_client,
+        servicer,
+        sentiment_analyzer,
+        idea_summarizer,
+        group: str | None = None,
+        consumer: str | None = None,
+        batch_size: int | None = None,
+        block_ms: int | None = None,
+        claim_idle_ms: int | None = None,
+        claim_interval_s: int | None = None,
+        max_deliveries: int | None = None,
+    ):
+        """
+        Args:
+            redis_client: redis.Redis created with decode_responses=True
+            servicer: AnalyticsServicer whose run_analysis persists each job
+            sentiment_analyzer: SentimentAnalyzer used for batched scoring
+            idea_summarizer: IdeaSummarizer used for batched embedding
+            group: Consumer group on the request stream
+            consumer: Consumer name within the group (unique per replica)
+            batch_size: Entries per XREADGROUP (COUNT)
+            block_ms: XREADGROUP BLOCK timeout
+            claim_idle_ms: Reclaim entries pending longer than this
+            claim_interval_s: Seconds between reclaim passes
+            max_deliveries: Deliveries before an entry is sent to the DLQ
+        """
+        self._redis = redis_client
+        self._servicer = servicer
+        self._sentiment_analyzer = sentiment_analyzer
+        self._idea_summarizer = idea_summarizer
+        self.request_stream = config.REQUEST_STREAM
+        self.result_stream = config.RESULT_STREAM
+        self.dlq_stream = config.DLQ_STREAM
+        self.group = group or config.STREAM_GROUP
+        self.consumer = consumer or config.STREAM_CONSUMER
+        self._batch_size = max(1, batch_size or config.STREAM_BATCH_SIZE)
+        self._block_ms = max(1, block_ms or config.STREAM_BLOCK_MS)
+        self._claim_idle_ms = (
+            config.STREAM_CLAIM_IDLE_MS if claim_idle_ms is None else claim_idle_ms)
+        self._claim_interval = (
+            config.STREAM_CLAIM_INTERVAL_S if claim_interval_s is None else claim_interval_s)
+        self._max_deliveries = max(1, max_deliveries or config.STREAM_MAX_DELIVERIES)
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, servicer, sentiment_analyzer, idea_summarizer) -> 'StreamWorker':
+        import redis
+
+        client = redis.Redis(
+            host=config.REDIS_HOST,
+            port=config.REDIS_PORT,
+            password=config.REDIS_PASSWORD,
+            decode_responses=True,
+            health_check_interval=30,
+        )
+        return cls(client, servicer, sentiment_analyzer, idea_summarizer)
+
+    def ensure_group(self) -> None:
+        """Create the consumer group (and stream) if needed"""
+        from redis.exceptions import ResponseError
+
+        try:
+            self._redis.xgroup_create(
+                self.request_stream, self.group, id='$', mkstream=True)
+            logger.info(f"Created consumer group {self.group} on {self.request_stream}")
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def start(self) -> None:
+        """Consume on a background thread"""
+        self._thread = threading.Thread(
+            target=self.run, name='stream-worker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Finish the current batch and stop"""
+        self._stopping.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=timeout)
+
+    def run(self) -> None:
+        """Consume until stop() is called"""
+        from redis.exceptions import RedisError
+
+        logger.info(
+            f"Stream worker {self.consumer} reading {self.request_stream} "
+            f"(group {self.group}, batch {self._batch_size})")
+        group_ready = False
+        next_claim = 0.0
+        backoff = 1.0
+        while not self._stopping.is_set():
+            try:
+                if not group_ready:
+                    self.ensure_group()
+                    group_ready = True
+                if self._claim_interval and time.monotonic() >= next_claim:
+                    self.reclaim()
+                    next_claim = time.monotonic() + self._claim_interval
+                self.poll()
+                backoff = 1.0
+            except RedisError as e:
+                logger.error(f"Redis error in stream worker: {e}; retrying in {backoff:.0f}s")
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+            except Exception as e:
+                # Nothing else consumes the stream in this process, so keep
+                # going; the batch stays pending and is reclaimed, and sent to
+                # the DLQ after STREAM_MAX_DELIVERIES
+                metrics.STREAM_JOBS.labels(outcome='error').inc()
+                logger.error(
+                    f"Unexpected error in stream worker: {e}; retrying in {backoff:.0f}s",
+                    exc_info=True,
+                )
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+        logger.info("Stream worker stopped")
+
+    def poll(self) -> int:
+        """Read and handle one batch of new entries; returns the entry count"""
+        response = self._redis.xreadgroup(
+            self.group,
+            self.consumer,
+            {self.request_stream: '>'},
+            count=self._batch_size,
+            block=self._block_ms,
+        )
+        entries = response[0][1] if response else []
+        if entries:
+            self.process(entries)
+        return len(entries)
+
+    def reclaim(self) -> int:
+        """
+        Claim entries idle in other consumers' pending lists
+
+        Entries delivered STREAM_MAX_DELIVERIES times already go to the DLQ
+        instead of being retried.
+
+        Returns:
+            Number of entries claimed
+        """
+        pending = self._redis.xpending_range(
+            self.request_stream, self.group, min='-', max='+',
+            count=self._batch_size, idle=self._claim_idle_ms,
+        )
+        if not pending:
+            return 0
+        exhausted = [
+            entry['message_id'] for entry in pending
+            if entry['times_delivered'] >= self._max_deliveries
+        ]
+        retry = [
+            entry['message_id'] for entry in pending
+            if entry['times_delivered'] < self._max_deliveries
+        ]
+        claimed = 0
+        if exhausted:
+            entries = self._claim(exhausted)
+            claimed += len(entries)
+            pipe = self._redis.pipeline(transaction=False)
+            for message_id, fields in entries:
+                self._queue_dlq(
+                    pipe, message_id, fields,
+                    f'Gave up after {self._max_deliveries} deliveries')
+            pipe.xack(self.request_stream, self.group, *exhausted)
+            pipe.execute()
+            metrics.STREAM_JOBS.labels(outcome='dlq').inc(len(entries))
+            logger.warning(f"Moved {len(entries)} repeatedly failing entries to {self.dlq_stream}")
+        if retry:
+            entries = self._claim(retry)
+            claimed += len(entries)
+            if entries:
+                logger.info(f"Reclaimed {len(entries)} idle entries")
+                self.process(entries)
+        metrics.STREAM_RECLAIMED.inc(claimed)
+        return claimed
+
+    def process(self, entries: List[Tuple[str, Dict[str, str]]]) -> None:
+        """Analyze a batch of entries, then publish results and XACK in one pipeline"""
+        jobs: List[StreamJob] = []
+        pipe = self._redis.pipeline(transaction=False)
+        invalid = 0
+        for message_id, fields in entries:
+            try:
+                request = parse_request(fields)
+            except ValueError as e:
+                logger.warning(f"Sending malformed entry {message_id} to DLQ: {e}")
+                self._queue_dlq(pipe, message_id, fields, str(e))
+                invalid += 1
+                continue
+            metadata = {key: fields[key] for key in TRACE_FIELDS if fields.get(key)}
+            jobs.append(StreamJob(message_id, request, metadata))
+
+        metrics.STREAM_BATCH_SIZE.observe(len(entries))
+        for job, result, trace_fields in self._analyze(jobs):
+            pipe.xadd(self.result_stream, self._envelope(result, trace_fields))
+            metrics.STREAM_JOBS.labels(
+                outcome='success' if result['success'] else 'failure').inc()
+        pipe.xack(self.request_stream, self.group, *[message_id for message_id, _ in entries])
+        pipe.execute()
+        if invalid:
+            metrics.STREAM_JOBS.labels(outcome='dlq').inc(invalid)
+
+    def _analyze(self, jobs: List[StreamJob]):
+        if not jobs:
+            return []
+        previous = [self._servicer.load_previous(job.request['questionId']) for job in jobs]
+        answer_lists = [job.request['answers'] for job in jobs]
+        job_sentiments = [None] * len(jobs)
+        known_embeddings = None
+        try:
+            # One batched sentiment pass and one embedding pass for every job
+            # in the read; clustering stays per question.
+            with self._servicer.analysis_slot(
+                BATCH_FORM, [answer for answers in answer_lists for answer in answers],
+            ), linked_span(
+                'stream_batch',
+                [job.metadata for job in jobs],
+                jobs=len(jobs),
+                answers=sum(len(answers) for answers in answer_lists),
+            ):
+                job_sentiments, known_embeddings = self._servicer.prepare_batch(
+                    answer_lists, previous)
+        except Exception:
+            logger.exception("Batched analysis failed; analyzing jobs one by one")
+            job_sentiments = [None] * len(jobs)
+            known_embeddings = None
+
+        results = []
+        for position, job in enumerate(jobs):
+            request = job.request
+            count = len(request['answers'])
+            with consumer_span(
+                'redis.stream.process.request',
+                job.metadata,
+                **{
+                    'messaging.system': 'redis',
+                    'messaging.source': self.request_stream,
+                    'messaging.message_id': job.message_id,
+                    'intelligence.question_id': request['questionId'],
+                    'intelligence.answers': count,
+                },
+            ):
+                try:
+                    with self._servicer.analysis_slot(
+                        request['formId'],
+                        request['answers'],
+                        _priority(request),
+                    ):
+                        analysis_data, cluster_summaries = self._servicer.run_analysis(
+                            request['questionId'],
+                            request['questionText'],
+                            request['answers'],
+                            sentiments=job_sentiments[position],
+                            known_embeddings=known_embeddings,
+                            previous=previous[position],
+                        )
+                    result = self._result(
+                        request,
+                        success=True,
+                        topIdeas=[
+                            {'idea': item['summary'], 'count': int(item.get('count', 0))}
+                            for item in cluster_summaries
+                            if item.get('summary')
+                        ][:MAX_TOP_IDEAS],
+                        sentiment=sentiment_percentages(analysis_data['answers']),
+                    )
+                except Exception as e:
+                    logger.error(f"Analysis failed for question {request['questionId']}: {e}")
+                    result = self._result(request, success=False, topIdeas=[], analysisError=str(e))
+                trace_fields = inject_context() or job.metadata
+            results.append((job, result, trace_fields))
+        return results
+
+    def _result(self, request: Dict[str, Any], **fields) -> Dict[str, Any]:
+        return {
+            'jobId': request['jobId'],
+            'formId': request['formId'],
+            'snapshotId': request['snapshotId'],
+            'windowKey': request['windowKey'],
+            'questionId': request['questionId'],
+            'analysisHash': request['analysisHash'],
+            **fields,
+            'lastEnrichedAt': _now(),
+            'modelVersion': config.MODEL_VERSION,
+        }
+
+    def _envelope(self, payload: Dict[str, Any], trace_fields: Dict[str, str]) -> Dict[str, str]:
+        fields = {
+            'payload': json.dumps(payload),
+            'producer_service': PRODUCER_SERVICE,
+            'produced_at': _now(),
+        }
+        fields.update({key: trace_fields[key] for key in TRACE_FIELDS if trace_fields.get(key)})
+        return fields
+
+    def _claim(self, message_ids: List[str]) -> List[Tuple[str, Dict[str, str]]]:
+        entries = self._redis.xclaim(
+            self.request_stream, self.group, self.consumer,
+            self._claim_idle_ms, message_ids,
+        )
+        # Entries trimmed from the stream come back without fields.
+        return [(message_id, fields) for message_id, fields in entries if fields]
+
+    def _queue_dlq(self, pipe, message_id: str, fields: Dict[str, str], error: str) -> None:
+        metadata = {key: fields[key] for key in TRACE_FIELDS if fields.get(key)}
+        pipe.xadd(self.dlq_stream, self._envelope({
+            'sourceStream': self.request_stream,
+            'dlqStream': self.dlq_stream,
+            'failedMessageId': message_id,
+            'payload': fields.get('payload'),
+            'metadata': {
+                **metadata,
+                'producer_service': fields.get('producer_service'),
+                'produced_at': fields.get('produced_at'),
+            },
+            'error': error,
+            'failedAt': _now(),
+        }, metadata))
@@ -0,0 +1,187 @@
+"""
+Tracing and per-stage instrumentation for intelligence-ms.
+
+Spans continue the W3C `traceparent` sent in gRPC metadata, so analyses show
+up under the calling service's trace. Exporter settings follow the same
+OTEL_* variables as the NestJS services (see libs/common telemetry).
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+import grpc
+from opentelemetry import propagate, trace
+
+from . import metrics
+from .load import record_stage
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = 'intelligence-ms'
+RPC_SERVICE = 'analytics.AnalyticsService'
+
+_tracer = trace.get_tracer(SERVICE_NAME)
+
+
+def init_tracing(service_name: str = SERVICE_NAME) -> bool:
+    """
+    Install an OTLP/HTTP trace exporter unless OTEL_SDK_DISABLED=true
+
+    Returns:
+        True when tracing was enabled
+    """
+    if os.getenv('OTEL_SDK_DISABLED', 'false').lower() == 'true':
+        logger.info("OpenTelemetry disabled")
+        return False
+
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    resource = Resource.create({
+        'service.name': os.getenv('OTEL_SERVICE_NAME', service_name),
+        'service.namespace': os.getenv('OTEL_SERVICE_NAMESPACE', 'burrito'),
+        'deployment.environment': os.getenv(
+            'OTEL_RESOURCE_DEPLOYMENT_ENVIRONMENT', 'development'),
+    })
+    endpoint = (
+        os.getenv('OTEL_EXPORTER_OTLP_TRACES_ENDPOINT')
+        or os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT')
+        or 'http://otel-collector.monitoring.svc.cluster.local:4318/v1/traces'
+    )
+    provider = TracerProvider(resource=resource)
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+    trace.set_tracer_provider(provider)
+    logger.info(f"OpenTelemetry tracing enabled, exporting to {endpoint}")
+    return True
+
+
+def shutdown_tracing() -> None:
+    """Flush pending spans"""
+    provider = trace.get_tracer_provider()
+    if hasattr(provider, 'shutdown'):
+        provider.shutdown()
+
+
+@contextmanager
+def server_span(method: str, metadata: Dict[str, str]):
+    """Server span for an RPC, parented to the caller's traceparent if any"""
+    with _tracer.start_as_current_span(
+        f'{RPC_SERVICE}/{method}',
+        context=propagate.extract(metadata),
+        kind=trace.SpanKind.SERVER,
+        attributes={
+            'rpc.system': 'grpc',
+            'rpc.service': RPC_SERVICE,
+            'rpc.method': method,
+        },
+    ) as current:
+        yield current
+
+
+class TracingInterceptor(grpc.ServerInterceptor):
+    """Opens a server span around every RPC handler"""
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        method = handler_call_details.method.rsplit('/', 1)[-1]
+        metadata = {
+            key: value
+            for key, value in (handler_call_details.invocation_metadata or ())
+            if isinstance(value, str)
+        }
+
+        def unary(behavior):
+            def traced(request_or_iterator, context):
+                with server_span(method, metadata):
+                    return behavior(request_or_iterator, context)
+            return traced
+
+        def streaming(behavior):
+            def traced(request_or_iterator, context):
+                with server_span(method, metadata):
+                    yield from behavior(request_or_iterator, context)
+            return traced
+
+        if handler.unary_unary:
+            return handler._replace(unary_unary=unary(handler.unary_unary))
+        if handler.stream_unary:
+            return handler._replace(stream_unary=unary(handler.stream_unary))
+        if handler.unary_stream:
+            return handler._replace(unary_stream=streaming(handler.unary_stream))
+        if handler.stream_stream:
+            return handler._replace(stream_stream=streaming(handler.stream_stream))
+        return handler
+
+
+@contextmanager
+def consumer_span(name: str, carrier: Dict[str, str], **attributes):
+    """Consumer span for a stream message, parented to the producer's traceparent"""
+    with _tracer.start_as_current_span(
+        name,
+        context=propagate.extract(carrier),
+        kind=trace.SpanKind.CONSUMER,
+        attributes=attributes,
+    ) as current:
+        yield current
+
+
+def linked_span(name: str, carriers: List[Dict[str, str]], **attributes):
+    """Span over work for several messages, linked to each producer's trace"""
+    links = []
+    for carrier in carriers:
+        context = trace.get_current_span(propagate.extract(carrier)).get_span_context()
+        if context.is_valid:
+            links.append(trace.Link(context))
+    return _tracer.start_as_current_span(
+        f'intelligence.{name}', links=links, attributes=attributes)
+
+
+def inject_context() -> Dict[str, str]:
+    """W3C trace headers (traceparent, tracestate, baggage) of the current span"""
+    carrier: Dict[str, str] = {}
+    propagate.inject(carrier)
+    return carrier
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Child span of the current span"""
+    with _tracer.start_as_current_span(
+        f'intelligence.{name}', attributes=attributes
+    ) as current:
+        yield current
+
+
+@contextmanager
+def stage(name: str, trace_span: bool = True, **attributes):
+    """
+    Time one invocation of an analysis stage
+
+    Args:
+        name: Stage label of intelligence_stage_duration_seconds
+        trace_span: Also open a child span; disable for per-answer stages
+        **attributes: Span attributes
+    """
+    start = time.perf_counter()
+    try:
+        if trace_span:
+            with span(name, **attributes):
+                yield
+        else:
+            yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.STAGE_DURATION_SECONDS.labels(stage=name).observe(elapsed)
+        record_stage(name, elapsed)
+
+
+def record_inference(model: str, batch_size: int) -> None:
+    """Count one model invocation over `batch_size` inputs"""
+    metrics.MODEL_INFERENCES.labels(model=model).inc()
+    metrics.MODEL_BATCH_SIZE.labels(model=model).observe(batch_size)
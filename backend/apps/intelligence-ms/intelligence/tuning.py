@@ -0,0 +1,383 @@
+"""
+Calibration of torch threads, model batch sizes and analysis concurrency.
+
+The best settings depend on the node's cores and on the configured models, so
+they are measured rather than guessed: calibrate() times the sentiment and
+embedding models on synthetic answers over a grid of torch thread counts and
+batch sizes, then times concurrent analyses at the chosen settings. The result
+is saved as a JSON profile (TUNING_PROFILE_PATH) together with a fingerprint of
+the CPU and models it was measured on; later starts apply the profile while the
+fingerprint still matches. See scripts/calibrate.py.
+"""
+import json
+import logging
+import math
+import os
+import platform
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from . import config
+
+logger = logging.getLogger(__name__)
+
+PROFILE_VERSION = 1
+# Config attributes a profile sets, unless the environment sets them explicitly
+SETTINGS = (
+    'TORCH_THREADS',
+    'SENTIMENT_BATCH_SIZE',
+    'EMBEDDING_BATCH_SIZE',
+    'ANALYSIS_CONCURRENCY',
+)
+# A setting within this fraction of the best throughput counts as a tie,
+# and ties go to the cheaper setting (fewer threads, smaller batches)
+TIE_TOLERANCE = 0.05
+
+_SUBJECTS = [
+    'The onboarding', 'The new dashboard', 'Customer support', 'The mobile app',
+    'The pricing page', 'Checkout', 'The weekly meeting', 'Search', 'The release notes',
+]
+_OPINIONS = [
+    'is fast and easy to use', 'was really helpful', 'feels confusing', 'is too slow',
+    'works as expected', 'keeps crashing', 'is fine', 'could explain things better',
+]
+_DETAILS = [
+    'especially on Mondays', 'compared to last year', 'for our whole team',
+    'when I use it on my phone', 'after the latest update', 'during busy hours',
+    'and I would like more examples', 'but the export takes a long time',
+]
+
+
+def available_cpus() -> int:
+    """Cores this process may use: its CPU affinity, capped by a cgroup v2 quota"""
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        if quota != 'max':
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+def fingerprint() -> Dict[str, Any]:
+    """What a profile was measured on; a profile is only applied where this matches"""
+    return {
+        'cpus': available_cpus(),
+        'machine': platform.machine(),
+        'cpu_model': _cpu_model(),
+        'torch': _torch_version(),
+        'sentiment_model': config.SENTIMENT_MODEL_ID,
+        'embedding_model': config.EMBEDDING_MODEL,
+    }
+
+
+def synthetic_texts(count: int, seed: int = 0) -> List[str]:
+    """English survey answers of one to three clauses, all distinct"""
+    rng = random.Random(seed)
+    texts = []
+    for index in range(count):
+        parts = [rng.choice(_SUBJECTS), rng.choice(_OPINIONS)]
+        parts += rng.sample(_DETAILS, rng.randint(0, 2))
+        texts.append(f"{' '.join(parts)} (#{index}).")
+    return texts
+
+
+def thread_candidates(cpus: int | None = None) -> List[int]:
+    """Powers of two up to the available cores, and the core count itself"""
+    cpus = cpus or available_cpus()
+    candidates = {cpus}
+    threads = 1
+    while threads < cpus:
+        candidates.add(threads)
+        threads *= 2
+    return sorted(candidates)
+
+
+def parse_sizes(spec: str) -> List[int]:
+    """Parse '8,16,32' into sorted distinct positive integers"""
+    return sorted({int(part) for part in spec.split(',') if part.strip() and int(part) > 0})
+
+
+def calibrate(
+    sentiment_analyzer,
+    idea_summarizer,
+    threads: Sequence[int] | None = None,
+    batch_sizes: Sequence[int] | None = None,
+    texts: int | None = None,
+    repeat: int | None = None,
+    concurrency: Sequence[int] | None = None,
+) -> Dict[str, Any]:
+    """
+    Measure the best settings for the loaded models on this node
+
+    Args:
+        sentiment_analyzer: SentimentAnalyzer with its models loaded
+        idea_summarizer: IdeaSummarizer with its embedding model loaded
+        threads: Torch thread counts to try (default: CALIBRATION_THREADS or thread_candidates())
+        batch_sizes: Batch sizes to try per model (default: CALIBRATION_BATCH_SIZES)
+        texts: Synthetic answers per measurement (default: CALIBRATION_TEXTS)
+        repeat: Timed runs per measurement after a warm-up run; the fastest counts
+        concurrency: Concurrent analyses to try (default: powers of two up to 2x the cores per thread count)
+
+    Returns:
+        A profile: fingerprint, chosen settings and every measurement
+
+    Model settings and torch threads are restored afterwards; apply the profile
+    with apply_profile().
+    """
+    threads = sorted(set(threads or parse_sizes(config.CALIBRATION_THREADS) or thread_candidates()))
+    batch_sizes = sorted(set(batch_sizes or parse_sizes(config.CALIBRATION_BATCH_SIZES)))
+    repeat = max(1, repeat or config.CALIBRATION_REPEAT)
+    corpus = synthetic_texts(max(1, texts or config.CALIBRATION_TEXTS))
+    saved = {name: getattr(config, name) for name in SETTINGS}
+    saved_threads = _get_threads()
+    started = time.perf_counter()
+
+    def sentiment(batch_size):
+        config.SENTIMENT_BATCH_SIZE = batch_size
+        return _throughput(lambda: sentiment_analyzer.analyze_batch(corpus), len(corpus), repeat)
+
+    def embedding(batch_size):
+        config.EMBEDDING_BATCH_SIZE = batch_size
+        return _throughput(lambda: idea_summarizer._embed_texts(corpus), len(corpus), repeat)
+
+    measurements: Dict[str, Any] = {'texts': len(corpus), 'repeat': repeat, 'models': [], 'concurrency': []}
+    try:
+        # Per thread count: the best batch size of each model, and the
+        # per-answer cost of running both at those batch sizes
+        candidates = []
+        for thread_count in threads:
+            _set_threads(thread_count)
+            rates = {
+                'sentiment': {size: sentiment(size) for size in batch_sizes},
+                'embedding': {size: embedding(size) for size in batch_sizes},
+            }
+            best = {model: _best(by_size) for model, by_size in rates.items()}
+            seconds_per_answer = sum(1.0 / rates[model][size] for model, size in best.items())
+            candidates.append((thread_count, best, seconds_per_answer))
+            measurements['models'].append({
+                'threads': thread_count,
+                'answers_per_second': {
+                    model: {str(size): round(rate, 2) for size, rate in by_size.items()}
+                    for model, by_size in rates.items()
+                },
+            })
+            logger.info(
+                'Calibration: %d threads, sentiment batch %d, embedding batch %d: %.1f answers/s',
+                thread_count, best['sentiment'], best['embedding'], 1.0 / seconds_per_answer)
+
+        fastest = min(cost for _, _, cost in candidates)
+        thread_count, best, _ = next(
+            candidate for candidate in candidates
+            if candidate[2] <= fastest * (1 + TIE_TOLERANCE)
+        )
+
+        # Concurrent analyses at the chosen settings. Sentiment calls are
+        # serialized, so extra slots overlap it with embedding and with the
+        # single-threaded parts of an analysis.
+        _set_threads(thread_count)
+        config.SENTIMENT_BATCH_SIZE = best['sentiment']
+        config.EMBEDDING_BATCH_SIZE = best['embedding']
+        if not concurrency:
+            limit = max(2, 2 * available_cpus() // thread_count)
+            concurrency = [1] + [slots for slots in (2, 4, 8, 16, 32) if slots <= limit]
+        job_rates = {}
+        for slots in sorted(set(concurrency)):
+            job_rates[slots] = _concurrent_throughput(
+                lambda: (sentiment_analyzer.analyze_batch(corpus), idea_summarizer._embed_texts(corpus)),
+                len(corpus), slots, repeat)
+            measurements['concurrency'].append(
+                {'slots': slots, 'answers_per_second': round(job_rates[slots], 2)})
+            logger.info('Calibration: %d concurrent analyses: %.1f answers/s', slots, job_rates[slots])
+        slots = _best(job_rates)
+    finally:
+        for name, value in saved.items():
+            setattr(config, name, value)
+        _set_threads(saved_threads)
+
+    measurements['seconds'] = round(time.perf_counter() - started, 1)
+    return {
+        'version': PROFILE_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'fingerprint': fingerprint(),
+        'settings': {
+            'TORCH_THREADS': thread_count,
+            'SENTIMENT_BATCH_SIZE': best['sentiment'],
+            'EMBEDDING_BATCH_SIZE': best['embedding'],
+            'ANALYSIS_CONCURRENCY': slots,
+        },
+        'measurements': measurements,
+    }
+
+
+def save_profile(profile: Dict[str, Any], path: str | None = None) -> str:
+    """Write a profile atomically; returns its path"""
+    path = path or config.TUNING_PROFILE_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(profile, f, indent=2)
+    os.replace(temporary, path)
+    return path
+
+
+def load_profile(path: str | None = None) -> Optional[Dict[str, Any]]:
+    """
+    Read a profile measured on this node and models
+
+    Returns None if there is none, it can't be read, or its fingerprint
+    no longer matches (different cores, CPU, torch or models).
+    """
+    path = path or config.TUNING_PROFILE_PATH
+    try:
+        with open(path) as f:
+            profile = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning('Ignoring unreadable tuning profile %s: %s', path, e)
+        return None
+    if not isinstance(profile, dict) or profile.get('version') != PROFILE_VERSION:
+        logger.warning('Ignoring tuning profile %s of an unsupported version', path)
+        return None
+    current = fingerprint()
+    stale = sorted(
+        key for key in current
+        if profile.get('fingerprint', {}).get(key) != current[key]
+    )
+    if stale:
+        logger.warning('Ignoring tuning profile %s measured on different %s',
+                       path, ', '.join(stale))
+        return None
+    return profile
+
+
+def apply_profile(profile: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Set the profile's settings in config and the torch thread count
+
+    Settings given as environment variables are kept. Call before creating the
+    scheduler, which reads ANALYSIS_CONCURRENCY once.
+
+    Returns:
+        The settings taken from the profile
+    """
+    applied = {}
+    for name, value in ((profile or {}).get('settings') or {}).items():
+        if name in SETTINGS and name not in os.environ:
+            setattr(config, name, int(value))
+            applied[name] = int(value)
+    if config.TORCH_THREADS > 0:
+        _set_threads(config.TORCH_THREADS)
+    return applied
+
+
+def tune_on_startup(sentiment_analyzer, idea_summarizer) -> Dict[str, int]:
+    """
+    Load, or calibrate and save, the tuning profile and apply it
+
+    Calibrates according to CALIBRATE_ON_STARTUP; a failed calibration is
+    logged and the service starts with the configured settings.
+
+    Returns:
+        The settings taken from the profile
+    """
+    mode = config.CALIBRATE_ON_STARTUP
+    profile = load_profile() if mode != 'always' else None
+    if profile is None and mode in ('missing', 'always'):
+        logger.info('Calibrating model settings, this takes a few minutes')
+        try:
+            profile = calibrate(sentiment_analyzer, idea_summarizer)
+            logger.info('Saved tuning profile to %s', save_profile(profile))
+        except Exception:
+            logger.exception('Calibration failed; starting with the configured settings')
+            profile = None
+    applied = apply_profile(profile)
+    if applied:
+        logger.info('Applied tuning profile: %s',
+                    ', '.join(f'{name}={value}' for name, value in applied.items()))
+    return applied
+
+
+def _throughput(run: Callable[[], Any], answers: int, repeat: int) -> float:
+    """Answers per second of the fastest of `repeat` runs after a warm-up run"""
+    run()
+    fastest = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        fastest = min(fastest, time.perf_counter() - start)
+    return answers / max(fastest, 1e-9)
+
+
+def _concurrent_throughput(run: Callable[[], Any], answers: int, slots: int, repeat: int) -> float:
+    """Answers per second of `slots` threads each doing `run` once"""
+    def once():
+        errors = []
+
+        def worker():
+            try:
+                run()
+            except Exception as e:
+                errors.append(e)
+
+        workers = [threading.Thread(target=worker) for _ in range(slots)]
+        for worker_thread in workers:
+            worker_thread.start()
+        for worker_thread in workers:
+            worker_thread.join()
+        if errors:
+            raise errors[0]
+
+    return _throughput(once, answers * slots, repeat)
+
+
+def _best(rates: Dict[int, float]) -> int:
+    """Smallest setting within TIE_TOLERANCE of the highest rate"""
+    highest = max(rates.values())
+    return min(setting for setting, rate in rates.items() if rate >= highest * (1 - TIE_TOLERANCE))
+
+
+def _get_threads() -> int:
+    try:
+        import torch
+    except ImportError:
+        return 0
+    return torch.get_num_threads()
+
+
+def _set_threads(threads: int) -> None:
+    if threads <= 0:
+        return
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+
+
+def _torch_version() -> str:
+    try:
+        import torch
+    except ImportError:
+        return ''
+    return torch.__version__
+
+
+def _cpu_model() -> str:
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor()
@@ -0,0 +1,259 @@
+"""
+Write-behind persistence for analysis results.
+"""
+import itertools
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Mapping, Tuple
+
+from pymongo.errors import PyMongoError
+
+from . import config
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisWriteBehind:
+    """Buffers analysis upserts and flushes them as unordered bulk writes"""
+
+    def __init__(
+        self,
+        writer: Callable[[List[Dict[str, Any]], Mapping[bytes, str]], Any],
+        on_flush: Callable[[List[str]], Any] | None = None,
+        queue_size: int | None = None,
+        batch_size: int | None = None,
+        flush_interval_ms: int | None = None,
+        max_retries: int | None = None,
+        retry_backoff_ms: int | None = None,
+        queue_timeout_ms: int | None = None,
+    ):
+        """
+        Initialize the write-behind buffer and start the flush thread
+
+        Args:
+            writer: Bulk-upserts analysis documents with their answer texts;
+                also used synchronously after close() and when the queue
+                stays full
+            on_flush: Called with the question IDs of every finished flush
+            queue_size: Maximum number of buffered analyses
+            batch_size: Flush as soon as this many analyses are buffered
+            flush_interval_ms: Flush at least this often while data is pending
+            max_retries: Retries per batch before it is dropped
+            retry_backoff_ms: Base delay between retries (doubled each attempt)
+            queue_timeout_ms: Longest wait for room in a full queue before an
+                analysis is written synchronously
+        """
+        self._writer = writer
+        self._on_flush = on_flush
+        self._batch_size = max(1, batch_size or config.ANALYSIS_WRITE_BATCH_SIZE)
+        self._flush_interval = max(
+            0.01,
+            (flush_interval_ms or config.ANALYSIS_WRITE_FLUSH_INTERVAL_MS) / 1000,
+        )
+        self._max_retries = max(
+            0,
+            config.ANALYSIS_WRITE_MAX_RETRIES if max_retries is None else max_retries,
+        )
+        self._retry_backoff = (
+            config.ANALYSIS_WRITE_RETRY_BACKOFF_MS
+            if retry_backoff_ms is None
+            else retry_backoff_ms
+        ) / 1000
+        self._queue_timeout = (
+            config.ANALYSIS_WRITE_QUEUE_TIMEOUT_MS
+            if queue_timeout_ms is None
+            else queue_timeout_ms
+        ) / 1000
+        self._queue: queue.Queue = queue.Queue(
+            maxsize=max(1, queue_size or config.ANALYSIS_WRITE_QUEUE_SIZE))
+        self._stopping = threading.Event()
+        # Held across the stopping check and the put, so nothing is queued
+        # after close() started the final drain
+        self._submit_lock = threading.Lock()
+        # Held around every write. _written_sync maps a question to the
+        # sequence number of its last synchronous write; queued analyses of
+        # that question with a lower number are skipped.
+        self._write_lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._written_sync: Dict[str, int] = {}
+        metrics.ANALYSIS_WRITE_QUEUE_DEPTH.set_function(self._queue.qsize)
+
+        self._thread = threading.Thread(
+            target=self._run, name='analysis-write-behind', daemon=True)
+        self._thread.start()
+
+    def submit(self, analysis_data: Dict[str, Any], texts: Mapping[bytes, str] | None = None) -> None:
+        """
+        Queue an analysis for the next bulk flush
+
+        Waits up to queue_timeout_ms while the queue is full, then writes the
+        analysis synchronously; older queued analyses of the same question are
+        then skipped, so they cannot overwrite it. After close() analyses are
+        written synchronously.
+
+        Args:
+            analysis_data: Analysis document, keyed by question_id
+            texts: Answer texts by hash, written before the document
+        """
+        texts = texts or {}
+        deadline = time.monotonic() + self._queue_timeout
+        if self._submit_lock.acquire(timeout=self._queue_timeout):
+            try:
+                if not self._stopping.is_set() and self._put(analysis_data, texts, deadline):
+                    return
+            finally:
+                self._submit_lock.release()
+        if not self._stopping.is_set():
+            logger.warning(
+                f"Write-behind queue still full after {self._queue_timeout:.1f}s; writing "
+                f"analysis {analysis_data.get('question_id')} synchronously"
+            )
+        self._write_sync(analysis_data, texts)
+
+    def _put(self, analysis_data, texts, deadline: float) -> bool:
+        item = (next(self._sequence), analysis_data, texts)
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+        metrics.ANALYSIS_WRITE_FAILURES.labels(reason='queue_full').inc()
+        logger.warning(
+            f"Write-behind queue full; waiting to queue analysis "
+            f"{analysis_data.get('question_id')}"
+        )
+        try:
+            self._queue.put(item, timeout=max(0.0, deadline - time.monotonic()))
+            return True
+        except queue.Full:
+            return False
+
+    def _write_sync(self, analysis_data, texts) -> None:
+        question_id = analysis_data['question_id']
+        try:
+            with self._write_lock:
+                # Analyses queued from here on are newer and still written
+                self._written_sync[question_id] = next(self._sequence)
+                self._writer([analysis_data], texts)
+        finally:
+            self._notify([question_id])
+
+    def close(self, timeout: float = 30.0) -> None:
+        """
+        Stop the flush thread after draining everything still queued
+
+        Args:
+            timeout: Seconds to wait for the final flush
+        """
+        with self._submit_lock:
+            self._stopping.set()
+        self._thread.join(timeout=timeout)
+        if self._thread.is_alive():
+            logger.error(
+                f"Write-behind flush did not finish within {timeout:.1f}s; "
+                f"{self._queue.qsize()} analyses may be lost"
+            )
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch:
+                # Nothing else drains the queue, so no error may end this
+                # thread: submit() would block forever once the queue fills.
+                try:
+                    self._flush(batch)
+                except Exception as e:
+                    metrics.ANALYSIS_WRITE_FAILURES.labels(reason='dropped').inc(len(batch))
+                    logger.error(
+                        f"Dropping {len(batch)} analyses after an unexpected write error: {e} "
+                        f"(questions: {[item[1].get('question_id') for item in batch]})",
+                        exc_info=True,
+                    )
+            elif self._stopping.is_set():
+                return
+
+    def _next_batch(self) -> List[Tuple[int, Dict[str, Any], Mapping[bytes, str]]]:
+        batch: List[Tuple[int, Dict[str, Any], Mapping[bytes, str]]] = []
+        deadline = time.monotonic() + self._flush_interval
+        while len(batch) < self._batch_size:
+            if self._stopping.is_set():
+                timeout = 0
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+            try:
+                if timeout:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: List[Tuple[int, Dict[str, Any], Mapping[bytes, str]]]) -> None:
+        question_ids = list(dict.fromkeys(item[1].get('question_id') for item in batch))
+        try:
+            with self._write_lock:
+                self._write_batch(batch)
+        finally:
+            self._notify(question_ids)
+
+    def _write_batch(self, batch: List[Tuple[int, Dict[str, Any], Mapping[bytes, str]]]) -> None:
+        # Unordered bulk writes give no ordering guarantee, so keep only the
+        # latest analysis per question within a batch.
+        latest: Dict[str, Dict[str, Any]] = {}
+        texts: Dict[bytes, str] = {}
+        for sequence, analysis_data, analysis_texts in batch:
+            question_id = analysis_data['question_id']
+            if sequence < self._written_sync.get(question_id, -1):
+                continue
+            latest[question_id] = analysis_data
+            texts.update(analysis_texts)
+        # Sequence numbers are taken under the submit lock right before the
+        # put, so the queue is in sequence order: once a newer analysis was
+        # dequeued, no analysis older than a synchronous write is left
+        newest = batch[-1][0]
+        for question_id, sequence in list(self._written_sync.items()):
+            if sequence < newest:
+                del self._written_sync[question_id]
+        documents = list(latest.values())
+        if not documents:
+            return
+
+        metrics.ANALYSIS_WRITE_BATCH_SIZE.observe(len(documents))
+        start = time.perf_counter()
+        try:
+            for attempt in range(self._max_retries + 1):
+                try:
+                    self._writer(documents, texts)
+                    return
+                except PyMongoError as e:
+                    if attempt >= self._max_retries:
+                        metrics.ANALYSIS_WRITE_FAILURES.labels(
+                            reason='dropped').inc(len(documents))
+                        logger.error(
+                            f"Dropping {len(documents)} analyses after {attempt + 1} attempts: "
+                            f"{e} (questions: {list(latest)})"
+                        )
+                        return
+                    metrics.ANALYSIS_WRITE_FAILURES.labels(reason='retry').inc()
+                    logger.warning(
+                        f"Bulk analysis write failed "
+                        f"(attempt {attempt + 1}/{self._max_retries + 1}): {e}"
+                    )
+                    time.sleep(self._retry_backoff * (2 ** attempt))
+        finally:
+            metrics.ANALYSIS_WRITE_FLUSH_SECONDS.observe(
+                time.perf_counter() - start)
+
+    def _notify(self, question_ids: List[str]) -> None:
+        if self._on_flush is None or not question_ids:
+            return
+        try:
+            self._on_flush(question_ids)
+        except Exception as e:
+            logger.error(f"Write-behind flush callback failed: {e}", exc_info=True)
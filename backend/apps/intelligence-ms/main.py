@@ -5,6 +5,7 @@ Provides gRPC endpoints for sentiment analysis and idea extraction
 import sys
 import os
 import logging
+import signal
 from concurrent import futures
 import grpc
 from dotenv import load_dotenv
@@ -39,33 +40,122 @@ def main():
         if SCRIPT_DIR not in sys.path:
             sys.path.insert(0, SCRIPT_DIR)
         
-        # Import after proto generation and path setup
-        logger.info("Importing modules...")
-        from intelligence.servicer import AnalyticsServicer
-        from intelligence.sentiment_analyzer import SentimentAnalyzer
-        from intelligence.idea_summarizer import IdeaSummarizer
-        from intelligence.database import MongoDBManager
-        from intelligence import analytics_pb2_grpc
-        
+        # Import after proto generation and path setup. Heavy ML libraries
+        # (torch, transformers, sentence-transformers, sklearn) are imported
+        # lazily by the model loaders below, so they load in parallel too.
+        from intelligence.startup import StartupTimer
+        timer = StartupTimer()
+        with timer.phase('imports'):
+            from intelligence.servicer import AnalyticsServicer
+            from intelligence.sentiment_analyzer import SentimentAnalyzer
+            from intelligence.idea_summarizer import IdeaSummarizer
+            from intelligence.database import MongoDBManager
+            from intelligence.metrics import start_metrics_server
+            from intelligence.similarity_index import SimilarityIndex
+            from intelligence.telemetry import TracingInterceptor, init_tracing
+            from intelligence.profiling import (
+                Profiling,
+                install_signal_handlers,
+                start_admin_server,
+            )
+            from intelligence.idea_catalog import IdeaCatalog
+            from intelligence.scheduler import FairScheduler
+            from intelligence.lanes import LaneInterceptor, RpcLanes
+            from intelligence.tuning import tune_on_startup
+            from intelligence import config
+            from intelligence import analytics_pb2_grpc
+
+        start_metrics_server()
+        init_tracing()
+
         # Initialize components
         logger.info("Initializing Intelligence Microservice...")
-        
-        # Initialize sentiment analyzer
-        sentiment_analyzer = SentimentAnalyzer()
-        logger.info("Sentiment analyzer initialized")
+        sentiment_analyzer = SentimentAnalyzer(eager=False)
+        idea_summarizer = IdeaSummarizer(eager=False)
 
-        idea_summarizer = IdeaSummarizer()
-        logger.info("Idea summarizer initialized")
-        
-        # Initialize database manager
-        db_manager = MongoDBManager()
-        logger.info("Database manager initialized")
-        
-        # Create gRPC server
-        server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+        # Admin profiling endpoints and signals (disabled unless configured)
+        profiling = Profiling(lambda: {
+            **sentiment_analyzer.loaded_models(),
+            **idea_summarizer.loaded_models(),
+        })
+        start_admin_server(profiling)
+        install_signal_handlers(profiling)
+
+        similarity_index = SimilarityIndex() if config.SIMILARITY_INDEX_ENABLED else None
+
+        # Load models, connect to MongoDB and map the similarity index concurrently
+        tasks = {
+            **sentiment_analyzer.loaders(),
+            **idea_summarizer.loaders(),
+            'mongodb': MongoDBManager,
+        }
+        if similarity_index is not None:
+            tasks['similarity_index'] = similarity_index.load
+        results = timer.run_parallel(tasks)
+        db_manager = results['mongodb']
+        logger.info("Models and database manager initialized")
+
+        # Torch threads, batch sizes and analysis slots from the tuning
+        # profile, calibrated first if CALIBRATE_ON_STARTUP asks for it.
+        # Must run before the scheduler is created.
+        with timer.phase('tuning'):
+            tune_on_startup(sentiment_analyzer, idea_summarizer)
+
+        if similarity_index is not None:
+            similarity_index.start(db_manager)
+            logger.info("Similarity index initialized")
+
+        idea_catalog = None
+        if config.IDEA_CANONICALIZATION_ENABLED:
+            with timer.phase('idea_catalog'):
+                idea_catalog = IdeaCatalog(db_manager.db['ideas'])
+            logger.info("Idea catalog initialized")
         
         # Create the servicer and dynamically make it inherit from the gRPC base class
-        servicer = AnalyticsServicer(db_manager, sentiment_analyzer, idea_summarizer)
+        servicer = AnalyticsServicer(
+            db_manager,
+            sentiment_analyzer,
+            idea_summarizer,
+            similarity_index=similarity_index,
+            idea_catalog=idea_catalog,
+            scheduler=FairScheduler() if config.SCHEDULER_ENABLED else None,
+        )
+
+        stream_worker = None
+        if config.SERVICE_MODE in ('stream', 'both'):
+            from intelligence.stream_worker import StreamWorker
+            stream_worker = StreamWorker.from_config(
+                servicer, sentiment_analyzer, idea_summarizer)
+
+        if config.SERVICE_MODE == 'stream':
+            # Stop after the current batch on SIGTERM
+            signal.signal(
+                signal.SIGTERM,
+                lambda signum, frame: stream_worker.stop(),
+            )
+            timer.log_summary()
+            logger.info("Intelligence Microservice consuming the request stream")
+            stream_worker.run()
+            return
+
+        # Create gRPC server. Keep more threads than analysis slots so jobs
+        # from every form reach the scheduler queue instead of the gRPC one,
+        # and one per lane slot so heavy calls cannot take every thread.
+        max_workers = config.GRPC_MAX_WORKERS
+        if config.SCHEDULER_ENABLED:
+            max_workers = max(
+                max_workers,
+                config.ANALYSIS_CONCURRENCY * config.SCHEDULER_THREADS_PER_SLOT,
+            )
+        interceptors = [TracingInterceptor()]
+        if config.RPC_LANES_ENABLED:
+            lanes = RpcLanes.from_config()
+            max_workers = max(max_workers, lanes.thread_budget())
+            interceptors.append(LaneInterceptor(lanes))
+        server = grpc.server(
+            futures.ThreadPoolExecutor(max_workers=max_workers),
+            interceptors=interceptors,
+        )
         
         # Register the servicer with the server
         analytics_pb2_grpc.add_AnalyticsServiceServicer_to_server(servicer, server)
@@ -74,13 +164,23 @@ def main():
         grpc_port = os.getenv('GRPC_PORT', '50051')
         server.add_insecure_port(f'0.0.0.0:{grpc_port}')
         
+        # Stop gracefully on SIGTERM (Kubernetes/Knative scale-down)
+        signal.signal(
+            signal.SIGTERM,
+            lambda signum, frame: server.stop(grace=5),
+        )
+
         # Start server
         server.start()
+        if stream_worker is not None:
+            stream_worker.start()
+        timer.log_summary()
         logger.info(f"Intelligence Microservice started on port {grpc_port}")
         logger.info("Press CTRL+C to stop the server")
         
         # Keep the server running
         server.wait_for_termination()
+        logger.info("Server stopped")
     
     except KeyboardInterrupt:
         logger.info("Shutting down server...")
@@ -92,6 +192,18 @@ def main():
         logger.error(f"Fatal error: {str(e)}", exc_info=True)
         sys.exit(1)
 
+    finally:
+        if locals().get('stream_worker') is not None:
+            stream_worker.stop()
+        # Snapshot the similarity index and flush write-behind analyses before exiting
+        if locals().get('similarity_index') is not None:
+            similarity_index.stop()
+        if 'db_manager' in locals():
+            db_manager.close()
+        if 'init_tracing' in locals():
+            from intelligence.telemetry import shutdown_tracing
+            shutdown_tracing()
+
 
 if __name__ == '__main__':
     main()
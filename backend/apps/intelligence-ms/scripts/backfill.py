@@ -0,0 +1,485 @@
+"""Re-run the analysis pipeline over historical questions.
+
+Usage:
+    python scripts/backfill.py                        # analyses not produced by INTELLIGENCE_MODEL_VERSION
+    python scripts/backfill.py --model-changed sentiment  # analyses scored by another sentiment model
+    python scripts/backfill.py --all --workers 4 --rate 20
+    python scripts/backfill.py --source dump.jsonl --checkpoint .cache/dump-backfill.json
+    python scripts/backfill.py --resume               # continue after the last checkpoint
+
+Questions are read from the `analyses` collection (in question_id order) or
+from a JSONL dump ({"question_id", "question_text", "answer_text"} per line,
+the test_client.py replay format). Worker processes each load the models once
+and analyze chunks of questions with one batched sentiment and embedding pass
+per chunk. The parent merges cluster summaries into the idea catalog and writes
+the documents with unordered bulk upserts. Documents keep the timestamp, and so
+the monthly bucket, of the analysis they replace; the rollups of closed buckets
+they land in are recomputed. After every bulk write the position of the last
+written question goes to --checkpoint, so --resume restarts there.
+Documents record the INTELLIGENCE_MODEL_VERSION and the models (see
+config.ANALYSIS_MODELS) they were produced with; the default version is derived
+from the models, so changing one selects every analysis again. --model-changed
+narrows that to analyses whose given model differs from the configured one.
+Questions that fail, alone or with their whole chunk, are logged and listed in
+the checkpoint; --resume retries them before continuing. A later run without
+--resume also picks them up again because their stored model version is still
+the old one.
+"""
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(SCRIPT_DIR)
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
+
+from intelligence import config  # noqa: E402
+
+logger = logging.getLogger('backfill')
+
+MONGO_PAGE_SIZE = 500
+
+# Per-process pipeline, built by _init_worker
+_servicer = None
+_reuse = False
+
+
+def _init_worker(torch_threads, reuse):
+    global _servicer, _reuse
+
+    logging.basicConfig(level=logging.WARNING)
+    if torch_threads:
+        try:
+            import torch
+
+            torch.set_num_threads(torch_threads)
+        except ImportError:
+            pass
+
+    from intelligence.database import MongoDBManager
+    from intelligence.idea_summarizer import IdeaSummarizer
+    from intelligence.sentiment_analyzer import SentimentAnalyzer
+    from intelligence.servicer import AnalyticsServicer
+
+    if reuse:
+        # load_previous() and the reuse of its results are gated on these
+        config.INCREMENTAL_ANALYSIS_ENABLED = True
+        config.INCREMENTAL_CLUSTERING_ENABLED = True
+    # Stored analyses are only read when their results may be reused; the
+    # parent process does all writes.
+    _servicer = AnalyticsServicer(
+        MongoDBManager() if reuse else None,
+        SentimentAnalyzer(),
+        IdeaSummarizer(),
+    )
+    _reuse = reuse
+
+
+def _analyze_chunk(questions):
+    """Analyze a chunk of questions; returns (question_id, document, error) per question."""
+    previous = [
+        _servicer.load_previous(question['question_id']) if _reuse else {}
+        for question in questions
+    ]
+    try:
+        sentiments, known_embeddings = _servicer.prepare_batch(
+            [question['answers'] for question in questions], previous)
+    except Exception:
+        logging.getLogger('backfill').exception('Batched pass failed; analyzing one by one')
+        sentiments, known_embeddings = [None] * len(questions), None
+
+    results = []
+    for position, question in enumerate(questions):
+        try:
+            analysis_data, _, _ = _servicer.analyze(
+                question['question_id'],
+                question['question_text'],
+                question['answers'],
+                sentiments=sentiments[position],
+                known_embeddings=known_embeddings,
+                previous=previous[position],
+            )
+            if question.get('timestamp') is not None:
+                analysis_data['timestamp'] = question['timestamp']
+            results.append((question['question_id'], analysis_data, None))
+        except Exception as e:
+            results.append((question['question_id'], None, str(e)))
+    return results
+
+
+def stale_filter(include_current=False, model_changed=()):
+    """Mongo filter on analyses that need re-analysis.
+
+    By default these are analyses of another model version. With model_changed
+    (keys of config.ANALYSIS_MODELS) only analyses whose stored model under any
+    of those keys differs from the configured one, or is not recorded, match.
+    """
+    if model_changed:
+        return {'$or': [
+            {f'models.{key}': {'$ne': config.ANALYSIS_MODELS[key]}} for key in model_changed
+        ]}
+    if include_current:
+        return {}
+    return {'model_version': {'$ne': config.MODEL_VERSION}}
+
+
+def mongo_questions(db, query, after=None, include_current=False, model_changed=()):
+    """Yield (position, question) from stored analyses in question_id order."""
+    from intelligence.analysis_format import ANSWER_TEXTS_COLLECTION, expand_analyses
+
+    base = {'$and': [dict(query), stale_filter(include_current, model_changed)]}
+    # Archived analyses keep no answers to re-analyze
+    base['archived'] = {'$ne': True}
+    while True:
+        page_query = dict(base)
+        if after is not None:
+            page_query['question_id'] = {'$gt': after}
+        page = list(
+            db['analyses']
+            .find(page_query, {
+                '_id': 0,
+                'question_id': 1,
+                'question_text': 1,
+                'timestamp': 1,
+                'format_version': 1,
+                'answers.answer_text': 1,
+                'answer_hashes': 1,
+                'sentiment_scores': 1,
+                'sentiment_labels': 1,
+                'label_names': 1,
+            })
+            .sort('question_id', 1)
+            .limit(MONGO_PAGE_SIZE)
+        )
+        if not page:
+            return
+        for doc in expand_analyses(page, db[ANSWER_TEXTS_COLLECTION]):
+            after = doc['question_id']
+            yield after, {
+                'question_id': doc['question_id'],
+                'question_text': doc.get('question_text') or '',
+                'answers': [answer.get('answer_text') or '' for answer in doc.get('answers') or []],
+                'timestamp': doc.get('timestamp'),
+            }
+
+
+def jsonl_questions(path, after=None):
+    """Yield (line number, question) from a JSONL dump, skipping lines up to `after`."""
+    with open(path) as handle:
+        for line_number, line in enumerate(handle, start=1):
+            if after is not None and line_number <= after:
+                continue
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            answers = record.get('answer_text', record.get('answers', []))
+            if isinstance(answers, str):
+                answers = [answers]
+            yield line_number, {
+                'question_id': record.get('question_id') or record.get('questionId', ''),
+                'question_text': record.get('question_text') or record.get('questionText', ''),
+                'answers': answers,
+            }
+
+
+class Throttle:
+    """Spaces out questions to at most `rate` per second (0 = unlimited)."""
+
+    def __init__(self, rate):
+        self.period = 1.0 / rate if rate > 0 else 0.0
+        self.next_at = time.monotonic()
+
+    def wait(self, count=1):
+        if not self.period:
+            return
+        delay = self.next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_at = max(self.next_at, time.monotonic() - self.period) + count * self.period
+
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Checkpoint:
+    """Position of the last question whose result was written, and the questions to retry."""
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.position = None
+        self.written = 0
+        self.failed = 0
+        self.failed_questions = set()
+
+    def load(self):
+        with open(self.path) as handle:
+            data = json.load(handle)
+        if data.get('source') != self.source:
+            raise SystemExit(
+                f"Checkpoint {self.path} is for source {data.get('source')!r}, not {self.source!r}")
+        if data.get('model_version') != config.MODEL_VERSION:
+            changed = sorted(
+                key for key, model in config.ANALYSIS_MODELS.items()
+                if (data.get('models') or {}).get(key) != model
+            )
+            logger.warning(
+                'Checkpoint was written for model version %s; now %s (changed models: %s)',
+                data.get('model_version'), config.MODEL_VERSION, ', '.join(changed) or 'none')
+        self.position = data.get('position')
+        self.written = data.get('written', 0)
+        self.failed = data.get('failed', 0)
+        self.failed_questions = set(data.get('failed_questions') or [])
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump({
+                'source': self.source,
+                'position': self.position,
+                'written': self.written,
+                'failed': self.failed,
+                'failed_questions': sorted(self.failed_questions),
+                'model_version': config.MODEL_VERSION,
+                'models': config.ANALYSIS_MODELS,
+                'updated_at': datetime.now(timezone.utc).isoformat(),
+            }, handle, indent=2)
+        os.replace(temporary, self.path)
+
+
+class Writer:
+    """Canonicalizes ideas and bulk-upserts analysis documents."""
+
+    def __init__(self, db_manager, idea_catalog, dry_run):
+        self.db_manager = db_manager
+        self.db = db_manager.db
+        self.idea_catalog = idea_catalog
+        self.dry_run = dry_run
+
+    def write(self, documents):
+        if not documents or self.dry_run:
+            return
+        if self.idea_catalog is not None:
+            self._canonicalize(documents)
+        # Documents without a timestamp (JSONL sources) land in the current bucket
+        self.db_manager.save_analyses(documents)
+        self._recompute_closed(documents)
+
+    def _recompute_closed(self, documents):
+        # Re-analyses replace documents in place, so a closed bucket's rollup
+        # still counts their old results until it is recomputed
+        from intelligence.partitions import bucket_of, close_bucket, closed_buckets
+
+        buckets = {
+            bucket_of(document['timestamp'])
+            for document in documents
+            if document.get('timestamp') is not None
+        }
+        for bucket in sorted(buckets.intersection(closed_buckets(self.db))):
+            close_bucket(self.db, bucket)
+
+    def _canonicalize(self, documents):
+        # Idea frequencies are moved by save_analyses() once the documents are stored
+        from intelligence.embeddings import unpack_vector
+
+        for document in documents:
+            stored_clusters = document['cluster_summaries']
+            clusters = [
+                {**cluster, 'centroid': unpack_vector(cluster.get('centroid'))}
+                for cluster in stored_clusters
+            ]
+            try:
+                self.idea_catalog.canonicalize(clusters)
+            except Exception as e:
+                logger.warning('Could not canonicalize ideas of %s: %s', document['question_id'], e)
+                continue
+            for stored_cluster, cluster in zip(stored_clusters, clusters):
+                if cluster.get('idea_id') is not None:
+                    stored_cluster['idea_id'] = cluster['idea_id']
+
+
+def run(args):
+    source = 'mongo' if args.source == 'mongo' else os.path.abspath(args.source)
+    checkpoint = Checkpoint(args.checkpoint, source)
+    if args.resume:
+        if os.path.exists(args.checkpoint):
+            checkpoint.load()
+            logger.info('Resuming after %r (%d written)', checkpoint.position, checkpoint.written)
+        else:
+            logger.info('No checkpoint at %s; starting from the beginning', args.checkpoint)
+
+    from intelligence.database import MongoDBManager
+
+    db_manager = MongoDBManager()
+    idea_catalog = None
+    if config.IDEA_CANONICALIZATION_ENABLED and not args.dry_run:
+        from intelligence.idea_catalog import IdeaCatalog
+
+        idea_catalog = IdeaCatalog(db_manager.db['ideas'])
+    writer = Writer(db_manager, idea_catalog, args.dry_run)
+
+    retry = sorted(checkpoint.failed_questions)
+    if source == 'mongo':
+        query = json.loads(args.query)
+        questions = mongo_questions(
+            db_manager.db, query, checkpoint.position, args.all, args.model_changed)
+        retried = mongo_questions(
+            db_manager.db, {'$and': [query, {'question_id': {'$in': retry}}]},
+            None, args.all, args.model_changed) if retry else ()
+    else:
+        questions = jsonl_questions(source, checkpoint.position)
+        retried = (
+            (position, question)
+            for position, question in jsonl_questions(source)
+            if position <= checkpoint.position and question['question_id'] in checkpoint.failed_questions
+        ) if retry else ()
+    if retry:
+        logger.info('Retrying %d failed questions first', len(retry))
+    # Retried questions lie before the checkpoint, so they never move it
+    questions = itertools.chain(((None, question) for _, question in retried), questions)
+
+    throttle = Throttle(args.rate)
+
+    def throttled():
+        for count, item in enumerate(questions):
+            if args.limit and count >= args.limit:
+                return
+            throttle.wait()
+            yield item
+
+    workers = max(1, args.workers)
+    torch_threads = args.torch_threads or max(1, (os.cpu_count() or 1) // workers)
+    started = time.monotonic()
+    buffered = []
+    # Position of the last chunk whose results are buffered or recorded as failed
+    handled = None
+    analyzed = 0
+    last_report = started
+
+    def flush():
+        nonlocal buffered
+        documents, buffered = buffered, []
+        if documents:
+            # A failed write leaves the checkpoint before these documents
+            writer.write(documents)
+            checkpoint.written += len(documents)
+            checkpoint.failed_questions.difference_update(
+                document['question_id'] for document in documents)
+        if not args.dry_run:
+            if handled is not None:
+                checkpoint.position = handled
+            checkpoint.save()
+
+    def handle(position, question_ids, future):
+        nonlocal analyzed, handled, last_report
+        try:
+            results = future.result()
+        except Exception as e:
+            logger.error('Chunk of %d questions failed: %s', len(question_ids), e)
+            results = [(question_id, None, str(e)) for question_id in question_ids]
+        for question_id, document, error in results:
+            analyzed += 1
+            if error:
+                checkpoint.failed += 1
+                checkpoint.failed_questions.add(question_id)
+                logger.error('Question %s failed: %s', question_id, error)
+            else:
+                buffered.append(document)
+        if position is not None:
+            handled = position
+        if len(buffered) >= args.write_batch:
+            flush()
+        if time.monotonic() - last_report >= args.report_interval:
+            last_report = time.monotonic()
+            elapsed = last_report - started
+            logger.info('%d analyzed, %d written, %d failed (%.1f questions/s)',
+                        analyzed, checkpoint.written, checkpoint.failed, analyzed / elapsed)
+
+    logger.info('Backfilling %s with %d workers x %d torch threads, model version %s',
+                source, workers, torch_threads, config.MODEL_VERSION)
+    # Results are consumed in submission order so the checkpoint never
+    # passes a question that is still being analyzed.
+    window = deque()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(torch_threads, args.reuse),
+    ) as pool:
+        try:
+            for chunk in chunked(throttled(), max(1, args.batch_questions)):
+                questions_of_chunk = [question for _, question in chunk]
+                window.append((
+                    chunk[-1][0],
+                    [question['question_id'] for question in questions_of_chunk],
+                    pool.submit(_analyze_chunk, questions_of_chunk),
+                ))
+                while len(window) > workers * 2:
+                    handle(*window.popleft())
+            while window:
+                handle(*window.popleft())
+        except KeyboardInterrupt:
+            logger.warning('Interrupted; writing completed results')
+            for _, _, future in window:
+                future.cancel()
+        flush()
+
+    elapsed = time.monotonic() - started
+    logger.info('Done: %d analyzed, %d written, %d failed in %.1fs (%.1f questions/s)',
+                analyzed, checkpoint.written, checkpoint.failed, elapsed,
+                analyzed / elapsed if elapsed > 0 else 0.0)
+    if checkpoint.failed_questions:
+        logger.warning('%d questions left to retry with --resume', len(checkpoint.failed_questions))
+    return 1 if checkpoint.failed_questions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--source', default='mongo',
+                        help="'mongo' (the analyses collection) or a JSONL file")
+    parser.add_argument('--query', default='{}', help='Extra Mongo filter on analyses, as JSON')
+    parser.add_argument('--all', action='store_true',
+                        help='Include analyses already produced by the current model version')
+    parser.add_argument('--model-changed', action='append', default=[], choices=sorted(config.ANALYSIS_MODELS),
+                        help='Only analyses whose model of this kind differs from the configured one '
+                             '(repeatable; overrides the model version and --all selection)')
+    parser.add_argument('--reuse', action='store_true',
+                        help='Reuse stored per-answer results and clusters of the current model version')
+    parser.add_argument('--workers', type=int, default=2, help='Worker processes (each loads the models)')
+    parser.add_argument('--torch-threads', type=int, default=0,
+                        help='Torch threads per worker (default: CPUs / workers)')
+    parser.add_argument('--batch-questions', type=int, default=16,
+                        help='Questions per worker task (one batched model pass)')
+    parser.add_argument('--write-batch', type=int, default=200, help='Documents per bulk upsert')
+    parser.add_argument('--rate', type=float, default=0, help='Maximum questions per second (0 = unlimited)')
+    parser.add_argument('--limit', type=int, default=0, help='Stop after N questions')
+    parser.add_argument('--checkpoint', default=os.path.join(config.BASE_DIR, '.cache', 'backfill-checkpoint.json'))
+    parser.add_argument('--resume', action='store_true', help='Continue after the checkpointed position')
+    parser.add_argument('--dry-run', action='store_true', help='Analyze without writing')
+    parser.add_argument('--report-interval', type=float, default=10.0, help='Seconds between progress lines')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,409 @@
+"""Benchmark the analysis pipeline on synthetic answer corpora.
+
+Usage:
+    python scripts/benchmark.py                                  # 10, 100, 1000 answers
+    python scripts/benchmark.py --sizes 10,1000,50000 --duplicate-rate 0.5 \\
+        --languages en=0.6,es=0.2,fr=0.2 --length long
+    python scripts/benchmark.py --output results.json --baseline baseline.json
+
+Each case times SentimentAnalyzer, every IdeaSummarizer stage and the full
+AnalyzeQuestion path against an in-memory database, and records the peak RSS
+reached while it ran. With --baseline, cases slower than the baseline by more
+than --tolerance are reported and the script exits with status 1.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(SCRIPT_DIR)
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
+
+MAX_ANSWERS = 50_000
+
+SUBJECTS = {
+    'en': ['The onboarding', 'The new dashboard', 'Customer support', 'The mobile app',
+           'The pricing page', 'Checkout', 'The weekly meeting', 'Search'],
+    'es': ['La incorporación', 'El nuevo panel', 'El soporte al cliente', 'La aplicación móvil',
+           'La página de precios', 'El pago', 'La reunión semanal', 'La búsqueda'],
+    'fr': ["L'intégration", 'Le nouveau tableau de bord', 'Le support client', "L'application mobile",
+           'La page des tarifs', 'Le paiement', 'La réunion hebdomadaire', 'La recherche'],
+    'de': ['Das Onboarding', 'Das neue Dashboard', 'Der Kundensupport', 'Die mobile App',
+           'Die Preisseite', 'Der Checkout', 'Das wöchentliche Meeting', 'Die Suche'],
+    'pt': ['A integração', 'O novo painel', 'O suporte ao cliente', 'O aplicativo móvel',
+           'A página de preços', 'O pagamento', 'A reunião semanal', 'A busca'],
+}
+OPINIONS = {
+    'en': ['is fast and easy to use', 'was really helpful', 'feels confusing',
+           'is too slow', 'works as expected', 'keeps crashing', 'is fine'],
+    'es': ['es rápido y fácil de usar', 'fue muy útil', 'resulta confuso',
+           'es demasiado lento', 'funciona como se espera', 'se bloquea a menudo', 'está bien'],
+    'fr': ['est rapide et facile à utiliser', 'était vraiment utile', 'est déroutant',
+           'est trop lent', 'fonctionne comme prévu', 'plante souvent', 'est correct'],
+    'de': ['ist schnell und einfach', 'war sehr hilfreich', 'ist verwirrend',
+           'ist zu langsam', 'funktioniert wie erwartet', 'stürzt oft ab', 'ist in Ordnung'],
+    'pt': ['é rápido e fácil de usar', 'foi muito útil', 'é confuso',
+           'é lento demais', 'funciona como esperado', 'trava com frequência', 'está ok'],
+}
+DETAILS = {
+    'en': ['especially on Mondays', 'compared to last year', 'for our whole team',
+           'when I use it on my phone', 'after the latest update', 'during busy hours'],
+    'es': ['sobre todo los lunes', 'en comparación con el año pasado', 'para todo el equipo',
+           'cuando lo uso en el móvil', 'después de la última actualización', 'en horas punta'],
+    'fr': ['surtout le lundi', "par rapport à l'an dernier", "pour toute l'équipe",
+           'quand je l’utilise sur mon téléphone', 'après la dernière mise à jour', 'aux heures de pointe'],
+    'de': ['vor allem montags', 'im Vergleich zum letzten Jahr', 'für das ganze Team',
+           'wenn ich es am Handy nutze', 'nach dem letzten Update', 'zu Stoßzeiten'],
+    'pt': ['principalmente às segundas', 'comparado ao ano passado', 'para toda a equipe',
+           'quando uso no celular', 'depois da última atualização', 'nos horários de pico'],
+}
+LENGTHS = {'short': (0, 0), 'medium': (1, 2), 'long': (3, 6)}
+
+
+def parse_languages(spec):
+    """Parse 'en=0.8,es=0.2' into normalized language weights."""
+    weights = {}
+    for part in spec.split(','):
+        language, _, weight = part.strip().partition('=')
+        if language not in SUBJECTS:
+            raise ValueError(f'Unsupported language {language!r}; use one of {sorted(SUBJECTS)}')
+        weights[language] = float(weight or 1)
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError('Language weights must sum to a positive number')
+    return {language: weight / total for language, weight in weights.items()}
+
+
+def make_corpus(size, duplicate_rate, languages, length, seed=0):
+    """
+    Generate synthetic answers
+
+    Args:
+        size: Number of answers
+        duplicate_rate: Probability that an answer repeats an earlier one
+        languages: Language weights from parse_languages()
+        length: 'short', 'medium' or 'long' (extra clauses per answer)
+        seed: Random seed, so runs compare like for like
+    """
+    rng = random.Random(seed)
+    codes = list(languages)
+    weights = [languages[code] for code in codes]
+    min_details, max_details = LENGTHS[length]
+    answers = []
+    for _ in range(size):
+        if answers and rng.random() < duplicate_rate:
+            answers.append(rng.choice(answers))
+            continue
+        language = rng.choices(codes, weights)[0]
+        details = rng.sample(DETAILS[language], rng.randint(min_details, max_details))
+        text = f'{rng.choice(SUBJECTS[language])} {rng.choice(OPINIONS[language])}'
+        if details:
+            text = f"{text}, {', '.join(details)}"
+        # A numeric tag keeps unique answers unique across a large corpus.
+        answers.append(f'{text} (#{rng.randrange(1_000_000)}).')
+    return answers
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS counter (Linux only)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as handle:
+            handle.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as handle:
+            for line in handle:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class MemoryDB:
+    """In-memory stand-in for MongoDBManager."""
+
+    def __init__(self):
+        self.analyses = {}
+
+    def save_analysis(self, analysis_data):
+        analysis_data['timestamp'] = datetime.now(timezone.utc)
+        self.analyses[analysis_data['question_id']] = analysis_data
+        return analysis_data['question_id']
+
+    def get_analysis(self, question_id):
+        return self.analyses.get(question_id)
+
+    def get_cluster_summaries(self, question_id):
+        return self.analyses.get(question_id, {}).get('cluster_summaries', [])
+
+
+class Request:
+    def __init__(self, question_id, question_text, answers):
+        self.question_id = question_id
+        self.question_text = question_text
+        self.answer_text = answers
+
+
+class Context:
+    def invocation_metadata(self):
+        return ()
+
+    def time_remaining(self):
+        return None
+
+    def abort(self, code, details):
+        raise RuntimeError(f'{code}: {details}')
+
+
+def stage_totals():
+    """Seconds and count recorded so far by intelligence_stage_duration_seconds."""
+    from intelligence import metrics
+
+    totals = {}
+    for metric in metrics.STAGE_DURATION_SECONDS.collect():
+        for sample in metric.samples:
+            stage = sample.labels.get('stage')
+            if sample.name.endswith('_sum'):
+                totals.setdefault(stage, [0.0, 0])[0] = sample.value
+            elif sample.name.endswith('_count'):
+                totals.setdefault(stage, [0.0, 0])[1] = int(sample.value)
+    return totals
+
+
+def stage_delta(before, after):
+    return {
+        stage: {'seconds': seconds - before.get(stage, [0.0, 0])[0],
+                'calls': count - before.get(stage, [0.0, 0])[1]}
+        for stage, (seconds, count) in after.items()
+        if count > before.get(stage, [0.0, 0])[1]
+    }
+
+
+def bench_sentiment(analyzer, answers):
+    for answer in answers:
+        analyzer.analyze(answer)
+
+
+def bench_summarizer_stages(summarizer, answers, question_text):
+    """Run the stages of IdeaSummarizer.summarize_and_embed one by one."""
+    timings = {}
+
+    start = time.perf_counter()
+    cleaned = summarizer._normalize_answers(answers)
+    counts = Counter(cleaned)
+    texts = list(counts)
+    weights = np.array([counts[text] for text in texts], dtype=float)
+    timings['summarizer.normalize'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    embeddings = summarizer._embed_texts(texts)
+    timings['summarizer.embedding'] = time.perf_counter() - start
+    if embeddings is None:
+        return timings
+
+    start = time.perf_counter()
+    labels = summarizer._cluster_embeddings(embeddings, weights)
+    timings['summarizer.clustering'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    summarizer._cluster_centroids(embeddings, weights, labels)
+    timings['summarizer.centroids'] = time.perf_counter() - start
+
+    representatives = []
+    start = time.perf_counter()
+    for label in sorted(set(labels)):
+        indices = np.where(labels == label)[0]
+        representatives.append(summarizer._representative_sentence(
+            texts, embeddings, weights, indices, label))
+    timings['summarizer.representatives'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for sentence in representatives:
+        summarizer._paraphrase_or_fallback(sentence)
+    timings['summarizer.paraphrase'] = time.perf_counter() - start
+    return timings
+
+
+def run_case(args, analyzer, summarizer, size, languages):
+    answers = make_corpus(size, args.duplicate_rate, languages, args.length, args.seed)
+    question_text = 'What do you think about the product?'
+    samples = {}
+
+    def record(name, seconds, **extra):
+        sample = samples.setdefault(name, {'seconds': []})
+        sample['seconds'].append(seconds)
+        sample.update(extra)
+
+    reset_peak_rss()
+    for _ in range(args.repeat):
+        if 'sentiment' in args.stages:
+            start = time.perf_counter()
+            bench_sentiment(analyzer, answers)
+            record('sentiment', time.perf_counter() - start)
+
+        if 'summarizer' in args.stages:
+            for name, seconds in bench_summarizer_stages(
+                    summarizer, answers, question_text).items():
+                record(name, seconds)
+
+        if 'servicer' in args.stages:
+            from intelligence.servicer import AnalyticsServicer
+
+            servicer = AnalyticsServicer(MemoryDB(), analyzer, summarizer)
+            before = stage_totals()
+            start = time.perf_counter()
+            response = servicer.AnalyzeQuestion(
+                Request('benchmark', question_text, answers), Context())
+            record('servicer', time.perf_counter() - start,
+                   breakdown=stage_delta(before, stage_totals()))
+            if not response.success:
+                raise RuntimeError(f'AnalyzeQuestion failed: {response.error_message}')
+
+    unique = len(set(answers))
+    results = []
+    for name, sample in samples.items():
+        seconds = statistics.median(sample['seconds'])
+        result = {
+            'case': case_key(size, args),
+            'answers': size,
+            'unique_answers': unique,
+            'stage': name,
+            'seconds': seconds,
+            'min_seconds': min(sample['seconds']),
+            'per_answer_ms': seconds * 1000 / size,
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        }
+        if 'breakdown' in sample:
+            result['breakdown'] = sample['breakdown']
+        results.append(result)
+    return results
+
+
+def case_key(size, args):
+    return f'{size}|dup={args.duplicate_rate}|lang={args.languages}|len={args.length}'
+
+
+def compare(results, baseline, tolerance):
+    """Return (regressions, improvements) against a previous results file."""
+    previous = {(item['case'], item['stage']): item for item in baseline.get('results', [])}
+    regressions, improvements = [], []
+    for item in results:
+        old = previous.get((item['case'], item['stage']))
+        if not old or old['seconds'] <= 0:
+            continue
+        ratio = item['seconds'] / old['seconds']
+        row = (item['case'], item['stage'], old['seconds'], item['seconds'], ratio)
+        if ratio > 1 + tolerance:
+            regressions.append(row)
+        elif ratio < 1 - tolerance:
+            improvements.append(row)
+    return regressions, improvements
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=SERVICE_DIR, stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10,100,1000',
+                        help=f'Comma-separated answer counts, up to {MAX_ANSWERS}')
+    parser.add_argument('--duplicate-rate', type=float, default=0.3)
+    parser.add_argument('--languages', default='en=1',
+                        help=f'Language weights, e.g. en=0.8,es=0.2 ({",".join(SUBJECTS)})')
+    parser.add_argument('--length', choices=sorted(LENGTHS), default='medium')
+    parser.add_argument('--stages', default='sentiment,summarizer,servicer')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Runs per case; the median is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write JSON results to this file')
+    parser.add_argument('--baseline', help='Compare against a previous JSON results file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed slowdown against the baseline (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    if any(size < 1 or size > MAX_ANSWERS for size in sizes):
+        parser.error(f'--sizes must be between 1 and {MAX_ANSWERS}')
+    if not 0 <= args.duplicate_rate < 1:
+        parser.error('--duplicate-rate must be in [0, 1)')
+    languages = parse_languages(args.languages)
+    args.stages = set(args.stages.split(','))
+
+    from intelligence import config
+    from intelligence.idea_summarizer import IdeaSummarizer
+    from intelligence.sentiment_analyzer import SentimentAnalyzer
+
+    load_start = time.perf_counter()
+    analyzer = SentimentAnalyzer()
+    summarizer = IdeaSummarizer()
+    print(f'Models loaded in {time.perf_counter() - load_start:.1f}s')
+
+    results = []
+    for size in sizes:
+        for result in run_case(args, analyzer, summarizer, size, languages):
+            results.append(result)
+            print(f"{size:>6} answers  {result['stage']:<28} "
+                  f"{result['seconds']:>9.3f}s  {result['per_answer_ms']:>8.2f} ms/answer  "
+                  f"peak RSS {result['peak_rss_mb']:.0f} MB")
+
+    report = {
+        'meta': {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'models': {
+                'sentiment': config.SENTIMENT_MODEL_ID,
+                'embedding': config.EMBEDDING_MODEL,
+                'paraphrase': config.PARAPHRASE_MODEL,
+                'translation': config.TRANSLATION_MODEL if config.TRANSLATE_BEFORE_SENTIMENT else None,
+            },
+            'args': {**vars(args), 'stages': sorted(args.stages)},
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+        print(f'Results written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        regressions, improvements = compare(results, baseline, args.tolerance)
+        for label, rows in (('Improved', improvements), ('REGRESSED', regressions)):
+            for case, stage, old, new, ratio in rows:
+                print(f'{label}: {stage} [{case}] {old:.3f}s -> {new:.3f}s ({ratio:.2f}x)')
+        if regressions:
+            sys.exit(1)
+        print('No regressions against baseline')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,19 @@
-"""Pre-cache HuggingFace models for offline runtime."""
+"""Pre-cache HuggingFace models for offline runtime.
+
+Usage:
+    python scripts/cache_models.py             # download checkpoints
+    python scripts/cache_models.py --prepare   # also write safetensors artifacts
+    python scripts/cache_models.py --report    # compare load time / RSS per source
+"""
+import argparse
+import json
 import os
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
 from huggingface_hub import snapshot_download
 
 BASE_DIR = os.getenv(
@@ -31,6 +45,11 @@ TRANSLATION_MODEL = os.getenv(
     'Helsinki-NLP/opus-mt-mul-en',
 )
 
+PREPARED_MODELS_DIR = os.getenv(
+    'PREPARED_MODELS_DIR',
+    os.path.join(BASE_DIR, '.cache', 'prepared-models'),
+)
+
 MODELS = [EMBEDDING_MODEL, PARAPHRASE_MODEL, SENTIMENT_MODEL_ID]
 if (
     TRANSLATE_BEFORE_SENTIMENT
@@ -46,10 +65,152 @@ def cache_models():
         snapshot_download(repo_id=model_id, cache_dir=HF_HOME)
 
 
+def prepared_path(model_id):
+    # Keep in sync with intelligence/model_artifacts.py
+    return os.path.join(PREPARED_MODELS_DIR, model_id.strip().replace('/', '--'))
+
+
+def load_model(model_id, source):
+    """Load a model the way the service does, from the HF cache or a prepared artifact."""
+    path = prepared_path(model_id) if source == 'prepared' else model_id
+    location = {} if source == 'prepared' else {'cache_dir': HF_HOME}
+    if model_id == EMBEDDING_MODEL:
+        from sentence_transformers import SentenceTransformer
+        folder = {} if source == 'prepared' else {'cache_folder': HF_HOME}
+        model = SentenceTransformer(path, local_files_only=True, **folder)
+        return model, None, model[0].auto_model
+
+    from transformers import (
+        AutoModelForSeq2SeqLM,
+        AutoModelForSequenceClassification,
+        AutoTokenizer,
+    )
+    if model_id == SENTIMENT_MODEL_ID:
+        factory = AutoModelForSequenceClassification
+    else:
+        factory = AutoModelForSeq2SeqLM
+    tokenizer = AutoTokenizer.from_pretrained(path, local_files_only=True, **location)
+    model = factory.from_pretrained(path, local_files_only=True, **location)
+    return model, tokenizer, model
+
+
+def prepare_models():
+    """Write every model as safetensors plus tokenizer files (tokenizer.json when fast)."""
+    for model_id in MODELS:
+        target = prepared_path(model_id)
+        tmp_target = f'{target}.tmp'
+        print(f'Preparing model: {model_id} -> {target}')
+        shutil.rmtree(tmp_target, ignore_errors=True)
+        model, tokenizer, _ = load_model(model_id, 'hub')
+        if tokenizer is None:
+            model.save(tmp_target, safe_serialization=True)
+        else:
+            model.save_pretrained(tmp_target, safe_serialization=True)
+            tokenizer.save_pretrained(tmp_target)
+        with open(os.path.join(tmp_target, 'prepared.json'), 'w') as handle:
+            json.dump(
+                {
+                    'model_id': model_id,
+                    'prepared_at': datetime.now(timezone.utc).isoformat(),
+                    'fast_tokenizer': os.path.exists(
+                        os.path.join(tmp_target, 'tokenizer.json')),
+                },
+                handle,
+            )
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(tmp_target, target)
+
+
+def read_rss_kb():
+    """Return (RssAnon, RssFile) in kB; file-backed pages are shareable."""
+    values = {'RssAnon': 0, 'RssFile': 0}
+    with open('/proc/self/status') as handle:
+        for line in handle:
+            key, _, value = line.partition(':')
+            if key in values:
+                values[key] = int(value.split()[0])
+    return values['RssAnon'], values['RssFile']
+
+
+def measure(model_id, source):
+    """Load one model in this process and print load time and RSS as JSON."""
+    os.environ['PREPARED_MODELS_DIR'] = PREPARED_MODELS_DIR
+    sys.path.insert(0, BASE_DIR)
+    import torch  # noqa: F401  (import cost is not part of the load time)
+    from intelligence.model_artifacts import map_weights
+
+    anon_before, file_before = read_rss_kb()
+    start = time.perf_counter()
+    _, _, weights = load_model(model_id, source)
+    if source == 'prepared':
+        map_weights(weights, model_id)
+    load_seconds = time.perf_counter() - start
+    anon_after, file_after = read_rss_kb()
+    print(json.dumps({
+        'model_id': model_id,
+        'source': source,
+        'load_seconds': round(load_seconds, 3),
+        'rss_anon_mb': round((anon_after - anon_before) / 1024, 1),
+        'rss_file_mb': round((file_after - file_before) / 1024, 1),
+    }))
+
+
+def report():
+    """Compare each model loaded from the HF cache and from its prepared artifact."""
+    print(f'{"model":<55} {"source":<9} {"load s":>7} {"anon MB":>8} {"file MB":>8}')
+    for model_id in MODELS:
+        sources = ['hub']
+        if os.path.exists(os.path.join(prepared_path(model_id), 'prepared.json')):
+            sources.append('prepared')
+        for source in sources:
+            # A fresh process per load so RSS is not shared between runs
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__),
+                 '--measure', model_id, '--source', source],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout.strip().splitlines()[-1]
+            result = json.loads(output)
+            print(
+                f'{model_id:<55} {source:<9} {result["load_seconds"]:>7.2f} '
+                f'{result["rss_anon_mb"]:>8.1f} {result["rss_file_mb"]:>8.1f}'
+            )
+
+
 def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--prepare',
+        action='store_true',
+        help='Write safetensors + tokenizer artifacts to PREPARED_MODELS_DIR.',
+    )
+    parser.add_argument(
+        '--report',
+        action='store_true',
+        help='Print load time and RSS per model for each available source.',
+    )
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    parser.add_argument('--source', default='hub', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.source)
+        return
+
+    if args.report and not args.prepare:
+        report()
+        return
+
     print(f'HF_HOME={HF_HOME}')
     cache_models()
     print('Cache warmup complete.')
+    if args.prepare:
+        print(f'PREPARED_MODELS_DIR={PREPARED_MODELS_DIR}')
+        prepare_models()
+        print('Model preparation complete.')
+    if args.report:
+        report()
 
 
 if __name__ == '__main__':
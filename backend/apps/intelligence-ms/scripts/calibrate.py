@@ -0,0 +1,103 @@
+"""Measure the best torch threads, batch sizes and analysis concurrency for this node.
+
+Usage:
+    python scripts/calibrate.py                          # write TUNING_PROFILE_PATH
+    python scripts/calibrate.py --dry-run                # only print the measurements
+    python scripts/calibrate.py --threads 1,2,4 --batch-sizes 16,32,64 --texts 512
+    python scripts/calibrate.py --output /tmp/profile.json
+
+Loads the sentiment and embedding models as the service does, times them on
+synthetic answers for every thread count and batch size, then times concurrent
+analyses at the best of those (see intelligence/tuning.py). The service applies
+the written profile on its next start while the CPU, torch version and models
+still match; run this again after changing any of them, or set
+CALIBRATE_ON_STARTUP=missing to let the service calibrate itself.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(SCRIPT_DIR)
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
+
+from intelligence import config  # noqa: E402
+from intelligence.tuning import calibrate, parse_sizes, save_profile, thread_candidates  # noqa: E402
+
+logger = logging.getLogger('calibrate')
+
+
+def print_report(profile):
+    measurements = profile['measurements']
+    print(f"{measurements['texts']} synthetic answers, best of {measurements['repeat']} runs, "
+          f"{measurements['seconds']}s")
+    for row in measurements['models']:
+        for model, rates in row['answers_per_second'].items():
+            cells = '  '.join(f'b{size}={rate:.1f}' for size, rate in rates.items())
+            print(f"threads={row['threads']:<3} {model:<10} answers/s  {cells}")
+    for row in measurements['concurrency']:
+        print(f"slots={row['slots']:<3} answers/s {row['answers_per_second']:.1f}")
+    print('Settings: ' + ', '.join(f'{name}={value}' for name, value in profile['settings'].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default=config.TUNING_PROFILE_PATH,
+                        help=f'Profile to write (default: TUNING_PROFILE_PATH, {config.TUNING_PROFILE_PATH})')
+    parser.add_argument('--threads', default=config.CALIBRATION_THREADS,
+                        help='Comma-separated torch thread counts '
+                             f'(default: powers of two up to the cores, {thread_candidates()})')
+    parser.add_argument('--batch-sizes', default=config.CALIBRATION_BATCH_SIZES,
+                        help=f'Comma-separated batch sizes (default: {config.CALIBRATION_BATCH_SIZES})')
+    parser.add_argument('--concurrency', default='',
+                        help='Comma-separated analysis slot counts (default: powers of two up to 2x cores per thread)')
+    parser.add_argument('--texts', type=int, default=config.CALIBRATION_TEXTS,
+                        help='Synthetic answers per measurement')
+    parser.add_argument('--repeat', type=int, default=config.CALIBRATION_REPEAT,
+                        help='Timed runs per measurement after a warm-up; the fastest counts')
+    parser.add_argument('--json', action='store_true', help='Print the profile as JSON')
+    parser.add_argument('--dry-run', action='store_true', help='Measure without writing the profile')
+    args = parser.parse_args()
+    try:
+        threads = parse_sizes(args.threads)
+        batch_sizes = parse_sizes(args.batch_sizes)
+        concurrency = parse_sizes(args.concurrency)
+    except ValueError:
+        parser.error('--threads, --batch-sizes and --concurrency take comma-separated integers')
+    if not batch_sizes:
+        parser.error('--batch-sizes must list at least one positive size')
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    from intelligence.idea_summarizer import IdeaSummarizer
+    from intelligence.sentiment_analyzer import SentimentAnalyzer
+
+    sentiment_analyzer = SentimentAnalyzer()
+    idea_summarizer = IdeaSummarizer(eager=False)
+    idea_summarizer.loaders()['embedding_model']()
+
+    profile = calibrate(
+        sentiment_analyzer,
+        idea_summarizer,
+        threads=threads,
+        batch_sizes=batch_sizes,
+        texts=args.texts,
+        repeat=args.repeat,
+        concurrency=concurrency,
+    )
+    if args.json:
+        print(json.dumps(profile, indent=2))
+    else:
+        print_report(profile)
+    if args.dry_run:
+        logger.info('Dry run: profile not written')
+    else:
+        logger.info('Wrote %s', save_profile(profile, args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""Export stored analyses to a Parquet file.
+
+Usage:
+    python scripts/export_parquet.py answers.parquet                     # one row per answer
+    python scripts/export_parquet.py answers.parquet --texts             # with the answer texts
+    python scripts/export_parquet.py clusters.parquet --table clusters --since 2024-01-01
+    python scripts/export_parquet.py questions.parquet --table questions --model-version v3
+
+Analyses are read from MongoDB with one cursor and a projection of the fields
+the table needs. Each Arrow record batch of --batch-rows rows is written as one
+Parquet row group as soon as it is full, so memory use does not grow with the
+number of analyses. The same tables are served by the ExportAnalyses RPC.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(SCRIPT_DIR)
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
+
+from intelligence import config  # noqa: E402
+from intelligence import export  # noqa: E402
+
+logger = logging.getLogger('export_parquet')
+
+
+def parse_time(value):
+    """ISO date or datetime, UTC unless it has an offset"""
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def run(args):
+    import pyarrow.parquet as pq
+
+    from intelligence.database import MongoDBManager
+
+    include_texts = args.table == export.ANSWERS_TABLE and args.texts
+    match = export.export_match(
+        [question_id for question_id in args.question_ids.split(',') if question_id],
+        args.model_version,
+        args.since,
+        args.until,
+    )
+    db_manager = MongoDBManager()
+    started = time.monotonic()
+    rows = batches = 0
+    try:
+        pages = db_manager.iter_analyses(
+            match,
+            export.projection(args.table, include_texts),
+            batch_size=args.cursor_batch_size,
+            expand=include_texts,
+        )
+        target = export.schema(args.table, include_texts)
+        with pq.ParquetWriter(args.output, target, compression=args.compression) as writer:
+            for batch in export.record_batches(pages, args.table, include_texts, args.batch_rows):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+                batches += 1
+                logger.info('%d rows written (%.0f rows/s)',
+                            rows, rows / max(time.monotonic() - started, 1e-9))
+    finally:
+        db_manager.close()
+
+    logger.info('Exported %d %s rows in %d row groups to %s (%.1f MB)',
+                rows, args.table, batches, args.output, os.path.getsize(args.output) / 1e6)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('output', help='Parquet file to write')
+    parser.add_argument('--table', choices=export.TABLES, default=export.ANSWERS_TABLE,
+                        help='Rows per answer, per cluster summary or per analysis (default: answers)')
+    parser.add_argument('--texts', action='store_true', help='Include answer texts (answers table)')
+    parser.add_argument('--question-ids', default='', help='Comma-separated question IDs (default: all)')
+    parser.add_argument('--model-version', default='', help='Only analyses of this model version')
+    parser.add_argument('--since', type=parse_time, help='Analyzed at or after this ISO date/time')
+    parser.add_argument('--until', type=parse_time, help='Analyzed before this ISO date/time')
+    parser.add_argument('--batch-rows', type=int, default=config.EXPORT_BATCH_ROWS,
+                        help='Rows per record batch and row group')
+    parser.add_argument('--cursor-batch-size', type=int, default=config.EXPORT_CURSOR_BATCH_SIZE,
+                        help='Documents per MongoDB cursor batch')
+    parser.add_argument('--compression', default='zstd', help='Parquet compression codec (default: zstd)')
+    args = parser.parse_args()
+    args.batch_rows = max(1, args.batch_rows)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
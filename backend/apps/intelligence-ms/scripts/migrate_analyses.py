@@ -0,0 +1,124 @@
+"""Convert stored analyses between storage formats.
+
+Usage:
+    python scripts/migrate_analyses.py                 # legacy documents to the compact format
+    python scripts/migrate_analyses.py --dry-run       # only report the size change
+    python scripts/migrate_analyses.py --to 1          # back to per-answer subdocuments
+
+Documents not yet in the target format are read in _id order, one page of
+--batch-size at a time. Answer texts are written to the answer_texts collection
+before the compact documents that refer to them. A document is only replaced if
+its timestamp has not changed since it was read, so an analysis the service
+re-saved meanwhile (already in ANALYSIS_DOC_FORMAT) is left alone. Converted
+documents no longer match the query, so an interrupted run is continued by
+running it again.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(SCRIPT_DIR)
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
+
+from intelligence.analysis_format import (  # noqa: E402
+    ANSWER_TEXTS_COLLECTION,
+    COMPACT_FORMAT,
+    LEGACY_FORMAT,
+    analysis_update,
+    encode_analysis,
+    expand_analyses,
+    save_answer_texts,
+)
+
+logger = logging.getLogger('migrate_analyses')
+
+
+def pending_query(target, query):
+    """Filter matching the documents not yet in the target format; archived stubs are skipped"""
+    if target == COMPACT_FORMAT:
+        pending = {'format_version': {'$ne': COMPACT_FORMAT}, 'archived': {'$ne': True}}
+    else:
+        pending = {'format_version': COMPACT_FORMAT, 'archived': {'$ne': True}}
+    return {'$and': [pending, query]} if query else pending
+
+
+def run(args):
+    import bson
+    from pymongo import UpdateOne
+
+    from intelligence.database import MongoDBManager
+
+    db_manager = MongoDBManager()
+    analyses = db_manager.db['analyses']
+    text_collection = db_manager.db[ANSWER_TEXTS_COLLECTION]
+    base = pending_query(args.to, json.loads(args.query))
+
+    started = time.monotonic()
+    seen = converted = skipped = 0
+    bytes_before = bytes_after = 0
+    texts_seen = set()
+    after = None
+    try:
+        while not args.limit or seen < args.limit:
+            page_query = base if after is None else {'$and': [base, {'_id': {'$gt': after}}]}
+            size = args.batch_size if not args.limit else min(args.batch_size, args.limit - seen)
+            page = list(analyses.find(page_query).sort('_id', 1).limit(size))
+            if not page:
+                break
+            after = page[-1]['_id']
+            seen += len(page)
+
+            operations = []
+            texts = {}
+            for stored, expanded in zip(page, expand_analyses(page, text_collection)):
+                document = {key: value for key, value in expanded.items() if key != '_id'}
+                doc, doc_texts = encode_analysis(document, args.to)
+                bytes_before += len(bson.encode(stored))
+                bytes_after += len(bson.encode(doc))
+                texts.update(doc_texts)
+                operations.append(UpdateOne(
+                    {'_id': stored['_id'], 'timestamp': stored.get('timestamp')},
+                    analysis_update(doc),
+                ))
+            texts_seen.update(texts)
+
+            if args.dry_run:
+                converted += len(operations)
+            else:
+                save_answer_texts(text_collection, texts)
+                result = analyses.bulk_write(operations, ordered=False)
+                converted += result.modified_count
+                skipped += len(operations) - result.matched_count
+            logger.info('%d read, %d converted, %d changed meanwhile (%.1f docs/s)',
+                        seen, converted, skipped, seen / max(time.monotonic() - started, 1e-9))
+    finally:
+        db_manager.close()
+
+    logger.info('%s%d documents to format %d: %.1f MB -> %.1f MB of documents, %d distinct answer texts',
+                'Dry run: ' if args.dry_run else '', converted, args.to,
+                bytes_before / 1e6, bytes_after / 1e6, len(texts_seen))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--to', type=int, choices=(LEGACY_FORMAT, COMPACT_FORMAT), default=COMPACT_FORMAT,
+                        help='Target storage format (default: 2, compact)')
+    parser.add_argument('--query', default='{}', help='Extra Mongo filter on analyses, as JSON')
+    parser.add_argument('--batch-size', type=int, default=200, help='Documents per page and bulk write')
+    parser.add_argument('--limit', type=int, default=0, help='Stop after N documents')
+    parser.add_argument('--dry-run', action='store_true', help='Convert in memory and report sizes without writing')
+    args = parser.parse_args()
+    args.batch_size = max(1, args.batch_size)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Close past monthly buckets of analyses and archive the expired ones.
+
+Usage:
+    python scripts/retention.py                      # roll up past months, archive expired ones
+    python scripts/retention.py --dry-run            # only report what would be done
+    python scripts/retention.py --retention-months 6
+    python scripts/retention.py --rebuild 2024-03    # recompute the rollup of one bucket
+
+Each run first gives analyses saved before partitioning the bucket of their
+timestamp. Every bucket before the current month without a rollup is then
+closed: its sentiment label counts go to analysis_rollups and its idea counts to
+idea_rollups, and stats stop aggregating its documents. Closed buckets older
+than --retention-months move their raw documents to analyses_archive_YYYY_MM
+and keep a summary stub in analyses. Every step is idempotent, so an
+interrupted run is continued by running it again; schedule it daily or monthly.
+"""
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(SCRIPT_DIR)
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
+
+from intelligence import config  # noqa: E402
+from intelligence.partitions import (  # noqa: E402
+    archive_bucket,
+    assign_buckets,
+    bucket_of,
+    close_bucket,
+    closed_buckets,
+    months_before,
+)
+
+logger = logging.getLogger('retention')
+
+
+def run(args):
+    from intelligence.database import MongoDBManager
+
+    db_manager = MongoDBManager()
+    db = db_manager.db
+    current = bucket_of(datetime.utcnow())
+    try:
+        if args.rebuild:
+            if args.rebuild >= current:
+                logger.error('Bucket %s is still open', args.rebuild)
+                return 1
+            if args.dry_run:
+                logger.info('Dry run: would rebuild the rollup of %s', args.rebuild)
+            else:
+                rollup = close_bucket(db, args.rebuild)
+                logger.info('Rebuilt %s: %d analyses, %d answers',
+                            args.rebuild, rollup['analyses'], rollup['answers'])
+            return 0
+
+        if args.dry_run:
+            unassigned = db['analyses'].count_documents({'bucket': {'$exists': False}})
+            logger.info('Dry run: %d analyses without a bucket', unassigned)
+        else:
+            logger.info('Assigned buckets to %d analyses', assign_buckets(db, args.batch_size))
+
+        closed = set(closed_buckets(db))
+        past = sorted(
+            bucket for bucket in db['analyses'].distinct('bucket', {'bucket': {'$lt': current}})
+            if bucket not in closed
+        )
+        for bucket in past:
+            if args.dry_run:
+                logger.info('Dry run: would close %s', bucket)
+                continue
+            rollup = close_bucket(db, bucket)
+            closed.add(bucket)
+            logger.info('Closed %s: %d analyses, %d answers',
+                        bucket, rollup['analyses'], rollup['answers'])
+
+        cutoff = months_before(current, args.retention_months)
+        for bucket in sorted(bucket for bucket in closed if bucket < cutoff):
+            if args.dry_run:
+                pending = db['analyses'].count_documents({'bucket': bucket, 'archived': {'$ne': True}})
+                logger.info('Dry run: would archive %d analyses of %s', pending, bucket)
+                continue
+            archived = archive_bucket(db, bucket, args.batch_size)
+            if archived:
+                logger.info('Archived %d analyses of %s', archived, bucket)
+    finally:
+        db_manager.close()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--retention-months', type=int, default=config.ANALYSIS_RETENTION_MONTHS,
+                        help='Closed months kept with their raw documents '
+                             f'(default: ANALYSIS_RETENTION_MONTHS, {config.ANALYSIS_RETENTION_MONTHS})')
+    parser.add_argument('--rebuild', metavar='YYYY-MM', help='Only recompute the rollup of this closed bucket')
+    parser.add_argument('--batch-size', type=int, default=200, help='Documents per page and bulk write')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would be done without writing')
+    args = parser.parse_args()
+    args.batch_size = max(1, args.batch_size)
+    args.retention_months = max(1, args.retention_months)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
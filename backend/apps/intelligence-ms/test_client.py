@@ -1,8 +1,32 @@
+"""gRPC test client and load generator for intelligence-ms.
+
+Usage:
+    python test_client.py                                   # one smoke-test request
+    python test_client.py --duration 60 --concurrency 16 --answers uniform:10:200
+    python test_client.py --requests 500 --rate 5 --concurrency 32 --channels 4
+    python test_client.py --replay recorded.jsonl --rate 10 --duration 120
+
+Load mode reports throughput, p50/p95/p99/max latency and a status breakdown per
+--interval, then a summary. With --rate the load is open-loop: requests are
+scheduled at a fixed arrival rate and latency is measured from the scheduled
+send time, so queueing inside the client counts against the server.
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import queue
+import random
+import sys
+import threading
 import time
+from collections import Counter
+
 import grpc
 
-# Wait briefly for server/proto generation
-time.sleep(2)
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, 'scripts'))
 
 try:
     from intelligence import analytics_pb2, analytics_pb2_grpc
@@ -11,8 +35,8 @@ except Exception as e:
     raise
 
 
-def run_test():
-    channel = grpc.insecure_channel('localhost:50051')
+def run_test(target='localhost:50051'):
+    channel = grpc.insecure_channel(target)
     stub = analytics_pb2_grpc.AnalyticsServiceStub(channel)
 
     req = analytics_pb2.AnalysisRequest()
@@ -35,5 +59,277 @@ def run_test():
         print('gRPC call failed:', e)
 
 
+def parse_distribution(spec):
+    """
+    Parse an answer-count distribution into a sampler
+
+    Formats: fixed:N, uniform:MIN:MAX, lognormal:MEDIAN:SIGMA[:MAX], choice:A,B,C
+    """
+    kind, _, params = spec.partition(':')
+    if kind == 'fixed':
+        count = int(params)
+        return lambda rng: count
+    if kind == 'uniform':
+        low, high = (int(value) for value in params.split(':'))
+        return lambda rng: rng.randint(low, high)
+    if kind == 'lognormal':
+        values = params.split(':')
+        median, sigma = float(values[0]), float(values[1])
+        cap = int(values[2]) if len(values) > 2 else 50_000
+        mu = math.log(median)
+        return lambda rng: max(1, min(cap, int(rng.lognormvariate(mu, sigma))))
+    if kind == 'choice':
+        choices = [int(value) for value in params.split(',')]
+        return lambda rng: rng.choice(choices)
+    raise ValueError(f'Unknown answer distribution {spec!r}')
+
+
+def synthetic_requests(distribution, seed, question_count, duplicate_rate, languages):
+    """Yield AnalysisRequest kwargs with synthetic answers, forever."""
+    from benchmark import make_corpus, parse_languages
+
+    rng = random.Random(seed)
+    language_weights = parse_languages(languages)
+    for sequence in itertools.count():
+        size = distribution(rng)
+        yield {
+            'question_id': f'load-q{sequence % question_count}',
+            'question_text': 'What do you think about the product?',
+            'answer_text': make_corpus(
+                size, duplicate_rate, language_weights, rng.choice(['short', 'medium', 'long']),
+                seed=rng.randrange(1 << 30),
+            ),
+        }
+
+
+def replay_requests(path):
+    """Yield AnalysisRequest kwargs from a JSONL file, looping over it."""
+    with open(path) as handle:
+        records = [json.loads(line) for line in handle if line.strip()]
+    if not records:
+        raise ValueError(f'{path} contains no requests')
+    for record in itertools.cycle(records):
+        answers = record.get('answer_text', record.get('answers', []))
+        if isinstance(answers, str):
+            answers = [answers]
+        yield {
+            'question_id': record.get('question_id') or record.get('questionId', ''),
+            'question_text': record.get('question_text') or record.get('questionText', ''),
+            'answer_text': answers,
+        }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class Stats:
+    """Thread-safe latency and status recorder, bucketed by interval."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.started = time.monotonic()
+        self.latencies = []
+        self.statuses = Counter()
+        self.answers = 0
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def record(self, finished, latency, status, answers):
+        bucket = int((finished - self.started) // self.interval)
+        with self._lock:
+            self.latencies.append(latency)
+            self.statuses[status] += 1
+            if status == 'OK':
+                self.answers += answers
+            latencies, statuses = self.buckets.setdefault(bucket, ([], Counter()))
+            latencies.append(latency)
+            statuses[status] += 1
+
+    def pop_bucket(self, bucket):
+        with self._lock:
+            return self.buckets.pop(bucket, ([], Counter()))
+
+
+def summarize(latencies, statuses, seconds):
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'throughput_rps': len(ordered) / seconds if seconds > 0 else 0.0,
+        'p50_ms': percentile(ordered, 0.50) * 1000,
+        'p95_ms': percentile(ordered, 0.95) * 1000,
+        'p99_ms': percentile(ordered, 0.99) * 1000,
+        'max_ms': (ordered[-1] if ordered else 0.0) * 1000,
+        'statuses': dict(statuses),
+    }
+
+
+def format_row(label, summary):
+    statuses = ' '.join(f'{code}={count}' for code, count in sorted(summary['statuses'].items()))
+    return (f"{label:>8} {summary['requests']:>6} req {summary['throughput_rps']:>7.2f} rps  "
+            f"p50 {summary['p50_ms']:>8.1f}  p95 {summary['p95_ms']:>8.1f}  "
+            f"p99 {summary['p99_ms']:>8.1f}  max {summary['max_ms']:>8.1f} ms  {statuses}")
+
+
+def send(stub, payload, timeout):
+    """Send one request; return its status label."""
+    try:
+        response = stub.AnalyzeQuestion(
+            analytics_pb2.AnalysisRequest(**payload), timeout=timeout)
+    except grpc.RpcError as e:
+        return e.code().name
+    return 'OK' if response.success else 'APP_ERROR'
+
+
+def run_load(args):
+    if args.replay:
+        source = replay_requests(args.replay)
+    else:
+        source = synthetic_requests(
+            parse_distribution(args.answers), args.seed, args.questions,
+            args.duplicate_rate, args.languages,
+        )
+    # Each channel is its own HTTP/2 connection, so several channels are needed
+    # to spread load over replicas behind an L4 load balancer.
+    stubs = [
+        analytics_pb2_grpc.AnalyticsServiceStub(grpc.insecure_channel(
+            args.target,
+            options=[('grpc.max_send_message_length', 64 * 1024 * 1024),
+                     ('grpc.max_receive_message_length', 64 * 1024 * 1024),
+                     ('grpc.use_local_subchannel_pool', 1)],
+        ))
+        for _ in range(max(1, args.channels))
+    ]
+    source_lock = threading.Lock()
+    stats = Stats(args.interval)
+    deadline = stats.started + args.duration if args.duration else None
+    issued = itertools.count()
+    work: queue.Queue = queue.Queue(maxsize=max(1, args.concurrency) * 4)
+    stop = threading.Event()
+
+    def next_payload():
+        if args.requests and next(issued) >= args.requests:
+            return None
+        if deadline and time.monotonic() >= deadline:
+            return None
+        with source_lock:
+            payload = next(source)
+        if args.compact:
+            payload = {**payload, 'compact': True}
+        return payload
+
+    def scheduler():
+        # Open loop: schedule arrivals independently of response times.
+        period = 1.0 / args.rate
+        scheduled = time.monotonic()
+        while not stop.is_set():
+            payload = next_payload()
+            if payload is None:
+                break
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            work.put((scheduled, payload))
+            scheduled += period
+        for _ in range(args.concurrency):
+            work.put(None)
+
+    def worker(index):
+        stub = stubs[index % len(stubs)]
+        while not stop.is_set():
+            if args.rate:
+                item = work.get()
+                if item is None:
+                    return
+                started, payload = item
+            else:
+                payload = next_payload()
+                if payload is None:
+                    return
+                started = time.monotonic()
+            status = send(stub, payload, args.timeout)
+            finished = time.monotonic()
+            stats.record(finished, finished - started, status, len(payload['answer_text']))
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True)
+               for i in range(args.concurrency)]
+    if args.rate:
+        threads.append(threading.Thread(target=scheduler, daemon=True))
+    for thread in threads:
+        thread.start()
+
+    timeline = []
+    bucket = 0
+    mode = f'open-loop {args.rate} rps' if args.rate else 'closed-loop'
+    print(f'Load test against {args.target}: {mode}, concurrency {args.concurrency}, '
+          f'{len(stubs)} channel(s)')
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(max(0.0, stats.started + (bucket + 1) * args.interval - time.monotonic()))
+            latencies, statuses = stats.pop_bucket(bucket)
+            row = summarize(latencies, statuses, args.interval)
+            row['t'] = (bucket + 1) * args.interval
+            timeline.append(row)
+            print(format_row(f"{row['t']:.0f}s", row))
+            bucket += 1
+    except KeyboardInterrupt:
+        stop.set()
+        print('Interrupted; waiting for in-flight requests')
+        for thread in threads:
+            thread.join(timeout=args.timeout)
+
+    elapsed = time.monotonic() - stats.started
+    total = summarize(stats.latencies, stats.statuses, elapsed)
+    total['answers_per_second'] = stats.answers / elapsed if elapsed > 0 else 0.0
+    print(format_row('total', total))
+    print(f"Answers analyzed: {stats.answers} ({total['answers_per_second']:.1f}/s)")
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump({'args': vars(args), 'summary': total, 'timeline': timeline}, handle, indent=2)
+        print(f'Results written to {args.output}')
+    errors = sum(count for code, count in stats.statuses.items() if code != 'OK')
+    return 1 if errors and errors == total['requests'] else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', default=os.getenv('INTELLIGENCE_GRPC_TARGET', 'localhost:50051'))
+    parser.add_argument('--requests', type=int, default=0, help='Stop after N requests')
+    parser.add_argument('--duration', type=float, default=0, help='Stop after N seconds')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent in-flight requests')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Open-loop arrival rate in requests/s (0 = closed loop)')
+    parser.add_argument('--channels', type=int, default=1, help='gRPC channels (connections)')
+    parser.add_argument('--answers', default='uniform:10:200',
+                        help='Answer counts: fixed:N, uniform:MIN:MAX, lognormal:MEDIAN:SIGMA[:MAX], choice:A,B')
+    parser.add_argument('--questions', type=int, default=100,
+                        help='Distinct question ids cycled through by synthetic requests')
+    parser.add_argument('--duplicate-rate', type=float, default=0.3)
+    parser.add_argument('--languages', default='en=1')
+    parser.add_argument('--replay', help='JSONL file of recorded requests to replay instead')
+    parser.add_argument('--compact', action='store_true',
+                        help='Ask for compact responses without the answer texts')
+    parser.add_argument('--timeout', type=float, default=120, help='Per-request deadline in seconds')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds per timeline row')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the summary and timeline as JSON')
+    args = parser.parse_args()
+
+    if not (args.requests or args.duration or args.replay or args.rate):
+        # Wait briefly for server/proto generation
+        time.sleep(2)
+        run_test(args.target)
+        return 0
+    if not (args.requests or args.duration):
+        parser.error('load mode needs --requests or --duration')
+    args.concurrency = max(1, args.concurrency)
+    return run_load(args)
+
+
 if __name__ == '__main__':
-    run_test()
+    sys.exit(main())
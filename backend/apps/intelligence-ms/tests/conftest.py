@@ -0,0 +1,22 @@
+"""Shared fixtures for the intelligence-ms unit tests."""
+import os
+import sys
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
+
+
+@pytest.fixture
+def db_manager(monkeypatch):
+    """MongoDBManager on an in-memory mongomock database"""
+    mongomock = pytest.importorskip('mongomock')
+    from intelligence import database
+
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(database, 'MongoClient', lambda *args, **kwargs: client)
+    manager = database.MongoDBManager()
+    yield manager
+    manager.close()
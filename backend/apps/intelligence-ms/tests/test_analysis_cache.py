@@ -0,0 +1,155 @@
+import time
+
+import pytest
+
+from intelligence import analysis_cache, config
+from intelligence.analysis_cache import AnalysisCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(analysis_cache.time, 'monotonic', clock)
+    return clock
+
+
+def cache_document(cache, question_id, document, view=False):
+    cache.end_read(question_id, cache.begin_read(question_id), view, document)
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = AnalysisCache(max_entries=10, ttl_seconds=30)
+    cache_document(cache, 'q1', {'question_id': 'q1'})
+
+    clock.now += 29
+    assert cache.get('q1', False) == {'question_id': 'q1'}
+    clock.now += 2
+    assert cache.get('q1', False) is None
+
+
+def test_least_recently_used_entries_are_evicted(clock):
+    cache = AnalysisCache(max_entries=2, ttl_seconds=30)
+    cache_document(cache, 'q1', {'question_id': 'q1'})
+    cache_document(cache, 'q2', {'question_id': 'q2'})
+    cache.get('q1', False)
+    cache_document(cache, 'q3', {'question_id': 'q3'})
+
+    assert cache.get('q2', False) is None
+    assert cache.get('q1', False) is not None
+    assert cache.get('q3', False) is not None
+
+
+def test_invalidate_drops_every_view(clock):
+    cache = AnalysisCache(max_entries=10, ttl_seconds=30)
+    cache_document(cache, 'q1', {'view': 'summary'}, view=False)
+    cache_document(cache, 'q1', {'view': 'full'}, view=True)
+    cache_document(cache, 'q2', {'view': 'summary'})
+
+    cache.invalidate(['q1'])
+
+    assert cache.get('q1', False) is None
+    assert cache.get('q1', True) is None
+    assert cache.get('q2', False) is not None
+
+
+def test_a_read_in_flight_during_an_invalidation_is_not_cached(clock):
+    cache = AnalysisCache(max_entries=10, ttl_seconds=30)
+    token = cache.begin_read('q1')
+    cache.invalidate(['q1'])
+    cache.end_read('q1', token, False, {'question_id': 'q1', 'version': 'old'})
+
+    assert cache.get('q1', False) is None
+    cache_document(cache, 'q1', {'question_id': 'q1', 'version': 'new'})
+    assert cache.get('q1', False) == {'question_id': 'q1', 'version': 'new'}
+
+
+def test_a_zero_size_cache_is_disabled(clock):
+    cache = AnalysisCache(max_entries=0, ttl_seconds=30)
+    cache_document(cache, 'q1', {'question_id': 'q1'})
+
+    assert not cache.enabled
+    assert cache.get('q1', False) is None
+
+
+def analysis(label):
+    return {
+        'question_id': 'q1',
+        'question_text': 'How was support?',
+        'answers': [{'index': 0, 'answer_text': 'Support', 'sentiment_score': 0.5,
+                     'sentiment_label': label}],
+        'aggregate_sentiment_score': 0.5,
+        'aggregate_sentiment_label': label,
+    }
+
+
+def cached_label(db_manager):
+    return db_manager.get_analyses(['q1'])['q1']['aggregate_sentiment_label']
+
+
+def read_during_writes(db_manager, writer):
+    """Read (and cache) the stored analysis right before each write"""
+    def write(docs, texts):
+        cached_label(db_manager)
+        return writer(docs, texts)
+
+    return write
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def test_sync_save_invalidates_the_cached_analysis(db_manager):
+    db_manager.save_analysis(analysis('NEGATIVE'))
+    assert cached_label(db_manager) == 'NEGATIVE'
+
+    db_manager.save_analysis(analysis('POSITIVE'))
+
+    assert cached_label(db_manager) == 'POSITIVE'
+
+
+@pytest.fixture
+def write_behind_manager(monkeypatch, request):
+    monkeypatch.setattr(config, 'ANALYSIS_WRITE_MODE', 'write_behind')
+    monkeypatch.setattr(config, 'ANALYSIS_WRITE_BATCH_SIZE', 1)
+    return request.getfixturevalue('db_manager')
+
+
+def test_write_behind_flush_invalidates_the_cached_analysis(write_behind_manager):
+    db_manager = write_behind_manager
+    buffer = db_manager._write_behind
+    db_manager.save_analysis(analysis('NEGATIVE'))
+    assert wait_until(lambda: db_manager.get_analysis('q1') is not None)
+    buffer._writer = read_during_writes(db_manager, buffer._writer)
+
+    db_manager.save_analysis(analysis('POSITIVE'))
+
+    # The read before the write cached the old analysis; the flush drops it
+    assert wait_until(lambda: db_manager.get_analysis('q1')['aggregate_sentiment_label'] == 'POSITIVE')
+    assert wait_until(lambda: cached_label(db_manager) == 'POSITIVE')
+
+
+def test_sync_fallback_invalidates_the_cached_analysis(write_behind_manager):
+    db_manager = write_behind_manager
+    buffer = db_manager._write_behind
+    db_manager.save_analysis(analysis('NEGATIVE'))
+    # After close() analyses are written synchronously
+    buffer.close()
+    buffer._writer = read_during_writes(db_manager, buffer._writer)
+
+    db_manager.save_analysis(analysis('POSITIVE'))
+
+    assert cached_label(db_manager) == 'POSITIVE'
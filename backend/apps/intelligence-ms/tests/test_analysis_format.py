@@ -0,0 +1,118 @@
+import pytest
+
+from intelligence.analysis_format import (
+    ANSWER_HASH_SIZE,
+    ANSWER_TEXTS_COLLECTION,
+    COMPACT_FORMAT,
+    LEGACY_FORMAT,
+    analysis_update,
+    answer_hash,
+    answer_hashes,
+    encode_analysis,
+    expand_analyses,
+    expand_analysis,
+    format_version,
+    save_answer_texts,
+)
+
+
+def analysis():
+    return {
+        'question_id': 'q1',
+        'question_text': 'What could be better?',
+        # Stored out of order; the index is authoritative
+        'answers': [
+            {'index': 1, 'answer_text': 'Dark mode', 'sentiment_score': 0.25, 'sentiment_label': 'negative'},
+            {'index': 0, 'answer_text': 'Faster exports', 'sentiment_score': 0.75, 'sentiment_label': 'positive'},
+            {'index': 2, 'answer_text': 'Faster exports', 'sentiment_score': 0.5, 'sentiment_label': 'positive'},
+        ],
+        'aggregate_sentiment_score': 0.5,
+        'aggregate_sentiment_label': 'positive',
+        'cluster_summaries': [{'summary': 'Faster exports', 'count': 2}],
+        'model_version': 'intelligence-ms-test',
+    }
+
+
+def by_index(answers):
+    return sorted(answers, key=lambda answer: answer['index'])
+
+
+def test_legacy_round_trip_keeps_the_document():
+    doc, texts = encode_analysis({**analysis(), 'label_counts': {'stale': 1}}, LEGACY_FORMAT)
+
+    assert texts == {}
+    assert format_version(doc) == LEGACY_FORMAT
+    assert 'label_counts' not in doc
+    assert expand_analysis(doc, {}) == {**analysis(), 'format_version': LEGACY_FORMAT}
+
+
+def test_compact_round_trip_restores_the_legacy_shape():
+    doc, texts = encode_analysis(analysis(), COMPACT_FORMAT)
+
+    assert format_version(doc) == COMPACT_FORMAT
+    assert 'answers' not in doc
+    assert doc['answer_count'] == 3
+    assert len(doc['answer_hashes']) == 3 * ANSWER_HASH_SIZE
+    assert doc['label_names'] == ['positive', 'negative']
+    assert doc['label_counts'] == {'positive': 2, 'negative': 1}
+    # Repeated answers share one stored text
+    assert texts == {answer_hash('Faster exports'): 'Faster exports', answer_hash('Dark mode'): 'Dark mode'}
+    assert answer_hashes(doc) == [answer_hash(text) for text in ('Faster exports', 'Dark mode', 'Faster exports')]
+
+    expanded = expand_analysis(doc, texts)
+    assert expanded['answers'] == by_index(analysis()['answers'])
+    for key in ('question_id', 'question_text', 'cluster_summaries', 'model_version', 'aggregate_sentiment_label'):
+        assert expanded[key] == analysis()[key]
+    assert 'answer_hashes' not in expanded and 'label_counts' not in expanded
+
+
+def test_compact_round_trip_of_an_analysis_without_answers():
+    doc, texts = encode_analysis({**analysis(), 'answers': []}, COMPACT_FORMAT)
+
+    assert texts == {}
+    assert doc['answer_count'] == 0
+    assert doc['label_counts'] == {}
+    assert expand_analysis(doc, texts)['answers'] == []
+
+
+def test_missing_labels_and_texts_expand_to_empty_strings():
+    data = analysis()
+    data['answers'][0]['sentiment_label'] = None
+    doc, _ = encode_analysis(data, COMPACT_FORMAT)
+
+    expanded = expand_analysis(doc, {})
+    assert [answer['answer_text'] for answer in expanded['answers']] == ['', '', '']
+    assert expanded['answers'][1]['sentiment_label'] == ''
+
+
+def test_archived_stub_is_not_expanded():
+    stub = {'question_id': 'q1', 'format_version': COMPACT_FORMAT, 'archived': True, 'label_counts': {'positive': 2}}
+    assert expand_analysis(stub, {}) is stub
+
+
+@pytest.mark.parametrize('version', [LEGACY_FORMAT, COMPACT_FORMAT])
+def test_analysis_update_drops_the_other_format(version):
+    doc, _ = encode_analysis(analysis(), version)
+    update = analysis_update(doc)
+
+    assert update['$set'] is doc
+    assert 'archived' in update['$unset']
+    if version == COMPACT_FORMAT:
+        assert 'answers' in update['$unset']
+    else:
+        assert 'answer_hashes' in update['$unset'] and 'label_counts' in update['$unset']
+
+
+def test_stored_texts_expand_both_formats(db_manager):
+    collection = db_manager.db[ANSWER_TEXTS_COLLECTION]
+    legacy, _ = encode_analysis({**analysis(), 'question_id': 'q0'}, LEGACY_FORMAT)
+    compact, texts = encode_analysis(analysis(), COMPACT_FORMAT)
+    save_answer_texts(collection, texts)
+    # Saving again leaves the stored texts alone
+    save_answer_texts(collection, {answer_hash('Dark mode'): 'changed'})
+
+    expanded = expand_analyses([legacy, compact], collection)
+
+    assert expanded[0]['answers'] == analysis()['answers']
+    assert expanded[1]['answers'] == by_index(analysis()['answers'])
+    assert collection.count_documents({}) == 2
@@ -0,0 +1,158 @@
+import argparse
+import json
+from concurrent.futures import Future
+from datetime import datetime
+
+from intelligence import config
+from intelligence.partitions import ROLLUPS_COLLECTION, close_bucket
+from scripts import backfill
+from scripts.backfill import Writer, mongo_questions
+
+
+def store(db_manager, question_id, **fields):
+    db_manager.db['analyses'].insert_one({
+        'question_id': question_id,
+        'question_text': 'What could be better?',
+        'answers': [{'answer_text': 'Faster exports'}],
+        **fields,
+    })
+
+
+def selected(db_manager, query=None, **kwargs):
+    return [position for position, _ in mongo_questions(db_manager.db, query or {}, **kwargs)]
+
+
+def seed(db_manager):
+    current = dict(config.ANALYSIS_MODELS)
+    store(db_manager, 'q1', model_version=config.MODEL_VERSION, models=current)
+    store(db_manager, 'q2', model_version='intelligence-ms-transformers-v1')
+    store(db_manager, 'q3', model_version='intelligence-ms-old',
+          models={**current, 'sentiment': 'some-org/older-sentiment-model'})
+    store(db_manager, 'q4', model_version='intelligence-ms-old',
+          models={**current, 'embedding': 'some-org/older-embedding-model'})
+    store(db_manager, 'q5', model_version='intelligence-ms-old', archived=True)
+
+
+def test_selects_analyses_of_other_model_versions(db_manager):
+    seed(db_manager)
+    assert selected(db_manager) == ['q2', 'q3', 'q4']
+
+
+def test_all_includes_current_analyses(db_manager):
+    seed(db_manager)
+    assert selected(db_manager, include_current=True) == ['q1', 'q2', 'q3', 'q4']
+
+
+def test_model_changed_selects_analyses_of_another_model_or_none_recorded(db_manager):
+    seed(db_manager)
+    assert selected(db_manager, model_changed=['sentiment']) == ['q2', 'q3']
+    assert selected(db_manager, model_changed=['sentiment', 'embedding']) == ['q2', 'q3', 'q4']
+
+
+def test_query_and_position_narrow_the_selection(db_manager):
+    seed(db_manager)
+    assert selected(db_manager, {'question_id': {'$in': ['q2', 'q3']}}) == ['q2', 'q3']
+    assert selected(db_manager, after='q2') == ['q3', 'q4']
+
+
+def test_questions_carry_their_timestamp(db_manager):
+    store(db_manager, 'q1', timestamp=datetime(2024, 3, 5))
+    assert [question['timestamp'] for _, question in mongo_questions(db_manager.db, {})] == [
+        datetime(2024, 3, 5)]
+
+
+def reanalyzed(question_id, label, timestamp):
+    return {
+        'question_id': question_id,
+        'question_text': 'What could be better?',
+        'answers': [{'index': 0, 'answer_text': 'Faster exports', 'sentiment_score': 0.9,
+                     'sentiment_label': label}],
+        'cluster_summaries': [],
+        'timestamp': timestamp,
+    }
+
+
+def test_writer_keeps_the_bucket_and_recomputes_its_rollup(db_manager):
+    db_manager.save_analyses([reanalyzed('q1', 'NEGATIVE', datetime(2024, 3, 5))])
+    close_bucket(db_manager.db, '2024-03')
+
+    Writer(db_manager, None, dry_run=False).write(
+        [reanalyzed('q1', 'POSITIVE', datetime(2024, 3, 5))])
+
+    doc = db_manager.db['analyses'].find_one({'question_id': 'q1'})
+    assert doc['timestamp'] == datetime(2024, 3, 5)
+    assert doc['bucket'] == '2024-03'
+    rollup = db_manager.db[ROLLUPS_COLLECTION].find_one({'_id': '2024-03'})
+    assert rollup['label_counts'] == {'POSITIVE': 1}
+    assert rollup['analyses'] == 1
+
+
+class InlineExecutor:
+    """ProcessPoolExecutor stand-in running tasks in the calling process"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def backfill_args(tmp_path, **overrides):
+    values = dict(
+        source='mongo', query='{}', all=False, model_changed=[], reuse=False, workers=1,
+        torch_threads=1, batch_questions=2, write_batch=1, rate=0, limit=0,
+        checkpoint=str(tmp_path / 'checkpoint.json'), resume=False, dry_run=False,
+        report_interval=60.0,
+    )
+    values.update(overrides)
+    return argparse.Namespace(**values)
+
+
+def test_failed_chunks_are_retried_on_resume(db_manager, tmp_path, monkeypatch):
+    for question_id in ('q1', 'q2', 'q3', 'q4', 'q5'):
+        store(db_manager, question_id, model_version='intelligence-ms-old',
+              timestamp=datetime(2024, 3, 5))
+    broken = {'q3'}
+
+    def analyze_chunk(questions):
+        if broken & {question['question_id'] for question in questions}:
+            raise RuntimeError('worker died')
+        return [
+            (question['question_id'],
+             {**reanalyzed(question['question_id'], 'POSITIVE', question['timestamp']),
+              'model_version': config.MODEL_VERSION},
+             None)
+            for question in questions
+        ]
+
+    monkeypatch.setattr(backfill, 'ProcessPoolExecutor', InlineExecutor)
+    monkeypatch.setattr(backfill, '_analyze_chunk', analyze_chunk)
+    monkeypatch.setattr(config, 'IDEA_CANONICALIZATION_ENABLED', False)
+
+    # Chunks are (q1, q2), (q3, q4), (q5): the second one raises
+    assert backfill.run(backfill_args(tmp_path)) == 1
+    with open(tmp_path / 'checkpoint.json') as handle:
+        saved = json.load(handle)
+    assert saved['position'] == 'q5'
+    assert saved['failed_questions'] == ['q3', 'q4']
+    assert selected(db_manager) == ['q3', 'q4']
+
+    broken.clear()
+    assert backfill.run(backfill_args(tmp_path, resume=True)) == 0
+    with open(tmp_path / 'checkpoint.json') as handle:
+        saved = json.load(handle)
+    assert saved['failed_questions'] == []
+    assert saved['position'] == 'q5'
+    assert selected(db_manager) == []
+    assert db_manager.db['analyses'].find_one({'question_id': 'q3'})['bucket'] == '2024-03'
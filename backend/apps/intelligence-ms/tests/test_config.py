@@ -0,0 +1,25 @@
+import importlib
+
+import pytest
+
+from intelligence import config
+
+
+@pytest.fixture
+def reload_config(monkeypatch):
+    yield lambda: importlib.reload(config)
+    monkeypatch.undo()
+    importlib.reload(config)
+
+
+@pytest.mark.parametrize('mode', ['sync', 'write_behind', ' Write_Behind '])
+def test_write_mode_accepts_known_modes(monkeypatch, reload_config, mode):
+    monkeypatch.setenv('ANALYSIS_WRITE_MODE', mode)
+    assert reload_config().ANALYSIS_WRITE_MODE == mode.strip().lower()
+
+
+@pytest.mark.parametrize('mode', ['async', 'writebehind', ''])
+def test_write_mode_rejects_unknown_modes(monkeypatch, reload_config, mode):
+    monkeypatch.setenv('ANALYSIS_WRITE_MODE', mode)
+    with pytest.raises(ValueError, match='ANALYSIS_WRITE_MODE'):
+        reload_config()
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from intelligence.idea_catalog import IdeaCatalog
+
+
+def cluster(summary, count, centroid):
+    return {'summary': summary, 'count': count, 'centroid': np.asarray(centroid, dtype=np.float32)}
+
+
+def analysis(question_id, clusters):
+    return {
+        'question_id': question_id,
+        'question_text': 'What could be better?',
+        'answers': [
+            {'index': 0, 'answer_text': 'faster exports', 'sentiment_score': 0.5, 'sentiment_label': 'NEUTRAL'},
+        ],
+        'cluster_summaries': [
+            {key: value for key, value in item.items() if key != 'centroid'} for item in clusters
+        ],
+    }
+
+
+def frequencies(db_manager):
+    return {doc['summary']: doc['frequency'] for doc in db_manager.db['ideas'].find()}
+
+
+@pytest.fixture
+def catalog(db_manager):
+    return IdeaCatalog(db_manager.db['ideas'], merge_distance=0.1)
+
+
+def test_canonicalize_matches_existing_ideas_and_creates_new_ones(catalog, db_manager):
+    first = [cluster('Faster exports', 3, [1, 0, 0]), cluster('Dark mode', 2, [0, 1, 0])]
+    catalog.canonicalize(first)
+    second = [cluster('Quicker exports', 1, [0.99, 0.05, 0]), cluster('Pricing', 1, [0, 0, 1])]
+    catalog.canonicalize(second)
+
+    assert second[0]['idea_id'] == first[0]['idea_id']
+    assert second[1]['idea_id'] not in (first[0]['idea_id'], first[1]['idea_id'])
+    assert db_manager.db['ideas'].count_documents({}) == 3
+    # Nothing is counted until an analysis is saved
+    assert set(frequencies(db_manager).values()) == {0}
+
+
+def test_similar_clusters_of_one_analysis_share_a_new_idea(catalog, db_manager):
+    clusters = [cluster('Faster exports', 3, [1, 0, 0]), cluster('Quicker exports', 1, [0.99, 0.05, 0])]
+    catalog.canonicalize(clusters)
+    assert clusters[0]['idea_id'] == clusters[1]['idea_id']
+    assert db_manager.db['ideas'].count_documents({}) == 1
+
+
+def test_ideas_created_by_another_replica_are_matched(catalog, db_manager):
+    other = IdeaCatalog(db_manager.db['ideas'], merge_distance=0.1)
+    created = [cluster('Faster exports', 3, [1, 0, 0])]
+    other.canonicalize(created)
+
+    clusters = [cluster('Quicker exports', 1, [0.99, 0.05, 0])]
+    catalog.canonicalize(clusters)
+    assert clusters[0]['idea_id'] == created[0]['idea_id']
+
+
+def test_frequencies_move_when_the_analysis_is_saved(catalog, db_manager):
+    clusters = [cluster('Faster exports', 3, [1, 0, 0])]
+    catalog.canonicalize(clusters)
+    db_manager.save_analysis(analysis('q1', clusters))
+    assert frequencies(db_manager) == {'Faster exports': 3}
+
+    # Re-analysis replaces the question's contribution instead of adding to it
+    clusters = [cluster('Faster exports', 5, [1, 0, 0]), cluster('Dark mode', 2, [0, 1, 0])]
+    catalog.canonicalize(clusters)
+    db_manager.save_analysis(analysis('q1', clusters))
+    assert frequencies(db_manager) == {'Faster exports': 5, 'Dark mode': 2}
+
+
+def test_failed_save_does_not_count(catalog, db_manager, monkeypatch):
+    clusters = [cluster('Faster exports', 3, [1, 0, 0])]
+    catalog.canonicalize(clusters)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('write failed')
+
+    monkeypatch.setattr(db_manager.db['analyses'], 'bulk_write', fail)
+    with pytest.raises(Exception):
+        db_manager.save_analysis(analysis('q1', clusters))
+    assert frequencies(db_manager) == {'Faster exports': 0}
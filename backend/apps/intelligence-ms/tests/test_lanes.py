@@ -0,0 +1,108 @@
+import threading
+from concurrent import futures
+
+import grpc
+import pytest
+
+from intelligence import analytics_pb2, analytics_pb2_grpc
+from intelligence.lanes import (
+    ANALYZE_LANE,
+    EXPORT_LANE,
+    READ_LANE,
+    Lane,
+    LaneFull,
+    LaneInterceptor,
+    RpcLanes,
+)
+from intelligence.servicer import AnalyticsServicer
+
+
+def test_lane_rejects_calls_beyond_its_queue():
+    lane = Lane('test', concurrency=1, queue_size=0)
+    lane.acquire()
+
+    with pytest.raises(LaneFull):
+        lane.acquire()
+    lane.release()
+    lane.acquire(timeout=0.1)
+    lane.release()
+
+
+def test_queued_call_times_out():
+    lane = Lane('test', concurrency=1, queue_size=1)
+    lane.acquire()
+
+    with pytest.raises(TimeoutError):
+        lane.acquire(timeout=0.01)
+    lane.release()
+
+
+class BlockingReads:
+    """Holds get_analyses calls until released"""
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.entered = threading.Event()
+        self.released = threading.Event()
+        self.blocking = True
+        self._get_analyses = db_manager.get_analyses
+        db_manager.get_analyses = self.get_analyses
+
+    def get_analyses(self, *args, **kwargs):
+        if self.blocking:
+            self.entered.set()
+            assert self.released.wait(5)
+        return self._get_analyses(*args, **kwargs)
+
+
+@pytest.fixture
+def lanes():
+    return RpcLanes({
+        name: Lane(name, concurrency=1, queue_size=0)
+        for name in (ANALYZE_LANE, READ_LANE, EXPORT_LANE)
+    })
+
+
+@pytest.fixture
+def stub(db_manager, lanes):
+    db_manager.save_analysis({'question_id': 'q1', 'question_text': 'How was support?',
+                              'answers': []})
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=lanes.thread_budget() + 2),
+        interceptors=[LaneInterceptor(lanes)],
+    )
+    analytics_pb2_grpc.add_AnalyticsServiceServicer_to_server(
+        AnalyticsServicer(db_manager, None, None), server)
+    port = server.add_insecure_port('127.0.0.1:0')
+    server.start()
+    channel = grpc.insecure_channel(f'127.0.0.1:{port}')
+    yield analytics_pb2_grpc.AnalyticsServiceStub(channel)
+    channel.close()
+    server.stop(None)
+
+
+def test_interceptor_holds_the_lane_of_the_rpc(db_manager, lanes, stub):
+    reads = BlockingReads(db_manager)
+    running = stub.GetAnalysis.future(analytics_pb2.GetAnalysisRequest(question_id='q1'))
+    assert reads.entered.wait(5)
+    reads.blocking = False
+
+    try:
+        assert lanes.lanes[READ_LANE]._running == 1
+        assert lanes.lanes[ANALYZE_LANE]._running == 0
+        # A second read finds its lane full...
+        with pytest.raises(grpc.RpcError) as rejected:
+            stub.GetAnalyses(analytics_pb2.GetAnalysesRequest(question_ids=['q1']))
+        assert rejected.value.code() == grpc.StatusCode.RESOURCE_EXHAUSTED
+        assert 'read lane is full' in rejected.value.details()
+        # ...while an export runs in a lane of its own
+        chunks = list(stub.ExportAnalyses(analytics_pb2.ExportAnalysesRequest()))
+        assert sum(chunk.rows for chunk in chunks) == 0
+        assert lanes.lanes[EXPORT_LANE]._running == 0
+    finally:
+        reads.released.set()
+
+    assert running.result(timeout=5).question_id == 'q1'
+    assert lanes.lanes[READ_LANE]._running == 0
+    response = stub.GetAnalyses(analytics_pb2.GetAnalysesRequest(question_ids=['q1']))
+    assert [analysis.question_id for analysis in response.analyses] == ['q1']
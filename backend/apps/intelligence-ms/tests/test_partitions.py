@@ -0,0 +1,242 @@
+from datetime import datetime
+
+import pytest
+
+from intelligence.partitions import (
+    IDEA_ROLLUPS_COLLECTION,
+    ROLLUPS_COLLECTION,
+    archive_bucket,
+    archive_collection,
+    assign_buckets,
+    bucket_of,
+    close_bucket,
+    closed_buckets,
+    contribution,
+    idea_count_pipeline,
+    months_before,
+    open_match,
+)
+
+
+def analysis(question_id, labels, ideas, timestamp):
+    return {
+        'question_id': question_id,
+        'question_text': 'What could be better?',
+        'answers': [
+            {
+                'index': index,
+                'answer_text': f'{question_id} answer {index}',
+                'sentiment_score': 0.9,
+                'sentiment_label': label,
+            }
+            for index, label in enumerate(labels)
+        ],
+        'aggregate_sentiment_score': 0.9,
+        'aggregate_sentiment_label': labels[0],
+        'cluster_summaries': [{'summary': summary, 'count': count} for summary, count in ideas.items()],
+        'timestamp': timestamp,
+    }
+
+
+def idea_rollups(db_manager, bucket):
+    return {
+        doc['summary']: doc['count']
+        for doc in db_manager.db[IDEA_ROLLUPS_COLLECTION].find({'bucket': bucket})
+    }
+
+
+def label_stats(db_manager):
+    return {stat['sentiment']: stat['count'] for stat in db_manager.get_sentiment_stats()['stats']}
+
+
+def test_bucket_of_and_months_before():
+    assert bucket_of(datetime(2024, 3, 31, 23, 59)) == '2024-03'
+    assert months_before('2024-03', 2) == '2024-01'
+    assert months_before('2024-03', 3) == '2023-12'
+    assert months_before('2024-03', 27) == '2021-12'
+    assert archive_collection('2024-03') == 'analyses_archive_2024_03'
+
+
+def test_contribution_of_legacy_and_compact_documents():
+    legacy = {
+        'answers': [
+            {'sentiment_label': 'positive'},
+            {'sentiment_label': 'positive'},
+            {'sentiment_label': None},
+        ],
+        'cluster_summaries': [
+            {'summary': 'Faster exports', 'count': 2},
+            {'summary': 'Dark mode'},
+            {'summary': '', 'count': 5},
+        ],
+    }
+    assert contribution(legacy) == (
+        {'positive': 2, '': 1},
+        {'Faster exports': 2, 'Dark mode': 1},
+    )
+    compact = {'label_counts': {'negative': 3}, 'answers': [{'sentiment_label': 'positive'}]}
+    assert contribution(compact) == ({'negative': 3}, {})
+
+
+def test_close_bucket_rolls_up_its_analyses(db_manager):
+    db_manager.save_analyses([
+        analysis('q1', ['positive', 'negative'], {'Faster exports': 2}, datetime(2024, 1, 10)),
+        analysis('q2', ['positive'], {'Faster exports': 1, 'Dark mode': 1}, datetime(2024, 1, 20)),
+        analysis('q3', ['neutral'], {'Dark mode': 1}, datetime(2024, 2, 1)),
+    ])
+
+    rollup = close_bucket(db_manager.db, '2024-01')
+
+    assert rollup['label_counts'] == {'positive': 2, 'negative': 1}
+    assert rollup['answers'] == 3
+    assert rollup['analyses'] == 2
+    assert idea_rollups(db_manager, '2024-01') == {'Faster exports': 3, 'Dark mode': 1}
+    # Closed buckets come from the rollup, open ones from the analyses
+    assert label_stats(db_manager) == {'positive': 2, 'negative': 1, 'neutral': 1}
+
+
+def test_resave_moves_an_analysis_out_of_its_closed_bucket(db_manager):
+    db_manager.save_analyses([
+        analysis('q1', ['positive', 'negative'], {'Faster exports': 2}, datetime(2024, 1, 10)),
+        analysis('q2', ['positive'], {'Dark mode': 1}, datetime(2024, 1, 20)),
+    ])
+    close_bucket(db_manager.db, '2024-01')
+
+    db_manager.save_analyses([
+        analysis('q1', ['neutral'], {'Dark mode': 1}, datetime(2024, 2, 5)),
+    ])
+
+    rollup = db_manager.db[ROLLUPS_COLLECTION].find_one({'_id': '2024-01'})
+    assert rollup['label_counts'] == {'positive': 1, 'negative': 0}
+    assert rollup['answers'] == 1
+    assert rollup['analyses'] == 1
+    assert idea_rollups(db_manager, '2024-01') == {'Faster exports': 0, 'Dark mode': 1}
+    assert db_manager.db['analyses'].find_one({'question_id': 'q1'})['bucket'] == '2024-02'
+    assert label_stats(db_manager) == {'positive': 1, 'neutral': 1}
+    # Recomputing the bucket agrees with the released rollup
+    assert close_bucket(db_manager.db, '2024-01')['label_counts'] == {'positive': 1}
+
+
+def test_assign_buckets_uses_the_timestamp(db_manager):
+    db_manager.db['analyses'].insert_many([
+        {'question_id': 'q1', 'timestamp': datetime(2024, 5, 3)},
+        {'question_id': 'q2'},
+        {'question_id': 'q3', 'timestamp': datetime(2024, 6, 1), 'bucket': '2024-06'},
+    ])
+
+    assert assign_buckets(db_manager.db, batch_size=1) == 2
+
+    buckets = {doc['question_id']: doc['bucket'] for doc in db_manager.db['analyses'].find()}
+    assert buckets == {'q1': '2024-05', 'q2': '1970-01', 'q3': '2024-06'}
+
+
+@pytest.mark.parametrize('doc_format', [1, 2])
+def test_archive_bucket_keeps_a_stub_with_the_contribution(db_manager, monkeypatch, doc_format):
+    from intelligence import config
+
+    monkeypatch.setattr(config, 'ANALYSIS_DOC_FORMAT', doc_format)
+    db_manager.save_analyses([
+        analysis('q1', ['positive', 'negative'], {'Faster exports': 2}, datetime(2024, 1, 10)),
+        analysis('q2', ['neutral'], {'Dark mode': 1}, datetime(2024, 2, 1)),
+    ])
+    close_bucket(db_manager.db, '2024-01')
+
+    assert archive_bucket(db_manager.db, '2024-01') == 1
+
+    stub = db_manager.db['analyses'].find_one({'question_id': 'q1'}, {'_id': 0})
+    assert stub['archived'] is True
+    assert stub['label_counts'] == {'positive': 1, 'negative': 1}
+    assert stub['answer_count'] == 2
+    assert 'answers' not in stub and 'answer_hashes' not in stub
+    assert stub['cluster_summaries'] == [{'summary': 'Faster exports', 'count': 2}]
+    archived = db_manager.db[archive_collection('2024-01')].find_one({'question_id': 'q1'})
+    assert archived['bucket'] == '2024-01'
+    assert contribution(stub)[0] == contribution(archived)[0]
+    assert label_stats(db_manager) == {'positive': 1, 'negative': 1, 'neutral': 1}
+
+
+class HookedCollection:
+    """Collection running a hook once, before the first matching call of a method"""
+
+    def __init__(self, collection, method, when, hook):
+        self._collection = collection
+        self._method = method
+        self._when = when
+        self._hook = hook
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name != self._method:
+            return attribute
+
+        def hooked(*args, **kwargs):
+            if self._hook is not None and self._when(*args):
+                hook, self._hook = self._hook, None
+                hook()
+            return attribute(*args, **kwargs)
+
+        return hooked
+
+
+class HookedDatabase:
+    def __init__(self, db, collection, method, when, hook):
+        self._db = db
+        self._hooked = HookedCollection(db[collection], method, when, hook)
+        self._name = collection
+
+    def __getitem__(self, name):
+        return self._hooked if name == self._name else self._db[name]
+
+
+@pytest.mark.parametrize('collection,method,when', [
+    # Moved once the bucket is marked closing, before its analyses are counted
+    ('analyses', 'find', lambda query, *args: query == {'bucket': '2024-01'}),
+    # Moved after they are counted
+    (ROLLUPS_COLLECTION, 'find_one', lambda *args: True),
+    # Moved between computing the rollup and finishing it
+    (ROLLUPS_COLLECTION, 'update_one', lambda query, *args: 'releases' in query),
+])
+def test_close_bucket_counts_a_concurrent_move_once(db_manager, collection, method, when):
+    db_manager.save_analyses([
+        analysis('q1', ['positive', 'negative'], {'Faster exports': 2}, datetime(2024, 1, 10)),
+        analysis('q2', ['positive'], {'Dark mode': 1}, datetime(2024, 1, 20)),
+    ])
+
+    def resave():
+        db_manager.save_analyses([
+            analysis('q1', ['neutral'], {'Dark mode': 1}, datetime(2024, 2, 5)),
+        ])
+
+    rollup = close_bucket(HookedDatabase(db_manager.db, collection, method, when, resave), '2024-01')
+
+    assert rollup['label_counts'] == {'positive': 1}
+    assert rollup['analyses'] == 1
+    stored = db_manager.db[ROLLUPS_COLLECTION].find_one({'_id': '2024-01'})
+    assert 'closing' not in stored and 'releases' not in stored
+    assert stored['label_counts'] == {'positive': 1}
+    assert idea_rollups(db_manager, '2024-01') == {'Dark mode': 1}
+    assert label_stats(db_manager) == {'positive': 1, 'neutral': 1}
+
+
+def test_a_closing_bucket_counts_as_open(db_manager):
+    db_manager.save_analyses([
+        analysis('q1', ['positive'], {'Dark mode': 1}, datetime(2024, 1, 10)),
+        analysis('q2', ['negative'], {'Dark mode': 1}, datetime(2024, 2, 10)),
+    ])
+    close_bucket(db_manager.db, '2024-02')
+    # As left by a close_bucket() that was interrupted
+    db_manager.db[ROLLUPS_COLLECTION].insert_one({'_id': '2024-01', 'closing': True, 'releases': []})
+
+    assert closed_buckets(db_manager.db) == ['2024-02']
+    assert label_stats(db_manager) == {'positive': 1, 'negative': 1}
+    open_ideas = db_manager.db['analyses'].aggregate(
+        idea_count_pipeline(open_match(closed_buckets(db_manager.db))))
+    assert [(idea['_id'], idea['count']) for idea in open_ideas] == [('Dark mode', 1)]
+
+    db_manager.save_analyses([analysis('q1', ['neutral'], {}, datetime(2024, 3, 1))])
+    rollup = db_manager.db[ROLLUPS_COLLECTION].find_one({'_id': '2024-01'})
+    assert [release['question_id'] for release in rollup['releases']] == ['q1']
+
+    # Closing again keeps the queued release, which the count no longer needs
+    assert close_bucket(db_manager.db, '2024-01')['analyses'] == 0
+    assert label_stats(db_manager) == {'negative': 1, 'neutral': 1}
@@ -0,0 +1,123 @@
+import threading
+import time
+
+import pytest
+
+from intelligence.scheduler import FairScheduler, estimate_cost
+
+
+def test_estimate_cost_counts_answers_and_characters(monkeypatch):
+    monkeypatch.setattr('intelligence.config.SCHEDULER_CHARS_PER_UNIT', 10)
+    assert estimate_cost([]) == 1.0
+    assert estimate_cost(['a' * 10, 'b' * 30]) == 2 + 4
+
+
+class Recorder:
+    """Queues jobs behind a held slot and records the order they start in"""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.started = []
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def submit(self, name, form_id, cost=1.0, priority=0):
+        def job():
+            with self.scheduler.slot(form_id, cost, priority):
+                with self._lock:
+                    self.started.append(name)
+
+        thread = threading.Thread(target=job)
+        thread.start()
+        self._threads.append(thread)
+        # Wait until the job is queued, so submission order is deterministic
+        deadline = time.monotonic() + 2
+        while self.scheduler._waiting < len(self._threads) and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join(2)
+        assert not any(thread.is_alive() for thread in self._threads)
+
+
+def run_queued(scheduler, jobs):
+    """Hold the only slot, queue jobs, then release it and return the start order"""
+    recorder = Recorder(scheduler)
+    with scheduler.slot('holder', 1.0):
+        for job in jobs:
+            recorder.submit(*job)
+    recorder.join()
+    return recorder.started
+
+
+def test_free_slots_are_granted_immediately():
+    scheduler = FairScheduler(concurrency=2)
+    with scheduler.slot('a', 1.0):
+        with scheduler.slot('b', 1.0, timeout=0.01):
+            pass
+
+
+def test_forms_share_slots_round_robin():
+    scheduler = FairScheduler(concurrency=1, quantum=1)
+    started = run_queued(scheduler, [
+        ('a1', 'a'), ('a2', 'a'), ('a3', 'a'), ('b1', 'b'), ('c1', 'c'),
+    ])
+    assert started == ['a1', 'b1', 'c1', 'a2', 'a3']
+
+
+def test_large_jobs_wait_for_enough_credit():
+    scheduler = FairScheduler(concurrency=1, quantum=10)
+    started = run_queued(scheduler, [
+        ('big1', 'big', 30), ('big2', 'big', 30),
+        ('small1', 'small', 5), ('small2', 'small', 5), ('small3', 'small', 5), ('small4', 'small', 5),
+    ])
+    # The small form gets through its jobs while the big one saves up
+    assert started.index('small4') < started.index('big2')
+    assert sorted(started) == sorted(['big1', 'big2', 'small1', 'small2', 'small3', 'small4'])
+
+
+def test_higher_priority_is_served_first():
+    scheduler = FairScheduler(concurrency=1, quantum=1)
+    started = run_queued(scheduler, [('low', 'a', 1, 0), ('high', 'b', 1, 5), ('mid', 'c', 1, 1)])
+    assert started == ['high', 'mid', 'low']
+
+
+def test_wait_is_bounded_by_the_timeout():
+    scheduler = FairScheduler(concurrency=1)
+    with scheduler.slot('a', 1.0):
+        started = time.monotonic()
+        with pytest.raises(TimeoutError):
+            with scheduler.slot('b', 1.0, timeout=0.05):
+                pass
+        assert time.monotonic() - started < 1
+    assert scheduler._waiting == 0
+    # The timed-out waiter left no trace; the slot is free again
+    with scheduler.slot('b', 1.0, timeout=0.05):
+        pass
+
+
+def test_grpc_no_deadline_means_no_timeout():
+    scheduler = FairScheduler(concurrency=1)
+    granted = threading.Event()
+
+    def job():
+        # time_remaining() of a call without a deadline
+        with scheduler.slot('b', 1.0, timeout=float(2 ** 63)):
+            granted.set()
+
+    with scheduler.slot('a', 1.0):
+        thread = threading.Thread(target=job)
+        thread.start()
+        assert not granted.wait(0.05)
+    thread.join(2)
+    assert granted.is_set()
+
+
+def test_slot_is_released_when_the_job_fails():
+    scheduler = FairScheduler(concurrency=1)
+    with pytest.raises(RuntimeError):
+        with scheduler.slot('a', 1.0):
+            raise RuntimeError('analysis failed')
+    with scheduler.slot('a', 1.0, timeout=0.01):
+        pass
@@ -0,0 +1,58 @@
+import logging
+
+import pytest
+
+from intelligence import config
+from intelligence.sentiment_analyzer import SentimentAnalyzer
+
+
+def fake_pipeline(texts, **kwargs):
+    def scores(text):
+        positive = 0.8 if 'great' in text else 0.1
+        return [
+            {'label': 'positive', 'score': positive},
+            {'label': 'neutral', 'score': 0.1},
+            {'label': 'negative', 'score': 0.9 - positive},
+        ]
+
+    if isinstance(texts, str):
+        return [scores(texts)]
+    return [scores(text) for text in texts]
+
+
+@pytest.fixture
+def analyzer(monkeypatch):
+    monkeypatch.setattr(config, 'SENTIMENT_REPORT_ENABLED', True)
+    analyzer = SentimentAnalyzer(eager=False)
+    analyzer._sentiment = fake_pipeline
+    return analyzer
+
+
+def reports(caplog):
+    return [
+        record.getMessage() for record in caplog.records
+        if record.getMessage().startswith('Sentiment report')
+    ]
+
+
+def test_analyze_and_analyze_batch_log_the_same_report(analyzer, caplog):
+    caplog.set_level(logging.INFO, logger='intelligence.sentiment_analyzer')
+
+    single = [analyzer.analyze(text) for text in ('great support', 'slow exports')]
+    single_reports = reports(caplog)
+    caplog.clear()
+    batch = analyzer.analyze_batch(['great support', '', 'slow exports'])
+
+    assert batch == [single[0], (0.5, 'NEUTRAL'), single[1]]
+    assert len(single_reports) == 2
+    assert reports(caplog) == single_reports
+    assert single_reports[0].endswith('label=POSITIVE')
+
+
+def test_reports_are_not_logged_when_disabled(analyzer, caplog, monkeypatch):
+    monkeypatch.setattr(config, 'SENTIMENT_REPORT_ENABLED', False)
+    caplog.set_level(logging.INFO, logger='intelligence.sentiment_analyzer')
+
+    analyzer.analyze_batch(['great support'])
+
+    assert reports(caplog) == []
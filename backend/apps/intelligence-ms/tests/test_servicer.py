@@ -0,0 +1,326 @@
+from datetime import datetime, timezone
+
+import grpc
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from intelligence import analytics_pb2, config
+from intelligence.servicer import AnalyticsServicer
+
+
+class FakeDatabase:
+    def __init__(self, document):
+        self.document = document
+
+    def get_analysis(self, question_id):
+        return self.document
+
+
+def servicer_with(document):
+    servicer = AnalyticsServicer.__new__(AnalyticsServicer)
+    servicer.db_manager = FakeDatabase(document)
+    return servicer
+
+
+@pytest.fixture(autouse=True)
+def incremental(monkeypatch):
+    monkeypatch.setattr(config, 'INCREMENTAL_ANALYSIS_ENABLED', True)
+
+
+def stored(**overrides):
+    document = {
+        'question_id': 'q1',
+        'model_version': config.MODEL_VERSION,
+        'models': dict(config.ANALYSIS_MODELS),
+        'answers': [],
+    }
+    document.update(overrides)
+    return document
+
+
+def test_load_previous_reuses_analysis_of_the_current_models():
+    document = stored()
+    assert servicer_with(document).load_previous('q1') is document
+
+
+def test_load_previous_skips_analysis_of_another_version():
+    assert servicer_with(stored(model_version='intelligence-ms-old')).load_previous('q1') == {}
+
+
+def test_load_previous_skips_analysis_of_another_model_with_a_pinned_version():
+    models = dict(config.ANALYSIS_MODELS, sentiment='some-org/older-sentiment-model')
+    assert servicer_with(stored(models=models)).load_previous('q1') == {}
+
+
+def test_load_previous_skips_analysis_without_models():
+    document = stored()
+    del document['models']
+    assert servicer_with(document).load_previous('q1') == {}
+
+
+def test_load_previous_for_incremental_clustering_only(monkeypatch):
+    monkeypatch.setattr(config, 'INCREMENTAL_ANALYSIS_ENABLED', False)
+    monkeypatch.setattr(config, 'INCREMENTAL_CLUSTERING_ENABLED', True)
+    document = stored(answers=[
+        {'index': 0, 'answer_text': 'Faster checkout', 'sentiment_score': 0.9,
+         'sentiment_label': 'POSITIVE'},
+    ])
+    servicer = servicer_with(document)
+
+    assert servicer.load_previous('q1') is document
+    # The clusters are reused, the per-answer results are not
+    assert servicer.reusable_results(document) == ({}, {})
+
+
+def test_load_previous_without_either_flag(monkeypatch):
+    monkeypatch.setattr(config, 'INCREMENTAL_ANALYSIS_ENABLED', False)
+    monkeypatch.setattr(config, 'INCREMENTAL_CLUSTERING_ENABLED', False)
+
+    assert servicer_with(stored()).load_previous('q1') == {}
+
+
+class FakeSentimentAnalyzer:
+    def __init__(self):
+        self.batches = []
+
+    def analyze_batch(self, texts):
+        self.batches.append(list(texts))
+        return [(0.9, 'POSITIVE') if 'great' in text else (0.1, 'NEGATIVE') for text in texts]
+
+
+class FakeIdeaSummarizer:
+    def __init__(self):
+        self.embedded = []
+
+    @staticmethod
+    def normalize_answer(answer):
+        return ' '.join((answer or '').split())
+
+    def embed_unique(self, texts):
+        texts = list(dict.fromkeys(texts))
+        self.embedded.extend(texts)
+        return {text: np.ones(2, dtype=np.float32) for text in texts}
+
+    def summarize_and_embed(self, answers, question_text, known_embeddings=None,
+                            previous_clusters=None):
+        embeddings = {self.normalize_answer(answer): np.ones(2, dtype=np.float32)
+                      for answer in answers}
+        return [{'summary': 'Support', 'count': len(answers)}], embeddings
+
+
+class Aborted(Exception):
+    pass
+
+
+class FakeContext:
+    def __init__(self, metadata=()):
+        self.metadata = tuple(metadata)
+
+    def invocation_metadata(self):
+        return self.metadata
+
+    def time_remaining(self):
+        return None
+
+    def abort(self, code, details):
+        raise Aborted(code, details)
+
+
+@pytest.fixture
+def pipeline(db_manager):
+    return AnalyticsServicer(db_manager, FakeSentimentAnalyzer(), FakeIdeaSummarizer())
+
+
+def test_analyze_question_stream_ends_with_the_status(pipeline, monkeypatch):
+    monkeypatch.setattr(config, 'ANALYSIS_STREAM_CHUNK_SIZE', 2)
+    request = analytics_pb2.AnalysisRequest(
+        question_id='q1',
+        question_text='How was support?',
+        answer_text=['great support', 'slow replies', 'great docs'],
+    )
+
+    events = list(pipeline.AnalyzeQuestionStream(request, FakeContext()))
+
+    assert [event.WhichOneof('event') for event in events] == [
+        'sentiments', 'sentiments', 'clusters', 'status']
+    assert [
+        [(answer.index, answer.sentiment_label) for answer in event.sentiments.answers]
+        for event in events[:2]
+    ] == [[(0, 'POSITIVE'), (1, 'NEGATIVE')], [(2, 'POSITIVE')]]
+    assert [(item.summary, item.count) for item in events[2].clusters.cluster_summaries] == [
+        ('Support', 3)]
+    status = events[-1].status
+    assert status.success and status.question_id == 'q1'
+    assert status.aggregate_sentiment_label == 'POSITIVE'
+    # The status is sent once the analysis is saved
+    assert pipeline.db_manager.get_analysis('q1')['aggregate_sentiment_label'] == 'POSITIVE'
+
+
+def test_analyze_question_stream_reports_a_failure_last(pipeline):
+    def fail(*args, **kwargs):
+        raise RuntimeError('clustering failed')
+
+    pipeline.idea_summarizer.summarize_and_embed = fail
+    request = analytics_pb2.AnalysisRequest(question_id='q1', answer_text=['great support'])
+
+    events = list(pipeline.AnalyzeQuestionStream(request, FakeContext()))
+
+    assert [event.WhichOneof('event') for event in events] == ['sentiments', 'status']
+    assert not events[-1].status.success
+    assert events[-1].status.error_message == 'clustering failed'
+
+
+def test_upload_waits_for_a_late_question_id(pipeline):
+    pipeline.db_manager.save_analysis({
+        'question_id': 'q1',
+        'question_text': 'How was support?',
+        'answers': [{'index': 0, 'answer_text': 'great support', 'sentiment_score': 0.9,
+                     'sentiment_label': 'POSITIVE'}],
+        'model_version': config.MODEL_VERSION,
+        'models': dict(config.ANALYSIS_MODELS),
+    })
+    chunks = [
+        analytics_pb2.AnswerChunk(answer_text=['great support'], compact=True),
+        analytics_pb2.AnswerChunk(),
+        analytics_pb2.AnswerChunk(question_id='q1', answer_text=['slow replies']),
+        analytics_pb2.AnswerChunk(question_text='How was support?', answer_text=['great docs']),
+    ]
+
+    response = pipeline.AnalyzeQuestionUpload(iter(chunks), FakeContext())
+
+    assert response.success, response.error_message
+    assert response.question_id == 'q1'
+    assert list(response.compact_answers.indices) == [0, 1, 2]
+    assert list(response.compact_answers.sentiment_labels) == [
+        analytics_pb2.SENTIMENT_LABEL_POSITIVE,
+        analytics_pb2.SENTIMENT_LABEL_NEGATIVE,
+        analytics_pb2.SENTIMENT_LABEL_POSITIVE,
+    ]
+    # The answer sent before question_id reused the stored analysis of q1
+    assert response.reused_answers == 1
+    assert pipeline.sentiment_analyzer.batches == [['slow replies'], ['great docs']]
+    stored = pipeline.db_manager.get_analysis('q1')
+    assert stored['question_text'] == 'How was support?'
+    assert [answer['answer_text'] for answer in stored['answers']] == [
+        'great support', 'slow replies', 'great docs']
+
+
+def test_upload_without_a_question_id_fails(pipeline):
+    response = pipeline.AnalyzeQuestionUpload(
+        iter([analytics_pb2.AnswerChunk(answer_text=['great support'])]), FakeContext())
+
+    assert not response.success
+    assert response.error_message == 'No answer chunk set question_id'
+
+
+def millis(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+@pytest.fixture
+def exported(pipeline):
+    answers = {
+        'q1': ['great support', 'slow replies', 'great docs'],
+        'q2': ['great app', 'crashes'],
+        'q3': ['great'],
+    }
+    pipeline.db_manager.save_analyses([
+        {
+            'question_id': question_id,
+            'question_text': f'Question {question_id}',
+            'timestamp': timestamp,
+            'model_version': model_version,
+            'answers': [
+                {'index': index, 'answer_text': text, 'sentiment_score': 0.9,
+                 'sentiment_label': 'POSITIVE' if 'great' in text else 'NEGATIVE'}
+                for index, text in enumerate(answers[question_id])
+            ],
+            'aggregate_sentiment_score': 0.5,
+            'aggregate_sentiment_label': 'POSITIVE',
+            'cluster_summaries': [{'summary': 'Support', 'count': len(answers[question_id])}],
+        }
+        for question_id, timestamp, model_version in (
+            ('q1', datetime(2024, 1, 10), 'v1'),
+            ('q2', datetime(2024, 2, 10), 'v1'),
+            ('q3', datetime(2024, 2, 15), 'v2'),
+        )
+    ])
+    return pipeline
+
+
+def export_tables(servicer, **fields):
+    """Decode every message on its own, as the README tells clients they can"""
+    chunks = list(servicer.ExportAnalyses(
+        analytics_pb2.ExportAnalysesRequest(**fields), FakeContext()))
+    tables = [pa.ipc.open_stream(chunk.ipc_stream).read_all() for chunk in chunks]
+    assert [chunk.rows for chunk in chunks] == [table.num_rows for table in tables]
+    return tables
+
+
+def test_export_answers_with_filters(exported):
+    tables = export_tables(
+        exported,
+        model_version='v1',
+        analyzed_after=millis(2024, 1, 1),
+        analyzed_before=millis(2024, 2, 12),
+        include_answer_texts=True,
+        batch_rows=2,
+    )
+
+    assert [table.num_rows for table in tables] == [2, 2, 1]
+    assert {str(table.schema) for table in tables} == {str(tables[0].schema)}
+    schema = tables[0].schema
+    assert schema.names == [
+        'question_id', 'analyzed_at', 'model_version', 'answer_index',
+        'answer_text', 'sentiment_score', 'sentiment_label']
+    assert schema.field('analyzed_at').type == pa.timestamp('ms', tz='UTC')
+    assert schema.field('answer_index').type == pa.int32()
+    assert schema.field('sentiment_score').type == pa.float32()
+    assert pa.types.is_dictionary(schema.field('sentiment_label').type)
+    rows = pa.concat_tables(tables).to_pylist()
+    assert [(row['question_id'], row['answer_index'], row['answer_text'], row['sentiment_label'])
+            for row in rows] == [
+        ('q1', 0, 'great support', 'POSITIVE'),
+        ('q1', 1, 'slow replies', 'NEGATIVE'),
+        ('q1', 2, 'great docs', 'POSITIVE'),
+        ('q2', 0, 'great app', 'POSITIVE'),
+        ('q2', 1, 'crashes', 'NEGATIVE'),
+    ]
+    assert {row['model_version'] for row in rows} == {'v1'}
+    assert rows[0]['analyzed_at'] == datetime(2024, 1, 10, tzinfo=timezone.utc)
+
+
+def test_export_questions_and_clusters_of_some_questions(exported):
+    (questions,) = export_tables(
+        exported, table=analytics_pb2.EXPORT_TABLE_QUESTIONS, question_ids=['q1', 'q3'])
+    (clusters,) = export_tables(
+        exported, table=analytics_pb2.EXPORT_TABLE_CLUSTERS, question_ids=['q2'])
+
+    assert questions.schema.names == [
+        'question_id', 'question_text', 'analyzed_at', 'model_version',
+        'aggregate_sentiment_score', 'aggregate_sentiment_label', 'answer_count',
+        'label_counts', 'bucket', 'archived']
+    assert [(row['question_id'], row['answer_count'], dict(row['label_counts']), row['bucket'])
+            for row in questions.to_pylist()] == [
+        ('q1', 3, {'POSITIVE': 2, 'NEGATIVE': 1}, '2024-01'),
+        ('q3', 1, {'POSITIVE': 1}, '2024-02'),
+    ]
+    assert clusters.schema.names == [
+        'question_id', 'analyzed_at', 'cluster_index', 'summary', 'count',
+        'representative', 'idea_id']
+    assert [(row['question_id'], row['summary'], row['count'])
+            for row in clusters.to_pylist()] == [('q2', 'Support', 2)]
+
+
+def test_export_without_matches_still_sends_the_schema(exported):
+    (table,) = export_tables(exported, model_version='v9')
+
+    assert table.num_rows == 0
+    assert table.schema.names[:3] == ['question_id', 'analyzed_at', 'model_version']
+
+
+def test_export_rejects_an_oversized_batch(exported):
+    with pytest.raises(Aborted) as aborted:
+        export_tables(exported, batch_rows=1_000_000)
+    assert aborted.value.args[0] == grpc.StatusCode.INVALID_ARGUMENT
@@ -0,0 +1,202 @@
+from datetime import datetime
+
+import grpc
+import numpy as np
+import pytest
+
+from intelligence import analytics_pb2, config
+from intelligence.embeddings import pack_embeddings
+from intelligence.servicer import AnalyticsServicer
+from intelligence.similarity_index import SimilarityIndex
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+QUERY = unit(1, 0, 0)
+# Answer index -> vector, by decreasing similarity to QUERY
+Q1 = np.stack([unit(1, 0.1, 0), unit(1, 1, 0), unit(0, 0, 1)])
+Q2 = np.stack([unit(1, 0.3, 0), np.zeros(3, dtype=np.float32)])
+
+
+def index_of(tmp_path, **kwargs):
+    kwargs.setdefault('min_train', 1000)
+    index = SimilarityIndex(path=str(tmp_path / 'index'), nlist=0, nprobe=4, **kwargs)
+    index.add('q1', Q1, datetime(2024, 1, 1))
+    index.add('q2', Q2, datetime(2024, 2, 1))
+    return index
+
+
+def keys(matches):
+    return [(question_id, answer_index) for question_id, answer_index, _ in matches]
+
+
+def test_search_returns_the_closest_answers_first(tmp_path):
+    index = index_of(tmp_path)
+
+    matches = index.search(QUERY, top_k=3)
+
+    assert keys(matches) == [('q1', 0), ('q2', 0), ('q1', 1)]
+    scores = [score for _, _, score in matches]
+    assert scores == sorted(scores, reverse=True)
+    assert scores[0] == pytest.approx(float(Q1[0] @ QUERY), abs=1e-3)
+    # The all-zero answer of q2 is not indexed
+    assert index.size == 4
+
+
+def test_search_excludes_a_question(tmp_path):
+    index = index_of(tmp_path)
+
+    assert keys(index.search(QUERY, top_k=10, exclude_question_id='q1')) == [('q2', 0)]
+
+
+def test_add_replaces_the_vectors_of_a_question(tmp_path):
+    index = index_of(tmp_path)
+
+    index.add('q1', np.stack([unit(0, 1, 0)]))
+
+    assert keys(index.search(QUERY, top_k=10)) == [('q2', 0), ('q1', 0)]
+    assert index.size == 2
+    assert index.get_vector('q1', 1) is None
+
+
+def test_snapshot_round_trip(tmp_path):
+    index = index_of(tmp_path)
+    expected = index.search(QUERY, top_k=10)
+
+    assert index.snapshot()
+    # Nothing changed since the last snapshot
+    assert not index.snapshot()
+
+    loaded = SimilarityIndex(path=str(tmp_path / 'index'), nlist=0, nprobe=4, min_train=1000)
+    assert loaded.load()
+    assert loaded.size == index.size
+    assert loaded.built_until == datetime(2024, 2, 1)
+    assert keys(loaded.search(QUERY, top_k=10)) == keys(expected)
+    np.testing.assert_allclose(loaded.get_vector('q2', 0), Q2[0], atol=1e-3)
+
+    # Vectors added after loading replace the snapshot's until the next one
+    loaded.add('q2', np.stack([unit(0, 0, 1)]))
+    assert keys(loaded.search(QUERY, top_k=2)) == [('q1', 0), ('q1', 1)]
+    assert loaded.snapshot()
+    reloaded = SimilarityIndex(path=str(tmp_path / 'index'), nlist=0, nprobe=4, min_train=1000)
+    assert reloaded.load()
+    assert keys(reloaded.search(QUERY, top_k=2)) == [('q1', 0), ('q1', 1)]
+    assert reloaded.size == 4
+
+
+def test_snapshot_of_another_embedding_model_is_ignored(tmp_path, monkeypatch):
+    index_of(tmp_path).snapshot()
+
+    monkeypatch.setattr(config, 'EMBEDDING_MODEL', 'some-org/another-embedding-model')
+    loaded = SimilarityIndex(path=str(tmp_path / 'index'))
+
+    assert not loaded.load()
+    assert loaded.size == 0
+
+
+def test_rebuild_trains_lists_and_keeps_results(tmp_path):
+    index = index_of(tmp_path, min_train=2)
+    expected = keys(index.search(QUERY, top_k=10))
+
+    assert index.needs_rebuild()
+    index.rebuild()
+
+    assert not index.needs_rebuild()
+    assert keys(index.search(QUERY, top_k=10)) == expected
+    assert index.snapshot()
+    loaded = SimilarityIndex(path=str(tmp_path / 'index'), nlist=0, nprobe=4, min_train=2)
+    assert loaded.load()
+    assert keys(loaded.search(QUERY, top_k=10)) == expected
+
+
+def test_backfill_from_stored_analyses(tmp_path, db_manager):
+    for question_id, embeddings in (('q1', Q1), ('q2', Q2)):
+        db_manager.save_analysis({
+            'question_id': question_id,
+            'question_text': 'What could be better?',
+            'answers': [],
+            'answer_embeddings': pack_embeddings(embeddings),
+        })
+    index = SimilarityIndex(path=str(tmp_path / 'index'), nlist=0, nprobe=4, min_train=1000)
+
+    assert index.backfill(db_manager.iter_answer_embeddings()) == 2
+    assert keys(index.search(QUERY, top_k=2)) == [('q1', 0), ('q2', 0)]
+    assert index.built_until is not None
+
+
+class Aborted(Exception):
+    pass
+
+
+class FakeContext:
+    def abort(self, code, details):
+        raise Aborted(code, details)
+
+
+class FakeSummarizer:
+    def embed(self, texts):
+        return np.stack([QUERY for _ in texts])
+
+
+@pytest.fixture
+def servicer(tmp_path, db_manager):
+    index = index_of(tmp_path)
+    for question_id, count in (('q1', 3), ('q2', 2)):
+        db_manager.save_analysis({
+            'question_id': question_id,
+            'question_text': 'What could be better?',
+            'answers': [
+                {'index': index, 'answer_text': f'{question_id} answer {index}'}
+                for index in range(count)
+            ],
+        })
+    servicer = AnalyticsServicer.__new__(AnalyticsServicer)
+    servicer.db_manager = db_manager
+    servicer.similarity_index = index
+    servicer.idea_summarizer = FakeSummarizer()
+    return servicer
+
+
+def similar(servicer, **fields):
+    response = servicer.FindSimilarAnswers(
+        analytics_pb2.SimilarAnswersRequest(**fields), FakeContext())
+    return [(answer.question_id, answer.answer_index) for answer in response.answers]
+
+
+def test_find_similar_answers_to_a_text(servicer):
+    response = servicer.FindSimilarAnswers(
+        analytics_pb2.SimilarAnswersRequest(text='faster checkout', top_k=2), FakeContext())
+
+    assert [(a.question_id, a.answer_index, a.answer_text) for a in response.answers] == [
+        ('q1', 0, 'q1 answer 0'),
+        ('q2', 0, 'q2 answer 0'),
+    ]
+    assert response.answers[0].similarity >= response.answers[1].similarity
+
+
+def test_find_similar_answers_applies_min_similarity(servicer):
+    threshold = float(Q1[1] @ QUERY) + 0.01
+
+    assert similar(servicer, text='faster checkout', min_similarity=threshold) == [
+        ('q1', 0), ('q2', 0)]
+
+
+def test_find_similar_answers_to_a_stored_answer(servicer):
+    # The query answer itself is never returned
+    assert similar(servicer, question_id='q1', answer_index=0, top_k=2) == [
+        ('q2', 0), ('q1', 1)]
+    assert similar(servicer, question_id='q1', answer_index=0, exclude_same_question=True) == [
+        ('q2', 0)]
+
+
+def test_find_similar_answers_rejects_an_empty_query(servicer):
+    with pytest.raises(Aborted) as aborted:
+        similar(servicer)
+    assert aborted.value.args[0] == grpc.StatusCode.INVALID_ARGUMENT
+
+    with pytest.raises(Aborted) as aborted:
+        similar(servicer, question_id='q1', answer_index=7)
+    assert aborted.value.args[0] == grpc.StatusCode.NOT_FOUND
@@ -0,0 +1,178 @@
+import json
+import threading
+import time
+from contextlib import nullcontext
+
+import pytest
+
+from intelligence.stream_worker import StreamWorker, parse_request
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+def payload(**overrides):
+    request = {
+        'jobId': 'job-1',
+        'formId': 'form-1',
+        'snapshotId': 'snap-1',
+        'windowKey': '2024-06',
+        'questionId': 'q1',
+        'questionText': 'What could be better?',
+        'answers': ['Faster exports', 'Dark mode'],
+        'analysisHash': 'hash-1',
+        'createdAt': '2024-06-01T00:00:00.000Z',
+    }
+    request.update(overrides)
+    return request
+
+
+class FakeServicer:
+    """Scores every answer as positive and returns one cluster"""
+
+    def __init__(self, fail_questions=()):
+        self.fail_questions = set(fail_questions)
+        self.analyzed = []
+
+    def load_previous(self, question_id):
+        return {}
+
+    def analysis_slot(self, form_id, answers, priority=0, timeout=None):
+        return nullcontext()
+
+    def prepare_batch(self, answer_lists, previous_docs):
+        return [[(0.9, 'POSITIVE')] * len(answers) for answers in answer_lists], {}
+
+    def run_analysis(self, question_id, question_text, answers, **kwargs):
+        if question_id in self.fail_questions:
+            raise RuntimeError('model unavailable')
+        self.analyzed.append(question_id)
+        analysis = {'answers': [
+            {'answer_text': answer, 'sentiment_label': 'POSITIVE'} for answer in answers
+        ]}
+        return analysis, [{'summary': 'Faster exports', 'count': len(answers)}]
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+@pytest.fixture
+def servicer():
+    return FakeServicer(fail_questions={'broken'})
+
+
+@pytest.fixture
+def worker(redis_client, servicer):
+    worker = StreamWorker(
+        redis_client, servicer, None, None,
+        group='test', consumer='c1', batch_size=10, block_ms=10,
+        claim_idle_ms=0, claim_interval_s=0, max_deliveries=2,
+    )
+    worker.ensure_group()
+    return worker
+
+
+def add(redis_client, worker, fields):
+    return redis_client.xadd(worker.request_stream, fields)
+
+
+def read(redis_client, stream):
+    return [(message_id, json.loads(fields['payload'])) for message_id, fields in redis_client.xrange(stream)]
+
+
+def pending(redis_client, worker):
+    return redis_client.xpending(worker.request_stream, worker.group)['pending']
+
+
+@pytest.mark.parametrize('fields, error', [
+    ({}, 'no payload'),
+    ({'payload': '{not json'}, 'not valid JSON'),
+    ({'payload': '[1, 2]'}, 'not a JSON object'),
+    ({'payload': json.dumps({'jobId': 'job-1'})}, 'missing'),
+    ({'payload': json.dumps(payload(answers='Faster exports'))}, 'answers'),
+    ({'payload': json.dumps(payload(answers=['ok', 3]))}, 'answers'),
+    ({'payload': json.dumps(payload(formId=7))}, 'formId must be strings'),
+])
+def test_parse_request_rejects_malformed_entries(fields, error):
+    with pytest.raises(ValueError, match=error):
+        parse_request(fields)
+
+
+def test_parse_request_returns_the_payload():
+    assert parse_request({'payload': json.dumps(payload())}) == payload()
+
+
+def test_results_are_published_and_requests_acknowledged(redis_client, worker, servicer):
+    add(redis_client, worker, {'payload': json.dumps(payload()), 'traceparent': '00-' + '1' * 32 + '-' + '2' * 16 + '-01'})
+    add(redis_client, worker, {'payload': json.dumps(payload(jobId='job-2', questionId='broken'))})
+
+    assert worker.poll() == 2
+
+    results = [result for _, result in read(redis_client, worker.result_stream)]
+    assert [(result['jobId'], result['success']) for result in results] == [('job-1', True), ('job-2', False)]
+    assert results[0]['sentiment'] == {'positivePct': 100.0, 'neutralPct': 0.0, 'negativePct': 0.0}
+    assert results[0]['topIdeas'] == [{'idea': 'Faster exports', 'count': 2}]
+    assert results[1]['analysisError'] == 'model unavailable'
+    assert servicer.analyzed == ['q1']
+    assert pending(redis_client, worker) == 0
+    assert read(redis_client, worker.dlq_stream) == []
+
+
+def test_malformed_entries_go_to_the_dlq(redis_client, worker):
+    bad_id = add(redis_client, worker, {'payload': '{not json', 'produced_at': 'yesterday'})
+    add(redis_client, worker, {'payload': json.dumps(payload())})
+
+    worker.poll()
+
+    dlq = [entry for _, entry in read(redis_client, worker.dlq_stream)]
+    assert len(dlq) == 1
+    assert dlq[0]['failedMessageId'] == bad_id
+    assert dlq[0]['payload'] == '{not json'
+    assert 'not valid JSON' in dlq[0]['error']
+    assert len(read(redis_client, worker.result_stream)) == 1
+    assert pending(redis_client, worker) == 0
+
+
+def test_entries_failing_repeatedly_go_to_the_dlq(redis_client, worker):
+    message_id = add(redis_client, worker, {'payload': json.dumps(payload())})
+    # Delivered to consumers that crashed before acknowledging
+    redis_client.xreadgroup(worker.group, 'crashed', {worker.request_stream: '>'})
+    redis_client.xclaim(worker.request_stream, worker.group, 'crashed', 0, [message_id])
+    time.sleep(0.01)
+
+    assert worker.reclaim() == 1
+
+    dlq = [entry for _, entry in read(redis_client, worker.dlq_stream)]
+    assert [entry['failedMessageId'] for entry in dlq] == [message_id]
+    assert read(redis_client, worker.result_stream) == []
+    assert pending(redis_client, worker) == 0
+
+
+def test_run_keeps_consuming_after_unexpected_errors(redis_client, worker, monkeypatch):
+    envelope = worker._envelope
+    failures = []
+
+    def flaky_envelope(payload, trace_fields):
+        if not failures:
+            failures.append(payload)
+            raise TypeError('Object of type bytes is not JSON serializable')
+        return envelope(payload, trace_fields)
+
+    monkeypatch.setattr(worker, '_envelope', flaky_envelope)
+    monkeypatch.setattr(worker._stopping, 'wait', lambda timeout=None: worker._stopping.is_set())
+    add(redis_client, worker, {'payload': json.dumps(payload())})
+    add_later = threading.Timer(0.1, add, (redis_client, worker, {'payload': json.dumps(payload(jobId='job-2'))}))
+
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    add_later.start()
+    deadline = time.monotonic() + 5
+    while not read(redis_client, worker.result_stream) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    worker.stop()
+    thread.join(5)
+
+    assert failures
+    assert [result['jobId'] for _, result in read(redis_client, worker.result_stream)] == ['job-2']
+    assert not thread.is_alive()
@@ -0,0 +1,207 @@
+import threading
+import time
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+from intelligence.write_behind import AnalysisWriteBehind
+
+
+class RecordingWriter:
+    """Bulk writer that records its batches and fails as scripted"""
+
+    def __init__(self, failures=()):
+        self.batches = []
+        self.failures = list(failures)
+        self.calls = 0
+        self.written = threading.Event()
+
+    def __call__(self, documents, texts):
+        self.calls += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        self.batches.append((list(documents), dict(texts)))
+        self.written.set()
+
+
+def written_ids(writer):
+    return [doc['question_id'] for documents, _ in writer.batches for doc in documents]
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def make_buffer(writer, **kwargs):
+    options = dict(batch_size=10, flush_interval_ms=20, max_retries=2, retry_backoff_ms=1)
+    options.update(kwargs)
+    return AnalysisWriteBehind(writer, **options)
+
+
+def test_flush_keeps_latest_analysis_per_question():
+    writer = RecordingWriter()
+    flushed = []
+    buffer = make_buffer(writer, on_flush=flushed.extend, batch_size=3, flush_interval_ms=1000)
+    buffer.submit({'question_id': 'q1', 'version': 1}, {b'h1': 'one'})
+    buffer.submit({'question_id': 'q2', 'version': 1})
+    buffer.submit({'question_id': 'q1', 'version': 2}, {b'h2': 'two'})
+    assert writer.written.wait(2)
+    buffer.close()
+
+    documents, texts = writer.batches[0]
+    assert sorted((doc['question_id'], doc['version']) for doc in documents) == [('q1', 2), ('q2', 1)]
+    assert texts == {b'h1': 'one', b'h2': 'two'}
+    assert sorted(flushed) == ['q1', 'q2']
+
+
+def test_close_drains_queue_and_later_submits_write_synchronously():
+    writer = RecordingWriter()
+    buffer = make_buffer(writer, flush_interval_ms=10_000)
+    buffer.submit({'question_id': 'q1'})
+    buffer.close()
+    assert written_ids(writer) == ['q1']
+
+    buffer.submit({'question_id': 'q2'})
+    assert written_ids(writer) == ['q1', 'q2']
+
+
+def test_retries_transient_errors():
+    writer = RecordingWriter(failures=[AutoReconnect('down'), AutoReconnect('down')])
+    buffer = make_buffer(writer)
+    buffer.submit({'question_id': 'q1'})
+    buffer.close()
+    assert writer.calls == 3
+    assert len(writer.batches) == 1
+
+
+def test_drops_batch_after_retries_and_keeps_running():
+    writer = RecordingWriter(failures=[AutoReconnect('down')] * 3)
+    flushed = []
+    buffer = make_buffer(writer, on_flush=flushed.extend)
+    buffer.submit({'question_id': 'lost'})
+    buffer.submit({'question_id': 'lost'})
+    assert wait_until(lambda: writer.calls == 3)
+
+    buffer.submit({'question_id': 'kept'})
+    assert writer.written.wait(2)
+    buffer.close()
+    assert written_ids(writer) == ['kept']
+    assert 'lost' in flushed
+
+
+@pytest.mark.parametrize('error', [ValueError('cannot encode object'), KeyError('question_id')])
+def test_unexpected_errors_do_not_stop_the_flush_thread(error):
+    writer = RecordingWriter(failures=[error])
+    buffer = make_buffer(writer, max_retries=5)
+    buffer.submit({'question_id': 'bad'})
+    buffer.submit({'question_id': 'bad'})
+    assert wait_until(lambda: writer.calls == 1)
+
+    buffer.submit({'question_id': 'good'})
+    assert writer.written.wait(2)
+    buffer.close()
+    assert writer.calls == 2
+    assert written_ids(writer) == ['good']
+
+
+def test_failing_flush_callback_does_not_stop_the_flush_thread():
+    writer = RecordingWriter()
+
+    def on_flush(question_ids):
+        raise RuntimeError('cache unavailable')
+
+    buffer = make_buffer(writer, on_flush=on_flush, batch_size=1)
+    buffer.submit({'question_id': 'q1'})
+    buffer.submit({'question_id': 'q2'})
+    buffer.close()
+    assert written_ids(writer) == ['q1', 'q2']
+
+
+def test_full_queue_blocks_until_flushed():
+    release = threading.Event()
+    writer = RecordingWriter()
+
+    def slow_writer(documents, texts):
+        release.wait(2)
+        writer(documents, texts)
+
+    buffer = make_buffer(slow_writer, queue_size=1, batch_size=1)
+    buffer.submit({'question_id': 'q1'})
+    buffer.submit({'question_id': 'q2'})
+    submitted = threading.Event()
+    thread = threading.Thread(target=lambda: (buffer.submit({'question_id': 'q3'}), submitted.set()))
+    thread.start()
+    assert not submitted.wait(0.1)
+    release.set()
+    assert submitted.wait(2)
+    thread.join()
+    buffer.close()
+    assert written_ids(writer) == ['q1', 'q2', 'q3']
+
+
+def test_full_queue_writes_synchronously_after_the_timeout():
+    release = threading.Event()
+    writer = RecordingWriter()
+    flushed = []
+
+    def slow_writer(documents, texts):
+        if not release.is_set() and documents[0]['question_id'] == 'q1':
+            release.wait(2)
+        writer(documents, texts)
+
+    buffer = make_buffer(slow_writer, on_flush=flushed.extend, queue_size=1, batch_size=1,
+                         queue_timeout_ms=50)
+    buffer.submit({'question_id': 'q1'})
+    assert wait_until(lambda: buffer._queue.empty())
+    buffer.submit({'question_id': 'q2', 'version': 1})
+    submitted = threading.Event()
+    thread = threading.Thread(target=lambda: (
+        buffer.submit({'question_id': 'q2', 'version': 2}), submitted.set()))
+    thread.start()
+    # Waits for the flush of q1 to release the write, then writes directly
+    assert not submitted.wait(0.2)
+    release.set()
+    assert submitted.wait(2)
+    thread.join()
+    buffer.close()
+
+    # The older queued analysis of q2 is either written first or skipped;
+    # it never overwrites the newer one
+    versions = [doc['version'] for documents, _ in writer.batches
+                for doc in documents if doc['question_id'] == 'q2']
+    assert versions in ([2], [1, 2])
+    assert 'q2' in flushed
+
+
+def test_analyses_queued_after_a_synchronous_write_are_kept():
+    writer = RecordingWriter()
+    buffer = make_buffer(writer, queue_size=1, batch_size=1, flush_interval_ms=10_000,
+                         queue_timeout_ms=0)
+    buffer._write_sync({'question_id': 'q1', 'version': 1}, {})
+    buffer.submit({'question_id': 'q1', 'version': 2})
+    buffer.close()
+    assert [doc['version'] for documents, _ in writer.batches for doc in documents] == [1, 2]
+
+
+def test_submits_racing_close_are_never_lost():
+    writer = RecordingWriter()
+    buffer = make_buffer(writer, queue_size=4, batch_size=2, flush_interval_ms=1)
+    question_ids = [f'q{index}' for index in range(200)]
+
+    def submit_all(offset):
+        for question_id in question_ids[offset::4]:
+            buffer.submit({'question_id': question_id})
+
+    threads = [threading.Thread(target=submit_all, args=(offset,)) for offset in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.005)
+    buffer.close()
+    for thread in threads:
+        thread.join()
+    assert sorted(written_ids(writer)) == sorted(question_ids)
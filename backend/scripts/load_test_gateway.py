@@ -1,10 +1,18 @@
 #!/usr/bin/env python3
 import argparse
 import concurrent.futures
+import http.client
+import itertools
 import json
+import math
+import multiprocessing
+import queue
+import random
 import subprocess
+import threading
 import time
 import urllib.error
+import urllib.parse
 import urllib.request
 
 
@@ -26,7 +34,12 @@ def send_request(url: str, host_header: str | None) -> tuple[int, float]:
     return status, latency
 
 
-def watch_scaling(namespace: str, label: str, interval: float = 5.0):
+def watch_scaling(
+    namespace: str,
+    label: str,
+    interval: float = 5.0,
+    samples: list | None = None,
+):
     while True:
         try:
             pods = subprocess.check_output(
@@ -54,6 +67,9 @@ def watch_scaling(namespace: str, label: str, interval: float = 5.0):
                 ready_counts.append("R" if ready else "NR")
             print(
                 f"[scale] pods: {len(pod_names)} -> {list(zip(pod_names, ready_counts))}")
+            if samples is not None:
+                samples.append(
+                    (time.time(), len(pod_names), ready_counts.count("R")))
         except Exception as exc:
             print(f"[scale] failed to query pods: {exc}")
             time.sleep(interval * 2)
@@ -61,9 +77,355 @@ def watch_scaling(namespace: str, label: str, interval: float = 5.0):
         time.sleep(interval)
 
 
+class LatencyHistogram:
+    """HDR-style latency histogram: log-spaced buckets with ~1% precision.
+
+    Bucket counts merge by addition, so histograms from separate workers or
+    seconds combine without keeping every sample.
+    """
+
+    BASE = 1.01
+
+    def __init__(self):
+        self.counts: dict[int, int] = {}
+        self.total = 0
+        self.min_ms = math.inf
+        self.max_ms = 0.0
+        self.sum_ms = 0.0
+
+    def record(self, latency_ms: float):
+        key = int(math.log(max(latency_ms, 0.001) * 1000, self.BASE))
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.total += 1
+        self.sum_ms += latency_ms
+        self.min_ms = min(self.min_ms, latency_ms)
+        self.max_ms = max(self.max_ms, latency_ms)
+
+    def merge(self, other: "LatencyHistogram"):
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.total += other.total
+        self.sum_ms += other.sum_ms
+        self.min_ms = min(self.min_ms, other.min_ms)
+        self.max_ms = max(self.max_ms, other.max_ms)
+
+    def percentile(self, fraction: float) -> float:
+        if not self.total:
+            return 0.0
+        target = max(1, math.ceil(fraction * self.total))
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen >= target:
+                # Upper edge of the bucket, clamped to the observed range.
+                value = self.BASE ** (key + 1) / 1000
+                return min(max(value, self.min_ms), self.max_ms)
+        return self.max_ms
+
+    def summary(self) -> dict:
+        return {
+            "count": self.total,
+            "mean_ms": self.sum_ms / self.total if self.total else 0.0,
+            "min_ms": self.min_ms if self.total else 0.0,
+            "p50_ms": self.percentile(0.50),
+            "p90_ms": self.percentile(0.90),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "p999_ms": self.percentile(0.999),
+            "max_ms": self.max_ms,
+        }
+
+
+def load_scenario(path: str, default_url: str) -> dict:
+    """Load GraphQL operations: {"url": ..., "operations": [{name, query, variables, weight}]}."""
+    with open(path) as handle:
+        scenario = json.load(handle)
+    operations = scenario.get("operations") or []
+    if not operations:
+        raise ValueError(f"{path} defines no operations")
+    for operation in operations:
+        if "query" not in operation:
+            raise ValueError(f"Operation {operation.get('name')!r} has no query")
+        operation.setdefault("name", operation.get("operationName", "operation"))
+        operation.setdefault("weight", 1)
+    scenario.setdefault("url", default_url)
+    return scenario
+
+
+class KeepAliveClient:
+    """One persistent HTTP connection per thread."""
+
+    def __init__(self, url: str, timeout: float):
+        parsed = urllib.parse.urlsplit(url)
+        self._https = parsed.scheme == "https"
+        self._netloc = parsed.netloc
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def request(self, method: str, path: str, body: bytes | None, headers: dict):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn_cls = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+            conn = conn_cls(self._netloc, timeout=self._timeout)
+            self._local.conn = conn
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()  # drain so the connection can be reused
+            if resp.will_close:
+                self._drop(conn)
+            return resp.status, data
+        except Exception:
+            self._drop(conn)
+            raise
+
+    def _drop(self, conn):
+        conn.close()
+        self._local.conn = None
+
+
+def open_loop_worker(worker_id: int, options: dict, results: "multiprocessing.Queue"):
+    """Send this worker's share of a constant arrival rate until the deadline.
+
+    Requests are scheduled at fixed intended send times and latency is
+    measured from that time, so a slow server cannot slow the load down
+    (no coordinated omission).
+    """
+    processes = options["processes"]
+    rate = options["rate"]
+    start_at = options["start_at"]
+    deadline = start_at + options["duration"]
+    scenario = options.get("scenario")
+    tokens = options.get("tokens") or []
+    url = scenario["url"] if scenario else options["url"]
+    target = urllib.parse.urlsplit(url)
+    path = target.path or "/"
+    if target.query:
+        path = f"{path}?{target.query}"
+    client = KeepAliveClient(url, options["timeout"])
+    rng = random.Random(worker_id)
+    token_cycle = itertools.cycle(tokens[worker_id::processes] or tokens or [None])
+    token_lock = threading.Lock()
+
+    lock = threading.Lock()
+    overall = LatencyHistogram()
+    statuses: dict[str, int] = {}
+    by_operation: dict[str, LatencyHistogram] = {}
+    seconds: dict[int, tuple[LatencyHistogram, dict[str, int]]] = {}
+
+    def build_request():
+        headers = {"Connection": "keep-alive"}
+        if options.get("host_header"):
+            headers["Host"] = options["host_header"]
+        if tokens:
+            with token_lock:
+                headers["Authorization"] = f"Bearer {next(token_cycle)}"
+        if not scenario:
+            return "GET", None, headers, None
+        operation = rng.choices(
+            scenario["operations"],
+            weights=[op["weight"] for op in scenario["operations"]],
+        )[0]
+        payload = {"query": operation["query"], "variables": operation.get("variables") or {}}
+        if operation.get("operationName"):
+            payload["operationName"] = operation["operationName"]
+        headers["Content-Type"] = "application/json"
+        return "POST", json.dumps(payload).encode(), headers, operation["name"]
+
+    def send(intended: float, method, body, headers, operation):
+        try:
+            status_code, data = client.request(method, path, body, headers)
+            status = str(status_code)
+            if scenario and status_code == 200 and b'"errors"' in data:
+                status = "gql_error"
+        except Exception:
+            status = "0"
+        finished = time.time()
+        latency_ms = (finished - intended) * 1000
+        second = int(finished - start_at)
+        with lock:
+            overall.record(latency_ms)
+            statuses[status] = statuses.get(status, 0) + 1
+            if operation:
+                by_operation.setdefault(operation, LatencyHistogram()).record(latency_ms)
+            hist, counts = seconds.setdefault(second, (LatencyHistogram(), {}))
+            hist.record(latency_ms)
+            counts[status] = counts.get(status, 0) + 1
+
+    unflushed = [0]
+
+    def flush(until: float):
+        # Report every elapsed second, including empty ones, so the parent can
+        # print a second as soon as all workers have reported it.
+        with lock:
+            if until == math.inf:
+                last = max(seconds, default=unflushed[0] - 1)
+            else:
+                last = int(until - start_at) - 1
+            closed = [
+                (second, seconds.pop(second, None))
+                for second in range(unflushed[0], last + 1)
+            ]
+            unflushed[0] = max(unflushed[0], last + 1)
+        for second, entry in closed:
+            hist, counts = entry or (LatencyHistogram(), {})
+            results.put(("second", worker_id, second, hist, counts))
+
+    stop_reporter = threading.Event()
+
+    def reporter():
+        while not stop_reporter.wait(0.25):
+            flush(time.time())
+
+    reporter_thread = threading.Thread(target=reporter, daemon=True)
+    reporter_thread.start()
+
+    interval = processes / rate
+    with concurrent.futures.ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+        for index in itertools.count():
+            # Workers interleave: worker k owns arrivals k, k + P, k + 2P, ...
+            intended = start_at + (worker_id / rate) + index * interval
+            if intended >= deadline:
+                break
+            delay = intended - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, intended, *build_request())
+
+    stop_reporter.set()
+    reporter_thread.join()
+    flush(math.inf)
+    results.put(("done", worker_id, overall, statuses, by_operation))
+
+
+def format_statuses(statuses: dict) -> str:
+    return " ".join(f"{code}={count}" for code, count in sorted(statuses.items()))
+
+
+def run_open_loop(args, pod_samples: list | None):
+    scenario = load_scenario(args.scenario, args.graphql_url) if args.scenario else None
+    tokens = []
+    if args.tokens_file:
+        with open(args.tokens_file) as handle:
+            tokens = [line.strip() for line in handle if line.strip()]
+    processes = max(1, args.processes)
+    options = {
+        "url": args.url,
+        "host_header": args.host_header,
+        "rate": args.rate,
+        "duration": args.duration,
+        "processes": processes,
+        "concurrency": max(1, args.concurrency),
+        "timeout": args.timeout,
+        "scenario": scenario,
+        "tokens": tokens,
+        # Give every process time to start before the first arrival.
+        "start_at": time.time() + 1.0,
+    }
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    workers = [
+        ctx.Process(target=open_loop_worker, args=(i, options, results), daemon=True)
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+
+    mode = f"GraphQL scenario {args.scenario}" if scenario else args.url
+    print(f"Open loop: {args.rate:g} req/s for {args.duration:g}s against {mode} "
+          f"({processes} process(es) x {options['concurrency']} connections)")
+
+    pending: dict[int, list] = {}
+    reported: dict[int, set] = {}
+    timeline = []
+    overall = LatencyHistogram()
+    statuses: dict[str, int] = {}
+    by_operation: dict[str, LatencyHistogram] = {}
+    done = set()
+    next_second = 0
+
+    def emit(second: int):
+        hist, counts = pending.pop(second, (LatencyHistogram(), {}))
+        reported.pop(second, None)
+        row = {"second": second, "requests": hist.total, "statuses": counts, **hist.summary()}
+        pods = ""
+        if pod_samples:
+            at = options["start_at"] + second + 1
+            latest = [sample for sample in pod_samples if sample[0] <= at]
+            if latest:
+                _, row["pods"], row["pods_ready"] = latest[-1]
+                pods = f"  pods {row['pods_ready']}/{row['pods']}"
+        timeline.append(row)
+        print(f"[{second + 1:>4}s] {hist.total:>6} req  p50 {row['p50_ms']:>8.1f}  "
+              f"p99 {row['p99_ms']:>8.1f}  max {row['max_ms']:>8.1f} ms  "
+              f"{format_statuses(counts)}{pods}")
+
+    while len(done) < processes:
+        try:
+            message = results.get(timeout=1.0)
+        except queue.Empty:
+            if not any(worker.is_alive() for worker in workers):
+                print("[warn] workers exited without reporting")
+                break
+            continue
+        if message[0] == "second":
+            _, worker_id, second, hist, counts = message
+            merged, merged_counts = pending.setdefault(second, (LatencyHistogram(), {}))
+            merged.merge(hist)
+            for code, count in counts.items():
+                merged_counts[code] = merged_counts.get(code, 0) + count
+            reported.setdefault(second, set()).add(worker_id)
+        else:
+            _, worker_id, hist, counts, operations = message
+            done.add(worker_id)
+            overall.merge(hist)
+            for code, count in counts.items():
+                statuses[code] = statuses.get(code, 0) + count
+            for name, op_hist in operations.items():
+                by_operation.setdefault(name, LatencyHistogram()).merge(op_hist)
+        # A second is complete once every live worker has reported it.
+        while next_second in reported and len(reported[next_second] | done) >= processes:
+            emit(next_second)
+            next_second += 1
+    for second in sorted(pending):
+        emit(second)
+    for worker in workers:
+        worker.join(timeout=5)
+
+    summary = overall.summary()
+    achieved = overall.total / args.duration if args.duration else 0.0
+    print("\nResults:")
+    print(f"  Target rate: {args.rate:g} req/s, achieved: {achieved:.1f} req/s")
+    print(f"  Total: {overall.total}")
+    print(f"  Status counts: {format_statuses(statuses)}")
+    print("  Latency (ms, from intended send time): "
+          + "  ".join(f"{key[:-3]}={summary[key]:.1f}" for key in
+                      ("mean_ms", "p50_ms", "p90_ms", "p95_ms", "p99_ms", "p999_ms", "max_ms")))
+    for name, op_hist in sorted(by_operation.items()):
+        op_summary = op_hist.summary()
+        print(f"  {name}: n={op_summary['count']} p50={op_summary['p50_ms']:.1f} "
+              f"p99={op_summary['p99_ms']:.1f} max={op_summary['max_ms']:.1f}")
+
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump({
+                "target_rate": args.rate,
+                "achieved_rate": achieved,
+                "duration": args.duration,
+                "processes": processes,
+                "statuses": statuses,
+                "latency": summary,
+                "operations": {name: hist.summary() for name, hist in by_operation.items()},
+                "timeline": timeline,
+            }, handle, indent=2)
+        print(f"  Time series written to {args.output}")
+
+
 def main():
     parser = argparse.ArgumentParser(
-        description="Fire requests at the API gateway to observe load balancing and HPA scaling.",
+        description="Fire requests at the API gateway to observe load balancing and HPA scaling. "
+        "Closed loop by default; --rate switches to a constant-arrival-rate (open-loop) mode.",
     )
     parser.add_argument(
         "--url",
@@ -87,6 +449,47 @@ def main():
         default=20,
         help="Number of concurrent workers.",
     )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="Open-loop mode: constant arrival rate in requests/s (default: closed loop).",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=60,
+        help="Open-loop mode: seconds to sustain --rate (default 60).",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Open-loop mode: worker processes sharing the rate; results are merged.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=5.0,
+        help="Open-loop mode: per-request timeout in seconds (default 5).",
+    )
+    parser.add_argument(
+        "--scenario",
+        help="Open-loop mode: JSON file of weighted GraphQL operations to POST instead of GET --url.",
+    )
+    parser.add_argument(
+        "--graphql-url",
+        default="http://127.0.0.1/graphql",
+        help="GraphQL endpoint when the scenario file has no url (default: http://127.0.0.1/graphql).",
+    )
+    parser.add_argument(
+        "--tokens-file",
+        help="Open-loop mode: bearer tokens, one per line, rotated across requests.",
+    )
+    parser.add_argument(
+        "--output",
+        help="Open-loop mode: write the summary and per-second time series as JSON.",
+    )
     parser.add_argument(
         "--watch-scaling",
         action="store_true",
@@ -100,20 +503,25 @@ def main():
     )
     args = parser.parse_args()
 
+    pod_samples: list | None = None
     if args.watch_scaling:
-        import threading
-
+        pod_samples = []
         thread = threading.Thread(
             target=watch_scaling,
             kwargs={
                 "namespace": "evaluation-system",
                 "label": "app=api-gateway",
                 "interval": args.watch_interval,
+                "samples": pod_samples,
             },
             daemon=True,
         )
         thread.start()
 
+    if args.rate > 0:
+        run_open_loop(args, pod_samples)
+        return
+
     statuses: dict[int, int] = {}
     latencies: list[float] = []
 